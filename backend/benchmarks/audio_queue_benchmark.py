@@ -0,0 +1,173 @@
+"""
+A traffic spike against an ElevenLabs account with a concurrency cap, with
+generation inline in generate_audio and through the audio queue
+(utils.audio_queue).
+
+The ElevenLabs stub returns 429 above --elevenlabs-concurrency concurrent
+generations. Each scenario sends --requests requests at once and reports
+status codes, how many responses carry audio, ElevenLabs calls, 429s and
+peak concurrency:
+
+- inline: every request calls ElevenLabs itself; the spike turns into 429s
+- queued: AUDIO_MAX_CONCURRENCY workers drain the queue; every request gets
+  audio and ElevenLabs never sees more than the worker count. Per-job wait
+  and service times come from the job items
+- queued, repeated prompts: only --distinct prompts among the requests;
+  identical prompts share a job, so ElevenLabs generates each once
+- backpressure: AUDIO_JOB_WAIT_SECONDS is shorter than the backlog takes to
+  drain, so analyze_api sheds the excess with 429 and Retry-After
+
+Delays are production medians scaled by --latency-scale; the queue's timing
+settings are scaled the same way.
+
+Usage (from backend/):
+    python -m benchmarks.audio_queue_benchmark
+    python -m benchmarks.audio_queue_benchmark --requests 96 --elevenlabs-concurrency 4
+"""
+import argparse
+import contextlib
+import io
+import itertools
+import json
+import os
+import sys
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+from benchmarks.load_test import DEFAULT_LATENCIES, percentile
+from benchmarks.pipeline import LocalPipeline, sample_image
+from harness import stubs
+from harness.handlers import LAYER_DIRS
+
+for _layer in LAYER_DIRS:
+    if _layer not in sys.path:
+        sys.path.append(_layer)
+from utils import audio_queue  # noqa: E402
+
+QUEUE_URL = 'https://sqs.us-east-1.amazonaws.com/000000000000/soundscape-audio-local'
+
+
+def prompt_variants(distinct):
+    """Bedrock stub text whose sound prompt cycles through `distinct` variants"""
+    counter = itertools.count()
+    lock = threading.Lock()
+
+    def text(body):
+        with lock:
+            variant = next(counter) % distinct
+        return stubs.DEFAULT_CLAUDE_TEXT.replace("SOUND_PROMPT: ", f"SOUND_PROMPT: Variation {variant}. ")
+    return text
+
+
+def configure_queue(enabled, args, job_wait_seconds):
+    """Point utils.audio_queue at the local queue (or disable it) with scaled timings"""
+    if enabled:
+        os.environ['AUDIO_QUEUE_URL'] = QUEUE_URL
+        os.environ['AUDIO_MAX_CONCURRENCY'] = str(args.elevenlabs_concurrency)
+    else:
+        os.environ.pop('AUDIO_QUEUE_URL', None)
+    audio_queue.QUEUE_URL = QUEUE_URL if enabled else None
+    audio_queue.MAX_CONCURRENCY = args.elevenlabs_concurrency
+    audio_queue.SERVICE_SECONDS = DEFAULT_LATENCIES['elevenlabs'] * args.latency_scale
+    audio_queue.JOB_WAIT_SECONDS = job_wait_seconds
+    audio_queue.DEPTH_CACHE_SECONDS = 0.0
+    audio_queue._depth_cache.update(value=None, expires=0.0)
+
+
+def run_scenario(args, queued, distinct=None, job_wait_seconds=30.0, stagger=0.0):
+    configure_queue(queued, args, job_wait_seconds)
+    models = {
+        name: stubs.LatencyModel(median=median, sigma=0.3, scale=args.latency_scale, seed=args.seed + index)
+        for index, (name, median) in enumerate(DEFAULT_LATENCIES.items())
+    }
+    pipeline = LocalPipeline(latencies=models, elevenlabs_concurrency=args.elevenlabs_concurrency,
+                             sqs_visibility_timeout=max(1.0, 4 * audio_queue.SERVICE_SECONDS))
+    pipeline.bedrock.text = prompt_variants(distinct or args.requests)
+    image = sample_image(640, 480)
+
+    def one_request(index):
+        time.sleep(index * stagger)
+        response, trace = pipeline.analyze(image, {'Idempotency-Key': str(uuid.uuid4())})
+        return response, trace.totals()['total']
+
+    started = time.perf_counter()
+    with contextlib.redirect_stdout(io.StringIO()):
+        with ThreadPoolExecutor(max_workers=args.requests) as pool:
+            results = list(pool.map(one_request, range(args.requests)))
+        wall = time.perf_counter() - started
+        pipeline.close()
+
+    statuses = {}
+    with_audio = 0
+    retry_after = []
+    for response, _ in results:
+        statuses[response['statusCode']] = statuses.get(response['statusCode'], 0) + 1
+        if response['statusCode'] == 200 and 'elevenlabs' not in json.loads(response['body']).get('degraded', []):
+            with_audio += 1
+        if response['statusCode'] == 429:
+            retry_after.append(int(response['headers'].get('Retry-After', 0)))
+
+    jobs = [item for key, item in pipeline.table.items.items() if str(key).startswith('audiojob#')]
+    return {
+        'statuses': dict(sorted(statuses.items())),
+        'with_audio': with_audio,
+        'latency_p50': percentile([t for _, t in results], 50),
+        'latency_p99': percentile([t for _, t in results], 99),
+        'wall': wall,
+        'elevenlabs_calls': pipeline.elevenlabs.calls,
+        'elevenlabs_429': pipeline.elevenlabs.rejected,
+        'peak_in_flight': pipeline.elevenlabs.peak_in_flight,
+        'jobs': len(jobs),
+        'waiters': sum(int(job.get('waiters', 1)) for job in jobs),
+        'wait_ms': [int(job['waitMs']) for job in jobs if 'waitMs' in job],
+        'service_ms': [int(job['serviceMs']) for job in jobs if 'serviceMs' in job],
+        'retry_after': retry_after
+    }
+
+
+def print_scenario(name, result):
+    print(f"{name}")
+    print(f"  status codes {result['statuses']}, with audio {result['with_audio']}, "
+          f"latency p50 {result['latency_p50'] * 1000:.0f} ms p99 {result['latency_p99'] * 1000:.0f} ms")
+    print(f"  ElevenLabs calls {result['elevenlabs_calls']}, 429s {result['elevenlabs_429']}, "
+          f"peak concurrency {result['peak_in_flight']}")
+    if result['jobs']:
+        print(f"  jobs {result['jobs']} for {result['waiters']} requests "
+              f"({result['waiters'] - result['jobs']} deduplicated)")
+    if result['wait_ms']:
+        print(f"  job wait p50 {percentile(result['wait_ms'], 50)} ms p99 {percentile(result['wait_ms'], 99)} ms, "
+              f"service p50 {percentile(result['service_ms'], 50)} ms p99 {percentile(result['service_ms'], 99)} ms")
+    if result['retry_after']:
+        print(f"  shed {len(result['retry_after'])} requests, Retry-After "
+              f"{min(result['retry_after'])}-{max(result['retry_after'])} s")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--requests', type=int, default=48)
+    parser.add_argument('--elevenlabs-concurrency', type=int, default=4)
+    parser.add_argument('--distinct', type=int, default=6, help="Distinct prompts in the repeated-prompt scenario")
+    parser.add_argument('--latency-scale', type=float, default=0.01)
+    parser.add_argument('--seed', type=int, default=11)
+    args = parser.parse_args(argv)
+
+    print(f"{args.requests} simultaneous requests, ElevenLabs limited to {args.elevenlabs_concurrency} "
+          f"concurrent generations, delays x{args.latency_scale}")
+    print()
+    print_scenario("inline", run_scenario(args, queued=False))
+    print_scenario("queued", run_scenario(args, queued=True))
+    print_scenario(f"queued, {args.distinct} distinct prompts", run_scenario(args, queued=True, distinct=args.distinct))
+
+    # Sustained arrivals at twice what the workers drain, with a wait budget of
+    # six generations: admission holds the backlog inside the budget and sheds the rest
+    service = DEFAULT_LATENCIES['elevenlabs'] * args.latency_scale
+    overload = argparse.Namespace(**dict(vars(args), requests=args.requests * 4))
+    print_scenario("backpressure", run_scenario(overload, queued=True, job_wait_seconds=6 * service,
+                                                stagger=service / args.elevenlabs_concurrency / 2))
+    configure_queue(False, args, 60.0)
+
+
+if __name__ == '__main__':
+    main()
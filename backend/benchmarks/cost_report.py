@@ -0,0 +1,179 @@
+"""
+Cost per 1,000 requests by how they were served, from the usage each stage
+writes to the item (utils.metering).
+
+Items are grouped by metering.mode(): full, hedged, reused (a similar image's
+soundscape, no Bedrock or ElevenLabs), labels-only (Bedrock skipped),
+no-audio (ElevenLabs skipped), deduplicated (audio from a queued job another
+request created) and error. For each mode it prints the estimated USD per
+1,000 requests, split by component, and the average tokens and seconds of
+audio behind it.
+
+Items come from a table (--table, a scan of items that have usage), a JSON
+lines export (--items), or by default from a local simulation: the pipeline
+runs against the stubs once per scenario (normal traffic, a repeated image
+with SIMILARITY_MODE=reuse, a Bedrock outage, an ElevenLabs outage, and
+audio through the SQS job queue, where DynamoDB and SQS calls add up), each
+in a fresh pipeline so breaker state does not carry over. Simulated token counts
+and clip durations are the stubs', so the simulation shows the split between
+modes rather than production spend.
+
+Usage (from backend/):
+    python -m benchmarks.cost_report
+    python -m benchmarks.cost_report --requests 20
+    python -m benchmarks.cost_report --table soundscape-table
+    python -m benchmarks.cost_report --items usage.jsonl
+"""
+import argparse
+import contextlib
+import io
+import json
+import os
+import sys
+from decimal import Decimal
+
+from benchmarks.pipeline import LocalPipeline, sample_image
+from harness.handlers import LAYER_DIRS
+
+for _layer in LAYER_DIRS:
+    if _layer not in sys.path:
+        sys.path.append(_layer)
+from utils import audio_queue, metering, similarity  # noqa: E402
+
+COMPONENTS = ('bedrock', 'elevenlabs', 'rekognition', 's3', 'dynamodb', 'sqs', 'stepfunctions')
+MODES = ('full', 'hedged', 'reused', 'labels-only', 'no-audio', 'deduplicated', 'error')
+QUEUE_URL = 'https://sqs.us-east-1.amazonaws.com/000000000000/soundscape-audio-local'
+
+
+def scan_table(name):
+    import boto3
+
+    table = boto3.resource('dynamodb').Table(name)
+    kwargs = {'FilterExpression': 'attribute_exists(#u)', 'ExpressionAttributeNames': {'#u': 'usage'}}
+    while True:
+        page = table.scan(**kwargs)
+        yield from page['Items']
+        if 'LastEvaluatedKey' not in page:
+            return
+        kwargs['ExclusiveStartKey'] = page['LastEvaluatedKey']
+
+
+def read_items(path):
+    with open(path) as lines:
+        for line in lines:
+            if line.strip():
+                yield json.loads(line, parse_float=Decimal)
+
+
+def simulate(requests, verbose=False):
+    """Items from running each scenario in its own pipeline"""
+    image = sample_image()
+
+    def normal(pipeline):
+        pass
+
+    def bedrock_outage(pipeline):
+        pipeline.bedrock.latency.error_rate = 1.0
+
+    def elevenlabs_outage(pipeline):
+        pipeline.elevenlabs.latency.error_rate = 1.0
+
+    # (name, prepare, SIMILARITY_MODE, audio through the queue)
+    scenarios = [('normal', normal, 'off', False), ('repeated image', normal, 'reuse', False),
+                 ('bedrock outage', bedrock_outage, 'off', False), ('elevenlabs outage', elevenlabs_outage, 'off', False),
+                 ('queued audio', normal, 'off', True)]
+    items = []
+    mode = similarity.MODE
+    queue_url = os.environ.get('AUDIO_QUEUE_URL')
+    try:
+        for name, prepare, similarity_mode, queued in scenarios:
+            similarity.MODE = similarity_mode
+            use_queue(QUEUE_URL if queued else None)
+            pipeline = LocalPipeline()
+            prepare(pipeline)
+            try:
+                for _ in range(requests):
+                    with contextlib.redirect_stdout(sys.stdout if verbose else io.StringIO()):
+                        pipeline.analyze(image)
+            finally:
+                pipeline.close()
+            found = [item for key, item in pipeline.table.items.items()
+                     if not key.startswith(('idempotency#', 'breaker#', 'audiojob#', 'search#', 'lsh#'))]
+            print(f"{name}: {len(found)} requests")
+            items.extend(found)
+    finally:
+        similarity.MODE = mode
+        use_queue(queue_url)
+    return items
+
+
+def use_queue(url):
+    """Point utils.audio_queue (and the pipeline's audio workers) at url, or turn the queue off"""
+    if url:
+        os.environ['AUDIO_QUEUE_URL'] = url
+    else:
+        os.environ.pop('AUDIO_QUEUE_URL', None)
+    audio_queue.QUEUE_URL = url
+
+
+def summarize(items):
+    """{mode: {requests, cost by component, summed units}}"""
+    modes = {}
+    for item in items:
+        if not item.get('usage'):
+            continue
+        summary = modes.setdefault(metering.mode(item), {'requests': 0, 'cost': {}, 'units': {}})
+        usage = metering.total(item['usage'])
+        summary['requests'] += 1
+        for component, value in metering.cost(usage).items():
+            summary['cost'][component] = summary['cost'].get(component, 0.0) + value
+        for name, value in usage.items():
+            if name != 'calls':
+                summary['units'][name] = summary['units'].get(name, 0.0) + value
+        summary['units']['calls'] = summary['units'].get('calls', 0.0) + sum(usage['calls'].values())
+    return modes
+
+
+def report(modes):
+    header = f"{'mode':<14}{'requests':>9}{'$/1k':>9}" + ''.join(f"{c:>14}" for c in COMPONENTS)
+    print(header)
+    for name in sorted(modes, key=lambda mode: MODES.index(mode) if mode in MODES else len(MODES)):
+        summary = modes[name]
+        per_thousand = 1000 / summary['requests']
+        cost = {component: value * per_thousand for component, value in summary['cost'].items()}
+        print(f"{name:<14}{summary['requests']:>9}{sum(cost.values()):>9.2f}"
+              + ''.join(f"{cost.get(c, 0.0):>14.4f}" for c in COMPONENTS))
+    print()
+    print(f"{'mode':<14}{'input tok':>10}{'output tok':>11}{'audio s':>9}{'calls':>7}   (averages per request)")
+    for name, summary in modes.items():
+        units = {unit: value / summary['requests'] for unit, value in summary['units'].items()}
+        print(f"{name:<14}{units.get('bedrockInputTokens', 0):>10.0f}{units.get('bedrockOutputTokens', 0):>11.0f}"
+              f"{units.get('elevenlabsSeconds', 0):>9.1f}{units.get('calls', 0):>7.1f}")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    source = parser.add_mutually_exclusive_group()
+    source.add_argument('--table', help="Scan this DynamoDB table")
+    source.add_argument('--items', help="Read items from a JSON lines file")
+    parser.add_argument('--requests', type=int, default=10, help="Requests per simulated scenario")
+    parser.add_argument('--verbose', action='store_true', help="Show handler logs")
+    args = parser.parse_args(argv)
+
+    if args.table:
+        items = list(scan_table(args.table))
+    elif args.items:
+        items = list(read_items(args.items))
+    else:
+        items = simulate(args.requests, args.verbose)
+        print()
+    modes = summarize(items)
+    if not modes:
+        print("No items with usage")
+        return 1
+    report(modes)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
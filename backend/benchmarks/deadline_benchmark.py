@@ -0,0 +1,143 @@
+"""
+Requests against slow downstreams with and without the request deadline
+(utils.deadline).
+
+Bedrock and ElevenLabs get heavy latency tails, so some requests take longer
+than API Gateway waits (API_LIMIT_SECONDS). Without a deadline
+(REQUEST_BUDGET_SECONDS effectively unlimited, as before) such a request still
+runs every step, and its result reaches nobody. With the deadline,
+generate_audio skips ElevenLabs and the renditions when the budget is gone,
+and the ElevenLabs read timeout is cut to what is left, so the request
+completes degraded within the limit. The Bedrock stub is not a botocore
+client and ignores the read timeout utils.deadline.client() would set, so a
+Bedrock tail longer than the limit is still late here; only the work after
+it is skipped. Reports per mode:
+
+- p50/p99 latency and responses later than the API limit
+- ElevenLabs calls and seconds of audio generated for responses that were late
+- responses degraded by the deadline
+
+Delays and the deadline settings are scaled by --latency-scale.
+
+Usage (from backend/):
+    python -m benchmarks.deadline_benchmark
+    python -m benchmarks.deadline_benchmark --requests 200 --tail-probability 0.2
+"""
+import argparse
+import contextlib
+import io
+import json
+import sys
+from concurrent.futures import ThreadPoolExecutor
+
+from benchmarks.load_test import DEFAULT_LATENCIES, percentile
+from benchmarks.pipeline import LocalPipeline, sample_image
+from harness import stubs
+from harness.handlers import LAYER_DIRS
+
+for _layer in LAYER_DIRS:
+    if _layer not in sys.path:
+        sys.path.append(_layer)
+from utils import deadline  # noqa: E402
+
+API_LIMIT_SECONDS = 29.0
+
+# Module settings expressed in seconds, rescaled with the latencies
+SCALED_SETTINGS = {
+    'image_to_text': ('BEDROCK_MIN_SECONDS', 'AUDIO_RESERVE_SECONDS'),
+    'generate_audio': ('ELEVENLABS_TIMEOUT_SECONDS', 'ELEVENLABS_MIN_SECONDS', 'POSTPROCESS_RESERVE_SECONDS',
+                       'RENDER_MIN_SECONDS', 'EXTENDED_MIN_SECONDS')
+}
+
+
+def build_pipeline(args, budget_seconds):
+    tails = {'bedrock': args.tail_probability, 'elevenlabs': args.tail_probability}
+    models = {
+        name: stubs.LatencyModel(median=median, sigma=0.3, scale=args.latency_scale, seed=args.seed + index,
+                                 tail_probability=tails.get(name, 0.0), tail_factor=args.tail_factor)
+        for index, (name, median) in enumerate(DEFAULT_LATENCIES.items())
+    }
+    pipeline = LocalPipeline(latencies=models)
+    # Record generated seconds per request so late requests' work can be counted
+    generate = pipeline.elevenlabs._generate
+
+    def tracked(json_body, timeout):
+        response = generate(json_body, timeout)
+        trace = stubs.current_trace()
+        if trace is not None and response.status_code == 200:
+            trace.add('elevenlabs_seconds', float(json_body['duration_seconds']))
+        return response
+    pipeline.elevenlabs._generate = tracked
+
+    scale = args.latency_scale
+    for name, settings in SCALED_SETTINGS.items():
+        module = pipeline.handlers[name]
+        for setting in settings:
+            setattr(module, setting, getattr(module, setting) * scale)
+    deadline.BUDGET_SECONDS = budget_seconds * scale
+    deadline.RESPONSE_RESERVE_SECONDS = 1.0 * scale
+    deadline.MIN_TIMEOUT_SECONDS = 0.5 * scale
+    return pipeline
+
+
+def run(args, budget_seconds):
+    defaults = (deadline.BUDGET_SECONDS, deadline.RESPONSE_RESERVE_SECONDS, deadline.MIN_TIMEOUT_SECONDS)
+    pipeline = build_pipeline(args, budget_seconds)
+    image = sample_image(640, 480)
+
+    def one_request(_):
+        response, trace = pipeline.analyze(image)
+        return response, trace.totals()
+
+    try:
+        with contextlib.redirect_stdout(io.StringIO()):
+            with ThreadPoolExecutor(max_workers=args.concurrency) as pool:
+                results = list(pool.map(one_request, range(args.requests)))
+    finally:
+        deadline.BUDGET_SECONDS, deadline.RESPONSE_RESERVE_SECONDS, deadline.MIN_TIMEOUT_SECONDS = defaults
+
+    limit = API_LIMIT_SECONDS * args.latency_scale
+    totals = [t['total'] for _, t in results]
+    late = [t for _, t in results if t['total'] > limit]
+    statuses = {}
+    degraded = 0
+    for response, _ in results:
+        statuses[response['statusCode']] = statuses.get(response['statusCode'], 0) + 1
+        if response['statusCode'] == 200 and 'elevenlabs' in json.loads(response['body']).get('degraded', []):
+            degraded += 1
+    return {
+        'statuses': dict(sorted(statuses.items())),
+        'p50': percentile(totals, 50) / args.latency_scale,
+        'p99': percentile(totals, 99) / args.latency_scale,
+        'max': max(totals) / args.latency_scale,
+        'late': len(late),
+        'elevenlabs_calls': pipeline.elevenlabs.calls,
+        'wasted_seconds': sum(t.get('elevenlabs_seconds', 0.0) for t in late),
+        'generated_seconds': pipeline.elevenlabs.seconds_generated,
+        'degraded': degraded
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--requests', type=int, default=120)
+    parser.add_argument('--concurrency', type=int, default=16)
+    parser.add_argument('--tail-probability', type=float, default=0.1)
+    parser.add_argument('--tail-factor', type=float, default=6.0)
+    parser.add_argument('--latency-scale', type=float, default=0.01)
+    parser.add_argument('--seed', type=int, default=5)
+    args = parser.parse_args(argv)
+
+    print(f"{args.requests} requests, {args.tail_probability:.0%} of Bedrock and ElevenLabs calls "
+          f"{args.tail_factor:g}x slower; API limit {API_LIMIT_SECONDS:g} s (latencies in production seconds)")
+    print(f"{'mode':<12}{'p50':>8}{'p99':>8}{'max':>8}{'late':>6}{'no audio':>10}{'EL calls':>10}"
+          f"{'EL s wasted':>13}  status codes")
+    for name, budget in (('no budget', 1e6), ('deadline', deadline.BUDGET_SECONDS)):
+        result = run(args, budget)
+        print(f"{name:<12}{result['p50']:>8.1f}{result['p99']:>8.1f}{result['max']:>8.1f}{result['late']:>6}"
+              f"{result['degraded']:>10}{result['elevenlabs_calls']:>10}"
+              f"{result['wasted_seconds']:>9.0f}/{result['generated_seconds']:<4.0f} {result['statuses']}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,142 @@
+"""
+Cost of the deadline-bounded boto3 clients (utils.deadline.client) with real
+botocore clients.
+
+Every (read timeout step, attempts) pair a request needs is a separate
+client, built the first time a container needs it. This builds the variants
+of a DynamoDB Table, an S3 client and a Rekognition client twice: each from
+a fresh boto3 session (how deadline.client used to build them) and through
+deadline.client, which builds them all from one shared session. Reports per
+mode the milliseconds and memory (tracemalloc, so Python allocations only)
+per variant and the microseconds per lookup of a variant that already
+exists. No request is sent: the clients get dummy credentials unless the
+environment has some.
+
+A session per variant takes about 0.2 s, so by default only a few steps are
+built; --steps with every TIMEOUT_STEPS value builds all of them.
+
+Usage (from backend/):
+    python -m benchmarks.deadline_client_benchmark
+    python -m benchmarks.deadline_client_benchmark --steps 1 2 3 4 6 8 10 12 15 18 21 24 27 30 45 60
+"""
+import argparse
+import gc
+import os
+import sys
+import time
+import tracemalloc
+
+from harness.handlers import LAYER_DIRS
+
+for _layer in LAYER_DIRS:
+    if _layer not in sys.path:
+        sys.path.append(_layer)
+
+os.environ.setdefault('AWS_DEFAULT_REGION', 'us-east-1')
+os.environ.setdefault('AWS_ACCESS_KEY_ID', 'benchmark')
+os.environ.setdefault('AWS_SECRET_ACCESS_KEY', 'benchmark')
+
+import boto3  # noqa: E402
+from botocore.config import Config  # noqa: E402
+
+from utils import deadline  # noqa: E402
+
+SERVICES = ('dynamodb', 's3', 'rekognition')
+TABLE_NAME = 'benchmark-table'
+
+
+def bases():
+    """The container-level clients the handlers create at import"""
+    return {
+        'dynamodb': boto3.resource('dynamodb').Table(TABLE_NAME),
+        's3': boto3.client('s3'),
+        'rekognition': boto3.client('rekognition')
+    }
+
+
+def session_per_variant(base, service, step, attempts):
+    """A variant built the way deadline.client used to: from a new session"""
+    low_level = base.meta.client if service == 'dynamodb' else base
+    config = low_level.meta.config.merge(Config(
+        connect_timeout=min(deadline.CONNECT_TIMEOUT_SECONDS, step), read_timeout=step,
+        retries={'total_max_attempts': attempts, 'mode': 'standard'}
+    ))
+    session = boto3.session.Session()
+    if service == 'dynamodb':
+        return session.resource('dynamodb', region_name=low_level.meta.region_name, config=config).Table(TABLE_NAME)
+    return session.client(service, region_name=low_level.meta.region_name, config=config)
+
+
+def shared_session(base, service, step, attempts):
+    return deadline.client(base, deadline.start(budget=3600), timeout=step, attempts=attempts)
+
+
+def build_all(build, variants, clients):
+    built = []
+    for service, base in clients.items():
+        for step, attempts in variants:
+            built.append(build(base, service, step, attempts))
+    return built
+
+
+def reset():
+    deadline._clients.clear()
+    deadline._session = None
+    gc.collect()
+
+
+def measure(build, variants):
+    """Milliseconds and tracemalloc KB per variant, from a cold cache"""
+    clients = bases()
+    reset()
+    started = time.perf_counter()
+    built = build_all(build, variants, clients)
+    elapsed = time.perf_counter() - started
+
+    reset()
+    gc.collect()
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    built = build_all(build, variants, clients)
+    gc.collect()
+    used = tracemalloc.get_traced_memory()[0] - before
+    tracemalloc.stop()
+    count = len(built)
+    return elapsed * 1000 / count, used / 1024.0 / count, count
+
+
+def lookups(variants, count):
+    """Microseconds per deadline.client call that finds its variant cached"""
+    clients = bases()
+    reset()
+    build_all(shared_session, variants, clients)
+    request_deadline = deadline.start(budget=3600)
+    table = clients['dynamodb']
+    step, attempts = variants[len(variants) // 2]
+    started = time.perf_counter()
+    for _ in range(count):
+        deadline.client(table, request_deadline, timeout=step, attempts=attempts)
+    return (time.perf_counter() - started) * 1e6 / count
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--steps', type=int, nargs='+', default=[2, 6, 15, 30], help="Read timeout steps to build")
+    parser.add_argument('--attempts', type=int, nargs='+', default=list(range(1, deadline.MAX_ATTEMPTS + 1)))
+    parser.add_argument('--lookups', type=int, default=20000)
+    args = parser.parse_args(argv)
+
+    variants = [(step, attempts) for step in args.steps for attempts in args.attempts]
+    print(f"{len(variants)} variants per service ({len(args.steps)} steps x {len(args.attempts)} attempt counts), "
+          f"services: {', '.join(SERVICES)}")
+    print(f"{'mode':<22}{'clients':>8}{'ms/variant':>12}{'KB/variant':>12}{'total ms':>10}")
+    for name, build in (('session per variant', session_per_variant), ('shared session', shared_session)):
+        per_variant_ms, per_variant_kb, count = measure(build, variants)
+        print(f"{name:<22}{count:>8}{per_variant_ms:>12.1f}{per_variant_kb:>12.0f}{per_variant_ms * count:>10.0f}")
+    reset()
+    print(f"cached lookup: {lookups(variants, args.lookups):.1f} us per deadline.client call")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
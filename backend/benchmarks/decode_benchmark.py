@@ -0,0 +1,101 @@
+"""
+Peak RSS and decode time of utils.imaging.decode() versus a plain full decode.
+
+Each measurement runs in a fresh process so ru_maxrss reflects that decode
+alone. Images are synthetic noise (so JPEG and PNG payloads are realistic in
+size) generated once per size into a temporary directory.
+
+Usage (from backend/):
+    python -m benchmarks.decode_benchmark
+    python -m benchmarks.decode_benchmark --sizes 2 12 24 --formats jpeg --max-side 1568
+"""
+import argparse
+import multiprocessing
+import os
+import resource
+import sys
+import tempfile
+import time
+
+from harness.handlers import LAYER_DIRS
+
+
+def _make_image(path, megapixels, image_format):
+    from PIL import Image
+
+    width = int((megapixels * 1e6 * 4 / 3) ** 0.5)
+    height = int(width * 3 / 4)
+    # Low-amplitude noise over a gradient keeps file sizes close to real photos
+    noise = Image.effect_noise((width, height), 24).convert('L')
+    gradient = Image.linear_gradient('L').resize((width, height))
+    image = Image.merge('RGB', (gradient, noise, Image.blend(gradient, noise, 0.5)))
+    image.save(path, format=image_format.upper(), **({'quality': 85} if image_format == 'jpeg' else {'compress_level': 6}))
+    return width, height
+
+
+def _measure(method, path, max_side, queue):
+    for layer in LAYER_DIRS:
+        sys.path.append(layer)
+    from PIL import Image
+    from utils import imaging
+
+    with open(path, 'rb') as f:
+        data = f.read()
+    Image.MAX_IMAGE_PIXELS = None
+    baseline_kb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+    start = time.perf_counter()
+    if method == 'full':
+        import io
+        image = Image.open(io.BytesIO(data))
+        image.load()
+        if max_side and max(image.size) > max_side:
+            image.thumbnail((max_side, max_side), Image.LANCZOS, reducing_gap=None)
+    else:
+        image = imaging.decode(data, max_side=max_side, budget=imaging.DecodeBudget(limit_bytes=2 ** 40))
+    elapsed = time.perf_counter() - start
+
+    peak_kb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    queue.put((elapsed, (peak_kb - baseline_kb) / 1024.0, image.size))
+
+
+def measure(method, path, max_side):
+    queue = multiprocessing.Queue()
+    process = multiprocessing.Process(target=_measure, args=(method, path, max_side, queue))
+    process.start()
+    result = queue.get()
+    process.join()
+    return result
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--sizes', type=float, nargs='+', default=[1, 4, 12, 24], help="Image sizes in megapixels")
+    parser.add_argument('--formats', nargs='+', default=['jpeg', 'png'], choices=['jpeg', 'png'])
+    parser.add_argument('--max-side', type=int, default=1568, help="Target long edge (Claude's native resolution)")
+    parser.add_argument('--repeat', type=int, default=3, help="Runs per measurement; the fastest is reported")
+    args = parser.parse_args(argv)
+
+    print(f"{'format':<6}{'size':>8}{'file MB':>9}  {'full ms':>9}{'full MB':>9}  {'guarded ms':>11}{'guarded MB':>11}  {'speedup':>8}{'mem saved':>10}")
+    with tempfile.TemporaryDirectory() as workdir:
+        for image_format in args.formats:
+            for megapixels in args.sizes:
+                path = os.path.join(workdir, f"{megapixels}.{image_format}")
+                _make_image(path, megapixels, image_format)
+                file_mb = os.path.getsize(path) / 1e6
+
+                results = {}
+                for method in ('full', 'guarded'):
+                    runs = [measure(method, path, args.max_side) for _ in range(args.repeat)]
+                    results[method] = (min(r[0] for r in runs), min(r[1] for r in runs))
+
+                full_s, full_mb = results['full']
+                guarded_s, guarded_mb = results['guarded']
+                print(f"{image_format:<6}{megapixels:>6.0f}MP{file_mb:>9.2f}  {full_s * 1000:>9.1f}{full_mb:>9.1f}  "
+                      f"{guarded_s * 1000:>11.1f}{guarded_mb:>11.1f}  {full_s / guarded_s:>7.1f}x"
+                      f"{(1 - guarded_mb / full_mb) * 100 if full_mb else 0:>9.0f}%")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,163 @@
+"""
+Fault-injection drill for the circuit breakers and degradation controller.
+
+Runs the full pipeline in-process against the stubs and walks through a
+scripted incident: healthy traffic, a Bedrock outage, an ElevenLabs latency
+regression and recovery. After each phase it checks what the controller
+should have done (stop calling the failing downstream after the minimum
+number of calls, degrade instead of failing requests, share the open state
+with a second "container", close again after a successful half-open probe)
+and exits non-zero if any expectation fails.
+
+Breaker windows, cooldowns and SLOs are shortened through the BREAKER_*
+environment variables so the drill runs in about fifteen seconds. Between
+phases it waits one window length so each incident starts from a window
+that holds only its own calls.
+
+Usage (from backend/):
+    python -m benchmarks.degradation_drill
+    python -m benchmarks.degradation_drill --requests 12 --verbose
+"""
+import argparse
+import contextlib
+import io
+import json
+import os
+import sys
+import time
+
+DRILL_ENVIRONMENT = {
+    'BREAKER_MIN_CALLS': '5',
+    'BREAKER_ERROR_RATE': '0.5',
+    'BREAKER_WINDOW_SECONDS': '4',
+    'BREAKER_COOLDOWN_SECONDS': '1.5',
+    'BREAKER_SYNC_SECONDS': '0',
+    'BREAKER_BEDROCK_SLO_MS': '500',
+    'BREAKER_ELEVENLABS_SLO_MS': '500'
+}
+for _key, _value in DRILL_ENVIRONMENT.items():
+    os.environ.setdefault(_key, _value)
+
+from benchmarks.load_test import percentile  # noqa: E402
+from benchmarks.pipeline import LocalPipeline, sample_image  # noqa: E402
+from harness import stubs  # noqa: E402
+from harness.handlers import LAYER_DIRS  # noqa: E402
+
+for _layer in LAYER_DIRS:
+    if _layer not in sys.path:
+        sys.path.append(_layer)
+from utils import resilience  # noqa: E402
+
+HEALTHY = 0.02
+SLOW = 0.6
+
+
+def run_phase(pipeline, image, count, verbose):
+    bedrock_before, elevenlabs_before = pipeline.bedrock.calls, pipeline.elevenlabs.calls
+    results = []
+    for _ in range(count):
+        output = io.StringIO()
+        start = time.perf_counter()
+        with contextlib.redirect_stdout(sys.stdout if verbose else output):
+            response, _ = pipeline.analyze(image)
+        elapsed = time.perf_counter() - start
+        body = json.loads(response['body'])
+        results.append({'status': response['statusCode'], 'seconds': elapsed, 'degraded': body.get('degraded', [])})
+    return {
+        'requests': count,
+        'ok': sum(1 for r in results if r['status'] == 200),
+        'skipBedrock': sum(1 for r in results if 'bedrock' in r['degraded']),
+        'noAudio': sum(1 for r in results if 'elevenlabs' in r['degraded']),
+        'bedrockCalls': pipeline.bedrock.calls - bedrock_before,
+        'elevenlabsCalls': pipeline.elevenlabs.calls - elevenlabs_before,
+        'p50': percentile([r['seconds'] for r in results], 50),
+        'last': results[-1]
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--requests', type=int, default=10, help="Requests per phase")
+    parser.add_argument('--verbose', action='store_true', help="Show handler logs")
+    args = parser.parse_args(argv)
+
+    min_calls = int(os.environ['BREAKER_MIN_CALLS'])
+    # Long enough for the previous phase to leave the window and for an open breaker to cool down
+    settle = max(float(os.environ['BREAKER_COOLDOWN_SECONDS']), float(os.environ['BREAKER_WINDOW_SECONDS']))
+    if args.requests <= min_calls + 1:
+        parser.error(f"--requests must be more than BREAKER_MIN_CALLS + 1 ({min_calls + 1})")
+
+    bedrock = stubs.LatencyModel(HEALTHY, sigma=0.1, seed=1)
+    elevenlabs = stubs.LatencyModel(HEALTHY, sigma=0.1, seed=2)
+    with contextlib.redirect_stdout(io.StringIO()):
+        pipeline = LocalPipeline({'bedrock': bedrock, 'elevenlabs': elevenlabs})
+        image = sample_image(640, 480)
+    controller = resilience.controller(pipeline.table)
+
+    failures = []
+
+    def expect(condition, message):
+        if not condition:
+            failures.append(message)
+        return condition
+
+    def report(name, phase):
+        print(f"{name:<22}{phase['ok']:>4}/{phase['requests']:<4}{phase['skipBedrock']:>8}{phase['noAudio']:>9}"
+              f"{phase['bedrockCalls']:>10}{phase['elevenlabsCalls']:>12}{phase['p50'] * 1000:>9.0f}  {controller.mode()}")
+
+    print(f"{'phase':<22}{'ok':>9}{'no-llm':>8}{'no-audio':>9}{'bedrock':>10}{'elevenlabs':>12}{'p50 ms':>9}  mode after")
+
+    # 1. Healthy: every request uses both downstreams
+    phase = run_phase(pipeline, image, args.requests, args.verbose)
+    report('healthy', phase)
+    expect(phase['ok'] == args.requests, "healthy: all requests succeed")
+    expect(phase['bedrockCalls'] == args.requests and phase['elevenlabsCalls'] == args.requests, "healthy: no degradation")
+    expect(controller.mode() == resilience.DegradationController.FULL, "healthy: controller stays in full mode")
+
+    # 2. Bedrock outage: the breaker opens after min_calls failures; the rest skip Bedrock
+    bedrock.error_rate = 1.0
+    time.sleep(settle)
+    phase = run_phase(pipeline, image, args.requests, args.verbose)
+    report('bedrock outage', phase)
+    expect(phase['ok'] == args.requests, "bedrock outage: requests still succeed on the Rekognition prompt")
+    expect(phase['bedrockCalls'] == min_calls, f"bedrock outage: Bedrock called {phase['bedrockCalls']} times, expected {min_calls}")
+    expect(phase['skipBedrock'] == args.requests, "bedrock outage: every request reports the Bedrock degradation")
+    expect(controller.mode() == resilience.DegradationController.SKIP_BEDROCK, "bedrock outage: controller skips Bedrock")
+
+    # Another warm container reads the same breaker item and refuses too
+    other = resilience.CircuitBreaker('bedrock', pipeline.table)
+    expect(other.state() == resilience.OPEN and not other.allow(), "second container sees the open Bedrock breaker")
+    print(f"{'second container':<22}{'sees ' + other.state():>20}")
+
+    # 3. Bedrock recovers, ElevenLabs slows past its SLO: one probe closes Bedrock, ElevenLabs opens
+    bedrock.error_rate = 0.0
+    elevenlabs.median = SLOW
+    time.sleep(settle)
+    phase = run_phase(pipeline, image, args.requests, args.verbose)
+    report('elevenlabs slow', phase)
+    expect(phase['ok'] == args.requests, "elevenlabs slow: requests still succeed")
+    expect(phase['bedrockCalls'] == args.requests, "elevenlabs slow: the Bedrock probe closed the breaker")
+    expect(phase['elevenlabsCalls'] == min_calls, f"elevenlabs slow: ElevenLabs called {phase['elevenlabsCalls']} times, expected {min_calls}")
+    expect(phase['noAudio'] == args.requests - phase['elevenlabsCalls'], "elevenlabs slow: later requests return without audio")
+    expect(phase['last']['seconds'] < SLOW / 2, "elevenlabs slow: degraded requests no longer wait on ElevenLabs")
+    expect(controller.mode() == resilience.DegradationController.NO_AUDIO, "elevenlabs slow: controller drops audio")
+
+    # 4. Recovery: after the cooldown one probe closes ElevenLabs again
+    elevenlabs.median = HEALTHY
+    time.sleep(settle)
+    phase = run_phase(pipeline, image, args.requests, args.verbose)
+    report('recovery', phase)
+    expect(phase['elevenlabsCalls'] == args.requests and phase['noAudio'] == 0, "recovery: audio generation resumes")
+    expect(controller.mode() == resilience.DegradationController.FULL, "recovery: controller returns to full mode")
+
+    print()
+    if failures:
+        for failure in failures:
+            print(f"FAIL {failure}")
+        return 1
+    print("PASS all expectations")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
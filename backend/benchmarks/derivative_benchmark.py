@@ -0,0 +1,87 @@
+"""
+CPU time per image and bytes saved by image_to_text's display-size
+derivatives (functions/image_to_text/derivatives.py).
+
+Renders the thumb and medium derivatives of synthetic photos (noise over a
+gradient, as in decode_benchmark) of each size and format, and reports the
+CPU time of the whole render (decode, resample, every encode), the size of
+each derivative, and what a results view (medium) and a gallery card
+(thumb) save over loading the upload. 1.8 MP is what the browser uploads
+after its own downscale; larger sizes are uploads from clients that send
+the camera original.
+
+Usage (from backend/):
+    python -m benchmarks.derivative_benchmark
+    python -m benchmarks.derivative_benchmark --sizes 1.8 12 --formats jpeg --repeat 5
+"""
+import argparse
+import os
+import sys
+import tempfile
+
+from benchmarks.decode_benchmark import _make_image
+from benchmarks.load_test import percentile
+from harness.handlers import FUNCTIONS_DIR, LAYER_DIRS
+
+for _layer in LAYER_DIRS:
+    if _layer not in sys.path:
+        sys.path.append(_layer)
+sys.path.insert(0, os.path.join(FUNCTIONS_DIR, 'image_to_text'))
+import derivatives  # noqa: E402
+from utils import imaging  # noqa: E402
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--sizes', type=float, nargs='+', default=[1.8, 4, 12, 24], help="Image sizes in megapixels")
+    parser.add_argument('--formats', nargs='+', default=['jpeg', 'png'], choices=['jpeg', 'png'],
+                        help="Formats of the upload")
+    parser.add_argument('--repeat', type=int, default=3, help="Renders per image; the median CPU time is reported")
+    args = parser.parse_args(argv)
+
+    encodings = derivatives.available()
+    if not encodings:
+        print("No derivative formats available; check IMAGE_DERIVATIVES and IMAGE_DERIVATIVE_FORMATS")
+        return 2
+    names = [f"{size}-{encoding}" for size in sorted(derivatives.ENABLED_SIZES, key=lambda s: derivatives.SIZES[s])
+             for encoding in encodings]
+    print("sizes: " + ', '.join(f"{size} {derivatives.SIZES[size]}px" for size in derivatives.ENABLED_SIZES)
+          + f"  encodings: {', '.join(encodings)}")
+
+    header = f"{'upload':<6}{'size':>7}{'file KB':>9}{'cpu ms':>8}{'decode':>8}{'encode':>8}"
+    header += ''.join(f"{name + ' KB':>16}" for name in names)
+    header += f"{'medium saved':>14}{'thumb saved':>13}"
+    print(header)
+    print('-' * len(header))
+
+    with tempfile.TemporaryDirectory() as workdir:
+        for image_format in args.formats:
+            for megapixels in args.sizes:
+                path = os.path.join(workdir, f"{megapixels}.{image_format}")
+                _make_image(path, megapixels, image_format)
+                with open(path, 'rb') as f:
+                    data = f.read()
+
+                runs = []
+                for _ in range(args.repeat):
+                    rendered, stats = derivatives.render(data, budget=imaging.DecodeBudget(limit_bytes=2 ** 40))
+                    runs.append(stats)
+                sizes = {name: len(derivative['data']) for name, derivative in rendered.items()}
+
+                def saved(size):
+                    # The smallest encoding of the size, as a <picture> with a WebP source loads it
+                    smallest = min((bytes_ for name, bytes_ in sizes.items() if name.startswith(size + '-')), default=None)
+                    return 1 - smallest / float(len(data)) if smallest is not None else 0.0
+
+                row = (f"{image_format:<6}{megapixels:>5.1f}MP{len(data) / 1024:>9.0f}"
+                       f"{percentile([r['cpuMs'] for r in runs], 50):>8.0f}"
+                       f"{percentile([r['decodeMs'] for r in runs], 50):>8.0f}"
+                       f"{percentile([r['encodeMs'] for r in runs], 50):>8.0f}")
+                row += ''.join(f"{sizes.get(name, 0) / 1024:>16.1f}" for name in names)
+                row += f"{saved('medium'):>14.1%}{saved('thumb'):>13.1%}"
+                print(row)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
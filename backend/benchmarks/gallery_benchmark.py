@@ -0,0 +1,258 @@
+"""
+Cost of listing recent soundscapes as the table grows: the gallery's GSI
+query against the full scan it replaces.
+
+Fills the local table with --sizes items (mostly COMPLETED, some in other
+states, plus idempotency lock and audio job items that carry no status and
+so stay out of the sparse index), then pages through the gallery handler
+with the first-page cache disabled. For each size it reports read units and
+items examined per page, and handler latency for the first and a deep page.
+A scan-based listing (scan everything, filter by status, sort by createdAt)
+is measured alongside for comparison.
+
+Read units follow DynamoDB's accounting: 0.5 per item read eventually
+consistently (up to 4 KB), so the query's cost is set by the page size alone.
+
+--check runs the same listing against a real DynamoDB API instead of the
+in-memory table: moto's (pip install moto), or DynamoDB Local with
+--endpoint-url. It creates the table and the status-createdAt-index as
+deployed, loads two very different sizes, pages through the gallery handler
+and fails unless every page's ScannedCount is the number of items it returned
+and at most the page size, at both sizes. A scan's ScannedCount is shown for
+contrast. moto's
+latency and consumed capacity are not DynamoDB's, so only counts are checked.
+
+Usage (from backend/):
+    python -m benchmarks.gallery_benchmark
+    python -m benchmarks.gallery_benchmark --sizes 1000 100000 1000000 --pages 10
+    python -m benchmarks.gallery_benchmark --check
+    python -m benchmarks.gallery_benchmark --check --endpoint-url http://localhost:8000 --sizes 500 50000
+"""
+import argparse
+import contextlib
+import io
+import json
+import os
+import random
+import sys
+import time
+import uuid
+from decimal import Decimal
+
+from benchmarks.load_test import percentile
+from benchmarks.pipeline import ENVIRONMENT, LocalPipeline
+from harness.handlers import load_handler
+
+SCENES = ['beach', 'forest', 'city', 'mountain', 'indoor', 'desert', 'snow', 'nature']
+STATUSES = ['COMPLETED'] * 90 + ['ERROR'] * 4 + ['PROCESSING'] * 3 + ['ANALYZED'] * 3
+
+
+def soundscape_items(size, seed=3):
+    """Soundscape items spread over the last 30 days"""
+    rng = random.Random(seed)
+    now = int(time.time())
+    for index in range(size):
+        image_id = str(uuid.UUID(int=rng.getrandbits(128)))
+        if index % 50 == 0:
+            # Special items have no status attribute
+            key = f"idempotency#{image_id}"
+            yield {'imageId': key, 'lockState': 'COMPLETED', 'createdAt': Decimal(now)}
+            continue
+        yield {
+            'imageId': image_id,
+            'status': rng.choice(STATUSES),
+            'createdAt': Decimal(now - rng.randrange(30 * 86400)),
+            'scene': rng.choice(SCENES),
+            'description': "A wide sandy beach under a clear sky with gentle waves rolling onto the shore.",
+            'soundPrompt': "Gentle ocean waves lapping over sand, seagulls calling overhead, a soft sea breeze.",
+            'detectedElements': ['Beach', 'Sand', 'Sea', 'Wave', 'Sky', 'Bird'],
+            'audioUrl': f"https://soundscape-audio.s3.amazonaws.com/audio/{image_id}.mp3",
+            'degraded': []
+        }
+
+
+def populate(table, size, seed=3):
+    """Soundscape items written straight into the fake"""
+    for item in soundscape_items(size, seed):
+        table.items[item['imageId']] = item
+    table._version += 1
+
+
+def scan_listing(table, limit):
+    """What listing costs without the index: read everything, then filter and sort"""
+    items = table.scan(FilterExpression='#s = :s', ExpressionAttributeNames={'#s': 'status'},
+                       ExpressionAttributeValues={':s': 'COMPLETED'})['Items']
+    items.sort(key=lambda item: item['createdAt'], reverse=True)
+    return items[:limit]
+
+
+def page_through(handler, table, pages, limit):
+    """(read units, latency seconds) per page, following nextCursor"""
+    results = []
+    cursor = None
+    for _ in range(pages):
+        params = {'limit': str(limit)}
+        if cursor:
+            params['cursor'] = cursor
+        units = table.read_units
+        start = time.perf_counter()
+        response = handler.lambda_handler({'httpMethod': 'GET', 'queryStringParameters': params}, None)
+        elapsed = time.perf_counter() - start
+        body = json.loads(response['body'])
+        results.append((table.read_units - units, elapsed, body['count']))
+        cursor = body['nextCursor']
+        if not cursor:
+            break
+    return results
+
+
+class QueryLog:
+    """A real Table whose queries are passed through and their counts kept"""
+
+    def __init__(self, table):
+        self.table = table
+        self.pages = []
+
+    def query(self, **request):
+        response = self.table.query(ReturnConsumedCapacity='INDEXES', **request)
+        self.pages.append({'count': response['Count'], 'scanned': response['ScannedCount'],
+                           'capacity': (response.get('ConsumedCapacity') or {}).get('CapacityUnits')})
+        return response
+
+    @property
+    def read_units(self):
+        return sum(page['capacity'] or 0 for page in self.pages)
+
+
+def create_table(dynamodb, name, index_name, projected):
+    """The soundscape table with the gallery index, as deployed"""
+    table = dynamodb.create_table(
+        TableName=name,
+        KeySchema=[{'AttributeName': 'imageId', 'KeyType': 'HASH'}],
+        AttributeDefinitions=[{'AttributeName': 'imageId', 'AttributeType': 'S'},
+                              {'AttributeName': 'status', 'AttributeType': 'S'},
+                              {'AttributeName': 'createdAt', 'AttributeType': 'N'}],
+        GlobalSecondaryIndexes=[{
+            'IndexName': index_name,
+            'KeySchema': [{'AttributeName': 'status', 'KeyType': 'HASH'},
+                          {'AttributeName': 'createdAt', 'KeyType': 'RANGE'}],
+            'Projection': {'ProjectionType': 'INCLUDE', 'NonKeyAttributes': list(projected)}
+        }],
+        BillingMode='PAY_PER_REQUEST'
+    )
+    table.wait_until_exists()
+    return table
+
+
+def scanned_by_scan(table):
+    """Items a scan-based listing reads, over every 1 MB scan page"""
+    scanned, request = 0, {'Select': 'COUNT'}
+    while True:
+        response = table.scan(**request)
+        scanned += response['ScannedCount']
+        if 'LastEvaluatedKey' not in response:
+            return scanned
+        request['ExclusiveStartKey'] = response['LastEvaluatedKey']
+
+
+def check_index(args):
+    """Whether gallery pages read only page-size items at every size, against a real DynamoDB API"""
+    import boto3
+
+    for name, value in ENVIRONMENT.items():
+        os.environ.setdefault(name, value)
+    mock = contextlib.nullcontext()
+    if not args.endpoint_url:
+        try:
+            from moto import mock_aws
+        except ImportError:
+            print("--check needs moto (pip install moto) or DynamoDB Local (--endpoint-url)")
+            return 2
+        mock = mock_aws()
+
+    failures = []
+    print(f"{'items':>9}{'pages':>7}{'items/page':>12}{'scanned/page':>14}{'RCU/page':>10}{'scan scanned':>14}")
+    with mock:
+        dynamodb = boto3.resource('dynamodb', endpoint_url=args.endpoint_url)
+        handler = load_handler('gallery')
+        handler.CACHE_TTL_SECONDS = 0
+        projected = [field for field in handler.PROJECTED_FIELDS if field not in ('imageId', 'status', 'createdAt')]
+        for size in args.sizes:
+            table = create_table(dynamodb, f"gallery-check-{size}-{uuid.uuid4().hex[:8]}", handler.INDEX_NAME,
+                                 projected)
+            try:
+                with table.batch_writer() as batch:
+                    for item in soundscape_items(size):
+                        batch.put_item(Item=item)
+                log = QueryLog(table)
+                handler.table = log
+                with contextlib.redirect_stdout(io.StringIO()):
+                    page_through(handler, log, args.pages, args.limit)
+                scan_scanned = scanned_by_scan(table)
+            finally:
+                if args.endpoint_url:
+                    table.delete()
+
+            scanned = [page['scanned'] for page in log.pages]
+            capacity = [page['capacity'] for page in log.pages if page['capacity'] is not None]
+            print(f"{size:>9}{len(log.pages):>7}{max(page['count'] for page in log.pages):>12}{max(scanned):>14}"
+                  f"{max(capacity) if capacity else float('nan'):>10.1f}{scan_scanned:>14}")
+            if max(scanned) > args.limit:
+                failures.append(f"{size} items: a page scanned {max(scanned)} items for a page size of {args.limit}")
+            if any(page['scanned'] != page['count'] for page in log.pages):
+                failures.append(f"{size} items: pages scanned items they did not return: "
+                                f"{[(page['count'], page['scanned']) for page in log.pages]}")
+            if len(log.pages) < args.pages:
+                failures.append(f"{size} items: only {len(log.pages)} of {args.pages} pages; use a larger size")
+
+    for failure in failures:
+        print(f"FAIL {failure}")
+    if not failures:
+        print(f"PASS every page scanned at most {args.limit} items at each size")
+    return 1 if failures else 0
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--sizes', type=int, nargs='+', default=None,
+                        help="Table sizes (default 1000 10000 100000, or 500 20000 with --check)")
+    parser.add_argument('--pages', type=int, default=10)
+    parser.add_argument('--limit', type=int, default=20)
+    parser.add_argument('--scan-max', type=int, default=100000, help="Skip the scan comparison above this size")
+    parser.add_argument('--check', action='store_true', help="Check the index against moto or DynamoDB Local")
+    parser.add_argument('--endpoint-url', help="DynamoDB Local endpoint for --check, instead of moto")
+    args = parser.parse_args(argv)
+
+    if args.check:
+        args.sizes = args.sizes or [500, 20000]
+        return check_index(args)
+    args.sizes = args.sizes or [1000, 10000, 100000]
+
+    print(f"{'items':>9}{'RCU/page':>10}{'p50 ms':>9}{'max ms':>9}{'pages':>7}"
+          f"{'scan RCU':>11}{'scan ms':>10}")
+    for size in args.sizes:
+        pipeline = LocalPipeline()
+        handler = pipeline.handlers['gallery']
+        handler.CACHE_TTL_SECONDS = 0
+        populate(pipeline.table, size)
+
+        with contextlib.redirect_stdout(io.StringIO()):
+            # The first query after loading builds the stub's sorted index
+            page_through(handler, pipeline.table, 1, args.limit)
+            pages = page_through(handler, pipeline.table, args.pages, args.limit)
+
+        units = [page[0] for page in pages]
+        latencies = [page[1] * 1000 for page in pages]
+        line = (f"{size:>9}{max(units):>10.1f}{percentile(latencies, 50):>9.2f}{max(latencies):>9.2f}"
+                f"{len(pages):>7}")
+        if size <= args.scan_max:
+            before = pipeline.table.read_units
+            start = time.perf_counter()
+            scan_listing(pipeline.table, args.limit)
+            line += f"{pipeline.table.read_units - before:>11.0f}{(time.perf_counter() - start) * 1000:>10.1f}"
+        print(line)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
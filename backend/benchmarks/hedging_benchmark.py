@@ -0,0 +1,95 @@
+"""
+Tail latency of Bedrock calls with and without hedging.
+
+Drives utils.hedging.Hedger against two FakeBedrock stubs (primary and
+hedge target) whose latency is log-normal with a heavy tail: a small
+fraction of calls take tail_factor times longer, which is what hedging is
+for. Latencies are the production shape scaled down (--scale) so a few
+hundred calls run in seconds. Reports p50/p95/p99, hedge rate against the
+budget, hedge wins, and the extra load hedging put on the downstream.
+
+Usage (from backend/):
+    python -m benchmarks.hedging_benchmark
+    python -m benchmarks.hedging_benchmark --calls 1000 --tail-probability 0.05 --budget 0.1
+"""
+import argparse
+import contextlib
+import io
+import json
+import sys
+import time
+
+from benchmarks.load_test import percentile
+from harness import stubs
+from harness.handlers import LAYER_DIRS
+
+for _layer in LAYER_DIRS:
+    if _layer not in sys.path:
+        sys.path.append(_layer)
+from utils import hedging  # noqa: E402
+
+# Production-shaped Bedrock latency: ~6 s median Claude call
+MEDIAN_SECONDS = 6.0
+
+
+def run(calls, hedge_enabled, args):
+    primary = stubs.FakeBedrock(stubs.LatencyModel(
+        MEDIAN_SECONDS, sigma=args.sigma, scale=args.scale, seed=1,
+        tail_probability=args.tail_probability, tail_factor=args.tail_factor))
+    alternate = stubs.FakeBedrock(stubs.LatencyModel(
+        MEDIAN_SECONDS, sigma=args.sigma, scale=args.scale, seed=2,
+        tail_probability=args.tail_probability, tail_factor=args.tail_factor))
+    hedger = hedging.Hedger(
+        'bedrock', percentile=args.percentile, budget=args.budget,
+        min_delay=MEDIAN_SECONDS * args.scale, max_delay=MEDIAN_SECONDS * args.scale * args.tail_factor,
+        initial_delay=MEDIAN_SECONDS * args.scale * 2, min_samples=20)
+    body = json.dumps({'messages': []})
+
+    def invoke(client):
+        response = client.invoke_model(modelId='model', body=body)
+        return json.loads(response['body'].read())
+
+    latencies = []
+    with contextlib.redirect_stdout(io.StringIO()):
+        for _ in range(calls):
+            start = time.perf_counter()
+            hedger.run(lambda: invoke(primary), (lambda: invoke(alternate)) if hedge_enabled else None)
+            latencies.append((time.perf_counter() - start) / args.scale)
+    hedger._executor.shutdown(wait=True)
+
+    return {
+        'p50': percentile(latencies, 50),
+        'p95': percentile(latencies, 95),
+        'p99': percentile(latencies, 99),
+        'max': max(latencies),
+        'hedgeRate': hedger.counters['hedged'] / calls,
+        'hedgeWins': hedger.counters['hedgeWins'],
+        'budgetDenied': hedger.counters['budgetDenied'],
+        'downstreamCalls': primary.calls + alternate.calls,
+        'finalDelay': hedger.delay() / args.scale
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--calls', type=int, default=400)
+    parser.add_argument('--scale', type=float, default=0.004, help="Multiplier from production to benchmark seconds")
+    parser.add_argument('--sigma', type=float, default=0.25)
+    parser.add_argument('--tail-probability', type=float, default=0.04)
+    parser.add_argument('--tail-factor', type=float, default=6.0)
+    parser.add_argument('--percentile', type=float, default=95)
+    parser.add_argument('--budget', type=float, default=0.1, help="Maximum fraction of calls that may hedge")
+    args = parser.parse_args()
+
+    print(f"{args.calls} calls, median {MEDIAN_SECONDS:.1f} s, {args.tail_probability:.0%} tail at {args.tail_factor:g}x, "
+          f"hedge at p{args.percentile:g}, budget {args.budget:.0%} (latencies in production seconds)")
+    print(f"{'mode':<10}{'p50':>8}{'p95':>8}{'p99':>8}{'max':>8}{'hedged':>9}{'wins':>7}{'denied':>8}{'calls':>8}")
+    for name, enabled in (('off', False), ('hedged', True)):
+        result = run(args.calls, enabled, args)
+        print(f"{name:<10}{result['p50']:>8.2f}{result['p95']:>8.2f}{result['p99']:>8.2f}{result['max']:>8.2f}"
+              f"{result['hedgeRate']:>9.1%}{result['hedgeWins']:>7}{result['budgetDenied']:>8}{result['downstreamCalls']:>8}")
+    print(f"Adaptive hedge delay settled at {result['finalDelay']:.2f} s")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,245 @@
+"""
+Interactive and bulk requests competing for Bedrock and ElevenLabs, with and
+without the scheduler's priority lanes (utils/scheduler.py).
+
+A discrete-event simulation on virtual time, so a ten-minute trace runs in
+well under a second: every request takes a Bedrock slot, then an ElevenLabs
+slot, through the same LaneQueue the scheduler's local backend uses. A
+request waiting longer than the stage's share of the 28 s request budget
+gives up, as the handlers do (Bedrock falls back to labels, ElevenLabs to no
+audio). Two modes run on the same trace:
+
+- shared: one FIFO queue per downstream, which is what the pipeline does
+  without the scheduler
+- lanes: the fair-share lanes of SCHEDULER_WEIGHTS and SCHEDULER_CEILINGS
+
+Per lane it reports slot waits, end-to-end time, the share of requests that
+gave up a stage and the deepest queue seen.
+
+The arrival trace is synthetic by default: a steady trickle of interactive
+uploads while a backfill pushes bulk requests past what the downstreams can
+serve. --trace reads a JSON lines file of {"t", "lane", "bedrockSeconds",
+"elevenlabsSeconds"} (seconds; service times optional) or a capture
+(utils.capture), whose requests keep their arrival offsets, lane and
+recorded call times.
+
+Usage (from backend/):
+    python -m benchmarks.lane_benchmark
+    python -m benchmarks.lane_benchmark --bulk-rate 1.5 --capacity bedrock=8,elevenlabs=4
+    python -m benchmarks.lane_benchmark --trace arrivals.jsonl
+    python -m benchmarks.lane_benchmark --trace captures/ --weights interactive=4,bulk=1
+"""
+import argparse
+import heapq
+import random
+import sys
+
+from benchmarks.load_test import percentile
+from benchmarks.replay import group_requests, load_records
+from harness.handlers import LAYER_DIRS
+
+for _layer in LAYER_DIRS:
+    if _layer not in sys.path:
+        sys.path.append(_layer)
+from utils import scheduler  # noqa: E402
+
+DOWNSTREAMS = ('bedrock', 'elevenlabs')
+# Median service time in seconds; production-shaped, as in hedging_benchmark
+MEDIAN_SECONDS = {'bedrock': 6.0, 'elevenlabs': 10.0}
+SIGMA = 0.35
+BUDGET_SECONDS = 28.0
+# Time a stage must still have when its slot comes: the handlers' DEADLINE_* reserves
+GIVE_UP_BEFORE_END = {'bedrock': 3.0 + 8.0, 'elevenlabs': 4.0 + 1.5}
+
+
+class Arrival:
+    def __init__(self, t, lane, service):
+        self.t = t
+        self.lane = lane
+        self.service = service
+
+
+def synthetic(duration, interactive_rate, bulk_rate, bulk_seconds, seed):
+    rng = random.Random(seed)
+    arrivals = []
+    for lane, rate, until in ((scheduler.INTERACTIVE, interactive_rate, duration),
+                              (scheduler.BULK, bulk_rate, bulk_seconds)):
+        t = 0.0
+        while rate > 0:
+            t += rng.expovariate(rate)
+            if t >= until:
+                break
+            arrivals.append(Arrival(t, lane, {}))
+    return sorted(arrivals, key=lambda a: a.t)
+
+
+def read_trace(path):
+    records = load_records(path)
+    if records and 'fn' in records[0]:
+        requests = group_requests(records)
+        start = requests[0].ts if requests else 0.0
+        arrivals = []
+        for request in requests:
+            analyze = request.by_function.get('analyze_api') or {}
+            service = {svc: sum(call.get('ms') or 0 for call in request.calls.get(svc, [])) / 1000.0
+                       for svc in DOWNSTREAMS if request.calls.get(svc)}
+            arrivals.append(Arrival(request.ts - start, (analyze.get('req') or {}).get('lane') or scheduler.INTERACTIVE,
+                                    service))
+        return arrivals
+    arrivals = []
+    for record in records:
+        service = {svc: record[f"{svc}Seconds"] for svc in DOWNSTREAMS if record.get(f"{svc}Seconds") is not None}
+        arrivals.append(Arrival(float(record['t']), record.get('lane') or scheduler.INTERACTIVE, service))
+    return sorted(arrivals, key=lambda a: a.t)
+
+
+class Request:
+    """A request of the trace as it moves through the simulation; the queues' ticket"""
+
+    def __init__(self, arrival):
+        self.arrival = arrival
+        self.lane = arrival.lane
+        self.queued_at = {}
+        self.waits = {}
+        self.gave_up = []
+        self.done = None
+
+
+class Simulation:
+    """One pass over the trace; lanes=False queues every request in one FIFO lane"""
+
+    def __init__(self, arrivals, capacity, weights, ceilings, lanes, seed):
+        self.arrivals = arrivals
+        self.lanes = lanes
+        self.rng = random.Random(seed)
+        self.queues = {}
+        for downstream in DOWNSTREAMS:
+            # Without lanes, everything is interactive and may use the whole capacity
+            policy = scheduler.FairShare(capacity[downstream], weights, ceilings if lanes else {})
+            self.queues[downstream] = scheduler.LaneQueue(policy)
+        self.events = []
+        self.sequence = 0
+        self.max_depth = {}
+
+    def schedule(self, t, action, request, downstream):
+        self.sequence += 1
+        heapq.heappush(self.events, (t, self.sequence, action, request, downstream))
+
+    def run(self):
+        requests = [Request(arrival) for arrival in self.arrivals]
+        for request in requests:
+            self.schedule(request.arrival.t, self.request_slot, request, 'bedrock')
+        while self.events:
+            t, _, action, request, downstream = heapq.heappop(self.events)
+            action(t, request, downstream)
+        return requests
+
+    def queue_lane(self, request):
+        return request.lane if self.lanes else scheduler.INTERACTIVE
+
+    def service_time(self, request, downstream):
+        recorded = request.arrival.service.get(downstream)
+        if recorded is not None:
+            return recorded
+        return MEDIAN_SECONDS[downstream] * self.rng.lognormvariate(0.0, SIGMA)
+
+    def request_slot(self, t, request, downstream):
+        request.queued_at[downstream] = t
+        queue = self.queues[downstream]
+        if queue.request(self.queue_lane(request), request):
+            self.start(t, request, downstream)
+            return
+        key = (downstream, request.lane)
+        depth = sum(1 for waiting in queue.waiting[self.queue_lane(request)] if waiting.lane == request.lane)
+        self.max_depth[key] = max(self.max_depth.get(key, 0), depth)
+        give_up = request.arrival.t + BUDGET_SECONDS - GIVE_UP_BEFORE_END[downstream]
+        self.schedule(max(t, give_up), self.give_up, request, downstream)
+
+    def start(self, t, request, downstream):
+        request.waits[downstream] = t - request.queued_at[downstream]
+        self.schedule(t + self.service_time(request, downstream), self.finish, request, downstream)
+
+    def give_up(self, t, request, downstream):
+        if downstream in request.waits:
+            return
+        request.gave_up.append(downstream)
+        self.grant(t, downstream, self.queues[downstream].cancel(self.queue_lane(request), request))
+        self.next_stage(t, request, downstream)
+
+    def finish(self, t, request, downstream):
+        self.grant(t, downstream, self.queues[downstream].release(self.queue_lane(request)))
+        self.next_stage(t, request, downstream)
+
+    def grant(self, t, downstream, granted):
+        for _, request in granted:
+            self.start(t, request, downstream)
+
+    def next_stage(self, t, request, downstream):
+        if downstream == 'bedrock':
+            self.schedule(t, self.request_slot, request, 'elevenlabs')
+        else:
+            request.done = t
+
+
+def report(mode, requests, max_depth):
+    print(f"{mode}:")
+    header = (f"  {'lane':<12}{'requests':>9}{'bedrock wait p50/p95':>22}{'elevenlabs wait p50/p95':>25}"
+              f"{'total p50/p95/p99':>22}{'gave up':>9}{'max queue':>11}")
+    print(header)
+    for lane in scheduler.LANES:
+        lane_requests = [r for r in requests if r.lane == lane]
+        if not lane_requests:
+            continue
+        waits = {downstream: [r.waits[downstream] for r in lane_requests if downstream in r.waits]
+                 for downstream in DOWNSTREAMS}
+        totals = [r.done - r.arrival.t for r in lane_requests]
+        gave_up = sum(1 for r in lane_requests if r.gave_up) / float(len(lane_requests))
+        depth = max(max_depth.get((downstream, lane), 0) for downstream in DOWNSTREAMS)
+        print(f"  {lane:<12}{len(lane_requests):>9}"
+              + ''.join(f"{percentile(waits[d], 50):>13.1f}/{percentile(waits[d], 95):<5.1f}s"
+                        + (' ' * 3 if d == 'elevenlabs' else '') for d in DOWNSTREAMS)
+              + f"{percentile(totals, 50):>8.1f}/{percentile(totals, 95):.1f}/{percentile(totals, 99):.1f}s"
+              + f"{gave_up:>9.1%}{depth:>11}")
+
+
+def pairs(text, cast=float):
+    """{name: value} from name=value,name=value"""
+    return {name.strip(): cast(value) for name, _, value in (pair.partition('=') for pair in text.split(',')) if value}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--trace', help="Arrival trace (JSON lines) or capture file/directory")
+    parser.add_argument('--duration', type=float, default=600, help="Seconds of synthetic interactive traffic")
+    parser.add_argument('--interactive-rate', type=float, default=0.15, help="Interactive requests per second")
+    parser.add_argument('--bulk-rate', type=float, default=0.6, help="Bulk requests per second during the backfill")
+    parser.add_argument('--bulk-seconds', type=float, default=300, help="Length of the synthetic backfill")
+    parser.add_argument('--capacity', default=','.join(f"{d}={n}" for d, n in scheduler.CAPACITY.items()),
+                        help="Slots per downstream, as SCHEDULER_CAPACITY")
+    parser.add_argument('--weights', help="Lane weights, as SCHEDULER_WEIGHTS")
+    parser.add_argument('--ceilings', help="Lane ceilings as shares of capacity, as SCHEDULER_CEILINGS")
+    parser.add_argument('--seed', type=int, default=1)
+    args = parser.parse_args(argv)
+
+    capacity = pairs(args.capacity, int)
+    weights = pairs(args.weights) if args.weights else scheduler.WEIGHTS
+    ceilings = pairs(args.ceilings) if args.ceilings else scheduler.CEILINGS
+    if set(DOWNSTREAMS) - set(capacity):
+        parser.error(f"--capacity needs a value for each of {', '.join(DOWNSTREAMS)}")
+
+    arrivals = read_trace(args.trace) if args.trace else synthetic(
+        args.duration, args.interactive_rate, args.bulk_rate, args.bulk_seconds, args.seed)
+    if not arrivals:
+        print("No arrivals in the trace")
+        return 1
+    print(f"{len(arrivals)} arrivals over {arrivals[-1].t:.0f} s; capacity {capacity}; "
+          f"weights {weights}; ceilings {ceilings}")
+    for mode, lanes in (('shared', False), ('lanes', True)):
+        simulation = Simulation(arrivals, capacity, weights, ceilings, lanes, args.seed)
+        print()
+        report(mode, simulation.run(), simulation.max_depth)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
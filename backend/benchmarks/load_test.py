@@ -0,0 +1,243 @@
+"""
+End-to-end load test of the analyze pipeline against local stubs.
+
+Runs requests through analyze_api -> local Step Functions -> every stage
+handler at a configurable concurrency, then reports latency percentiles,
+throughput, memory high-water marks and a per-stage breakdown. A saved
+baseline can be compared against to flag regressions.
+
+Usage (from backend/):
+    python -m benchmarks.load_test --requests 200 --concurrency 16
+    python -m benchmarks.load_test --save-baseline
+    python -m benchmarks.load_test --compare
+"""
+import argparse
+import contextlib
+import io
+import json
+import os
+import resource
+import sys
+import time
+import tracemalloc
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+from benchmarks.pipeline import LocalPipeline, sample_image
+from harness import stubs
+
+DEFAULT_BASELINE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'baseline.json')
+
+# Median production latencies (seconds) of each downstream; scaled by --latency-scale
+DEFAULT_LATENCIES = {
+    's3': 0.02,
+    'dynamodb': 0.008,
+    'rekognition': 0.35,
+    'bedrock': 4.0,
+    'elevenlabs': 6.0
+}
+
+# Metrics compared against the baseline, and whether larger is worse
+COMPARED_METRICS = {
+    'latency.p50': True,
+    'latency.p95': True,
+    'latency.p99': True,
+    'throughput_rps': False,
+    'memory.tracemalloc_peak_mb': True
+}
+
+
+def percentile(values, pct):
+    """Nearest-rank percentile of a list of numbers"""
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    rank = max(0, min(len(ordered) - 1, int(round(pct / 100.0 * len(ordered) + 0.5)) - 1))
+    return ordered[rank]
+
+
+def summarize(values):
+    return {
+        'p50': round(percentile(values, 50), 6),
+        'p95': round(percentile(values, 95), 6),
+        'p99': round(percentile(values, 99), 6),
+        'mean': round(sum(values) / len(values), 6) if values else 0.0,
+        'max': round(max(values), 6) if values else 0.0
+    }
+
+
+def parse_latency_overrides(pairs):
+    latencies = dict(DEFAULT_LATENCIES)
+    for pair in pairs or []:
+        name, _, value = pair.partition('=')
+        if name not in latencies:
+            raise SystemExit(f"Unknown downstream '{name}'. Choose from: {', '.join(latencies)}")
+        latencies[name] = float(value)
+    return latencies
+
+
+def build_pipeline(args):
+    latencies = parse_latency_overrides(args.latency)
+    models = {
+        name: stubs.LatencyModel(
+            median=median,
+            sigma=args.sigma,
+            error_rate=args.error_rate if name in ('bedrock', 'elevenlabs') else 0.0,
+            scale=args.latency_scale,
+            seed=args.seed + index
+        )
+        for index, (name, median) in enumerate(latencies.items())
+    }
+    pipeline = LocalPipeline(latencies=models)
+    if args.capture_dir:
+        # Record this run's traffic for benchmarks.replay
+        from utils import capture
+        capture.CAPTURE_DIR = args.capture_dir
+        capture.CAPTURE_SAMPLE_RATE = 1.0
+    return pipeline
+
+
+def run(args):
+    pipeline = build_pipeline(args)
+    image = sample_image(args.width, args.height)
+
+    def one_request(index):
+        headers = {'Idempotency-Key': str(uuid.uuid4())} if args.idempotency else {}
+        response, trace = pipeline.analyze(image, headers)
+        return response['statusCode'], trace.totals()
+
+    # Handlers log heavily; keep the report readable
+    sink = io.StringIO()
+    tracemalloc.start()
+    started = time.perf_counter()
+    with contextlib.redirect_stdout(sink):
+        with ThreadPoolExecutor(max_workers=args.concurrency) as pool:
+            results = list(pool.map(one_request, range(args.requests)))
+    wall = time.perf_counter() - started
+    _, traced_peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    totals = [t['total'] for _, t in results]
+    stage_names = sorted({name for _, t in results for name in t if name != 'total'})
+    statuses = {}
+    for status, _ in results:
+        statuses[str(status)] = statuses.get(str(status), 0) + 1
+
+    return {
+        'config': {
+            'requests': args.requests,
+            'concurrency': args.concurrency,
+            'latency_scale': args.latency_scale,
+            'error_rate': args.error_rate,
+            'image': f"{args.width}x{args.height}",
+            'image_bytes': len(image)
+        },
+        'latency': summarize(totals),
+        'throughput_rps': round(args.requests / wall, 3),
+        'wall_seconds': round(wall, 3),
+        'status_codes': statuses,
+        'memory': {
+            'tracemalloc_peak_mb': round(traced_peak / 1e6, 3),
+            'max_rss_mb': round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024.0, 1)
+        },
+        'stages': {name: summarize([t.get(name, 0.0) for _, t in results]) for name in stage_names},
+        'calls': {
+            's3': pipeline.s3.calls,
+            'dynamodb': pipeline.table.calls,
+            'rekognition': pipeline.rekognition.calls,
+            'bedrock': pipeline.bedrock.calls,
+            'elevenlabs': pipeline.elevenlabs.calls
+        }
+    }
+
+
+def _lookup(report, dotted):
+    value = report
+    for part in dotted.split('.'):
+        value = value[part]
+    return value
+
+
+def compare(report, baseline, tolerance):
+    """Return human-readable regressions of report against baseline"""
+    regressions = []
+    for metric, larger_is_worse in COMPARED_METRICS.items():
+        try:
+            old = _lookup(baseline, metric)
+            new = _lookup(report, metric)
+        except KeyError:
+            continue
+        if not old:
+            continue
+        change = (new - old) / old
+        if (larger_is_worse and change > tolerance) or (not larger_is_worse and change < -tolerance):
+            regressions.append(f"{metric}: {old} -> {new} ({change:+.1%})")
+    return regressions
+
+
+def print_report(report):
+    latency = report['latency']
+    print(f"requests={report['config']['requests']} concurrency={report['config']['concurrency']} "
+          f"wall={report['wall_seconds']}s throughput={report['throughput_rps']} req/s")
+    print(f"latency p50={latency['p50'] * 1000:.1f}ms p95={latency['p95'] * 1000:.1f}ms "
+          f"p99={latency['p99'] * 1000:.1f}ms max={latency['max'] * 1000:.1f}ms")
+    if 'memory' in report:
+        print(f"memory tracemalloc_peak={report['memory']['tracemalloc_peak_mb']}MB "
+              f"max_rss={report['memory']['max_rss_mb']}MB")
+    print(f"status codes: {report['status_codes']}  downstream calls: {report['calls']}")
+    print(f"{'stage':<28}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}")
+    for name, stats in report['stages'].items():
+        print(f"{name:<28}{stats['p50'] * 1000:>10.2f}{stats['p95'] * 1000:>10.2f}{stats['p99'] * 1000:>10.2f}")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--requests', type=int, default=100)
+    parser.add_argument('--concurrency', type=int, default=8)
+    parser.add_argument('--latency', action='append', metavar='NAME=SECONDS',
+                        help="Override a downstream median latency, e.g. bedrock=2.5")
+    parser.add_argument('--latency-scale', type=float, default=0.01,
+                        help="Multiplier applied to every injected delay (default 0.01)")
+    parser.add_argument('--sigma', type=float, default=0.35, help="Log-normal spread of injected latency")
+    parser.add_argument('--error-rate', type=float, default=0.0, help="Failure rate for Bedrock and ElevenLabs")
+    parser.add_argument('--width', type=int, default=1280)
+    parser.add_argument('--height', type=int, default=960)
+    parser.add_argument('--idempotency', action='store_true', help="Send an Idempotency-Key with each request")
+    parser.add_argument('--seed', type=int, default=7)
+    parser.add_argument('--capture-dir', help="Write a traffic capture of this run for benchmarks.replay")
+    parser.add_argument('--baseline', default=DEFAULT_BASELINE)
+    parser.add_argument('--save-baseline', action='store_true')
+    parser.add_argument('--compare', action='store_true', help="Fail if metrics regress past --tolerance")
+    parser.add_argument('--tolerance', type=float, default=0.15)
+    parser.add_argument('--json', action='store_true', help="Print the raw report as JSON")
+    args = parser.parse_args(argv)
+
+    report = run(args)
+    if args.json:
+        print(json.dumps(report, indent=2))
+    else:
+        print_report(report)
+
+    if args.save_baseline:
+        with open(args.baseline, 'w') as f:
+            json.dump(report, f, indent=2, sort_keys=True)
+        print(f"Saved baseline to {args.baseline}")
+
+    if args.compare:
+        if not os.path.exists(args.baseline):
+            print(f"No baseline at {args.baseline}; run with --save-baseline first")
+            return 2
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        regressions = compare(report, baseline, args.tolerance)
+        if regressions:
+            print("REGRESSIONS:")
+            for line in regressions:
+                print(f"  {line}")
+            return 1
+        print(f"No regressions beyond {args.tolerance:.0%} of baseline")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
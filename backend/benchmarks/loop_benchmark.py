@@ -0,0 +1,110 @@
+"""
+Render speed of generate_audio's loop engine versus realtime.
+
+Synthesizes an ElevenLabs-length stereo clip at 44.1 kHz (drifting tones over
+noise with a slow swell, so loop points are not trivial), then times loop
+point search, rendering tracks of several lengths, and streaming the same
+length in blocks. Speed is reported as seconds of audio produced per
+wall-clock second ("x realtime"). The seam line compares the loudness step
+and largest sample step across the loop boundary with a naive hard loop of
+the whole clip.
+With ffmpeg available, --with-encode adds MP3 encoding of each track, the
+dominant cost in generate_audio.
+
+Usage (from backend/):
+    python -m benchmarks.loop_benchmark
+    python -m benchmarks.loop_benchmark --clip-seconds 8 --lengths 60 600 3600 --with-encode
+"""
+import argparse
+import os
+import sys
+import time
+
+import numpy as np
+
+from harness.handlers import FUNCTIONS_DIR
+
+sys.path.insert(0, os.path.join(FUNCTIONS_DIR, 'generate_audio'))
+import looping  # noqa: E402
+import renditions  # noqa: E402
+
+
+def synth_clip(seconds, sample_rate=looping.SAMPLE_RATE):
+    rng = np.random.default_rng(7)
+    t = np.arange(int(seconds * sample_rate)) / sample_rate
+    swell = 0.6 + 0.4 * np.sin(2 * np.pi * t / seconds)
+    tones = 0.2 * np.sin(2 * np.pi * 180 * t + 4 * np.sin(2 * np.pi * 0.7 * t)) + 0.1 * np.sin(2 * np.pi * 410 * t)
+    left = swell * tones + rng.normal(0, 0.04, t.shape[0])
+    right = swell * np.roll(tones, 200) + rng.normal(0, 0.04, t.shape[0])
+    # ElevenLabs clips tend to fade out at the end
+    fade = np.minimum(1.0, (t[-1] - t) / 0.3)
+    return (np.stack([left, right], axis=1) * fade[:, None]).astype(np.float32)
+
+
+def seam(loop, sample_rate=looping.SAMPLE_RATE, window_seconds=0.05):
+    """
+    (loudness step in dB, largest sample step relative to the typical step)
+    when the buffer wraps from its end back to its start
+    """
+    window = int(window_seconds * sample_rate)
+    before = np.sqrt(np.mean(loop[-window:] ** 2)) + 1e-9
+    after = np.sqrt(np.mean(loop[:window] ** 2)) + 1e-9
+    step = np.abs(loop[0] - loop[-1]).max()
+    typical = np.abs(np.diff(loop, axis=0)).max(axis=1).mean()
+    return abs(20 * np.log10(after / before)), step / typical
+
+
+def timed(fn):
+    start = time.perf_counter()
+    result = fn()
+    return time.perf_counter() - start, result
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--clip-seconds', type=float, default=8.0, help="Generated clip length (ElevenLabs duration)")
+    parser.add_argument('--lengths', type=float, nargs='+', default=[60, 600, 3600], help="Track lengths in seconds")
+    parser.add_argument('--block-frames', type=int, default=4096)
+    parser.add_argument('--with-encode', action='store_true', help="Also time MP3 encoding of each track")
+    args = parser.parse_args(argv)
+
+    rate = looping.SAMPLE_RATE
+    clip = synth_clip(args.clip_seconds)
+    search_s, points = timed(lambda: looping.find_loop_points(clip, rate))
+    loop = looping.make_loop(clip, points)
+
+    print(f"clip: {args.clip_seconds:.0f} s stereo @ {rate} Hz")
+    print(f"loop: {points.start / rate:.3f}-{points.end / rate:.3f} s, score {points.score:.3f}, "
+          f"search {search_s * 1000:.1f} ms ({args.clip_seconds / search_s:.0f}x realtime)")
+    looped_db, looped_step = seam(loop)
+    naive_db, naive_step = seam(clip)
+    print(f"seam: looped {looped_db:.1f} dB / {looped_step:.2f}x step, "
+          f"naive whole-clip loop {naive_db:.1f} dB / {naive_step:.2f}x step")
+
+    header = f"{'track s':>8}{'render ms':>11}{'render x rt':>13}{'stream ms':>11}{'stream x rt':>13}"
+    if args.with_encode:
+        header += f"{'encode ms':>11}{'encode x rt':>13}"
+    print(header)
+
+    encode = args.with_encode and renditions.available()
+    if args.with_encode and not encode:
+        print(f"ffmpeg not found at {renditions.FFMPEG_PATH}; skipping encode timings")
+
+    for seconds in args.lengths:
+        render_s, track = timed(lambda: looping.render(clip, rate, seconds, points))
+
+        blocks = -(-int(seconds * rate) // args.block_frames)
+        generator = looping.stream(clip, rate, points, args.block_frames)
+        stream_s, _ = timed(lambda: [next(generator) for _ in range(blocks)])
+
+        row = f"{seconds:>8.0f}{render_s * 1000:>11.1f}{seconds / render_s:>13.0f}{stream_s * 1000:>11.1f}{seconds / stream_s:>13.0f}"
+        if encode:
+            encode_s, _ = timed(lambda: renditions.encode_pcm(track.astype('<f4').tobytes(), rate, looping.CHANNELS,
+                                                              timeout=max(60, seconds)))
+            row += f"{encode_s * 1000:>11.0f}{seconds / encode_s:>13.0f}"
+        print(row)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
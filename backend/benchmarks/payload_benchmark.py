@@ -0,0 +1,163 @@
+"""
+Step Functions transition sizes and serialization cost, before and after
+the compact stage payload (utils.payload).
+
+Builds one representative request: a Claude-length description and sound
+prompt, ~20 detected elements, four renditions and an 800-point waveform
+computed by generate_audio's own code. From it, it derives the state each
+stage emitted before (every stage forwarding the whole analysis, and
+final_response wrapping the body as a JSON string in an API Gateway
+envelope) and the compact payloads emitted now. Reports:
+
+- bytes per transition, and in total
+- JSON work per request: each transition is encoded by the Lambda runtime
+  and decoded by the next stage; the old analyze_api then decoded the
+  output and the body and encoded the body again, the new one forwards the
+  output as the body
+- stdlib json against orjson (when installed) for the response body
+
+The old final output also inlined the waveform peaks; they are now passed by
+reference like the other large fields.
+
+Usage (from backend/):
+    python -m benchmarks.payload_benchmark
+    python -m benchmarks.payload_benchmark --repeat 5000
+"""
+import argparse
+import json
+import os
+import sys
+import timeit
+
+import numpy as np
+
+from harness.handlers import FUNCTIONS_DIR, LAYER_DIRS
+
+for _layer in LAYER_DIRS:
+    if _layer not in sys.path:
+        sys.path.append(_layer)
+sys.path.insert(0, os.path.join(FUNCTIONS_DIR, 'generate_audio'))
+import waveform  # noqa: E402
+from utils import payload  # noqa: E402
+
+IMAGE_ID = '6f1c2a9e-8d4b-4c1e-9a7f-3b5d2e8c1f04'
+BUCKET = 'https://soundscape-audio.s3.amazonaws.com'
+
+
+def sample_request():
+    """(final body, workflow input) for a typical completed request"""
+    rng = np.random.default_rng(7)
+    pcm = (rng.standard_normal(16000 * 8) * 0.2).astype('<f4').tobytes()
+    peaks = waveform.compute(pcm, 16000, 44100)
+    renditions = [
+        {'name': name, 'key': f"audio/{IMAGE_ID}{suffix}", 'url': f"{BUCKET}/audio/{IMAGE_ID}{suffix}",
+         'contentType': content_type, 'codec': codec, 'bitrateKbps': kbps, 'bytes': size}
+        for name, suffix, content_type, codec, kbps, size in (
+            ('preview-opus', '-preview.ogg', 'audio/ogg', 'opus', 32, 33120),
+            ('preview-aac', '-preview.m4a', 'audio/mp4', 'aac', 48, 49380),
+            ('standard', '.mp3', 'audio/mpeg', 'mp3', 128, 129306),
+            ('extended', '-extended.mp3', 'audio/mpeg', 'mp3', 128, 1921044)
+        )
+    ]
+    body = {
+        'imageId': IMAGE_ID,
+        'description': ("A wide sandy beach under a clear sky with gentle waves rolling onto the shore, "
+                        "a few seagulls gliding overhead and people walking along the waterline in the distance."),
+        'scene': 'beach',
+        'audioUrl': f"{BUCKET}/audio/{IMAGE_ID}.mp3",
+        'renditions': renditions,
+        'waveform': dict(peaks, key=f"audio/{IMAGE_ID}.peaks.json", url=f"{BUCKET}/audio/{IMAGE_ID}.peaks.json"),
+        'detectedElements': ['Beach', 'Sand', 'Sea', 'Ocean', 'Water', 'Wave', 'Sky', 'Cloud', 'Bird', 'Seagull',
+                             'Person', 'Shoreline', 'Coast', 'Horizon', 'Outdoors', 'Nature', 'waves', 'seagulls',
+                             'sea breeze', 'distant voices'],
+        'soundPrompt': ("Gentle ocean waves lapping and receding over sand, seagulls calling overhead, a soft "
+                        "steady sea breeze, and faint distant voices of people enjoying the beach."),
+        'degraded': []
+    }
+    return body, {'imageId': IMAGE_ID, 's3Key': f"uploads/{IMAGE_ID}.jpg"}
+
+
+def legacy_states(body, workflow_input):
+    """Stage outputs of the previous workflow, in order"""
+    validated = dict(workflow_input, format='jpeg', width=1280, height=960)
+    analyzed = {k: body[k] for k in ('imageId', 'description', 'scene', 'detectedElements', 'soundPrompt', 'degraded')}
+    generated = {k: body[k] for k in ('imageId', 'description', 'scene', 'audioUrl', 'renditions', 'waveform',
+                                      'detectedElements', 'soundPrompt', 'degraded')}
+    envelope = {'statusCode': 200, 'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+                'body': json.dumps(body)}
+    return [('input', workflow_input), ('validate_image', validated), ('image_to_text', analyzed),
+            ('generate_audio', generated), ('final_response', envelope)]
+
+
+def compact_states(body, workflow_input):
+    """Stage outputs of the compact workflow, in order"""
+    validated = payload.compact(workflow_input, format='jpeg', width=1280, height=960)
+    analyzed = payload.compact(validated, scene=body['scene'], elementCount=len(body['detectedElements']),
+                               degraded=body['degraded'])
+    generated = payload.compact(analyzed, audioUrl=body['audioUrl'])
+    # The waveform is referenced too: scalars and the sidecar URL, peaks fetched by the player
+    response = dict(body, waveform=waveform.summary(body['waveform']))
+    return [('input', workflow_input), ('validate_image', validated), ('image_to_text', analyzed),
+            ('generate_audio', generated), ('final_response', response)]
+
+
+def legacy_request(states):
+    # Every transition: the runtime encodes the output, the next stage decodes it
+    for _, state in states:
+        json.loads(json.dumps(state))
+    # analyze_api: decode output, decode body, encode body again
+    output = json.dumps(states[-1][1])
+    return json.dumps(json.loads(json.loads(output)['body']))
+
+
+def compact_request(states):
+    for _, state in states:
+        json.loads(json.dumps(state))
+    # analyze_api forwards the output string as the body
+    return json.dumps(states[-1][1])
+
+
+def per_call_us(function, repeat):
+    return min(timeit.repeat(function, number=repeat, repeat=3)) / repeat * 1e6
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--repeat', type=int, default=2000)
+    args = parser.parse_args(argv)
+
+    body, workflow_input = sample_request()
+    legacy, compact = legacy_states(body, workflow_input), compact_states(body, workflow_input)
+
+    print("Transition sizes (bytes of JSON state)")
+    print(f"{'stage output':<18}{'before':>10}{'after':>10}")
+    for (name, old), (_, new) in zip(legacy, compact):
+        print(f"{name:<18}{len(json.dumps(old)):>10}{len(json.dumps(new)):>10}")
+    old_total = sum(len(json.dumps(state)) for _, state in legacy)
+    new_total = sum(len(json.dumps(state)) for _, state in compact)
+    print(f"{'total':<18}{old_total:>10}{new_total:>10}  ({1 - new_total / old_total:.0%} less)")
+    print(f"Response body {len(json.dumps(body))} -> {len(json.dumps(compact[-1][1]))} bytes; the old final "
+          f"output escaped it to {len(json.dumps(legacy[-1][1]))}. The player now fetches the "
+          f"{len(waveform.encode(body['waveform']))} byte peaks sidecar from S3 in parallel with the audio.")
+
+    old_us = per_call_us(lambda: legacy_request(legacy), args.repeat)
+    new_us = per_call_us(lambda: compact_request(compact), args.repeat)
+    print()
+    print("JSON work per request (stdlib json)")
+    print(f"  before  {old_us:8.1f} us")
+    print(f"  after   {new_us:8.1f} us  ({old_us / new_us:.1f}x less)")
+
+    print()
+    print("Response body encoding")
+    body = compact[-1][1]
+    stdlib_us = per_call_us(lambda: json.dumps(body, separators=(',', ':')), args.repeat)
+    print(f"  json.dumps      {stdlib_us:8.1f} us")
+    if payload.orjson is not None:
+        fast_us = per_call_us(lambda: payload.dumps(body), args.repeat)
+        print(f"  payload.dumps   {fast_us:8.1f} us  (orjson, {stdlib_us / fast_us:.1f}x)")
+    else:
+        print("  orjson is not installed; payload.dumps uses the stdlib encoder")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,208 @@
+"""
+Loads the Lambda handlers from functions/*/app.py (harness.handlers) and
+wires them to the in-memory stubs, with a local Step Functions stand-in that runs the same
+validate -> analyze -> audio -> response sequence as the deployed workflow.
+"""
+import io
+import json
+import os
+import threading
+import time
+
+from harness import stubs
+from harness.handlers import WORKFLOW_STAGES, LocalContext, load_handler
+
+ENVIRONMENT = {
+    'AWS_DEFAULT_REGION': 'us-east-1',
+    'AWS_REGION': 'us-east-1',
+    'AWS_ACCESS_KEY_ID': 'local',
+    'AWS_SECRET_ACCESS_KEY': 'local',
+    'TABLE_NAME': 'soundscape-local',
+    'IMAGES_BUCKET': 'soundscape-images-local',
+    'AUDIO_BUCKET': 'soundscape-audio-local',
+    'ELEVEN_LABS_PARAM': '/soundscape/elevenlabs-api-key',
+    'ELEVENLABS_API_KEY': 'local-elevenlabs-key',
+    'STATE_MACHINE_ARN': 'arn:aws:states:us-east-1:000000000000:stateMachine:soundscape-local'
+}
+
+
+class LocalStepFunctions:
+    """start_sync_execution stand-in that runs the workflow stages in-process"""
+
+    def __init__(self, handlers, stage_timeout=30.0):
+        self.handlers = handlers
+        self.stage_timeout = stage_timeout
+        self.executions = 0
+
+    def start_sync_execution(self, stateMachineArn, name, input, **kwargs):
+        self.executions += 1
+        state = json.loads(input)
+        started = time.time()
+
+        for stage in WORKFLOW_STAGES:
+            handler = self.handlers[stage]
+            start = time.perf_counter()
+            try:
+                state = handler.lambda_handler(state, LocalContext(stage, self.stage_timeout))
+            except Exception as err:
+                stubs.record(f"stage:{stage}", time.perf_counter() - start)
+                return {
+                    'executionArn': f"{stateMachineArn}:{name}",
+                    'name': name,
+                    'startDate': started,
+                    'stopDate': time.time(),
+                    'status': 'FAILED',
+                    'error': type(err).__name__,
+                    'cause': json.dumps({'errorMessage': str(err), 'errorType': type(err).__name__})
+                }
+            stubs.record(f"stage:{stage}", time.perf_counter() - start)
+            # Lambda results cross the Step Functions boundary as JSON
+            state = json.loads(json.dumps(state, default=stubs._json_default))
+
+        return {
+            'executionArn': f"{stateMachineArn}:{name}",
+            'name': name,
+            'startDate': started,
+            'stopDate': time.time(),
+            'status': 'SUCCEEDED',
+            'output': json.dumps(state)
+        }
+
+    def describe_state_machine(self, stateMachineArn):
+        return {'stateMachineArn': stateMachineArn, 'status': 'ACTIVE'}
+
+
+class LocalAudioWorkers:
+    """
+    SQS event source mapping stand-in for generate_audio.worker_handler:
+    `concurrency` pollers, each invoking the handler with a batch of one and
+    deleting the message unless it is reported as a batch item failure.
+    """
+
+    def __init__(self, sqs, handler, concurrency, queue_url=None):
+        self.sqs = sqs
+        self.handler = handler
+        self.queue_url = queue_url or os.environ.get('AUDIO_QUEUE_URL')
+        self.invocations = 0
+        self._stopped = threading.Event()
+        self._threads = [threading.Thread(target=self._poll, name=f"audio-worker-{i}", daemon=True)
+                         for i in range(concurrency)]
+        for thread in self._threads:
+            thread.start()
+
+    def _poll(self):
+        while not self._stopped.is_set():
+            messages = self.sqs.receive_message(QueueUrl=self.queue_url, MaxNumberOfMessages=1,
+                                                WaitTimeSeconds=0.1).get('Messages', [])
+            for message in messages:
+                event = {'Records': [{
+                    'messageId': message['MessageId'],
+                    'receiptHandle': message['ReceiptHandle'],
+                    'body': message['Body'],
+                    'attributes': message['Attributes'],
+                    'eventSource': 'aws:sqs'
+                }]}
+                self.invocations += 1
+                result = self.handler(event, LocalContext('audio_worker', 60.0))
+                failed = {f['itemIdentifier'] for f in (result or {}).get('batchItemFailures', [])}
+                if message['MessageId'] not in failed:
+                    self.sqs.delete_message(QueueUrl=self.queue_url, ReceiptHandle=message['ReceiptHandle'])
+
+    def stop(self):
+        self._stopped.set()
+        for thread in self._threads:
+            thread.join()
+
+
+class LocalPipeline:
+    """
+    All handlers loaded and patched onto shared in-memory services.
+
+    latencies maps a downstream name (s3, dynamodb, rekognition, bedrock,
+    bedrock_hedge, elevenlabs, sqs) to a stubs.LatencyModel. With
+    AUDIO_QUEUE_URL set, audio is generated by LocalAudioWorkers
+    (AUDIO_MAX_CONCURRENCY of them); call close() to stop them.
+    elevenlabs_concurrency makes the ElevenLabs stub return 429s above it.
+    """
+
+    def __init__(self, latencies=None, audio_factory=None, elevenlabs_concurrency=None, sqs_visibility_timeout=30.0):
+        for key, value in ENVIRONMENT.items():
+            os.environ.setdefault(key, value)
+
+        latencies = latencies or {}
+        self.s3 = stubs.FakeS3(latencies.get('s3'))
+        self.dynamodb = stubs.FakeDynamoDBResource(latencies.get('dynamodb'))
+        self.table = self.dynamodb.Table(os.environ['TABLE_NAME'])
+        self.table.add_index('status-createdAt-index', 'status', 'createdAt')
+        self.table.add_index('searchTerm-searchScore-index', 'searchTerm', 'searchScore')
+        self.rekognition = stubs.FakeRekognition(latencies.get('rekognition'))
+        self.bedrock = stubs.FakeBedrock(latencies.get('bedrock'))
+        # Second region/model for hedged calls; only used with BEDROCK_HEDGE_ENABLED
+        self.hedge_bedrock = stubs.FakeBedrock(latencies.get('bedrock_hedge', latencies.get('bedrock')))
+        self.elevenlabs = stubs.FakeElevenLabs(latencies.get('elevenlabs'), audio_factory=audio_factory,
+                                               max_concurrency=elevenlabs_concurrency)
+        self.sqs = stubs.FakeSQS(latencies.get('sqs'), visibility_timeout=sqs_visibility_timeout)
+        self.ssm = stubs.FakeSSM({os.environ['ELEVEN_LABS_PARAM']: os.environ['ELEVENLABS_API_KEY']})
+
+        self.handlers = {name: load_handler(name) for name in WORKFLOW_STAGES + ['analyze_api', 'health_check', 'gallery', 'search']}
+        self.stepfunctions = LocalStepFunctions(self.handlers)
+        self._patch()
+        self.audio_workers = None
+        if os.environ.get('AUDIO_QUEUE_URL'):
+            self.audio_workers = LocalAudioWorkers(self.sqs, self.handlers['generate_audio'].worker_handler,
+                                                   int(os.environ.get('AUDIO_MAX_CONCURRENCY', '4')))
+
+    def close(self):
+        if self.audio_workers:
+            self.audio_workers.stop()
+
+    def _patch(self):
+        replacements = {
+            's3': self.s3,
+            'table': self.table,
+            'dynamodb': self.dynamodb,
+            'rekognition': self.rekognition,
+            'bedrock': self.bedrock,
+            'ssm': self.ssm,
+            'stepfunctions': self.stepfunctions,
+            'requests': self.elevenlabs,
+            'sqs': self.sqs
+        }
+        for module in self.handlers.values():
+            for attribute, replacement in replacements.items():
+                if hasattr(module, attribute):
+                    setattr(module, attribute, replacement)
+            if getattr(module, 'hedge_bedrock', None) is not None:
+                module.hedge_bedrock = self.hedge_bedrock
+            # validate_image reads the bucket name once at import
+            if hasattr(module, 'images_bucket'):
+                module.images_bucket = os.environ['IMAGES_BUCKET']
+
+    def analyze(self, image_bytes, headers=None):
+        """Drive one request through analyze_api; returns (response, trace)"""
+        import base64
+
+        event = {
+            'httpMethod': 'POST',
+            'path': '/api/analyze',
+            'headers': dict(headers or {}, **{'Content-Type': 'application/json'}),
+            'body': json.dumps({'image': base64.b64encode(image_bytes).decode('ascii')})
+        }
+        trace = stubs.start_trace()
+        start = time.perf_counter()
+        response = self.handlers['analyze_api'].lambda_handler(event, LocalContext('analyze_api'))
+        trace.add('total', time.perf_counter() - start)
+        return response, trace
+
+
+def sample_image(width=1280, height=960, quality=85):
+    """A synthetic JPEG of the given size; needs Pillow (backend/layers/pillow)"""
+    from PIL import Image, ImageDraw
+
+    image = Image.new('RGB', (width, height), (70, 130, 180))
+    draw = ImageDraw.Draw(image)
+    for y in range(0, height, max(1, height // 24)):
+        draw.rectangle([0, y, width, y + height // 48], fill=(194, 178, 128))
+    buffer = io.BytesIO()
+    image.save(buffer, format='JPEG', quality=quality)
+    return buffer.getvalue()
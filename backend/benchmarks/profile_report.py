@@ -0,0 +1,248 @@
+"""
+Aggregate per-invocation profiles (utils/profiling.py) into flame graphs.
+
+Profiles are written by handlers decorated with utils.profiling.profiled(),
+one gzipped JSON object per invocation under <prefix><imageId>/. collect
+downloads a prefix (one request, or all of them) from S3; flame and top read
+a profile file or a directory of them, recursively.
+
+flame prints collapsed stacks ("frame;frame;frame weight" per line), the
+input of flamegraph.pl, inferno and speedscope. Each stage is a root frame.
+
+- CPU (default): cProfile keeps caller -> callee edges, not whole stacks, so
+  stacks are rebuilt from the roots down, splitting each function's time
+  between the callers that spent it, in microseconds, as flameprof does,
+  starting at the handler each profile names. Recursive calls are folded
+  into their first occurrence.
+- --memory: the allocation sites still holding memory when the handler
+  returned, by bytes, from tracemalloc's own stacks
+
+top prints the per-stage wall, CPU and memory of the profiles and the
+functions with the most self and cumulative time.
+
+Usage (from backend/):
+    python -m benchmarks.profile_report collect --bucket my-profile-bucket --prefix profiles/<imageId>/ -o profiles/
+    python -m benchmarks.profile_report flame profiles/ > cpu.folded
+    flamegraph.pl cpu.folded > cpu.svg
+    python -m benchmarks.profile_report flame profiles/ --memory --function generate_audio > memory.folded
+    python -m benchmarks.profile_report top profiles/ --limit 30
+"""
+import argparse
+import gzip
+import json
+import os
+import sys
+
+from benchmarks.load_test import percentile
+
+# Paths are shown from the first of these markers on
+PATH_MARKERS = ('site-packages/', 'functions/', 'python/utils/', 'lib/python')
+# Stacks rebuilt from cProfile edges stop below this share of a stage's time
+MIN_SHARE = 0.001
+
+
+def load_profiles(path, function=None):
+    paths = [path]
+    if os.path.isdir(path):
+        paths = sorted(os.path.join(root, name) for root, _, names in os.walk(path)
+                       for name in names if name.endswith('.json.gz') or name.endswith('.json'))
+    profiles = []
+    for file_path in paths:
+        opener = gzip.open if file_path.endswith('.gz') else open
+        with opener(file_path, 'rt') as f:
+            profile = json.load(f)
+        if function is None or profile.get('fn') == function:
+            profiles.append(profile)
+    return profiles
+
+
+def short_path(filename):
+    for marker in PATH_MARKERS:
+        index = filename.find(marker)
+        if index >= 0:
+            return filename[index + len(marker):] if marker != 'functions/' else filename[index:]
+    return os.path.basename(filename)
+
+
+def label(filename, line, name):
+    """One flame graph frame; semicolons separate frames, so none may appear inside one"""
+    if filename == '~':
+        text = name
+    else:
+        text = f"{name} ({short_path(filename)}:{line})"
+    return text.replace(';', ',')
+
+
+class Function:
+    """Merged cProfile stats of one function across profiles"""
+
+    def __init__(self):
+        self.calls = 0
+        self.self_seconds = 0.0
+        self.cumulative_seconds = 0.0
+        self.callers = {}
+
+
+def merge_stats(profiles, roots=None):
+    """{(file, line, name): Function} per stage, summed over its profiles; roots collects each stage's handlers"""
+    stages = {}
+    for profile in profiles:
+        functions = stages.setdefault(profile['fn'], {})
+        if roots is not None and profile.get('root'):
+            roots.setdefault(profile['fn'], set()).add(tuple(profile['root']))
+        for filename, line, name, _, calls, tt, ct, callers in profile.get('stats', []):
+            function = functions.setdefault((filename, line, name), Function())
+            function.calls += calls
+            function.self_seconds += tt
+            function.cumulative_seconds += ct
+            for c_file, c_line, c_name, _, _, _, c_ct in callers:
+                key = (c_file, c_line, c_name)
+                function.callers[key] = function.callers.get(key, 0.0) + c_ct
+    return stages
+
+
+def cpu_stacks(profiles):
+    """{collapsed stack: microseconds} rebuilt from the merged caller edges"""
+    stacks = {}
+    handlers = {}
+    for stage, functions in merge_stats(profiles, handlers).items():
+        callees = {}
+        for key, function in functions.items():
+            for caller, seconds in function.callers.items():
+                callees.setdefault(caller, []).append((key, seconds))
+        # The decorator that started the profiler has no stats of that call, so the handler has no
+        # recorded caller, unless a nested stage ran through the same decorator
+        roots = [key for key in handlers.get(stage, ()) if key in functions]
+        if not roots:
+            roots = [key for key, function in functions.items() if not function.callers]
+        total = sum(functions[key].cumulative_seconds for key in roots)
+        minimum = total * MIN_SHARE
+
+        def walk(key, path, keys, seconds):
+            function = functions[key]
+            frames = path + [label(*key)]
+            if function.cumulative_seconds <= 0:
+                return
+            share = min(1.0, seconds / function.cumulative_seconds)
+            edges = [(callee, edge_seconds * share) for callee, edge_seconds in callees.get(key, [])
+                     if callee not in keys]
+            # Calls through a shared decorator (a nested stage) count in more than one edge; never
+            # hand the callees more time than this frame has
+            spent = sum(child for _, child in edges)
+            scale = min(1.0, seconds / spent) if spent else 1.0
+            children = 0.0
+            for callee, child in edges:
+                child *= scale
+                if child < minimum:
+                    continue
+                children += child
+                walk(callee, frames, keys | {callee}, child)
+            # What the callees walked into does not cover is this frame's own time
+            own = max(0.0, seconds - children)
+            if own >= minimum / 10:
+                stack = ';'.join(frames)
+                stacks[stack] = stacks.get(stack, 0) + own
+
+        for root in roots:
+            walk(root, [stage], {root}, functions[root].cumulative_seconds)
+    return {stack: int(round(seconds * 1e6)) for stack, seconds in stacks.items() if seconds * 1e6 >= 1}
+
+
+def memory_stacks(profiles):
+    """{collapsed stack: bytes} from the allocation sites"""
+    stacks = {}
+    for profile in profiles:
+        for allocation in profile.get('allocations', []):
+            frames = [profile['fn']] + [f"{short_path(filename)}:{line}" for filename, line in allocation['stack']]
+            stack = ';'.join(frame.replace(';', ',') for frame in frames)
+            stacks[stack] = stacks.get(stack, 0) + allocation['bytes']
+    return stacks
+
+
+def flame(profiles, memory, output):
+    stacks = memory_stacks(profiles) if memory else cpu_stacks(profiles)
+    for stack, weight in sorted(stacks.items()):
+        output.write(f"{stack} {weight}\n")
+    print(f"{len(stacks)} stacks from {len(profiles)} profiles", file=sys.stderr)
+
+
+def top(profiles, limit):
+    print(f"{'stage':<16}{'profiles':>9}{'wall p50/max':>18}{'cpu p50':>10}{'traced peak':>13}{'peak rss':>10}")
+    by_stage = {}
+    for profile in profiles:
+        by_stage.setdefault(profile['fn'], []).append(profile)
+    for stage, stage_profiles in sorted(by_stage.items()):
+        walls = [p['wallMs'] for p in stage_profiles]
+        cpus = [p['cpuMs'] for p in stage_profiles]
+        traced = max(p['memory']['tracedPeakBytes'] for p in stage_profiles) / 1e6
+        rss = max(p['memory']['peakRssBytes'] or 0 for p in stage_profiles) / 1e6
+        print(f"{stage:<16}{len(stage_profiles):>9}{percentile(walls, 50):>9.0f}/{max(walls):<6.0f}ms"
+              f"{percentile(cpus, 50):>8.0f}ms{traced:>11.1f}MB{rss:>8.0f}MB")
+
+    for stage, functions in sorted(merge_stats(profiles).items()):
+        print()
+        print(f"{stage}: top functions by self time")
+        print(f"  {'self s':>9}{'cumulative s':>14}{'calls':>9}  function")
+        ranked = sorted(functions.items(), key=lambda item: -item[1].self_seconds)[:limit]
+        for key, function in ranked:
+            print(f"  {function.self_seconds:>9.4f}{function.cumulative_seconds:>14.4f}{function.calls:>9}  {label(*key)}")
+
+
+def collect(bucket, prefix, output):
+    """Download the profiles under an S3 prefix into a directory, keeping their keys"""
+    import boto3
+
+    s3 = boto3.client('s3')
+    paginator = s3.get_paginator('list_objects_v2')
+    count = 0
+    for page in paginator.paginate(Bucket=bucket, Prefix=prefix):
+        for obj in page.get('Contents', []):
+            path = os.path.join(output, obj['Key'][len(prefix):].lstrip('/') or os.path.basename(obj['Key']))
+            os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+            s3.download_file(bucket, obj['Key'], path)
+            count += 1
+    print(f"Downloaded {count} profiles to {output}")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    collect_parser = commands.add_parser('collect', help="Download profiles from S3 into a directory")
+    collect_parser.add_argument('--bucket', required=True)
+    collect_parser.add_argument('--prefix', default='profiles/')
+    collect_parser.add_argument('-o', '--output', default='profiles')
+
+    flame_parser = commands.add_parser('flame', help="Collapsed stacks for a flame graph")
+    flame_parser.add_argument('profiles', help="Profile file or directory")
+    flame_parser.add_argument('--memory', action='store_true', help="Allocation stacks by bytes instead of CPU time")
+    flame_parser.add_argument('--function', help="Only this stage's profiles")
+    flame_parser.add_argument('-o', '--output', help="Write here instead of stdout")
+
+    top_parser = commands.add_parser('top', help="Per-stage summary and top functions")
+    top_parser.add_argument('profiles', help="Profile file or directory")
+    top_parser.add_argument('--function', help="Only this stage's profiles")
+    top_parser.add_argument('--limit', type=int, default=20)
+    args = parser.parse_args(argv)
+
+    if args.command == 'collect':
+        collect(args.bucket, args.prefix, args.output)
+        return 0
+
+    profiles = load_profiles(args.profiles, args.function)
+    if not profiles:
+        print(f"No profiles found in {args.profiles}", file=sys.stderr)
+        return 2
+    if args.command == 'flame':
+        if args.output:
+            with open(args.output, 'w') as output:
+                flame(profiles, args.memory, output)
+        else:
+            flame(profiles, args.memory, sys.stdout)
+    else:
+        top(profiles, args.limit)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,193 @@
+"""
+Tokens, latency and cost of the image_to_text prompt versions
+(utils/prompts.py), from recorded Bedrock responses.
+
+Recorded responses are the Bedrock calls of captured image_to_text requests
+(utils.capture), each with the prompt version that produced it, the billed
+usage, the image size and the call's latency. Without a capture, a synthetic
+set shaped like production v1 traffic is used.
+
+For every version the report shows, per request:
+
+- input tokens: billed, for responses recorded with that version; otherwise
+  the recorded count with the estimated prompt and image tokens of the
+  recording's version replaced by this version's (prompts.estimate), the
+  image fitted to --image-tokens
+- output tokens: the version's own recordings, or the other versions'
+  (marked "assumed") when it has none, capped at its max_tokens; truncated
+  is the share of responses that would hit the cap
+- latency: the recorded call time modelled as fixed + prefill per input token
+  + decode per output token, the decode rate fitted to the recordings
+- Bedrock cost per 1,000 requests at metering.PRICES, with the static prefix read from
+  the prompt cache at --cache-hit-rate when the version is cacheable on --model
+- the max_tokens its recorded outputs call for (prompts.recommend_max_tokens)
+
+Usage (from backend/):
+    python -m benchmarks.prompt_benchmark
+    python -m benchmarks.prompt_benchmark captures/ --image-tokens 800
+    python -m benchmarks.prompt_benchmark traffic.jsonl.gz --model anthropic.claude-3-7-sonnet-20250219-v1:0
+"""
+import argparse
+import random
+import sys
+
+from benchmarks.load_test import percentile
+from benchmarks.replay import load_records
+from harness.handlers import LAYER_DIRS
+
+for _layer in LAYER_DIRS:
+    if _layer not in sys.path:
+        sys.path.append(_layer)
+from utils import metering, prompts  # noqa: E402
+
+DEFAULT_MODEL = 'anthropic.claude-3-sonnet-20240229-v1:0'
+# Prompt processing time per input token; small next to decoding, so not fitted
+PREFILL_MS_PER_TOKEN = 0.15
+# Synthetic recordings: Claude 3 Sonnet answering the v1 prompt about phone photos
+SYNTHETIC_SIZES = [(1568, 1176), (1176, 1568), (1280, 960), (1024, 768), (4032, 3024), (800, 600)]
+SYNTHETIC_OUTPUT_TOKENS = (330, 70)
+SYNTHETIC_FIXED_MS = 900
+SYNTHETIC_DECODE_MS_PER_TOKEN = 16
+
+
+class Recording:
+    """One recorded Bedrock response"""
+
+    def __init__(self, version, width, height, input_tokens, output_tokens, ms):
+        self.version = version
+        self.width = width
+        self.height = height
+        self.input_tokens = input_tokens
+        self.output_tokens = output_tokens
+        self.ms = ms
+
+
+def from_captures(records):
+    recordings = []
+    for record in records:
+        if record.get('fn') != 'image_to_text':
+            continue
+        request = record.get('req') or {}
+        for call in record.get('calls', []):
+            response = call.get('res') or {}
+            usage = response.get('usage') or {}
+            if call.get('svc') != 'bedrock' or call.get('err') or not usage.get('output_tokens'):
+                continue
+            if (response.get('hedge') or {}).get('hedged'):
+                # Its time is the faster of two calls
+                continue
+            recordings.append(Recording(
+                response.get('prompt', 'v1'), request.get('width'), request.get('height'),
+                usage.get('input_tokens', 0) + usage.get('cache_read_input_tokens', 0)
+                + usage.get('cache_creation_input_tokens', 0),
+                usage['output_tokens'], call.get('ms')))
+    return recordings
+
+
+def synthetic(count, seed=7):
+    rng = random.Random(seed)
+    recordings = []
+    prompt = prompts.VERSIONS['v1']
+    for _ in range(count):
+        width, height = rng.choice(SYNTHETIC_SIZES)
+        output_tokens = max(80, min(prompt.max_tokens, int(rng.gauss(*SYNTHETIC_OUTPUT_TOKENS))))
+        input_tokens = prompts.estimate(prompt, width, height)['total'] + rng.randint(-20, 20)
+        ms = (SYNTHETIC_FIXED_MS + PREFILL_MS_PER_TOKEN * input_tokens
+              + SYNTHETIC_DECODE_MS_PER_TOKEN * output_tokens) * rng.uniform(0.85, 1.2)
+        recordings.append(Recording('v1', width, height, input_tokens, output_tokens, ms))
+    return recordings
+
+
+def fit_latency(recordings):
+    """(fixed ms, decode ms per output token) by least squares on the recorded times"""
+    points = [(r.output_tokens, r.ms - PREFILL_MS_PER_TOKEN * r.input_tokens) for r in recordings if r.ms]
+    if len(points) < 2:
+        return SYNTHETIC_FIXED_MS, SYNTHETIC_DECODE_MS_PER_TOKEN
+    mean_x = sum(x for x, _ in points) / len(points)
+    mean_y = sum(y for _, y in points) / len(points)
+    variance = sum((x - mean_x) ** 2 for x, _ in points)
+    if not variance:
+        return SYNTHETIC_FIXED_MS, SYNTHETIC_DECODE_MS_PER_TOKEN
+    slope = max(0.0, sum((x - mean_x) * (y - mean_y) for x, y in points) / variance)
+    return max(0.0, mean_y - slope * mean_x), slope
+
+
+def fitted_size(width, height, budget):
+    if not width or not height:
+        return width, height
+    target = prompts.billed_size(width, height, budget)
+    return (width, height) if target[0] >= width else target
+
+
+def input_tokens(recording, prompt, budget):
+    """The recording's input tokens had it been sent with prompt and the image fitted to budget"""
+    if recording.version == prompt.version:
+        return recording.input_tokens
+    recorded = prompts.VERSIONS.get(recording.version, prompts.VERSIONS['v1'])
+    before = prompts.estimate(recorded, recording.width, recording.height)['total']
+    after = prompts.estimate(prompt, *fitted_size(recording.width, recording.height, budget))['total']
+    return max(1, recording.input_tokens - before + after)
+
+
+def compare(recordings, model_id, budget, cache_hit_rate):
+    fixed_ms, decode_ms = fit_latency(recordings)
+    print(f"Latency model: {fixed_ms:.0f} ms + {PREFILL_MS_PER_TOKEN} ms/input token + {decode_ms:.1f} ms/output token")
+    print(f"Model {model_id}; image budget {budget} tokens; {len(recordings)} recorded responses")
+    print()
+    header = (f"{'version':<8}{'source':<10}{'input p50':>10}{'output p50':>11}{'max_tokens':>11}{'truncated':>10}"
+              f"{'latency p50':>12}{'p95':>8}{'$/1k':>8}{'cache':>7}{'recommended':>12}")
+    print(header)
+    print('-' * len(header))
+    for version, prompt in prompts.VERSIONS.items():
+        own = [r for r in recordings if r.version == version]
+        samples = own or recordings
+        outputs = [r.output_tokens for r in samples]
+        inputs = [input_tokens(r, prompt, budget) for r in samples]
+        billed_outputs = [min(output, prompt.max_tokens) for output in outputs]
+        truncated = sum(1 for output in outputs if output > prompt.max_tokens) / float(len(outputs))
+        latencies = [fixed_ms + PREFILL_MS_PER_TOKEN * i + decode_ms * o for i, o in zip(inputs, billed_outputs)]
+
+        cacheable = prompts.cacheable(prompt, model_id)
+        prefix = prompts.text_tokens(prompt.static_text()) if cacheable else 0
+        cached = prefix * cache_hit_rate
+        usage = {
+            'bedrockInputTokens': sum(inputs) / len(inputs) - cached,
+            'bedrockCacheReadTokens': cached,
+            'bedrockOutputTokens': sum(billed_outputs) / len(billed_outputs)
+        }
+        dollars = metering.cost(usage)['bedrock'] * 1000
+        print(f"{version:<8}{'recorded' if own else 'assumed':<10}{percentile(inputs, 50):>10}{percentile(billed_outputs, 50):>11}"
+              f"{prompt.max_tokens:>11}{truncated:>9.1%} {percentile(latencies, 50):>10.0f}ms"
+              f"{percentile(latencies, 95):>6.0f}ms{dollars:>8.2f}{'yes' if cacheable else 'no':>7}"
+              f"{prompts.recommend_max_tokens(outputs):>12}")
+
+    minimum = prompts.cache_min_tokens(model_id)
+    print()
+    if minimum is None:
+        print(f"{model_id} has no prompt caching on Bedrock; static prefixes are billed as input every request")
+    else:
+        print(f"{model_id} caches prefixes of at least {minimum} tokens; static prefixes: "
+              + ', '.join(f"{v} {prompts.text_tokens(p.static_text())}" for v, p in prompts.VERSIONS.items()))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('captures', nargs='?', help="Capture file (.jsonl/.jsonl.gz) or CAPTURE_DIR directory")
+    parser.add_argument('--synthetic', type=int, default=500, help="Synthetic responses when no capture is given")
+    parser.add_argument('--model', default=DEFAULT_MODEL, help="Bedrock model ID the versions are costed on")
+    parser.add_argument('--image-tokens', type=int, default=prompts.IMAGE_TOKEN_BUDGET,
+                        help="Image token budget (PROMPT_IMAGE_TOKENS)")
+    parser.add_argument('--cache-hit-rate', type=float, default=0.9,
+                        help="Share of requests that find the prefix in the prompt cache")
+    args = parser.parse_args(argv)
+
+    recordings = from_captures(load_records(args.captures)) if args.captures else synthetic(args.synthetic)
+    if not recordings:
+        print("No recorded Bedrock responses in the capture")
+        return 1
+    compare(recordings, args.model, min(args.image_tokens, prompts.MAX_IMAGE_TOKENS), args.cache_hit_rate)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,297 @@
+"""
+Replay captured production traffic against the local pipeline.
+
+Captures are written by utils.capture (CAPTURE_SAMPLE_RATE). Each captured
+request is re-driven through analyze_api at its original arrival offset
+(optionally accelerated), with Rekognition, Bedrock and ElevenLabs stubs
+returning the recorded labels, text and audio sizes after the recorded
+latency. Running the same capture before and after a change compares
+caching and concurrency behaviour on identical traffic.
+
+Usage (from backend/):
+    python -m benchmarks.replay collect --bucket my-capture-bucket --prefix captures/2026/10/ -o traffic.jsonl.gz
+    python -m benchmarks.replay run traffic.jsonl.gz --speed 10
+    python -m benchmarks.replay run captures/ --speed 0 --save-baseline
+"""
+import argparse
+import contextlib
+import gzip
+import io
+import json
+import os
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from benchmarks import load_test
+from benchmarks.pipeline import LocalPipeline
+from harness import stubs
+
+DEFAULT_BASELINE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'replay_baseline.json')
+
+_local = threading.local()
+
+
+def _open(path):
+    return gzip.open(path, 'rt') if path.endswith('.gz') else open(path)
+
+
+def load_records(path):
+    """Read capture records from a .jsonl(.gz) file or a CAPTURE_DIR directory"""
+    paths = [path]
+    if os.path.isdir(path):
+        paths = [os.path.join(path, f) for f in sorted(os.listdir(path)) if '.jsonl' in f or f.endswith('.json')]
+    records = []
+    for file_path in paths:
+        with _open(file_path) as f:
+            records.extend(json.loads(line) for line in f if line.strip())
+    return records
+
+
+class CapturedRequest:
+    """All captured stage records for one imageId, with a per-service call cursor"""
+
+    def __init__(self, image_id, records):
+        self.image_id = image_id
+        self.by_function = {r['fn']: r for r in records}
+        root = self.by_function.get('analyze_api') or min(records, key=lambda r: r['ts'])
+        self.ts = root['ts']
+        self.original_ms = root['ms']
+        self.calls = {}
+        for record in sorted(records, key=lambda r: r['ts']):
+            for call in record.get('calls', []):
+                self.calls.setdefault(call['svc'], []).append(call)
+        self.cursor = {}
+
+        request = (self.by_function.get('analyze_api') or {}).get('req') or {}
+        s3_read = next(iter(self.calls.get('s3', [])), {}).get('res') or {}
+        self.image_digest = request.get('imageDigest') or s3_read.get('digest') or image_id
+        self.image_size = request.get('imageWidth'), request.get('imageHeight')
+
+    def next_call(self, service):
+        calls = self.calls.get(service, [])
+        index = self.cursor.get(service, 0)
+        self.cursor[service] = index + 1
+        return calls[index] if index < len(calls) else (calls[-1] if calls else None)
+
+
+def group_requests(records):
+    grouped = {}
+    for record in records:
+        if record.get('id'):
+            grouped.setdefault(record['id'], []).append(record)
+    requests = [CapturedRequest(image_id, group) for image_id, group in grouped.items()]
+    return sorted(requests, key=lambda r: r.ts)
+
+
+class ReplayLatency:
+    """LatencyModel stand-in that replays the recorded duration of each call"""
+
+    def __init__(self, service, scale):
+        self.service = service
+        self.scale = scale
+
+    def sample(self):
+        request = getattr(_local, 'request', None)
+        call = request.next_call(self.service) if request else None
+        _local.last_call = call
+        return (call['ms'] / 1000.0) * self.scale if call else 0.0
+
+    def should_fail(self):
+        call = getattr(_local, 'last_call', None)
+        if not call:
+            return False
+        status = (call.get('res') or {}).get('status')
+        return bool(call.get('err')) or (status is not None and status != 200)
+
+    def wait(self):
+        delay = self.sample()
+        if delay:
+            time.sleep(delay)
+        return delay
+
+
+def _recorded_response(service):
+    call = getattr(_local, 'last_call', None)
+    return (call or {}).get('res') or {}
+
+
+def _labels(image):
+    labels = _recorded_response('rekognition').get('labels')
+    return [tuple(label) for label in labels] if labels else stubs.DEFAULT_LABELS
+
+
+def _claude_text(body):
+    return _recorded_response('bedrock').get('text') or stubs.DEFAULT_CLAUDE_TEXT
+
+
+def _audio(duration):
+    size = _recorded_response('elevenlabs').get('bytes') or int(duration * 16000)
+    return b'ID3' + bytes(max(size - 3, 128))
+
+
+_images = {}
+_images_lock = threading.Lock()
+
+
+def image_for(request):
+    """Deterministic synthetic image per captured digest, so repeats stay repeats"""
+    from PIL import Image
+
+    with _images_lock:
+        if request.image_digest not in _images:
+            seed = int(request.image_digest[:6], 16) if all(c in '0123456789abcdef' for c in request.image_digest[:6]) else hash(request.image_digest)
+            width, height = request.image_size
+            image = Image.new('RGB', (int(width or 1280), int(height or 960)),
+                              ((seed >> 16) & 0xff, (seed >> 8) & 0xff, seed & 0xff))
+            buffer = io.BytesIO()
+            image.save(buffer, format='JPEG', quality=85)
+            _images[request.image_digest] = buffer.getvalue()
+        return _images[request.image_digest]
+
+
+def build_pipeline(latency_scale):
+    latencies = {name: ReplayLatency(name, latency_scale) for name in ('rekognition', 'bedrock', 'elevenlabs')}
+    pipeline = LocalPipeline(latencies=latencies, audio_factory=_audio)
+    pipeline.rekognition.labels = _labels
+    pipeline.bedrock.text = _claude_text
+    return pipeline
+
+
+def replay(requests, speed, latency_scale, max_workers):
+    pipeline = build_pipeline(latency_scale)
+    images = [image_for(request) for request in requests]
+    first_ts = requests[0].ts if requests else 0.0
+
+    def one(index):
+        request = requests[index]
+        request.cursor = {}
+        _local.request = request
+        try:
+            response, trace = pipeline.analyze(images[index])
+        finally:
+            _local.request = None
+        return response['statusCode'], trace.totals(), request.original_ms / 1000.0
+
+    results = []
+    sink = io.StringIO()
+    started = time.perf_counter()
+    with contextlib.redirect_stdout(sink), ThreadPoolExecutor(max_workers=max_workers) as pool:
+        futures = []
+        for index, request in enumerate(requests):
+            if speed > 0:
+                due = (request.ts - first_ts) / speed
+                delay = due - (time.perf_counter() - started)
+                if delay > 0:
+                    time.sleep(delay)
+            futures.append(pool.submit(one, index))
+        results = [future.result() for future in futures]
+    wall = time.perf_counter() - started
+
+    totals = [t['total'] for _, t, _ in results]
+    stage_names = sorted({name for _, t, _ in results for name in t if name != 'total'})
+    statuses = {}
+    for status, _, _ in results:
+        statuses[str(status)] = statuses.get(str(status), 0) + 1
+
+    return {
+        'config': {
+            'requests': len(requests),
+            'concurrency': max_workers,
+            'speed': speed,
+            'latency_scale': latency_scale
+        },
+        'latency': load_test.summarize(totals),
+        'original_latency': load_test.summarize([original for _, _, original in results]),
+        'throughput_rps': round(len(requests) / wall, 3) if wall else 0.0,
+        'wall_seconds': round(wall, 3),
+        'status_codes': statuses,
+        'stages': {name: load_test.summarize([t.get(name, 0.0) for _, t, _ in results]) for name in stage_names},
+        'calls': {
+            's3': pipeline.s3.calls,
+            'dynamodb': pipeline.table.calls,
+            'rekognition': pipeline.rekognition.calls,
+            'bedrock': pipeline.bedrock.calls,
+            'elevenlabs': pipeline.elevenlabs.calls
+        }
+    }
+
+
+def collect(bucket, prefix, output):
+    """Merge per-invocation capture objects under an S3 prefix into one gzipped JSONL file"""
+    import boto3
+
+    s3 = boto3.client('s3')
+    paginator = s3.get_paginator('list_objects_v2')
+    count = 0
+    with gzip.open(output, 'wt') as out:
+        for page in paginator.paginate(Bucket=bucket, Prefix=prefix):
+            for obj in page.get('Contents', []):
+                body = s3.get_object(Bucket=bucket, Key=obj['Key'])['Body'].read().decode('utf-8')
+                for line in body.splitlines():
+                    if line.strip():
+                        out.write(line.strip() + '\n')
+                        count += 1
+    print(f"Wrote {count} capture records to {output}")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    collect_parser = commands.add_parser('collect', help="Download captures from S3 into one file")
+    collect_parser.add_argument('--bucket', required=True)
+    collect_parser.add_argument('--prefix', default='captures/')
+    collect_parser.add_argument('-o', '--output', default='traffic.jsonl.gz')
+
+    run_parser = commands.add_parser('run', help="Replay a capture file or directory")
+    run_parser.add_argument('capture')
+    run_parser.add_argument('--speed', type=float, default=1.0,
+                            help="Arrival pacing: 1 = original, 10 = ten times faster, 0 = all at once")
+    run_parser.add_argument('--latency-scale', type=float, default=None,
+                            help="Multiplier on recorded downstream latency (default 1/speed, or 1 when speed is 0)")
+    run_parser.add_argument('--max-workers', type=int, default=64)
+    run_parser.add_argument('--baseline', default=DEFAULT_BASELINE)
+    run_parser.add_argument('--save-baseline', action='store_true')
+    run_parser.add_argument('--compare', action='store_true')
+    run_parser.add_argument('--tolerance', type=float, default=0.15)
+    run_parser.add_argument('--json', action='store_true')
+    args = parser.parse_args(argv)
+
+    if args.command == 'collect':
+        collect(args.bucket, args.prefix, args.output)
+        return 0
+
+    requests = group_requests(load_records(args.capture))
+    if not requests:
+        print(f"No captured requests found in {args.capture}")
+        return 2
+    latency_scale = args.latency_scale
+    if latency_scale is None:
+        latency_scale = 1.0 / args.speed if args.speed > 0 else 1.0
+
+    report = replay(requests, args.speed, latency_scale, args.max_workers)
+    if args.json:
+        print(json.dumps(report, indent=2))
+    else:
+        load_test.print_report(report)
+        original = report['original_latency']
+        print(f"captured latency p50={original['p50'] * 1000:.1f}ms p95={original['p95'] * 1000:.1f}ms "
+              f"p99={original['p99'] * 1000:.1f}ms")
+
+    if args.save_baseline:
+        with open(args.baseline, 'w') as f:
+            json.dump(report, f, indent=2, sort_keys=True)
+        print(f"Saved baseline to {args.baseline}")
+    if args.compare:
+        with open(args.baseline) as f:
+            regressions = load_test.compare(report, json.load(f), args.tolerance)
+        for line in regressions:
+            print(f"REGRESSION {line}")
+        return 1 if regressions else 0
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
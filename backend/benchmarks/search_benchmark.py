@@ -0,0 +1,275 @@
+"""
+Search by scene and detected elements (utils.search_index) as the number of
+soundscapes grows.
+
+A synthetic corpus stands in for analysed images: each has a scene, six
+elements drawn from that scene's vocabulary and four from a long Zipf tail of
+rarer labels, each with a Rekognition-like confidence. Two runs:
+
+- table: --table-items images written into the local table with their
+  adjacency items, searched through the search handler. Results are checked
+  against a brute-force ranking, and read units are compared with a scan.
+- scale: --sizes images (millions) in a compact in-memory index built with
+  numpy (posting lists sorted by confidence, and per-image term maps), searched
+  with the same search() code. For each query it reports postings and items
+  read, DynamoDB round trips and read units, against what a scan of the table
+  would read.
+
+Read units at scale follow DynamoDB's accounting: a query page costs 0.5 per
+4 KB it returns (POSTING_BYTES per adjacency item) and BatchGetItem 0.5 per
+item. Latency is the search code's own; each round trip adds a DynamoDB call
+(a few ms) in production.
+
+Usage (from backend/):
+    python -m benchmarks.search_benchmark
+    python -m benchmarks.search_benchmark --sizes 1000000 5000000 --table-items 50000
+"""
+import argparse
+import contextlib
+import io
+import json
+import math
+import sys
+import time
+from decimal import Decimal
+
+import numpy as np
+
+from benchmarks.load_test import percentile
+from benchmarks.pipeline import LocalPipeline
+from harness.handlers import LAYER_DIRS
+
+for _layer in LAYER_DIRS:
+    if _layer not in sys.path:
+        sys.path.append(_layer)
+from utils import search_index  # noqa: E402
+
+SCENE_WEIGHTS = {'beach': 0.15, 'forest': 0.15, 'city': 0.2, 'mountain': 0.1, 'indoor': 0.15,
+                 'desert': 0.05, 'snow': 0.05, 'nature': 0.15}
+SCENE_VOCABULARY = {
+    'beach': ['sand', 'sea', 'wave', 'seagull', 'shore', 'ocean', 'water', 'sky', 'palm', 'boat'],
+    'forest': ['tree', 'leaf', 'moss', 'bird', 'path', 'wood', 'fern', 'rain', 'fog', 'stream'],
+    'city': ['building', 'car', 'road', 'person', 'traffic', 'street', 'light', 'bus', 'crowd', 'rain'],
+    'mountain': ['rock', 'peak', 'snow', 'cloud', 'valley', 'trail', 'tree', 'sky', 'wind', 'lake'],
+    'indoor': ['room', 'table', 'chair', 'window', 'lamp', 'person', 'book', 'cup', 'floor', 'wall'],
+    'desert': ['sand', 'dune', 'cactus', 'sun', 'rock', 'sky', 'heat', 'camel', 'wind', 'dust'],
+    'snow': ['ice', 'tree', 'sky', 'mountain', 'cold', 'ski', 'person', 'cloud', 'wind', 'sled'],
+    'nature': ['grass', 'flower', 'tree', 'field', 'sky', 'bird', 'insect', 'river', 'cloud', 'rain']
+}
+TAIL_TERMS = 2000
+SCENE_ELEMENTS = 6
+TAIL_ELEMENTS = 4
+COMPLETED_SHARE = 0.95
+
+QUERIES = [
+    'beach + seagull',
+    'forest without rain',
+    'city + rain',
+    'sky',
+    'snow + tree without ski',
+    'tree + bird + cloud',
+    'desert + camel',
+    'beach + label0400',
+    # Common terms that never meet: read until MAX_CANDIDATES
+    'snow + camel'
+]
+
+# Size of an adjacency item as read from the GSI: key, term, score, target id
+POSTING_BYTES = 120
+# Size of a soundscape item, which a scan reads whole
+ITEM_BYTES = 1500
+
+
+def vocabulary():
+    words = list(SCENE_WEIGHTS)
+    for pool in SCENE_VOCABULARY.values():
+        words.extend(word for word in pool if word not in words)
+    words.extend(f"label{index:04d}" for index in range(TAIL_TERMS))
+    return words
+
+
+def corpus(size, seed=7):
+    """(vocabulary, doc ids, term ids, confidences, completed flags) with one row per (image, term)"""
+    rng = np.random.default_rng(seed)
+    words = vocabulary()
+    position = {word: index for index, word in enumerate(words)}
+    scenes = list(SCENE_WEIGHTS)
+    pools = np.array([[position[word] for word in SCENE_VOCABULARY[scene]] for scene in scenes])
+    tail_start = position['label0000']
+
+    scene = rng.choice(len(scenes), size=size, p=list(SCENE_WEIGHTS.values()))
+    columns = [scene[:, None]]
+    columns.append(pools[scene[:, None], rng.integers(0, pools.shape[1], (size, SCENE_ELEMENTS))])
+    columns.append(tail_start + np.minimum(rng.zipf(1.3, (size, TAIL_ELEMENTS)) - 1, TAIL_TERMS - 1))
+    terms = np.concatenate(columns, axis=1).ravel()
+    confidence = np.concatenate([
+        np.full((size, 1), search_index.SCENE_CONFIDENCE),
+        rng.uniform(0.7, 1.0, (size, SCENE_ELEMENTS)),
+        rng.uniform(0.7, 0.95, (size, TAIL_ELEMENTS))
+    ], axis=1).ravel().round(3)
+    docs = np.repeat(np.arange(size), 1 + SCENE_ELEMENTS + TAIL_ELEMENTS)
+
+    # One row per (image, term), keeping the best confidence
+    key = docs.astype(np.int64) * len(words) + terms
+    order = np.lexsort((-confidence, key))
+    first = np.ones(len(order), dtype=bool)
+    first[1:] = key[order][1:] != key[order][:-1]
+    order = order[first]
+    completed = rng.random(size) < COMPLETED_SHARE
+    return words, docs[order], terms[order], confidence[order], completed
+
+
+class CompactIndex:
+    """
+    The table's index held in numpy arrays: posting lists as image ids sorted
+    by confidence, and each image's term map in CSR form. postings() and
+    documents() mirror search_index.TableIndex and count what DynamoDB would read.
+    """
+
+    def __init__(self, words, docs, terms, confidence, completed):
+        self.words = words
+        self.position = {word: index for index, word in enumerate(words)}
+        self.completed = completed
+        # Rows arrive sorted by image, then term
+        self.doc_terms, self.doc_confidence = terms, confidence
+        self.doc_start = np.searchsorted(docs, np.arange(len(completed) + 1))
+        order = np.lexsort((docs, -confidence, terms))
+        self.post_docs, self.post_confidence = docs[order], confidence[order]
+        self.post_start = np.searchsorted(terms[order], np.arange(len(words) + 1))
+        self.reset()
+
+    def reset(self):
+        self.postings_read = self.items_read = self.round_trips = 0
+        self.read_units = 0.0
+
+    def postings(self, term, limit, after=None):
+        self.round_trips += 1
+        index = self.position.get(term)
+        if index is None:
+            self.read_units += 0.5
+            return [], None
+        start = self.post_start[index] + (after or 0)
+        end = min(self.post_start[index + 1], start + limit)
+        entries = list(zip(self.post_docs[start:end].tolist(), self.post_confidence[start:end].tolist()))
+        self.postings_read += len(entries)
+        self.read_units += 0.5 * max(1, math.ceil(len(entries) * POSTING_BYTES / 4096))
+        more = end < self.post_start[index + 1]
+        return entries, (end - self.post_start[index]) if more else None
+
+    def documents(self, image_ids, fields):
+        self.round_trips += math.ceil(len(image_ids) / search_index.BATCH_SIZE)
+        self.items_read += len(image_ids)
+        self.read_units += 0.5 * len(image_ids)
+        found = {}
+        for image_id in image_ids:
+            start, end = self.doc_start[image_id], self.doc_start[image_id + 1]
+            terms = self.doc_terms[start:end].tolist()
+            scores = self.doc_confidence[start:end].tolist()
+            found[image_id] = {
+                'imageId': image_id,
+                'status': 'COMPLETED' if self.completed[image_id] else 'ERROR',
+                'searchTerms': {self.words[term]: score for term, score in zip(terms, scores)}
+            }
+        return found
+
+
+def brute_force(documents, include, exclude, limit):
+    """Scores of the best `limit` matches found by checking every image"""
+    scores = []
+    for item in documents:
+        terms = item['searchTerms']
+        if item['status'] == 'COMPLETED' and all(t in terms for t in include) and not any(t in terms for t in exclude):
+            scores.append(round(sum(float(terms[t]) for t in include), 3))
+    return sorted(scores, reverse=True)[:limit]
+
+
+def populate(table, words, docs, terms, confidence, completed):
+    """Soundscape items with their term maps and adjacency items, written straight into the fake"""
+    now = int(time.time())
+    scored = {}
+    for doc, term, score in zip(docs.tolist(), terms.tolist(), confidence.tolist()):
+        scored.setdefault(doc, {})[words[term]] = Decimal(str(score))
+    for doc, term_scores in scored.items():
+        image_id = f"img-{doc:08d}"
+        table.items[image_id] = {
+            'imageId': image_id,
+            'status': 'COMPLETED' if completed[doc] else 'ERROR',
+            'createdAt': Decimal(now - doc),
+            'scene': next(iter(term_scores)),
+            'description': "A wide sandy beach under a clear sky with gentle waves rolling onto the shore.",
+            'audioUrl': f"https://soundscape-audio.s3.amazonaws.com/audio/{image_id}.mp3",
+            'degraded': [],
+            'searchTerms': term_scores
+        }
+        for term, score in term_scores.items():
+            key = search_index.posting_key(term, image_id)
+            table.items[key] = {'imageId': key, 'searchTerm': term, 'searchScore': score, 'targetImageId': image_id}
+    table._version += 1
+
+
+def run_table(args):
+    size = args.table_items
+    words, docs, terms, confidence, completed = corpus(size, args.seed)
+    pipeline = LocalPipeline()
+    populate(pipeline.table, words, docs, terms, confidence, completed)
+    handler = pipeline.handlers['search']
+    documents = [item for key, item in pipeline.table.items.items() if not key.startswith(search_index.KEY_PREFIX)]
+    scan_units = len(pipeline.table.items) * 0.5
+
+    print(f"table: {size} images, {len(pipeline.table.items) - size} adjacency items; "
+          f"a scan reads {scan_units:.0f} RCU")
+    print(f"  {'query':<26}{'results':>8}{'RCU':>8}{'ms':>8}  matches brute force")
+    with contextlib.redirect_stdout(io.StringIO()):
+        # The first query after loading builds the stub's sorted index
+        handler.lambda_handler({'queryStringParameters': {'q': 'sky'}}, None)
+    for query in QUERIES:
+        before = pipeline.table.read_units
+        start = time.perf_counter()
+        with contextlib.redirect_stdout(io.StringIO()):
+            response = handler.lambda_handler({'queryStringParameters': {'q': query, 'limit': str(args.limit)}}, None)
+        elapsed = (time.perf_counter() - start) * 1000
+        body = json.loads(response['body'])
+        include, exclude = search_index.parse_query(query)
+        expected = brute_force(documents, include, exclude, args.limit)
+        found = [item['score'] for item in body['items']]
+        verdict = 'yes' if found == expected else ('partial' if not body['exhaustive'] else f"NO {found} {expected}")
+        print(f"  {query:<26}{body['count']:>8}{pipeline.table.read_units - before:>8.1f}{elapsed:>8.1f}  {verdict}")
+
+
+def run_scale(args, size):
+    start = time.perf_counter()
+    index = CompactIndex(*corpus(size, args.seed))
+    built = time.perf_counter() - start
+    scan_units = size * 0.5 * math.ceil(ITEM_BYTES / 4096)
+    print(f"scale: {size} images, {len(index.post_docs)} postings, built in {built:.1f} s; "
+          f"a scan reads {scan_units:.0f} RCU")
+    print(f"  {'query':<26}{'results':>8}{'postings':>10}{'items':>7}{'calls':>7}{'RCU':>8}{'ms':>8}  exhaustive")
+    for query in QUERIES:
+        include, exclude = search_index.parse_query(query)
+        latencies = []
+        for _ in range(args.repeat):
+            index.reset()
+            started = time.perf_counter()
+            found = search_index.search(index, include, exclude, limit=args.limit)
+            latencies.append((time.perf_counter() - started) * 1000)
+        print(f"  {query:<26}{len(found['results']):>8}{index.postings_read:>10}{index.items_read:>7}"
+              f"{index.round_trips:>7}{index.read_units:>8.1f}{percentile(latencies, 50):>8.1f}  {found['exhaustive']}")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--sizes', type=int, nargs='+', default=[1000000, 3000000])
+    parser.add_argument('--table-items', type=int, default=20000)
+    parser.add_argument('--limit', type=int, default=20)
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--seed', type=int, default=7)
+    args = parser.parse_args(argv)
+
+    run_table(args)
+    for size in args.sizes:
+        print()
+        run_scale(args, size)
+
+
+if __name__ == '__main__':
+    main()
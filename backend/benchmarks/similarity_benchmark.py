@@ -0,0 +1,169 @@
+"""
+Recall and cost of the label-vector LSH index (utils.similarity) on synthetic
+label sets.
+
+Images are drawn from --prototypes label sets of 6-12 labels each. An image
+keeps each of its prototype's labels with probability 0.85, its confidences
+move by a few points, and it gains up to two unrelated labels. So images of one
+prototype are similar to varying degrees, and images of different prototypes
+rarely are. For each index size, --items images go into an in-memory index
+that mirrors similarity.TableIndex, with the same bucket cap as the table
+bucket items. Then --queries new images are looked up with similarity.find().
+
+Ground truth is the exact best cosine similarity over all indexed images,
+computed with numpy. Reported per (bands x rows) setting:
+
+- recall: share of queries whose best match is >= the reuse threshold for
+  which the index found a match >= the threshold (a match it returns is
+  always above it, since candidates are checked exactly)
+- candidates: images read per lookup (BatchGetItem items), against --items
+  for a scan
+- full buckets: buckets at the member cap, which later images could not join
+- lookup p50/p99 in ms (signature, buckets, checks), and the brute-force time
+  for comparison
+
+Usage (from backend/):
+    python -m benchmarks.similarity_benchmark
+    python -m benchmarks.similarity_benchmark --sizes 10000 50000 --settings 16x12 8x8 --threshold 0.85
+"""
+import argparse
+import sys
+import time
+
+import numpy as np
+
+from benchmarks.load_test import percentile
+from harness.handlers import LAYER_DIRS
+
+for _layer in LAYER_DIRS:
+    if _layer not in sys.path:
+        sys.path.append(_layer)
+from utils import similarity  # noqa: E402
+
+VOCABULARY = 800
+
+
+class MemoryIndex:
+    """similarity.TableIndex over dicts: buckets capped at MAX_BUCKET_MEMBERS, items by imageId"""
+
+    def __init__(self, cap):
+        self.cap = cap
+        self.buckets = {}
+        self.items = {}
+
+    def add(self, image_id, names):
+        added = 0
+        for name in names:
+            members = self.buckets.setdefault(name, set())
+            if len(members) < self.cap:
+                members.add(image_id)
+                added += 1
+        return added
+
+    def candidates(self, names):
+        return set().union(*(self.buckets.get(name, ()) for name in names))
+
+    def documents(self, image_ids, fields=None):
+        return {image_id: self.items[image_id] for image_id in image_ids}
+
+
+def label_sets(count, prototypes, rng):
+    """`count` Rekognition-style label lists drawn around the prototypes"""
+    weights = 1.0 / np.arange(1, VOCABULARY + 1)
+    weights /= weights.sum()
+    images = []
+    for _ in range(count):
+        proto = prototypes[rng.integers(len(prototypes))]
+        labels = {name: min(99.9, max(70.0, confidence + rng.normal(0, 4)))
+                  for name, confidence in proto if rng.random() < 0.85}
+        for term in rng.choice(VOCABULARY, size=rng.integers(0, 3), p=weights):
+            labels.setdefault(f"label{term:03d}", rng.uniform(70, 85))
+        images.append([{'Name': name, 'Confidence': confidence} for name, confidence in labels.items()])
+    return images
+
+
+def make_prototypes(count, rng):
+    weights = 1.0 / np.arange(1, VOCABULARY + 1) ** 0.8
+    weights /= weights.sum()
+    return [[(f"label{term:03d}", rng.uniform(72, 99))
+             for term in rng.choice(VOCABULARY, size=rng.integers(6, 13), replace=False, p=weights)]
+            for _ in range(count)]
+
+
+def dense(vectors):
+    """L2-normalized rows over the vocabulary, for exact cosine similarity"""
+    matrix = np.zeros((len(vectors), VOCABULARY), dtype=np.float32)
+    for row, weights in enumerate(vectors):
+        for term, weight in weights.items():
+            matrix[row, int(term[5:])] = weight
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    return matrix / np.maximum(norms, 1e-9)
+
+
+def run(args, size, bands, rows, images, queries, truth):
+    index = MemoryIndex(similarity.MAX_BUCKET_MEMBERS)
+    for number, weights in enumerate(images[:size]):
+        image_id = f"img-{number:07d}"
+        index.items[image_id] = {'imageId': image_id, 'status': 'COMPLETED', 'audioUrl': f"audio/{image_id}.mp3",
+                                 'labelVector': weights, 'degraded': []}
+        index.add(image_id, similarity.buckets(similarity.signature(weights, bands, rows), bands, rows))
+
+    found = eligible = 0
+    candidates = []
+    latencies = []
+    for weights, best in zip(queries, truth):
+        started = time.perf_counter()
+        names = similarity.buckets(similarity.signature(weights, bands, rows), bands, rows)
+        checked = index.candidates(names)
+        match, _ = similarity.find(index, weights, names, threshold=args.threshold)
+        latencies.append((time.perf_counter() - started) * 1000)
+        candidates.append(len(checked))
+        if best >= args.threshold:
+            eligible += 1
+            found += match is not None
+    full = sum(len(members) >= index.cap for members in index.buckets.values())
+    return {
+        'recall': found / eligible if eligible else float('nan'),
+        'eligible': eligible,
+        'candidates': sum(candidates) / len(candidates),
+        'full': full / max(1, len(index.buckets)),
+        'p50': percentile(latencies, 50),
+        'p99': percentile(latencies, 99)
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--sizes', type=int, nargs='+', default=[10000, 50000])
+    parser.add_argument('--queries', type=int, default=500)
+    parser.add_argument('--prototypes', type=int, default=2000)
+    parser.add_argument('--settings', nargs='+', default=['4x16', '8x8', '16x8', '16x12', '24x12'],
+                        help="LSH settings as BANDSxROWS")
+    parser.add_argument('--threshold', type=float, default=similarity.REUSE_THRESHOLD)
+    parser.add_argument('--seed', type=int, default=13)
+    args = parser.parse_args(argv)
+
+    rng = np.random.default_rng(args.seed)
+    prototypes = make_prototypes(args.prototypes, rng)
+    images = [similarity.vector(labels) for labels in label_sets(max(args.sizes), prototypes, rng)]
+    queries = [similarity.vector(labels) for labels in label_sets(args.queries, prototypes, rng)]
+    matrix, query_matrix = dense(images), dense(queries)
+
+    print(f"{args.queries} lookups, reuse threshold {args.threshold}, bucket cap {similarity.MAX_BUCKET_MEMBERS}")
+    for size in args.sizes:
+        started = time.perf_counter()
+        truth = (query_matrix @ matrix[:size].T).max(axis=1)
+        brute_ms = (time.perf_counter() - started) * 1000 / args.queries
+        print()
+        print(f"{size} images: {int((truth >= args.threshold).sum())} lookups have a match >= threshold; "
+              f"brute force {brute_ms:.2f} ms and {size} items read per lookup")
+        print(f"  {'setting':<9}{'bits':>6}{'recall':>8}{'candidates':>12}{'full buckets':>14}{'p50 ms':>8}{'p99 ms':>8}")
+        for setting in args.settings:
+            bands, rows = (int(part) for part in setting.split('x'))
+            result = run(args, size, bands, rows, images, queries, truth)
+            print(f"  {setting:<9}{bands * rows:>6}{result['recall']:>8.1%}{result['candidates']:>12.1f}"
+                  f"{result['full']:>14.1%}{result['p50']:>8.2f}{result['p99']:>8.2f}")
+
+
+if __name__ == '__main__':
+    main()
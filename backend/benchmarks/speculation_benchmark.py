@@ -0,0 +1,184 @@
+"""
+Hit rate, wasted ElevenLabs spend and latency saved by speculative audio
+(utils/speculation.py) at each SPECULATION_MODE, from recorded analyses.
+
+A recorded analysis is a captured image_to_text request (utils.capture): its
+Rekognition labels, Claude's answer and the Bedrock call time, with the
+ElevenLabs generation time of the same request when generate_audio called it
+inline (otherwise AUDIO_SERVICE_SECONDS). Without a capture, a synthetic set
+is used in which Claude sometimes hears a scene other than the labels
+suggest.
+
+For every mode the report shows the share of requests that speculate (label
+confidence) and, of those, the share that keep the clip (similarity against
+the mode's threshold). A kept clip started a Bedrock call earlier, so it
+saves min(Bedrock time, generation time). A released one is counted as a
+full clip wasted: with an idle queue a worker has picked it up before Claude
+answers. Queue pressure is not modelled; the modes' pressure limits only cut
+speculation further under load.
+
+Usage (from backend/):
+    python -m benchmarks.speculation_benchmark
+    python -m benchmarks.speculation_benchmark captures/
+    python -m benchmarks.speculation_benchmark traffic.jsonl.gz --threshold 0.35
+"""
+import argparse
+import random
+import sys
+
+from benchmarks.load_test import percentile
+from benchmarks.replay import group_requests, load_records
+from harness.handlers import LAYER_DIRS
+
+for _layer in LAYER_DIRS:
+    if _layer not in sys.path:
+        sys.path.append(_layer)
+from utils import audio_queue, metering, prompts, speculation  # noqa: E402
+
+# Synthetic scenes: (labels, Claude's scene, elements, sound prompt)
+SCENES = [
+    ([('Beach', 98), ('Ocean', 97), ('Sea', 96), ('Water', 95), ('Sand', 89), ('Bird', 84), ('Wave', 77)],
+     'beach', ['waves', 'seagulls', 'sand', 'wind'],
+     "Gentle ocean waves lapping over sand, seagulls calling overhead and a steady sea breeze."),
+    ([('Forest', 97), ('Tree', 96), ('Plant', 93), ('Vegetation', 91), ('Woodland', 88), ('Path', 75)],
+     'forest', ['trees', 'leaves', 'birds', 'path'],
+     "Leaves rustling in the canopy, songbirds in the trees and footsteps on a forest path."),
+    ([('City', 97), ('Street', 95), ('Car', 93), ('Road', 92), ('Building', 90), ('Person', 86), ('Traffic Light', 80)],
+     'city', ['traffic', 'cars', 'pedestrians', 'buildings'],
+     "Busy street traffic with cars passing, horns in the distance and pedestrians talking on the sidewalk."),
+    ([('Indoors', 95), ('Room', 92), ('Furniture', 90), ('Person', 88), ('Cup', 81), ('Table', 79)],
+     'indoor', ['cafe', 'espresso machine', 'chatter', 'cups'],
+     "A cozy cafe with an espresso machine hissing, quiet chatter and cups clinking on saucers."),
+    ([('Mountain', 98), ('Snow', 96), ('Peak', 93), ('Sky', 92), ('Outdoors', 90), ('Glacier', 78)],
+     'mountain', ['snow', 'wind', 'peaks', 'glacier'],
+     "Howling wind over snowy peaks, ice creaking on the glacier and snow crunching underfoot.")
+]
+SYNTHETIC_BEDROCK_SECONDS = (6.0, 0.35)
+SYNTHETIC_GENERATION_SECONDS = (10.0, 0.25)
+
+
+class Analysis:
+    """One recorded analysis: what speculation would have had to decide on"""
+
+    def __init__(self, labels, scene, elements, sound_prompt, bedrock_seconds, generation_seconds, fallback=False):
+        self.labels = labels
+        self.scene = scene
+        self.elements = elements
+        self.sound_prompt = sound_prompt
+        self.bedrock_seconds = bedrock_seconds
+        self.generation_seconds = generation_seconds
+        self.fallback = fallback
+
+
+def from_captures(records):
+    analyses = []
+    for request in group_requests(records):
+        record = request.by_function.get('image_to_text')
+        if not record:
+            continue
+        labels = bedrock = None
+        for call in record.get('calls', []):
+            response = call.get('res') or {}
+            if call.get('svc') == 'rekognition' and 'labels' in response:
+                labels = [{'Name': name, 'Confidence': confidence} for name, confidence in response['labels']]
+            elif call.get('svc') == 'bedrock':
+                bedrock = call
+        if not labels:
+            continue
+        generations = [call['ms'] / 1000.0 for call in request.calls.get('elevenlabs', []) if call.get('ms')]
+        generation_seconds = generations[0] if generations else audio_queue.SERVICE_SECONDS
+        text = ((bedrock or {}).get('res') or {}).get('text')
+        if bedrock is None or bedrock.get('err') or not text:
+            # The fallback sends the label prompt itself
+            prompt = speculation.label_prompt([label['Name'] for label in labels])
+            analyses.append(Analysis(labels, 'unknown', [], prompt, (bedrock or {}).get('ms', 0) / 1000.0,
+                                     generation_seconds, fallback=True))
+            continue
+        _, scene, elements, sound_prompt = prompts.parse(text)
+        analyses.append(Analysis(labels, scene, elements, sound_prompt, bedrock['ms'] / 1000.0, generation_seconds))
+    return analyses
+
+
+def synthetic(count, mismatch, seed=3):
+    rng = random.Random(seed)
+    analyses = []
+    for _ in range(count):
+        labels, scene, elements, sound_prompt = rng.choice(SCENES)
+        kept = [label for label in labels if rng.random() > 0.25] or labels[:1]
+        labels = [{'Name': name, 'Confidence': min(99.9, confidence * rng.uniform(0.88, 1.02))} for name, confidence in kept]
+        labels.sort(key=lambda label: -label['Confidence'])
+        if rng.random() < mismatch:
+            # Claude hears what the labels miss: the same photo read as another scene
+            _, scene, elements, sound_prompt = rng.choice([s for s in SCENES if s[1] != scene])
+        analyses.append(Analysis(labels, scene, elements, sound_prompt,
+                                 SYNTHETIC_BEDROCK_SECONDS[0] * rng.lognormvariate(0, SYNTHETIC_BEDROCK_SECONDS[1]),
+                                 SYNTHETIC_GENERATION_SECONDS[0] * rng.lognormvariate(0, SYNTHETIC_GENERATION_SECONDS[1])))
+    return analyses
+
+
+def evaluate(analyses, threshold, min_confidence):
+    clip_seconds = speculation.generation('')['duration_seconds']
+    speculated = hits = 0
+    saved = []
+    for analysis in analyses:
+        if speculation.confidence(analysis.labels) < min_confidence:
+            saved.append(0.0)
+            continue
+        speculated += 1
+        prompt = speculation.label_prompt([label['Name'] for label in analysis.labels])
+        value = speculation.score(analysis.labels, analysis.scene, analysis.elements, analysis.sound_prompt, prompt)
+        if value >= threshold:
+            hits += 1
+            saved.append(min(analysis.bedrock_seconds, analysis.generation_seconds))
+        else:
+            saved.append(0.0)
+    wasted_seconds = (speculated - hits) * clip_seconds
+    wasted_cost = metering.cost({'elevenlabsSeconds': wasted_seconds}).get('elevenlabs', 0.0)
+    return {
+        'speculated': speculated / float(len(analyses)),
+        'hitRate': hits / float(speculated) if speculated else 0.0,
+        'savedMean': sum(saved) / len(saved),
+        'savedHitP50': percentile([s for s in saved if s], 50) if hits else 0.0,
+        'wastedPer1k': wasted_cost / len(analyses) * 1000,
+        'wastedSecondsPer1k': wasted_seconds / len(analyses) * 1000
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('captures', nargs='?', help="Capture file (.jsonl/.jsonl.gz) or CAPTURE_DIR directory")
+    parser.add_argument('--synthetic', type=int, default=1000, help="Synthetic analyses when no capture is given")
+    parser.add_argument('--mismatch', type=float, default=0.25,
+                        help="Share of synthetic analyses where Claude hears another scene than the labels")
+    parser.add_argument('--threshold', type=float, help="Also evaluate this threshold (SPECULATION_THRESHOLD)")
+    parser.add_argument('--min-confidence', type=float, default=0.0,
+                        help="Label confidence for the --threshold row (SPECULATION_MIN_CONFIDENCE)")
+    args = parser.parse_args(argv)
+
+    analyses = from_captures(load_records(args.captures)) if args.captures else synthetic(args.synthetic, args.mismatch)
+    if not analyses:
+        print("No recorded analyses with Rekognition labels in the capture")
+        return 1
+    scores = [speculation.score(a.labels, a.scene, a.elements, a.sound_prompt,
+                                speculation.label_prompt([label['Name'] for label in a.labels])) for a in analyses]
+    print(f"{len(analyses)} analyses ({sum(1 for a in analyses if a.fallback)} Bedrock fallbacks); similarity "
+          f"p10/p50/p90 {percentile(scores, 10):.2f}/{percentile(scores, 50):.2f}/{percentile(scores, 90):.2f}")
+    print()
+
+    rows = [(mode, preset['threshold'], preset['minConfidence']) for mode, preset in speculation.MODES.items()]
+    if args.threshold is not None:
+        rows.append(('custom', args.threshold, args.min_confidence))
+    header = (f"{'mode':<14}{'threshold':>10}{'min conf':>10}{'speculated':>12}{'hit rate':>10}"
+              f"{'saved/hit p50':>15}{'saved/request':>15}{'wasted s/1k':>13}{'wasted $/1k':>13}")
+    print(header)
+    print('-' * len(header))
+    for mode, threshold, min_confidence in rows:
+        result = evaluate(analyses, threshold, min_confidence)
+        print(f"{mode:<14}{threshold:>10.2f}{min_confidence:>10.0f}{result['speculated']:>12.1%}{result['hitRate']:>10.1%}"
+              f"{result['savedHitP50']:>14.2f}s{result['savedMean']:>14.2f}s{result['wastedSecondsPer1k']:>13.0f}"
+              f"{result['wastedPer1k']:>13.2f}")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,79 @@
+"""
+CPU time per clip for the loudness-normalized rendition pipeline.
+
+Synthesizes ElevenLabs-like MP3 clips (pink noise under a few tones) with
+ffmpeg, then runs generate_audio's renditions.render() on each and reports
+wall time, ffmpeg CPU time (user + sys of child processes), CPU seconds per
+second of audio, and output sizes per rendition. Needs an ffmpeg with
+libmp3lame, aac and libopus on PATH or in FFMPEG_PATH.
+
+Usage (from backend/):
+    python -m benchmarks.transcode_benchmark
+    python -m benchmarks.transcode_benchmark --durations 8 30 120 --repeat 5
+"""
+import argparse
+import os
+import resource
+import subprocess
+import sys
+import time
+
+from harness.handlers import FUNCTIONS_DIR
+
+sys.path.insert(0, os.path.join(FUNCTIONS_DIR, 'generate_audio'))
+import renditions  # noqa: E402
+
+
+def synth_clip(seconds):
+    """An MP3 shaped like an ElevenLabs sound effect: 44.1 kHz stereo, 128 kbps"""
+    result = subprocess.run([
+        renditions.FFMPEG_PATH, '-hide_banner', '-nostdin', '-y',
+        '-f', 'lavfi', '-i', f"anoisesrc=color=pink:amplitude=0.2:duration={seconds}:sample_rate=44100",
+        '-f', 'lavfi', '-i', f"sine=frequency=220:duration={seconds}:sample_rate=44100",
+        '-filter_complex', "[0:a][1:a]amix=inputs=2,aformat=channel_layouts=stereo",
+        '-c:a', 'libmp3lame', '-b:a', '128k', '-f', 'mp3', 'pipe:1'
+    ], capture_output=True, check=True)
+    return result.stdout
+
+
+def child_cpu_seconds():
+    usage = resource.getrusage(resource.RUSAGE_CHILDREN)
+    return usage.ru_utime + usage.ru_stime
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--durations', type=float, nargs='+', default=[8, 30, 120], help="Clip lengths in seconds")
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--renditions', nargs='+', default=renditions.ENABLED_RENDITIONS, choices=list(renditions.RENDITIONS))
+    args = parser.parse_args(argv)
+
+    if not renditions.available():
+        print(f"ffmpeg not found at {renditions.FFMPEG_PATH}; set FFMPEG_PATH")
+        return 2
+
+    print(f"ffmpeg: {renditions.FFMPEG_PATH}  renditions: {', '.join(args.renditions)}  cpus: {os.cpu_count()}")
+    header = f"{'clip s':>7}{'input KB':>10}{'wall ms':>10}{'cpu ms':>10}{'cpu s/audio s':>15}"
+    header += ''.join(f"{name + ' KB':>18}" for name in args.renditions)
+    print(header)
+
+    for seconds in args.durations:
+        clip = synth_clip(seconds)
+        walls, cpus = [], []
+        for _ in range(args.repeat):
+            cpu_before = child_cpu_seconds()
+            start = time.perf_counter()
+            rendered, _ = renditions.render(clip, args.renditions)
+            walls.append(time.perf_counter() - start)
+            cpus.append(child_cpu_seconds() - cpu_before)
+
+        wall = sorted(walls)[len(walls) // 2]
+        cpu = sorted(cpus)[len(cpus) // 2]
+        row = f"{seconds:>7.0f}{len(clip) / 1024:>10.1f}{wall * 1000:>10.1f}{cpu * 1000:>10.1f}{cpu / seconds:>15.4f}"
+        row += ''.join(f"{len(rendered[name]['data']) / 1024:>18.1f}" for name in args.renditions)
+        print(row)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,102 @@
+"""
+Throughput of generate_audio's waveform.compute() on decoded PCM.
+
+Generates mono float32 noise-plus-tone PCM at the analysis sample rate and
+reports how many seconds of audio per wall-clock second the vectorized NumPy
+reduction handles, against a plain-Python per-bucket loop producing the same
+peaks. Also reports the sidecar size next to the 128 kbps MP3 a client would
+otherwise download and decode. With ffmpeg available, --with-render adds the
+extra cost of emitting PCM from the renditions pass.
+
+Usage (from backend/):
+    python -m benchmarks.waveform_benchmark
+    python -m benchmarks.waveform_benchmark --durations 8 60 600 --points 800 --with-render
+"""
+import argparse
+import os
+import sys
+import time
+
+import numpy as np
+
+from harness.handlers import FUNCTIONS_DIR
+
+sys.path.insert(0, os.path.join(FUNCTIONS_DIR, 'generate_audio'))
+import renditions  # noqa: E402
+import waveform  # noqa: E402
+
+
+def synth_pcm(seconds, sample_rate):
+    rng = np.random.default_rng(42)
+    t = np.arange(int(seconds * sample_rate), dtype=np.float32) / sample_rate
+    signal = 0.3 * np.sin(2 * np.pi * 220 * t) * (0.5 + 0.5 * np.sin(2 * np.pi * 0.25 * t))
+    return (signal + rng.normal(0, 0.05, t.shape[0])).astype('<f4').tobytes()
+
+
+def reference_compute(pcm, points):
+    """Per-bucket Python loop over a list of samples; what a naive port would do"""
+    samples = np.frombuffer(pcm, dtype='<f4').tolist()
+    per_point = -(-len(samples) // points)
+    peaks, rms = [], []
+    for start in range(0, len(samples), per_point):
+        bucket = samples[start:start + per_point]
+        peaks.append(int(round(min(bucket) * 127)))
+        peaks.append(int(round(max(bucket) * 127)))
+        rms.append(int(round((sum(s * s for s in bucket) / per_point) ** 0.5 * 255)))
+    return peaks, rms
+
+
+def best_of(repeat, fn):
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = fn()
+        times.append(time.perf_counter() - start)
+    return min(times), result
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--durations', type=float, nargs='+', default=[8, 60, 600], help="Clip lengths in seconds")
+    parser.add_argument('--points', type=int, default=waveform.WAVEFORM_POINTS)
+    parser.add_argument('--sample-rate', type=int, default=waveform.ANALYSIS_SAMPLE_RATE)
+    parser.add_argument('--repeat', type=int, default=5, help="Runs per measurement; the fastest is reported")
+    parser.add_argument('--skip-reference', action='store_true', help="Skip the slow pure-Python baseline")
+    parser.add_argument('--with-render', action='store_true', help="Also time renditions.render() with and without PCM output")
+    args = parser.parse_args(argv)
+
+    print(f"numpy {np.__version__}  points: {args.points}  analysis rate: {args.sample_rate} Hz")
+    print(f"{'clip s':>7}{'numpy ms':>10}{'audio s/s':>12}{'python ms':>11}{'speedup':>9}{'sidecar KB':>12}{'mp3 KB':>9}")
+
+    for seconds in args.durations:
+        pcm = synth_pcm(seconds, args.sample_rate)
+        fast_s, result = best_of(args.repeat, lambda: waveform.compute(pcm, args.sample_rate, 44100, args.points))
+
+        if args.skip_reference:
+            slow_text, speedup_text = f"{'-':>11}", f"{'-':>9}"
+        else:
+            slow_s, (peaks, _) = best_of(1, lambda: reference_compute(pcm, args.points))
+            # Sanity check: both paths agree to within rounding
+            assert max(abs(a - b) for a, b in zip(peaks, result['peaks'])) <= 1
+            slow_text, speedup_text = f"{slow_s * 1000:>11.1f}", f"{slow_s / fast_s:>8.0f}x"
+
+        sidecar_kb = len(waveform.encode(result)) / 1024
+        mp3_kb = seconds * 128 / 8
+        print(f"{seconds:>7.0f}{fast_s * 1000:>10.2f}{seconds / fast_s:>12.0f}{slow_text}{speedup_text}"
+              f"{sidecar_kb:>12.1f}{mp3_kb:>9.0f}")
+
+    if args.with_render:
+        if not renditions.available():
+            print(f"ffmpeg not found at {renditions.FFMPEG_PATH}; skipping --with-render")
+            return 0
+        from benchmarks.transcode_benchmark import synth_clip
+        clip = synth_clip(8)
+        plain_s, _ = best_of(3, lambda: renditions.render(clip))
+        pcm_s, (_, analysis) = best_of(3, lambda: renditions.render(clip, pcm_sample_rate=args.sample_rate))
+        print(f"8 s clip render: {plain_s * 1000:.0f} ms without PCM, {pcm_s * 1000:.0f} ms with PCM "
+              f"(+{(pcm_s - plain_s) * 1000:.0f} ms, {len(analysis['pcm']) / 1024:.0f} KB PCM)")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -4,19 +4,51 @@ import os
 import uuid
 import traceback
 import base64
+import math
+import time
+
+import idempotency
+from utils import audio_queue, capture, deadline, imaging, metering, metrics, payload, profiling, scheduler
 
 # Initialize AWS clients
 s3 = boto3.client('s3')
 stepfunctions = boto3.client('stepfunctions')
+# Queue depth is read for backpressure when audio generation is queued
+sqs = boto3.client('sqs') if audio_queue.enabled() else None
+
+# The table is only needed for idempotent (keyed) requests
+table_name = os.environ.get('TABLE_NAME')
+table = boto3.resource('dynamodb').Table(table_name) if table_name else None
+
+# Longest extended soundscape a request may ask for; generate_audio is capped by the same setting
+MAX_LOOP_SECONDS = float(os.environ.get('AUDIO_MAX_LOOP_SECONDS', '600'))
 
+def loop_seconds(body):
+    """The extended track length the body asks for (loopSeconds), or None; ValueError when out of range"""
+    value = body.get('loopSeconds')
+    if value is None:
+        return None
+    if isinstance(value, bool) or not isinstance(value, (int, float)) or not math.isfinite(value) \
+            or not 0 <= value <= MAX_LOOP_SECONDS:
+        raise ValueError(f"loopSeconds must be a number of seconds from 0 to {MAX_LOOP_SECONDS:g}")
+    return float(value)
+
+@profiling.profiled('analyze_api')
+@capture.captured('analyze_api')
+@metering.metered('analyze_api')
 def lambda_handler(event, context):
     """
     Handler for the analyze API endpoint. This function:
     1. Extracts the image from the request
     2. Uploads it to S3
     3. Starts the Step Functions workflow with the S3 reference
+
+    The request's deadline (utils.deadline) starts here and travels in the
+    workflow input, so every stage knows how long the caller will wait.
     """
     print(f"analyze_api lambda_handler invoked with event type: {type(event)}")
+    request_deadline = deadline.start(context)
+    started = time.perf_counter()
 
     try:
         # Get state machine ARN from environment
@@ -46,7 +78,7 @@ def lambda_handler(event, context):
                 'headers': {
                     'Content-Type': 'application/json',
                     'Access-Control-Allow-Origin': '*',
-                    'Access-Control-Allow-Headers': 'Content-Type,X-Amz-Date,Authorization,X-Api-Key,X-Amz-Security-Token,X-Requested-With',
+                    'Access-Control-Allow-Headers': 'Content-Type,X-Amz-Date,Authorization,X-Api-Key,X-Amz-Security-Token,X-Requested-With,Idempotency-Key,X-Priority,X-Profile',
                     'Access-Control-Allow-Methods': 'GET,POST,OPTIONS,PUT,DELETE',
                     'Access-Control-Max-Age': '3600'
                 },
@@ -93,11 +125,30 @@ def lambda_handler(event, context):
                 })
             }
 
-        # Process the image
+        # Retries carrying the same idempotency key attach to the original execution;
+        # bulk work runs in its own lane of the scheduler (utils/scheduler.py)
         try:
-            # Generate a unique ID
-            image_id = str(uuid.uuid4())
+            idempotency_key = idempotency.get_idempotency_key(event, body)
+            lane = scheduler.lane_for(event, body)
+            requested_loop_seconds = loop_seconds(body)
+        except ValueError as key_err:
+            return {
+                'statusCode': 400,
+                'headers': {
+                    'Content-Type': 'application/json',
+                    'Access-Control-Allow-Origin': '*'
+                },
+                'body': json.dumps({
+                    'error': str(key_err)
+                })
+            }
 
+        if idempotency_key and table is None:
+            print("Idempotency key ignored: TABLE_NAME is not configured")
+            idempotency_key = None
+
+        # Process the image
+        try:
             # Decode base64 image
             image_data_str = body['image']
             if image_data_str.startswith('data:image/'):
@@ -106,78 +157,203 @@ def lambda_handler(event, context):
 
             image_data = base64.b64decode(image_data_str)
 
-            # Get image extension/format (you might want to improve this)
-            image_format = 'jpg'  # Default
+            if idempotency_key:
+                claim = idempotency.claim(table, idempotency_key, idempotency.request_digest(image_data))
+                image_id = claim['imageId']
+
+                if claim.get('mismatch'):
+                    return {
+                        'statusCode': 422,
+                        'headers': {
+                            'Content-Type': 'application/json',
+                            'Access-Control-Allow-Origin': '*'
+                        },
+                        'body': json.dumps({
+                            'error': 'This idempotency key was already used with a different image',
+                            'imageId': image_id
+                        })
+                    }
+
+                if not claim['owner']:
+                    print(f"Attaching to existing execution for image ID: {image_id}")
+                    item = idempotency.wait_for_result(
+                        table, idempotency_key, image_id,
+                        wait_seconds=min(idempotency.IDEMPOTENCY_WAIT_SECONDS, request_deadline.remaining())
+                    )
+                    if item:
+                        return {
+                            'statusCode': 200,
+                            'headers': {
+                                'Content-Type': 'application/json',
+                                'Access-Control-Allow-Origin': '*',
+                                'Access-Control-Allow-Headers': 'Content-Type,X-Amz-Date,Authorization,X-Api-Key,X-Amz-Security-Token,X-Requested-With,Idempotency-Key,X-Priority,X-Profile',
+                                'Access-Control-Allow-Methods': 'GET,POST,OPTIONS,PUT,DELETE'
+                            },
+                            'body': payload.dumps(idempotency.result_body(item))
+                        }
+
+                    # Still running (or just failed): tell the client to retry with the same key
+                    return {
+                        'statusCode': 409,
+                        'headers': {
+                            'Content-Type': 'application/json',
+                            'Access-Control-Allow-Origin': '*',
+                            'Retry-After': '2'
+                        },
+                        'body': json.dumps({
+                            'error': 'A request with this idempotency key is still being processed',
+                            'imageId': image_id
+                        })
+                    }
+
+                execution_name = idempotency.execution_name_for(image_id, claim['attempt'])
+            else:
+                # Generate a unique ID
+                image_id = str(uuid.uuid4())
+                execution_name = f"soundscape-{uuid.uuid4()}"
+
+            # The digest hashes the whole image, so it is only computed for a written recording
+            capture.annotate(image_id, request=lambda: {
+                'imageBytes': len(image_data),
+                'imageDigest': capture.digest(image_data),
+                'idempotent': bool(idempotency_key),
+                'lane': lane
+            })
+            metering.annotate(image_id)
+            profiling.annotate(image_id)
+
+            # Sniff the real format from the magic bytes; reject non-images before
+            # paying for an upload and a workflow execution
+            image_format = imaging.sniff_format(image_data)
+            try:
+                imaging.check_size(len(image_data))
+                if image_format is None:
+                    raise imaging.ImageRejected("File is not a JPEG or PNG image")
+            except imaging.ImageRejected as reject_err:
+                print(f"Rejecting upload: {reject_err}")
+                if idempotency_key:
+                    idempotency.fail(table, idempotency_key)
+                return {
+                    'statusCode': 400,
+                    'headers': {
+                        'Content-Type': 'application/json',
+                        'Access-Control-Allow-Origin': '*'
+                    },
+                    'body': json.dumps({
+                        'error': f'Invalid image: {str(reject_err)}'
+                    })
+                }
+
+            # Shed load while the audio queue could not start another job in time,
+            # instead of running a workflow that would end without audio
+            if audio_queue.enabled():
+                pressure = audio_queue.pressure(deadline.client(sqs, request_deadline))
+                # Bulk work only joins an idle queue, so it never delays interactive jobs
+                if pressure['state'] == audio_queue.PRESSURE_FULL or (
+                        lane == scheduler.BULK and pressure['state'] != audio_queue.PRESSURE_OK):
+                    pressure['retryAfter'] = pressure['retryAfter'] or max(1, int(pressure['estimatedWaitSeconds'] + 1))
+                    print(f"Audio queue is {pressure['state']}, rejecting {lane} request: {pressure}")
+                    metrics.emit({'AudioQueueRejected': 1, 'AudioQueueDepth': pressure['queued']}, dimensions={'Queue': 'audio'},
+                                 properties={'lane': lane})
+                    if idempotency_key:
+                        idempotency.fail(table, idempotency_key)
+                    return {
+                        'statusCode': 429,
+                        'headers': {
+                            'Content-Type': 'application/json',
+                            'Access-Control-Allow-Origin': '*',
+                            'Access-Control-Expose-Headers': 'Retry-After',
+                            'Retry-After': str(pressure['retryAfter'])
+                        },
+                        'body': json.dumps({
+                            'error': 'Audio generation is at capacity, please retry shortly',
+                            'retryAfterSeconds': pressure['retryAfter'],
+                            'queueDepth': pressure['queued']
+                        })
+                    }
+                if pressure['state'] == audio_queue.PRESSURE_BUSY:
+                    print(f"Audio queue is busy, expect a wait of about {pressure['estimatedWaitSeconds']} s")
 
             # Upload to S3
-            s3_key = f'uploads/{image_id}.{image_format}'
+            s3_key = f'uploads/{image_id}.{imaging.extension_for(image_format)}'
             images_bucket = os.environ.get('IMAGES_BUCKET')
 
             print(f"Uploading image to S3: {images_bucket}/{s3_key}")
-            s3.put_object(
+            deadline.client(s3, request_deadline).put_object(
                 Bucket=images_bucket,
                 Key=s3_key,
                 Body=image_data,
-                ContentType=f'image/{image_format}'
+                ContentType=imaging.content_type_for(image_format)
             )
+            metering.count('s3', 'put_object')
+            metering.add(s3BytesStored=len(image_data))
             print("Image uploaded successfully")
 
             # Prepare a smaller payload for Step Functions
             workflow_input = {
                 'imageId': image_id,
-                's3Key': s3_key
+                's3Key': s3_key,
+                'deadlineMs': request_deadline.epoch_ms
                 # Add any other metadata here, but NOT the image data
             }
+            if lane != scheduler.INTERACTIVE:
+                workflow_input['lane'] = lane
+            # Length of the extended (looped) track; generate_audio renders it from the short clip
+            if requested_loop_seconds is not None:
+                workflow_input['loopSeconds'] = requested_loop_seconds
+            # A profiled request (utils/profiling.py) is profiled in every stage
+            if profiling.active():
+                workflow_input['profile'] = True
 
-            # Generate a unique execution name
-            execution_name = f"soundscape-{uuid.uuid4()}"
-            print(f"Generated execution name: {execution_name}")
+            print(f"Using execution name: {execution_name}")
 
             # Start Step Functions synchronous execution with the smaller payload
             print(f"Starting synchronous Step Functions execution with ARN: {state_machine_arn}")
 
-            response = stepfunctions.start_sync_execution(
-                stateMachineArn=state_machine_arn,
-                name=execution_name,
-                input=json.dumps(workflow_input)  # Much smaller payload
-            )
+            with capture.call('stepfunctions', 'start_sync_execution') as call:
+                # The stages keep to the deadline themselves; this only stops us from
+                # waiting on an execution past the point the caller has given up
+                sync_client = deadline.client(stepfunctions, request_deadline, attempts=1,
+                                              reserve=-deadline.RESPONSE_RESERVE_SECONDS)
+                response = sync_client.start_sync_execution(
+                    stateMachineArn=state_machine_arn,
+                    name=execution_name,
+                    input=json.dumps(workflow_input)  # Much smaller payload
+                )
+                call.response = {'status': response['status']}
 
             # Log successful execution and results
             print(f"Step Functions execution completed: {response['status']}")
+            metrics.emit({'LaneRequestTime': int((time.perf_counter() - started) * 1000)},
+                         dimensions={'Lane': lane}, units={'LaneRequestTime': 'Milliseconds'},
+                         properties={'status': response['status']})
+
+            if idempotency_key:
+                if response['status'] == 'SUCCEEDED':
+                    idempotency.complete(table, idempotency_key)
+                else:
+                    idempotency.fail(table, idempotency_key)
 
             # Check for successful execution
             if response['status'] == 'SUCCEEDED':
-                # Parse output from the Step Functions execution
-                output_json = json.loads(response['output'])
-
-                # If FinalResponse function returned a properly formatted API response, use it
-                if isinstance(output_json, dict) and 'statusCode' in output_json and 'body' in output_json:
-                    # Extract the body from the response
-                    result_body = json.loads(output_json['body']) if isinstance(output_json['body'], str) else output_json['body']
+                # final_response returns the response body itself, so the execution
+                # output is forwarded as the HTTP body without another decode/encode
+                body = response['output']
+                if body.startswith('{"statusCode"'):
+                    # Executions of the previous workflow returned an API Gateway envelope
+                    output_json = payload.loads(body)
+                    body = output_json['body'] if isinstance(output_json['body'], str) else payload.dumps(output_json['body'])
 
-                    # Return the final response with 200 status code
-                    return {
-                        'statusCode': 200,
-                        'headers': {
-                            'Content-Type': 'application/json',
-                            'Access-Control-Allow-Origin': '*',
-                            'Access-Control-Allow-Headers': 'Content-Type,X-Amz-Date,Authorization,X-Api-Key,X-Amz-Security-Token,X-Requested-With',
-                            'Access-Control-Allow-Methods': 'GET,POST,OPTIONS,PUT,DELETE'
-                        },
-                        'body': json.dumps(result_body)
-                    }
-                else:
-                    # Return the raw output as response
-                    return {
-                        'statusCode': 200,
-                        'headers': {
-                            'Content-Type': 'application/json',
-                            'Access-Control-Allow-Origin': '*',
-                            'Access-Control-Allow-Headers': 'Content-Type,X-Amz-Date,Authorization,X-Api-Key,X-Amz-Security-Token,X-Requested-With',
-                            'Access-Control-Allow-Methods': 'GET,POST,OPTIONS,PUT,DELETE'
-                        },
-                        'body': response['output']
-                    }
+                return {
+                    'statusCode': 200,
+                    'headers': {
+                        'Content-Type': 'application/json',
+                        'Access-Control-Allow-Origin': '*',
+                        'Access-Control-Allow-Headers': 'Content-Type,X-Amz-Date,Authorization,X-Api-Key,X-Amz-Security-Token,X-Requested-With',
+                        'Access-Control-Allow-Methods': 'GET,POST,OPTIONS,PUT,DELETE'
+                    },
+                    'body': body
+                }
             else:
                 # If execution failed, return error
                 error_detail = "Unknown error"
@@ -186,6 +362,24 @@ def lambda_handler(event, context):
                 elif 'cause' in response:
                     error_detail = response['cause']
 
+                # Validation rejections are the client's fault, not a server error
+                if response.get('error') == 'ImageValidationError':
+                    # Lambda errors arrive as a JSON cause with errorMessage/errorType
+                    try:
+                        validation_message = json.loads(response.get('cause', '{}')).get('errorMessage', 'Invalid image')
+                    except (ValueError, AttributeError):
+                        validation_message = response.get('cause', 'Invalid image')
+                    return {
+                        'statusCode': 400,
+                        'headers': {
+                            'Content-Type': 'application/json',
+                            'Access-Control-Allow-Origin': '*'
+                        },
+                        'body': json.dumps({
+                            'error': validation_message
+                        })
+                    }
+
                 return {
                     'statusCode': 500,
                     'headers': {
@@ -202,6 +396,10 @@ def lambda_handler(event, context):
         except Exception as img_err:
             print(f"Error processing image: {img_err}")
             print(traceback.format_exc())
+
+            # Release the key so a retry can run the pipeline again
+            if idempotency_key and 'claim' in locals() and claim['owner']:
+                idempotency.fail(table, idempotency_key)
             return {
                 'statusCode': 500,
                 'headers': {
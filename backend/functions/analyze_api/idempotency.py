@@ -0,0 +1,211 @@
+import hashlib
+import os
+import time
+import uuid
+
+from botocore.exceptions import ClientError
+
+from utils import payload
+
+# Namespace used to derive a deterministic imageId from a client idempotency key
+IDEMPOTENCY_NAMESPACE = uuid.UUID('5b0f6a43-2c1e-4f7d-9a55-6d1b8f3c2e90')
+
+# How long a key stays bound to its execution. Expired lock items are reclaimable
+# immediately and are removed by the table's TTL on the expiresAt attribute.
+IDEMPOTENCY_TTL_SECONDS = int(os.environ.get('IDEMPOTENCY_TTL_SECONDS', '86400'))
+
+# How long a retry waits for an in-flight execution before asking the client to retry
+IDEMPOTENCY_WAIT_SECONDS = float(os.environ.get('IDEMPOTENCY_WAIT_SECONDS', '20'))
+
+# The workflow's TimeoutSeconds; 300 is the most StartSyncExecution waits for an Express workflow
+WORKFLOW_TIMEOUT_SECONDS = int(os.environ.get('WORKFLOW_TIMEOUT_SECONDS', '300'))
+
+# An IN_PROGRESS lock older than this belongs to a crashed invocation. Its execution has
+# timed out by then, so a takeover never runs a second execution of the same imageId
+# alongside the first; a shorter IDEMPOTENCY_STALE_SECONDS is raised to that.
+STALE_MARGIN_SECONDS = 30
+IDEMPOTENCY_STALE_SECONDS = max(int(os.environ.get('IDEMPOTENCY_STALE_SECONDS') or 0),
+                                WORKFLOW_TIMEOUT_SECONDS + STALE_MARGIN_SECONDS)
+
+MAX_KEY_LENGTH = 255
+
+LOCK_IN_PROGRESS = 'IN_PROGRESS'
+LOCK_COMPLETED = 'COMPLETED'
+LOCK_FAILED = 'FAILED'
+
+
+def get_idempotency_key(event, body):
+    """
+    Extract the client-supplied idempotency key from the Idempotency-Key header
+    or the clientRequestId body field. Returns None when the client sent neither.
+    """
+    key = None
+    headers = event.get('headers') or {}
+    for name, value in headers.items():
+        if name.lower() == 'idempotency-key':
+            key = value
+            break
+
+    if not key and isinstance(body, dict):
+        key = body.get('clientRequestId')
+
+    if not key:
+        return None
+
+    key = str(key).strip()
+    if not key or len(key) > MAX_KEY_LENGTH or not key.isprintable():
+        raise ValueError(f"Invalid idempotency key: must be 1-{MAX_KEY_LENGTH} printable characters")
+    return key
+
+
+def derive_image_id(key):
+    """Deterministic imageId for an idempotency key"""
+    return str(uuid.uuid5(IDEMPOTENCY_NAMESPACE, key))
+
+
+def execution_name_for(image_id, attempt):
+    """Deterministic Step Functions execution name for an imageId and attempt number"""
+    return f"soundscape-{image_id}-{attempt}"
+
+
+def request_digest(image_data):
+    """Digest of the image a key was first used with; a replay must send the same image"""
+    return hashlib.sha256(image_data).hexdigest()
+
+
+def _lock_id(key):
+    return f"idempotency#{hashlib.sha256(key.encode('utf-8')).hexdigest()}"
+
+
+def _is_conditional_failure(err):
+    return isinstance(err, ClientError) and err.response.get('Error', {}).get('Code') == 'ConditionalCheckFailedException'
+
+
+def claim(table, key, digest=None):
+    """
+    Try to take ownership of an idempotency key for the request with the
+    given request_digest().
+
+    Returns a dict with 'imageId', 'attempt' and 'owner'. When 'owner' is True the
+    caller must run the pipeline and then call complete() or fail(). When False,
+    another request owns the key and 'lock' holds the current lock item;
+    'mismatch' is True when that request sent a different image.
+    """
+    now = int(time.time())
+    lock_id = _lock_id(key)
+    image_id = derive_image_id(key)
+
+    item = {
+        'imageId': lock_id,
+        'targetImageId': image_id,
+        'lockState': LOCK_IN_PROGRESS,
+        'attempt': 1,
+        'createdAt': now,
+        'updatedAt': now,
+        'expiresAt': now + IDEMPOTENCY_TTL_SECONDS
+    }
+    if digest:
+        item['requestDigest'] = digest
+    try:
+        table.put_item(
+            Item=item,
+            ConditionExpression="attribute_not_exists(imageId) OR expiresAt < :now",
+            ExpressionAttributeValues={':now': now}
+        )
+        print(f"Claimed idempotency key for image ID: {image_id}")
+        return {'imageId': image_id, 'attempt': 1, 'owner': True}
+    except ClientError as err:
+        if not _is_conditional_failure(err):
+            raise
+
+    lock = table.get_item(Key={'imageId': lock_id}, ConsistentRead=True).get('Item')
+    if not lock:
+        # Expired and removed between our put and get; let the client retry cleanly
+        return {'imageId': image_id, 'attempt': 0, 'owner': False, 'lock': {'lockState': LOCK_IN_PROGRESS}}
+
+    # Reusing a key for another image is a client error, whatever state its execution is in
+    if digest and lock.get('requestDigest') and lock['requestDigest'] != digest:
+        print(f"Idempotency key reused with a different image for image ID: {image_id}")
+        return {'imageId': image_id, 'attempt': int(lock.get('attempt', 1)), 'owner': False, 'lock': lock,
+                'mismatch': True}
+
+    # A failed or abandoned attempt can be taken over by exactly one retry
+    attempt = int(lock.get('attempt', 1))
+    stale = int(lock.get('updatedAt', 0)) < now - IDEMPOTENCY_STALE_SECONDS
+    if lock.get('lockState') == LOCK_FAILED or (lock.get('lockState') == LOCK_IN_PROGRESS and stale):
+        try:
+            table.update_item(
+                Key={'imageId': lock_id},
+                UpdateExpression="set lockState=:p, attempt=:next, updatedAt=:now",
+                ConditionExpression="attempt = :seen AND (lockState = :f OR updatedAt < :stale)",
+                ExpressionAttributeValues={
+                    ':p': LOCK_IN_PROGRESS,
+                    ':f': LOCK_FAILED,
+                    ':next': attempt + 1,
+                    ':seen': attempt,
+                    ':now': now,
+                    ':stale': now - IDEMPOTENCY_STALE_SECONDS
+                }
+            )
+            print(f"Took over idempotency key for image ID: {image_id}, attempt {attempt + 1}")
+            return {'imageId': image_id, 'attempt': attempt + 1, 'owner': True}
+        except ClientError as err:
+            if not _is_conditional_failure(err):
+                raise
+            lock = table.get_item(Key={'imageId': lock_id}, ConsistentRead=True).get('Item') or lock
+
+    return {'imageId': image_id, 'attempt': attempt, 'owner': False, 'lock': lock}
+
+
+def _set_state(table, key, state):
+    try:
+        table.update_item(
+            Key={'imageId': _lock_id(key)},
+            UpdateExpression="set lockState=:s, updatedAt=:now",
+            ExpressionAttributeValues={':s': state, ':now': int(time.time())}
+        )
+    except Exception as err:
+        # The lock expires on its own; a missed update only delays retries
+        print(f"Failed to mark idempotency lock {state}: {err}")
+
+
+def complete(table, key):
+    """Mark the key's execution as completed so retries reuse its result"""
+    _set_state(table, key, LOCK_COMPLETED)
+
+
+def fail(table, key):
+    """Mark the key's execution as failed so the next retry may run it again"""
+    _set_state(table, key, LOCK_FAILED)
+
+
+def wait_for_result(table, key, image_id, wait_seconds=IDEMPOTENCY_WAIT_SECONDS):
+    """
+    Wait for an execution owned by another request to finish.
+
+    Returns the completed soundscape item, or None if the execution is still
+    running, has failed, or did not finish within wait_seconds.
+    """
+    lock_id = _lock_id(key)
+    deadline = time.time() + wait_seconds
+    delay = 0.25
+
+    while True:
+        lock = table.get_item(Key={'imageId': lock_id}, ConsistentRead=True).get('Item')
+        state = lock.get('lockState') if lock else None
+
+        if state == LOCK_COMPLETED:
+            item = table.get_item(Key={'imageId': image_id}, ConsistentRead=True).get('Item')
+            if item and item.get('status') == 'COMPLETED':
+                return item
+            return None
+        if state != LOCK_IN_PROGRESS or time.time() + delay > deadline:
+            return None
+
+        time.sleep(delay)
+        delay = min(delay * 2, 2.0)
+
+
+def result_body(item):
+    """Build the API response body for a completed soundscape item"""
+    return payload.response_body(item)
@@ -22,7 +22,7 @@ def lambda_handler(event, context):
         'headers': {
             'Content-Type': 'application/json',
             'Access-Control-Allow-Origin': '*',
-            'Access-Control-Allow-Headers': 'Content-Type,X-Amz-Date,Authorization,X-Api-Key,X-Amz-Security-Token,X-Requested-With',
+            'Access-Control-Allow-Headers': 'Content-Type,X-Amz-Date,Authorization,X-Api-Key,X-Amz-Security-Token,X-Requested-With,Idempotency-Key,X-Priority,X-Profile',
             'Access-Control-Allow-Methods': 'GET,POST,OPTIONS,PUT,DELETE',
             'Access-Control-Max-Age': '3600'
         },
@@ -0,0 +1,156 @@
+import base64
+import binascii
+import json
+import boto3
+import os
+import threading
+import time
+import traceback
+
+from utils import deadline, payload, profiling
+
+# Recent soundscapes come from a GSI keyed on status (partition) and createdAt
+# (sort), so a page costs the same however large the table grows. Lock, breaker
+# and audio job items carry no status and stay out of the index.
+INDEX_NAME = os.environ.get('GALLERY_INDEX_NAME', 'status-createdAt-index')
+DEFAULT_PAGE_SIZE = int(os.environ.get('GALLERY_PAGE_SIZE', '20'))
+MAX_PAGE_SIZE = int(os.environ.get('GALLERY_MAX_PAGE_SIZE', '50'))
+# The first page of each status is reused for this long per container; 0 disables it
+CACHE_TTL_SECONDS = float(os.environ.get('GALLERY_CACHE_TTL_SECONDS', '5'))
+LISTED_STATUSES = ('COMPLETED', 'ERROR', 'PROCESSING', 'ANALYZED')
+
+# Only what a gallery card shows; the index projects the same attributes
+PROJECTED_FIELDS = ('imageId', 'createdAt', 'status', 'scene', 'description', 'audioUrl', 'derivatives', 'degraded')
+
+try:
+    table_name = os.environ.get('TABLE_NAME')
+    table = boto3.resource('dynamodb').Table(table_name) if table_name else None
+except Exception as e:
+    print(f"Error initializing DynamoDB: {e}")
+    print(traceback.format_exc())
+
+_cache = {}
+_cache_lock = threading.Lock()
+
+
+class InvalidRequest(Exception):
+    pass
+
+
+def encode_cursor(last_evaluated_key):
+    """Opaque cursor for the next page: the query's LastEvaluatedKey, base64url JSON"""
+    raw = payload.dumps(payload.plain(last_evaluated_key)).encode('utf-8')
+    return base64.urlsafe_b64encode(raw).rstrip(b'=').decode('ascii')
+
+
+def decode_cursor(cursor, status):
+    try:
+        raw = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4))
+        key = json.loads(raw)
+    except (binascii.Error, ValueError):
+        raise InvalidRequest("Invalid cursor")
+    if (not isinstance(key, dict) or set(key) != {'imageId', 'status', 'createdAt'}
+            or key['status'] != status or not isinstance(key['createdAt'], int)):
+        raise InvalidRequest("Invalid cursor")
+    return key
+
+
+def parse_request(event):
+    params = (event or {}).get('queryStringParameters') or {}
+    status = (params.get('status') or 'COMPLETED').upper()
+    if status not in LISTED_STATUSES:
+        raise InvalidRequest(f"status must be one of: {', '.join(LISTED_STATUSES)}")
+    try:
+        limit = int(params.get('limit') or DEFAULT_PAGE_SIZE)
+    except ValueError:
+        raise InvalidRequest("limit must be an integer")
+    if not 1 <= limit <= MAX_PAGE_SIZE:
+        raise InvalidRequest(f"limit must be between 1 and {MAX_PAGE_SIZE}")
+    cursor = params.get('cursor') or None
+    return status, limit, cursor
+
+
+def query_page(db_table, status, limit, cursor=None):
+    """One page of items with the given status, newest first"""
+    names = {f"#f{index}": field for index, field in enumerate(PROJECTED_FIELDS)}
+    request = {
+        'IndexName': INDEX_NAME,
+        'KeyConditionExpression': '#s = :status',
+        'ExpressionAttributeNames': dict(names, **{'#s': 'status'}),
+        'ExpressionAttributeValues': {':status': status},
+        'ProjectionExpression': ', '.join(names),
+        'ScanIndexForward': False,
+        'Limit': limit
+    }
+    if cursor:
+        request['ExclusiveStartKey'] = decode_cursor(cursor, status)
+    response = db_table.query(**request)
+    last_key = response.get('LastEvaluatedKey')
+    return {
+        'items': [payload.plain(item) for item in response.get('Items', [])],
+        'nextCursor': encode_cursor(last_key) if last_key else None
+    }
+
+
+def first_page(db_table, status, limit):
+    """The newest page, cached for CACHE_TTL_SECONDS"""
+    key = (status, limit)
+    now = time.time()
+    with _cache_lock:
+        cached = _cache.get(key)
+        if cached and now < cached['expires']:
+            return cached['page'], True
+    page = query_page(db_table, status, limit)
+    if CACHE_TTL_SECONDS > 0:
+        with _cache_lock:
+            _cache[key] = {'page': page, 'expires': now + CACHE_TTL_SECONDS}
+    return page, False
+
+
+def response(status_code, body, cache_seconds=0):
+    headers = {
+        'Content-Type': 'application/json',
+        'Access-Control-Allow-Origin': '*',
+        'Access-Control-Allow-Headers': 'Content-Type,X-Amz-Date,Authorization,X-Api-Key,X-Amz-Security-Token,X-Requested-With',
+        'Access-Control-Allow-Methods': 'GET,OPTIONS'
+    }
+    if cache_seconds:
+        headers['Cache-Control'] = f"public, max-age={int(cache_seconds)}"
+    return {'statusCode': status_code, 'headers': headers, 'body': payload.dumps(body)}
+
+
+@profiling.profiled('gallery')
+def lambda_handler(event, context):
+    """
+    GET /gallery: recent soundscapes, newest first.
+
+    Query parameters: status (default COMPLETED), limit (default
+    GALLERY_PAGE_SIZE, at most GALLERY_MAX_PAGE_SIZE) and cursor (the
+    nextCursor of the previous page).
+    """
+    print(f"gallery lambda_handler invoked with parameters: {(event or {}).get('queryStringParameters')}")
+
+    if table is None:
+        return response(500, {'error': 'System configuration error: Missing table name'})
+
+    try:
+        status, limit, cursor = parse_request(event)
+    except InvalidRequest as err:
+        return response(400, {'error': str(err)})
+
+    try:
+        db_table = deadline.client(table, deadline.start(context))
+        if cursor:
+            page, cached = query_page(db_table, status, limit, cursor), False
+        else:
+            page, cached = first_page(db_table, status, limit)
+    except InvalidRequest as err:
+        return response(400, {'error': str(err)})
+    except Exception as e:
+        print(f"Error listing gallery: {e}")
+        print(traceback.format_exc())
+        return response(500, {'error': f'Error listing soundscapes: {str(e)}'})
+
+    print(f"Returning {len(page['items'])} {status} items, cached: {cached}, more: {bool(page['nextCursor'])}")
+    # Pages change as requests complete, so browsers and CDNs keep them no longer than we do
+    return response(200, dict(page, count=len(page['items']), cached=cached), cache_seconds=CACHE_TTL_SECONDS)
@@ -4,6 +4,14 @@ import requests
 import os
 import traceback
 import sys
+import math
+import time
+from decimal import Decimal
+
+import looping
+import renditions
+import waveform
+from utils import audio_queue, capture, deadline, metering, payload, profiling, resilience, scheduler, similarity, speculation
 
 # Add direct console logging for debugging
 print("generate_audio module loading...")
@@ -56,6 +64,8 @@ try:
         table = dynamodb.Table(table_name)
     audio_bucket = os.environ.get('AUDIO_BUCKET')
     param_name = os.environ.get('ELEVEN_LABS_PARAM')
+    # Only used when generation goes through the audio queue
+    sqs = boto3.client('sqs') if audio_queue.enabled() else None
     print(f"AWS services initialized. Table: {table_name}, Bucket: {audio_bucket}, Param: {param_name}")
 except Exception as e:
     print(f"Error initializing AWS services: {e}")
@@ -64,6 +74,26 @@ except Exception as e:
 # ElevenLabs API constants
 ELEVEN_LABS_API_URL = "https://api.elevenlabs.io/v1/sound-generation"
 
+# Request deadline budget (utils.deadline). ElevenLabs is only called with at
+# least ELEVENLABS_MIN_SECONDS to spare after POSTPROCESS_RESERVE_SECONDS, the
+# time kept back to store the clip; the ffmpeg renditions and the extended
+# loop are skipped when less than their minimum is left.
+ELEVENLABS_TIMEOUT_SECONDS = 30
+ELEVENLABS_MIN_SECONDS = float(os.environ.get('DEADLINE_ELEVENLABS_MIN_SECONDS', '4'))
+POSTPROCESS_RESERVE_SECONDS = float(os.environ.get('DEADLINE_POSTPROCESS_RESERVE_SECONDS', '1.5'))
+RENDER_MIN_SECONDS = float(os.environ.get('DEADLINE_RENDER_MIN_SECONDS', '2'))
+EXTENDED_MIN_SECONDS = float(os.environ.get('DEADLINE_EXTENDED_MIN_SECONDS', '4'))
+
+def to_dynamodb(value):
+    """Convert floats (which boto3 rejects) to Decimal, recursively"""
+    if isinstance(value, float):
+        return Decimal(str(value)) if math.isfinite(value) else None
+    if isinstance(value, dict):
+        return {k: to_dynamodb(v) for k, v in value.items()}
+    if isinstance(value, list):
+        return [to_dynamodb(v) for v in value]
+    return value
+
 def update_db_error(image_id, error_message):
     """Update DynamoDB with error information"""
     try:
@@ -83,6 +113,221 @@ def update_db_error(image_id, error_message):
         print(f"Failed to update DynamoDB with error status for {image_id}: {db_err}")
         print(traceback.format_exc())
 
+def audio_fallback(event, request_deadline, reason):
+    """
+    Complete the request without audio: the result carries no audioUrl or
+    renditions, 'elevenlabs' is added to degraded so the client shows the
+    soundscape without a player, and the item records why audio is missing.
+    """
+    image_id = event['imageId']
+    result = payload.compact(
+        dict(event, audioUrl=None),
+        fallback=True,
+        degraded=list(event.get('degraded') or []) + ['elevenlabs']
+    )
+
+    # Update DynamoDB without audio
+    try:
+        deadline.client(table, request_deadline).update_item(
+            Key={'imageId': image_id},
+            UpdateExpression="set #s=:s, audioError=:e, degraded=:g",
+            ExpressionAttributeNames={
+                '#s': 'status'
+            },
+            ExpressionAttributeValues={
+                ':s': 'COMPLETED',
+                ':e': reason,
+                ':g': result['degraded']
+            }
+        )
+        print("Updated DynamoDB with fallback status")
+    except Exception as db_err:
+        print(f"Failed to update DynamoDB with fallback status: {db_err}")
+
+    return result
+
+class AudioGenerationError(Exception):
+    """An ElevenLabs failure; retryable ones (429, 5xx, network) are worth another delivery"""
+
+    def __init__(self, message, retryable=False):
+        super().__init__(message)
+        self.retryable = retryable
+
+def get_api_key():
+    """ElevenLabs API key from the environment (testing/backup) or Parameter Store"""
+    print("Getting ElevenLabs API key")
+    elevenlabs_api_key_env = os.environ.get('ELEVENLABS_API_KEY')
+    if elevenlabs_api_key_env:
+        print("Using ElevenLabs API key from environment variable")
+        return elevenlabs_api_key_env
+
+    print(f"Retrieving API key from SSM Parameter Store: {param_name}")
+    ssm_response = ssm.get_parameter(
+        Name=param_name,
+        WithDecryption=True
+    )
+    print("Successfully retrieved API key from Parameter Store")
+    return ssm_response['Parameter']['Value']
+
+def sound_generation_request(sound_prompt):
+    """The ElevenLabs request body; identical bodies share one queued job"""
+    # Optimize sound prompt to conserve tokens; the body is the one speculative jobs send
+    return speculation.generation(optimize_sound_prompt(sound_prompt))
+
+def generate_clip(generation, eleven_labs_api_key, degradation, timeout=ELEVENLABS_TIMEOUT_SECONDS):
+    """Call the ElevenLabs Sound Generation API and return the MP3 bytes"""
+    print("Calling ElevenLabs Sound Generation API")
+    headers = {
+        "xi-api-key": eleven_labs_api_key,
+        "Content-Type": "application/json"
+    }
+
+    try:
+        # Log api request with masked API key
+        masked_headers = headers.copy()
+        masked_headers["xi-api-key"] = "****" + headers["xi-api-key"][-4:] if headers["xi-api-key"] else "****"
+        print(f"Sending request to ElevenLabs: {ELEVEN_LABS_API_URL}")
+        print(f"Headers (masked): {masked_headers}")
+        print(f"Payload size: {len(json.dumps(generation))} bytes")
+
+        # Errors, non-200s and slow responses all feed the ElevenLabs breaker
+        with degradation.breaker('elevenlabs').track():
+            with capture.call('elevenlabs', 'sound_generation') as call:
+                response = requests.post(
+                    ELEVEN_LABS_API_URL,
+                    headers=headers,
+                    json=generation,
+                    timeout=(deadline.CONNECT_TIMEOUT_SECONDS, timeout)
+                )
+                call.response = {
+                    'status': response.status_code,
+                    'bytes': len(response.content or b''),
+                    'duration': generation['duration_seconds'],
+                    'chars': len(generation['text'])
+                }
+
+            # Check response status
+            if response.status_code != 200:
+                print(f"ElevenLabs API returned non-200 status code: {response.status_code}")
+                print(f"Response text: {response.text[:200]}...")
+                raise AudioGenerationError(
+                    f"ElevenLabs API error ({response.status_code}): {response.text[:100]}...",
+                    retryable=response.status_code == 429 or response.status_code >= 500
+                )
+
+        print(f"Successfully received audio from ElevenLabs. Content-Type: {response.headers.get('Content-Type')}, Length: {response.headers.get('Content-Length')}")
+
+        # Get audio data
+        audio_data = response.content
+        if not audio_data or len(audio_data) < 100:  # Basic validation check
+            raise AudioGenerationError("Received empty or too small audio data from ElevenLabs")
+        metering.add(elevenlabsSeconds=generation['duration_seconds'], elevenlabsCharacters=len(generation['text']))
+        return audio_data
+    except requests.RequestException as req_err:
+        print(f"Network error when calling ElevenLabs API: {req_err}")
+        print(traceback.format_exc())
+        raise AudioGenerationError(f"ElevenLabs API request failed: {str(req_err)}", retryable=True)
+    except Exception as api_err:
+        print(f"Error in ElevenLabs API call: {api_err}")
+        print(traceback.format_exc())
+        raise
+
+def queued_clip(event, generation, request_deadline, job=None):
+    """
+    Generate through the audio queue: submit the request (or attach to an
+    identical queued one) and wait for a worker. Returns (clip bytes, None),
+    or (None, reason) when the job failed or did not finish in time. With
+    job, the speculative job image_to_text kept (utils/speculation.py), that
+    job is waited for instead.
+    """
+    speculative = job is not None
+    created = False
+    if not speculative:
+        job, created = audio_queue.submit(table, sqs, generation, event['imageId'],
+                                          deadline_ms=request_deadline.epoch_ms)
+    timeout = min(audio_queue.JOB_WAIT_SECONDS, request_deadline.remaining() - POSTPROCESS_RESERVE_SECONDS)
+
+    waited = time.perf_counter()
+    with capture.call('audio_queue', 'wait') as call:
+        job_item = audio_queue.wait(table, job, timeout)
+        call.response = {'job': job, 'created': created, 'state': job_item and job_item.get('jobState'),
+                         'speculative': speculative}
+    if job_item is None:
+        print(f"Audio job {job} still pending after {timeout:.1f} s")
+        return None, f"Audio generation queued for longer than {timeout:.0f} s"
+    if job_item['jobState'] != audio_queue.JOB_COMPLETED:
+        return None, f"Queued audio generation failed: {job_item.get('jobError', 'unknown error')}"
+
+    print(f"Audio job {job} completed (waited {job_item.get('waitMs')} ms, generated in {job_item.get('serviceMs')} ms)")
+    if speculative:
+        saved_ms = speculation.latency_saved(job_item, (time.perf_counter() - waited) * 1000)
+        print(f"Speculative clip saved about {saved_ms} ms")
+    with capture.call('s3', 'get_object') as call:
+        storage = deadline.client(s3, request_deadline)
+        audio_data = storage.get_object(Bucket=audio_bucket, Key=job_item['audioKey'])['Body'].read()
+        call.response = {'bytes': len(audio_data)}
+    return audio_data, None
+
+def run_job(message, context=None):
+    """Generate one queued clip and store it for every waiter"""
+    job = message['jobId']
+    job_item = audio_queue.start(table, job)
+    if job_item is None:
+        print(f"Audio job {job} is already finished, skipping delivery")
+        return
+
+    # Every waiter has given up: don't pay for a clip nobody will receive
+    job_deadline = deadline.from_event(job_item, context)
+    if not job_deadline.allows(ELEVENLABS_MIN_SECONDS):
+        raise AudioGenerationError("Every waiting request's deadline passed before a worker was free")
+
+    degradation = resilience.controller(table)
+    if not degradation.allow('elevenlabs'):
+        raise AudioGenerationError("ElevenLabs circuit breaker is open", retryable=True)
+
+    # Charged to the request that created the job; requests attached to it share the clip for free
+    with metering.meter(job_item.get('meterStage') or 'audio_worker', job_item.get('firstImageId'), table,
+                        job_deadline):
+        audio_data = generate_clip(message['generation'], get_api_key(), degradation,
+                                   timeout=job_deadline.timeout(ELEVENLABS_TIMEOUT_SECONDS))
+        key = audio_queue.audio_key(job)
+        deadline.client(s3, job_deadline).put_object(Bucket=audio_bucket, Key=key, Body=audio_data,
+                                                     ContentType='audio/mpeg')
+        metering.count('s3', 'put_object')
+        metering.add(s3BytesStored=len(audio_data))
+    timing = audio_queue.complete(table, job, key, int(job_item['startedAtMs']), int(job_item['enqueuedAtMs']))
+    print(f"Audio job {job} completed: waited {timing['waitMs']} ms, generated in {timing['serviceMs']} ms")
+
+@profiling.profiled('audio_worker')
+def worker_handler(event, context):
+    """
+    SQS handler for queued generations (see utils.audio_queue). Deployed as a
+    second function on this code with an SQS event source mapping: batch size
+    1, MaximumConcurrency = AUDIO_MAX_CONCURRENCY, ReportBatchItemFailures.
+    Retryable ElevenLabs errors are reported as item failures so SQS
+    redelivers after the visibility timeout, up to AUDIO_JOB_MAX_ATTEMPTS.
+    """
+    failures = []
+    for record in event.get('Records', []):
+        message = json.loads(record['body'])
+        try:
+            run_job(message, context)
+        except AudioGenerationError as err:
+            receive_count = int(record.get('attributes', {}).get('ApproximateReceiveCount', 1))
+            if err.retryable and receive_count < audio_queue.MAX_ATTEMPTS:
+                print(f"Audio job {message['jobId']} will be retried (attempt {receive_count}): {err}")
+                failures.append({'itemIdentifier': record['messageId']})
+            else:
+                audio_queue.fail(table, message['jobId'], str(err))
+        except Exception as err:
+            print(f"Audio job {message.get('jobId')} failed: {err}")
+            print(traceback.format_exc())
+            audio_queue.fail(table, message['jobId'], str(err))
+    return {'batchItemFailures': failures}
+
+@profiling.profiled('generate_audio')
+@capture.captured('generate_audio')
+@metering.metered('generate_audio')
 def lambda_handler(event, context):
     """
     Generates audio using ElevenLabs Sound Generation API based on
@@ -92,16 +337,33 @@ def lambda_handler(event, context):
 
     try:
         # Validate input
-        if not isinstance(event, dict) or 'imageId' not in event or 'soundPrompt' not in event:
+        if not isinstance(event, dict) or 'imageId' not in event:
             print(f"Invalid event structure: {type(event)}")
             raise Exception("Invalid input: Missing required fields")
 
-        # Get image analysis from previous step
+        # The analysis is on the item; only the prompt is needed here
         image_id = event['imageId']
-        description = event.get('description', '')
         scene = event.get('scene', 'unknown')
-        detected_elements = event.get('detectedElements', [])
-        sound_prompt = event['soundPrompt']
+        request_deadline = deadline.from_event(event, context)
+        storage = deadline.client(s3, request_deadline)
+
+        # image_to_text found a finished soundscape for a near-identical image (utils/similarity.py)
+        if event.get('reusedFrom') and event.get('audioUrl'):
+            deadline.client(table, request_deadline).update_item(
+                Key={'imageId': image_id},
+                UpdateExpression="set #s=:s",
+                ExpressionAttributeNames={'#s': 'status'},
+                ExpressionAttributeValues={':s': 'COMPLETED'}
+            )
+            print(f"Reusing audio of {event['reusedFrom']}: {event['audioUrl']}")
+            return payload.compact(event)
+
+        # The label vector comes with the prompt so the finished soundscape can join its similarity buckets
+        with capture.call('dynamodb', 'get_item') as call:
+            resolved = payload.resolve(deadline.client(table, request_deadline), event,
+                                       ['soundPrompt'] + (['labelVector'] if similarity.indexing() else []))
+            sound_prompt = resolved.get('soundPrompt', '')
+            call.response = {'chars': len(sound_prompt)}
 
         print(f"Processing image ID: {image_id}, Scene: {scene}")
         print(f"Sound prompt ({len(sound_prompt)} chars): {sound_prompt[:100]}...")
@@ -111,150 +373,192 @@ def lambda_handler(event, context):
             print(f"Invalid sound prompt: {sound_prompt}")
             raise Exception("Sound prompt is too short or empty")
 
-        # Get ElevenLabs API key from Parameter Store or environment variable
-        print("Getting ElevenLabs API key")
-        eleven_labs_api_key = None
-
-        # First try to get from environment variable if available (for testing/backup)
-        elevenlabs_api_key_env = os.environ.get('ELEVENLABS_API_KEY')
-        if elevenlabs_api_key_env:
-            print("Using ElevenLabs API key from environment variable")
-            eleven_labs_api_key = elevenlabs_api_key_env
-
-        # Otherwise try to get from Parameter Store
-        if not eleven_labs_api_key:
+        # While ElevenLabs is failing or too slow, return without audio instead of
+        # waiting out the request timeout. A queued clip is made by a worker, which
+        # claims the half-open probe itself: claiming it here would refuse the worker
+        degradation = resilience.controller(globals().get('table'))
+        if not degradation.allow('elevenlabs', claim=not audio_queue.enabled()):
+            print("ElevenLabs circuit breaker is open, completing without audio")
+            return audio_fallback(event, request_deadline, "Audio generation skipped: ElevenLabs circuit breaker is open")
+        # Likewise when the caller will have given up before a clip could be made
+        if not request_deadline.allows(ELEVENLABS_MIN_SECONDS + POSTPROCESS_RESERVE_SECONDS):
+            print(f"Only {request_deadline.remaining():.1f} s left of the request budget, completing without audio")
+            return audio_fallback(event, request_deadline, "Audio generation skipped: request deadline reached")
+
+        generation = sound_generation_request(sound_prompt)
+        if audio_queue.enabled():
+            audio_data = None
+            if event.get('speculativeJob'):
+                # image_to_text started this clip from the labels and kept it
+                audio_data, queue_error = queued_clip(event, generation, request_deadline, job=event['speculativeJob'])
+                if audio_data is None:
+                    print(f"Speculative clip unavailable, generating from the sound prompt: {queue_error}")
+            # Workers bound ElevenLabs concurrency; identical prompts share one job
+            if audio_data is None and request_deadline.allows(ELEVENLABS_MIN_SECONDS + POSTPROCESS_RESERVE_SECONDS):
+                audio_data, queue_error = queued_clip(event, generation, request_deadline)
+            if audio_data is None:
+                return audio_fallback(event, request_deadline, queue_error)
+        else:
             try:
-                print(f"Retrieving API key from SSM Parameter Store: {param_name}")
-                ssm_response = ssm.get_parameter(
-                    Name=param_name,
-                    WithDecryption=True
-                )
-                eleven_labs_api_key = ssm_response['Parameter']['Value']
-                print("Successfully retrieved API key from Parameter Store")
+                eleven_labs_api_key = get_api_key()
             except Exception as ssm_err:
                 print(f"Error accessing SSM parameter: {ssm_err}")
                 print(traceback.format_exc())
                 print("Using fallback sound generation strategy due to SSM access error")
-
-                # Generate audio URL without calling API
-                audio_key = f'audio/{image_id}_fallback.mp3'
-                audio_url = f"https://{audio_bucket}.s3.amazonaws.com/{audio_key}"
-
-                # Return result without audio (will be updated later)
-                result = {
-                    'imageId': image_id,
-                    'description': description,
-                    'scene': scene,
-                    'audioUrl': audio_url,  # Fallback URL
-                    'detectedElements': detected_elements,
-                    'soundPrompt': sound_prompt,
-                    'fallback': True
-                }
-
-                # Update DynamoDB without audio
-                try:
-                    table.update_item(
-                        Key={'imageId': image_id},
-                        UpdateExpression="set #s=:s, audioError=:e",
-                        ExpressionAttributeNames={
-                            '#s': 'status'
-                        },
-                        ExpressionAttributeValues={
-                            ':s': 'COMPLETED',
-                            ':e': f"Could not access audio API key: {str(ssm_err)}"
-                        }
+                return audio_fallback(event, request_deadline, f"Could not access audio API key: {str(ssm_err)}")
+            try:
+                # A slot of the request's lane (utils/scheduler.py), leaving time for a clip
+                lane = scheduler.lane_of(event)
+                slot_timeout = request_deadline.remaining() - ELEVENLABS_MIN_SECONDS - POSTPROCESS_RESERVE_SECONDS
+                with scheduler.slot('elevenlabs', lane, slot_timeout, globals().get('table'), request_deadline.expires_at):
+                    audio_data = generate_clip(
+                        generation, eleven_labs_api_key, degradation,
+                        timeout=request_deadline.timeout(ELEVENLABS_TIMEOUT_SECONDS, reserve=POSTPROCESS_RESERVE_SECONDS)
                     )
-                    print("Updated DynamoDB with fallback status")
-                except Exception as db_err:
-                    print(f"Failed to update DynamoDB with fallback status: {db_err}")
-
-                return result
-
-        # Call ElevenLabs Sound Generation API
-        print("Calling ElevenLabs Sound Generation API")
-        headers = {
-            "xi-api-key": eleven_labs_api_key,
-            "Content-Type": "application/json"
-        }
-
-        # Optimize sound prompt to conserve tokens
-        optimized_prompt = optimize_sound_prompt(sound_prompt)
-
-        payload = {
-            "text": optimized_prompt,
-            "duration_seconds": 8.0,  # Reduced from 10 to 8 seconds to save tokens
-            "prompt_influence": 0.7    # Increased from 0.5 to better follow the prompt with fewer tokens
-        }
-
-        try:
-            # Log api request with masked API key
-            masked_headers = headers.copy()
-            masked_headers["xi-api-key"] = "****" + headers["xi-api-key"][-4:] if headers["xi-api-key"] else "****"
-            print(f"Sending request to ElevenLabs: {ELEVEN_LABS_API_URL}")
-            print(f"Headers (masked): {masked_headers}")
-            print(f"Payload size: {len(json.dumps(payload))} bytes")
-
-            response = requests.post(
-                ELEVEN_LABS_API_URL,
-                headers=headers,
-                json=payload,
-                timeout=30  # Add timeout for the request
-            )
-
-            # Check response status
-            if response.status_code != 200:
-                print(f"ElevenLabs API returned non-200 status code: {response.status_code}")
-                print(f"Response text: {response.text[:200]}...")
-                raise Exception(f"ElevenLabs API error ({response.status_code}): {response.text[:100]}...")
-
-            print(f"Successfully received audio from ElevenLabs. Content-Type: {response.headers.get('Content-Type')}, Length: {response.headers.get('Content-Length')}")
+            except scheduler.SlotUnavailable as slot_err:
+                return audio_fallback(event, request_deadline, f"Audio generation skipped: {slot_err}")
+            except AudioGenerationError as gen_err:
+                if request_deadline.allows(ELEVENLABS_MIN_SECONDS):
+                    raise
+                # The call used up the budget; answer without audio while the caller still waits
+                return audio_fallback(event, request_deadline, f"Audio generation ran out of time: {gen_err}")
+
+        # Normalize loudness and render the preview/standard renditions. Without
+        # ffmpeg (or if it fails) the original ElevenLabs MP3 is stored as-is.
+        # The same ffmpeg pass emits PCM for the visualizer's waveform peaks.
+        rendered = None
+        loudness = None
+        if not request_deadline.allows(RENDER_MIN_SECONDS + POSTPROCESS_RESERVE_SECONDS):
+            print(f"Only {request_deadline.remaining():.1f} s left, storing original audio only")
+        elif renditions.available():
+            try:
+                rendered, loudness = renditions.render(
+                    audio_data, pcm_sample_rate=waveform.ANALYSIS_SAMPLE_RATE,
+                    timeout=request_deadline.timeout(reserve=POSTPROCESS_RESERVE_SECONDS))
+                print(f"Rendered {len(rendered)} renditions in {loudness['processingMs']} ms. Input loudness: {loudness['inputLufs']} LUFS")
+            except Exception as render_err:
+                print(f"Failed to render audio renditions, storing original: {render_err}")
+                print(traceback.format_exc())
+        else:
+            print("ffmpeg not available, storing original audio only")
 
-            # Get audio data
-            audio_data = response.content
-            if not audio_data or len(audio_data) < 100:  # Basic validation check
-                raise Exception("Received empty or too small audio data from ElevenLabs")
+        if not rendered:
+            rendered = {'standard': dict(renditions.RENDITIONS['standard'], data=audio_data, bitrateKbps=None)}
 
-        except requests.RequestException as req_err:
-            print(f"Network error when calling ElevenLabs API: {req_err}")
-            print(traceback.format_exc())
-            raise Exception(f"ElevenLabs API request failed: {str(req_err)}")
-        except Exception as api_err:
-            print(f"Error in ElevenLabs API call: {api_err}")
-            print(traceback.format_exc())
-            raise
-
-        # Save audio file to S3
-        print("Saving audio file to S3")
-        audio_key = f'audio/{image_id}.mp3'
+        # Save audio files to S3
+        print("Saving audio files to S3")
+        audio_renditions = []
         try:
-            s3_response = s3.put_object(
-                Bucket=audio_bucket,
-                Key=audio_key,
-                Body=audio_data,
-                ContentType='audio/mpeg'
-            )
-            print(f"Successfully saved audio to S3. ETag: {s3_response.get('ETag')}, Key: {audio_key}")
+            for name, rendition in rendered.items():
+                rendition_key = f"audio/{image_id}{rendition['suffix']}"
+                with capture.call('s3', 'put_object') as call:
+                    s3_response = storage.put_object(
+                        Bucket=audio_bucket,
+                        Key=rendition_key,
+                        Body=rendition['data'],
+                        ContentType=rendition['contentType']
+                    )
+                    call.response = {'bytes': len(rendition['data'])}
+                metering.add(s3BytesStored=len(rendition['data']))
+                print(f"Successfully saved {name} audio to S3. ETag: {s3_response.get('ETag')}, Key: {rendition_key}")
+                audio_renditions.append({
+                    'name': name,
+                    'key': rendition_key,
+                    'url': f"https://{audio_bucket}.s3.amazonaws.com/{rendition_key}",
+                    'contentType': rendition['contentType'],
+                    'codec': rendition['codec'],
+                    'bitrateKbps': rendition['bitrateKbps'],
+                    'bytes': len(rendition['data'])
+                })
         except Exception as s3_err:
             print(f"Failed to save audio to S3: {s3_err}")
             print(traceback.format_exc())
             raise Exception(f"Could not save audio file: {str(s3_err)}")
 
-        # Generate public URL for the audio file
-        audio_url = f"https://{audio_bucket}.s3.amazonaws.com/{audio_key}"
+        # Precompute peaks so clients can draw the waveform without decoding the audio
+        audio_waveform = None
+        if loudness and loudness.get('pcm'):
+            try:
+                peaks = waveform.compute(loudness.pop('pcm'), waveform.ANALYSIS_SAMPLE_RATE, loudness.get('sampleRate'))
+                waveform_key = f"audio/{image_id}{waveform.SIDECAR_SUFFIX}"
+                waveform_body = waveform.encode(peaks)
+                with capture.call('s3', 'put_object') as call:
+                    storage.put_object(
+                        Bucket=audio_bucket,
+                        Key=waveform_key,
+                        Body=waveform_body,
+                        ContentType=waveform.SIDECAR_CONTENT_TYPE
+                    )
+                    call.response = {'bytes': len(waveform_body)}
+                metering.add(s3BytesStored=len(waveform_body))
+                audio_waveform = dict(peaks, key=waveform_key, url=f"https://{audio_bucket}.s3.amazonaws.com/{waveform_key}")
+                print(f"Saved waveform sidecar ({len(waveform_body)} bytes, {peaks['points']} points, {peaks['durationSeconds']} s) to {waveform_key}")
+            except Exception as waveform_err:
+                # The player still works without precomputed peaks
+                print(f"Failed to compute waveform peaks: {waveform_err}")
+                print(traceback.format_exc())
+
+        # Longer ambience is looped locally from the short clip instead of
+        # paying ElevenLabs for a longer generation
+        extended_seconds = looping.target_seconds(event.get('loopSeconds'))
+        # loudness is only set when ffmpeg rendered the normalized clip
+        if (loudness and extended_seconds > generation['duration_seconds']
+                and request_deadline.allows(EXTENDED_MIN_SECONDS + POSTPROCESS_RESERVE_SECONDS)):
+            try:
+                extended_data, extended_info = looping.extend(
+                    rendered['standard']['data'], extended_seconds,
+                    timeout=request_deadline.timeout(reserve=POSTPROCESS_RESERVE_SECONDS))
+                extended_key = f"audio/{image_id}{looping.EXTENDED['suffix']}"
+                with capture.call('s3', 'put_object') as call:
+                    storage.put_object(
+                        Bucket=audio_bucket,
+                        Key=extended_key,
+                        Body=extended_data,
+                        ContentType=looping.EXTENDED['contentType']
+                    )
+                    call.response = {'bytes': len(extended_data)}
+                metering.add(s3BytesStored=len(extended_data))
+                audio_renditions.append(dict(
+                    extended_info,
+                    name='extended',
+                    key=extended_key,
+                    url=f"https://{audio_bucket}.s3.amazonaws.com/{extended_key}",
+                    contentType=looping.EXTENDED['contentType'],
+                    codec=looping.EXTENDED['codec'],
+                    bitrateKbps=looping.EXTENDED['bitrateKbps'],
+                    bytes=len(extended_data)
+                ))
+                print(f"Saved {extended_info['durationSeconds']} s extended track to {extended_key}. Loop: {extended_info['loop']}")
+            except Exception as loop_err:
+                # The short clip is still usable on its own
+                print(f"Failed to render extended track: {loop_err}")
+                print(traceback.format_exc())
+
+        # Cheapest first so clients can take the first one they can play
+        audio_renditions.sort(key=lambda r: r['bytes'])
+
+        # The standard rendition keeps the audio/{id}.mp3 URL existing clients use
+        audio_url = next(r['url'] for r in audio_renditions if r['name'] == 'standard')
         print(f"Generated audio URL: {audio_url}")
 
         # Update DynamoDB with audio info
-        print("Updating DynamoDB with audio URL")
+        print("Updating DynamoDB with audio URL and renditions")
+        input_lufs = loudness['inputLufs'] if loudness and math.isfinite(loudness['inputLufs']) else None
+        # The item keeps the waveform downsampled for the API response; full peaks live in S3
+        waveform_item = to_dynamodb(waveform.downsample(audio_waveform)) if audio_waveform else None
         try:
-            table.update_item(
+            deadline.client(table, request_deadline).update_item(
                 Key={'imageId': image_id},
-                UpdateExpression="set audioUrl=:a, #s=:s",
+                UpdateExpression="set audioUrl=:a, #s=:s, renditions=:r, loudnessLufs=:l, waveform=:w",
                 ExpressionAttributeNames={
                     '#s': 'status'
                 },
                 ExpressionAttributeValues={
                     ':a': audio_url,
-                    ':s': 'COMPLETED'
+                    ':s': 'COMPLETED',
+                    ':r': to_dynamodb(audio_renditions),
+                    ':l': Decimal(str(round(input_lufs, 2))) if input_lufs is not None else None,
+                    ':w': waveform_item
                 }
             )
             print("Successfully updated DynamoDB with audio URL and COMPLETED status")
@@ -263,15 +567,20 @@ def lambda_handler(event, context):
             print(traceback.format_exc())
             raise Exception(f"Failed to update audio URL: {str(db_err)}")
 
-        # Return audio info for the next step
-        result = {
-            'imageId': image_id,
-            'description': description,
-            'scene': scene,
-            'audioUrl': audio_url,
-            'detectedElements': detected_elements,
-            'soundPrompt': sound_prompt
-        }
+        # Only soundscapes with their own audio join the similarity buckets: one that failed or
+        # completed without audio could never be reused, and would hold a bucket slot for good
+        label_vector = similarity.from_item(resolved.get('labelVector'))
+        if label_vector:
+            try:
+                lsh_buckets = similarity.buckets(similarity.signature(label_vector))
+                added = similarity.TableIndex(deadline.client(table, request_deadline), None).add(image_id, lsh_buckets)
+                print(f"Added to {added} of {len(lsh_buckets)} similarity buckets")
+            except Exception as lsh_err:
+                print(f"Failed to update the similarity index for {image_id}: {lsh_err}")
+                print(traceback.format_exc())
+
+        # Return audio info for the next step; renditions and the waveform are read from the item
+        result = payload.compact(event, audioUrl=audio_url)
 
         print("Audio generation complete")
         return result
@@ -0,0 +1,253 @@
+"""
+Seamless loops from a short generated clip.
+
+ElevenLabs is asked for a short clip; longer ambience is made locally. We
+look for a loop region [start, end) whose last crossfade window sounds like
+the window just before start: every candidate end is scored against all
+possible starts at once with an FFT cross-correlation on a block-averaged
+copy of the clip, candidates whose energy differs are penalized, and the
+winner is refined to the exact frame. The tail of the region is then crossfaded with
+equal-power curves into the audio preceding start, so the loop buffer tiles
+without a click or a level jump. Everything operates on (samples, channels)
+float32 arrays; nothing loops per sample in Python.
+"""
+import math
+import os
+import time
+from collections import namedtuple
+
+import numpy as np
+
+import renditions
+
+# Rendered length of the '-extended.mp3' rendition; 0 disables it
+LOOP_SECONDS = float(os.environ.get('AUDIO_LOOP_SECONDS', '0'))
+MAX_LOOP_SECONDS = float(os.environ.get('AUDIO_MAX_LOOP_SECONDS', '600'))
+
+CROSSFADE_SECONDS = float(os.environ.get('AUDIO_LOOP_CROSSFADE_SECONDS', '0.5'))
+# Shortest loop we accept, as a fraction of the clip; shorter loops sound repetitive
+MIN_LOOP_FRACTION = 0.5
+# ElevenLabs clips often fade out; keep loop ends out of the last stretch
+TAIL_GUARD_SECONDS = 0.25
+# Candidate loop ends evaluated (each one is a single FFT correlation)
+END_CANDIDATES = 24
+# Rate of the coarse correlation search
+ANALYSIS_RATE = 11025
+# How strongly a loudness mismatch (in dB) lowers the correlation score
+ENERGY_PENALTY_PER_DB = 0.05
+FADE_OUT_SECONDS = 2.0
+
+# Render at the standard rendition's rate; stereo keeps the ambience's width
+SAMPLE_RATE = 44100
+CHANNELS = 2
+
+EXTENDED = {
+    'suffix': '-extended.mp3',
+    'contentType': 'audio/mpeg',
+    'codec': 'mp3',
+    'bitrateKbps': 128
+}
+
+LoopPoints = namedtuple('LoopPoints', ['start', 'end', 'crossfade', 'score'])
+
+
+def _as_frames(samples):
+    samples = np.asarray(samples, dtype=np.float32)
+    return samples[:, None] if samples.ndim == 1 else samples
+
+
+def _next_pow2(n):
+    return 1 << max(0, int(n - 1).bit_length())
+
+
+def _window_energy(mono, width):
+    """Sum of squares of every length-width window: energy[i] covers mono[i:i + width]"""
+    cumulative = np.concatenate(([0.0], np.cumsum(mono.astype(np.float64) ** 2)))
+    return cumulative[width:] - cumulative[:-width]
+
+
+def _scores(correlation, window_energy, tail_energy):
+    ncc = correlation / (np.sqrt(window_energy * tail_energy) + 1e-12)
+    mismatch_db = np.abs(10 * np.log10((window_energy + 1e-12) / (tail_energy + 1e-12)))
+    return ncc - ENERGY_PENALTY_PER_DB * mismatch_db
+
+
+def find_loop_points(samples, sample_rate, crossfade_seconds=CROSSFADE_SECONDS, min_loop_fraction=MIN_LOOP_FRACTION):
+    """
+    Pick loop points for a clip of shape (frames,) or (frames, channels).
+
+    Returns LoopPoints with start/end/crossfade in frames and score, the
+    normalized correlation (minus the energy penalty) between the window
+    before start and the window before end; 1.0 is a perfect match.
+    """
+    frames = _as_frames(samples)
+    length = frames.shape[0]
+    mono = frames.mean(axis=1)
+    crossfade = max(1, int(crossfade_seconds * sample_rate))
+    min_loop = max(crossfade * 2, int(length * min_loop_fraction))
+    last_end = length - int(TAIL_GUARD_SECONDS * sample_rate)
+    if last_end - min_loop < crossfade:
+        raise ValueError(f"Clip of {length / sample_rate:.2f} s is too short to loop with a {crossfade_seconds} s crossfade")
+
+    # Coarse search on a block-averaged copy (~11 kHz), refined at full rate below
+    factor = max(1, sample_rate // ANALYSIS_RATE)
+    coarse = mono[:length // factor * factor].reshape(-1, factor).mean(axis=1)
+    coarse_crossfade = max(1, crossfade // factor)
+    coarse_energy = _window_energy(coarse, coarse_crossfade)
+    size = _next_pow2(coarse.shape[0] + coarse_crossfade)
+    spectrum = np.fft.rfft(coarse, size)
+
+    ends = np.unique(np.linspace(crossfade + min_loop, last_end, END_CANDIDATES).astype(int) // factor)
+    best = None
+    for end in ends:
+        tail = coarse[end - coarse_crossfade:end]
+        # correlation[i] = sum(coarse[i:i + crossfade] * tail): the window ending at start = i + crossfade
+        correlation = np.fft.irfft(spectrum * np.conj(np.fft.rfft(tail, size)), size)
+        windows = np.arange(0, end - (min_loop // factor) - coarse_crossfade + 1)
+        if windows.size == 0:
+            continue
+        scores = _scores(correlation[windows], coarse_energy[windows], coarse_energy[end - coarse_crossfade])
+        index = int(np.argmax(scores))
+        if best is None or scores[index] > best[2]:
+            best = ((windows[index] + coarse_crossfade) * factor, end * factor, float(scores[index]))
+    if best is None:
+        raise ValueError("No loop candidates in clip")
+
+    # Refine the start to the exact frame around the coarse match
+    coarse_start, end, _ = best
+    energy = _window_energy(mono, crossfade)
+    tail = mono[end - crossfade:end]
+    first = max(crossfade, coarse_start - factor)
+    starts = np.arange(first, max(first, min(end - min_loop, coarse_start + factor)) + 1)
+    windows = np.lib.stride_tricks.sliding_window_view(mono, crossfade)[starts - crossfade]
+    scores = _scores(windows @ tail, energy[starts - crossfade], energy[end - crossfade])
+    index = int(np.argmax(scores))
+    return LoopPoints(int(starts[index]), int(end), crossfade, float(scores[index]))
+
+
+def equal_power_curves(length):
+    """Fade-out and fade-in gains whose squares sum to 1"""
+    phase = (np.arange(length, dtype=np.float32) + 0.5) / length * (math.pi / 2)
+    return np.cos(phase)[:, None], np.sin(phase)[:, None]
+
+
+def make_loop(samples, points):
+    """
+    The loop buffer: samples[start:end] with its last crossfade frames blended
+    into the frames preceding start, so the buffer's end flows into its start.
+    """
+    frames = _as_frames(samples)
+    start, end, crossfade = points.start, points.end, points.crossfade
+    fade_out, fade_in = equal_power_curves(crossfade)
+    loop = frames[start:end].copy()
+    loop[-crossfade:] = frames[end - crossfade:end] * fade_out + frames[start - crossfade:start] * fade_in
+    return loop
+
+
+def render(samples, sample_rate, seconds, points=None, fade_out_seconds=FADE_OUT_SECONDS):
+    """
+    Render a track of the given length: the clip's intro up to the loop
+    start, then the loop buffer tiled as often as needed, with a final
+    fade-out. Returns a (frames, channels) float32 array.
+    """
+    frames = _as_frames(samples)
+    total = int(seconds * sample_rate)
+    if total <= frames.shape[0]:
+        track = frames[:total].copy()
+    else:
+        points = points or find_loop_points(frames, sample_rate)
+        loop = make_loop(frames, points)
+        repeats = -(-(total - points.start) // loop.shape[0])
+        track = np.concatenate([frames[:points.start], np.tile(loop, (repeats, 1))])[:total]
+
+    fade = min(track.shape[0], int(fade_out_seconds * sample_rate))
+    if fade:
+        track[-fade:] *= equal_power_curves(fade)[0]
+    return track
+
+
+def stream(samples, sample_rate, points=None, block_frames=4096):
+    """
+    Yield (block_frames, channels) blocks of an endless seamless track: the
+    intro, then the loop buffer forever. Each block is one wrapped gather.
+    """
+    frames = _as_frames(samples)
+    points = points or find_loop_points(frames, sample_rate)
+    loop = make_loop(frames, points)
+    source = np.concatenate([frames[:points.start], loop])
+    intro, period = points.start, loop.shape[0]
+
+    position = 0
+    offsets = np.arange(block_frames)
+    while True:
+        indices = position + offsets
+        wrapped = np.where(indices < intro, indices, intro + (indices - intro) % period)
+        yield source[wrapped]
+        position += block_frames
+
+
+def blocks(samples, sample_rate, seconds, points=None, fade_out_seconds=FADE_OUT_SECONDS, block_frames=65536):
+    """
+    render()'s track as (frames, channels) float32 blocks of at most
+    block_frames, fade-out included, so a long track never exists whole
+    """
+    frames = _as_frames(samples)
+    total = int(seconds * sample_rate)
+    if total <= frames.shape[0]:
+        source = (frames[offset:offset + block_frames] for offset in range(0, total, block_frames))
+    else:
+        source = stream(frames, sample_rate, points, block_frames)
+
+    fade = min(total, int(fade_out_seconds * sample_rate))
+    gains = equal_power_curves(fade)[0] if fade else None
+    fade_start = total - fade
+    position = 0
+    for block in source:
+        block = np.array(block[:total - position], dtype=np.float32)
+        end = position + block.shape[0]
+        if fade and end > fade_start:
+            first = max(position, fade_start)
+            block[first - position:] *= gains[first - fade_start:end - fade_start]
+        yield block
+        position = end
+        if position >= total:
+            return
+
+
+def extend(audio_data, seconds, timeout=None):
+    """
+    Render an encoded clip into a seamless track of the given length and
+    encode it like the standard rendition. Returns (mp3 bytes, metadata).
+    The track is streamed into the encoder block by block: a 600 s track
+    would be about 200 MB of float32 PCM. timeout bounds the decode and the
+    encode together.
+    """
+    started = time.perf_counter()
+    pcm = renditions.decode_pcm(audio_data, SAMPLE_RATE, CHANNELS, timeout)
+    frames = np.frombuffer(pcm, dtype='<f4').reshape(-1, CHANNELS)
+    points = find_loop_points(frames, SAMPLE_RATE)
+    # MP3 encoding runs at roughly 50-100x realtime; scale the timeout with length
+    encode_timeout = max(renditions.TRANSCODE_TIMEOUT_SECONDS, seconds / 10)
+    if timeout is not None:
+        encode_timeout = min(encode_timeout, max(0.0, timeout - (time.perf_counter() - started)))
+    data = renditions.encode_pcm(
+        (block.astype('<f4', copy=False).tobytes() for block in blocks(frames, SAMPLE_RATE, seconds, points)),
+        SAMPLE_RATE, CHANNELS, 'standard', timeout=encode_timeout)
+    total = int(seconds * SAMPLE_RATE)
+    return data, {'durationSeconds': round(total / SAMPLE_RATE, 3), 'loop': loop_metadata(points, SAMPLE_RATE)}
+
+
+def target_seconds(requested=None):
+    """Length of the extended rendition, capped; 0 means do not render one"""
+    seconds = LOOP_SECONDS if requested is None else float(requested)
+    return max(0.0, min(seconds, MAX_LOOP_SECONDS))
+
+
+def loop_metadata(points, sample_rate):
+    """Loop points in seconds, so players with gapless looping can loop the standard clip"""
+    return {
+        'startSeconds': round(points.start / sample_rate, 4),
+        'endSeconds': round(points.end / sample_rate, 4),
+        'crossfadeSeconds': round(points.crossfade / sample_rate, 4),
+        'score': round(points.score, 4)
+    }
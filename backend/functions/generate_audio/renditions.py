@@ -0,0 +1,231 @@
+"""
+Loudness-normalized audio renditions rendered with ffmpeg.
+
+The ElevenLabs clip is measured once with the EBU R128 loudnorm filter,
+then decoded a second time and split into every configured rendition in a
+single ffmpeg process, using linear (measured) normalization so all
+renditions share the same gain. The same process can also emit mono float32
+PCM of the normalized signal for waveform analysis. When ffmpeg is not
+available the caller keeps the original MP3.
+"""
+import json
+import os
+import re
+import shutil
+import subprocess
+import tempfile
+import threading
+import time
+
+FFMPEG_PATH = os.environ.get('FFMPEG_PATH') or shutil.which('ffmpeg') or '/opt/bin/ffmpeg'
+
+# Streaming loudness target (LUFS), true-peak ceiling (dBTP) and loudness range
+TARGET_LUFS = float(os.environ.get('AUDIO_TARGET_LUFS', '-16'))
+TARGET_TRUE_PEAK = float(os.environ.get('AUDIO_TARGET_TRUE_PEAK', '-1.5'))
+TARGET_LRA = float(os.environ.get('AUDIO_TARGET_LRA', '11'))
+
+# Ceiling of one ffmpeg process; callers with a request deadline pass a smaller timeout
+TRANSCODE_TIMEOUT_SECONDS = float(os.environ.get('TRANSCODE_TIMEOUT_SECONDS', '20'))
+
+# name -> output settings. 'standard' keeps the audio/{id}.mp3 key clients already use.
+RENDITIONS = {
+    'standard': {
+        'suffix': '.mp3',
+        'contentType': 'audio/mpeg',
+        'codec': 'mp3',
+        'bitrateKbps': 128,
+        'args': ['-c:a', 'libmp3lame', '-b:a', '128k', '-ar', '44100', '-f', 'mp3']
+    },
+    'preview-aac': {
+        'suffix': '-preview.m4a',
+        'contentType': 'audio/mp4; codecs="mp4a.40.2"',
+        'codec': 'aac',
+        'bitrateKbps': 48,
+        'args': ['-c:a', 'aac', '-b:a', '48k', '-ac', '1', '-ar', '44100', '-movflags', '+faststart', '-f', 'mp4']
+    },
+    'preview-opus': {
+        'suffix': '-preview.ogg',
+        'contentType': 'audio/ogg; codecs="opus"',
+        'codec': 'opus',
+        'bitrateKbps': 32,
+        'args': ['-c:a', 'libopus', '-b:a', '32k', '-ac', '1', '-ar', '48000', '-f', 'ogg']
+    }
+}
+
+# 'standard' is always rendered: it backs the audio/{id}.mp3 URL and the extended track
+ENABLED_RENDITIONS = ['standard'] + [
+    name.strip() for name in os.environ.get('AUDIO_RENDITIONS', ','.join(RENDITIONS)).split(',')
+    if name.strip() in RENDITIONS and name.strip() != 'standard'
+]
+
+_LOUDNORM_JSON = re.compile(r'\{[^{}]*"input_i"[^{}]*\}', re.S)
+_INPUT_SAMPLE_RATE = re.compile(r'Stream #0:\d+.*?: Audio: .*?(\d+) Hz')
+
+
+def available():
+    """True when an ffmpeg binary (the ffmpeg layer in Lambda) can be run"""
+    return os.path.isfile(FFMPEG_PATH) and os.access(FFMPEG_PATH, os.X_OK)
+
+
+def _timeout(timeout):
+    return TRANSCODE_TIMEOUT_SECONDS if timeout is None else min(timeout, TRANSCODE_TIMEOUT_SECONDS)
+
+
+def _run(args, timeout=None):
+    result = subprocess.run(
+        [FFMPEG_PATH, '-hide_banner', '-nostdin', '-y'] + args,
+        capture_output=True,
+        timeout=_timeout(timeout)
+    )
+    if result.returncode != 0:
+        raise RuntimeError(f"ffmpeg failed ({result.returncode}): {result.stderr.decode('utf-8', 'replace')[-500:]}")
+    return result.stderr.decode('utf-8', 'replace')
+
+
+def decode_pcm(audio_data, sample_rate, channels, timeout=None):
+    """Decode an encoded clip to interleaved little-endian float32 PCM bytes"""
+    result = subprocess.run(
+        [FFMPEG_PATH, '-hide_banner', '-nostdin', '-i', 'pipe:0',
+         '-ac', str(channels), '-ar', str(sample_rate), '-f', 'f32le', 'pipe:1'],
+        input=audio_data, capture_output=True, timeout=_timeout(timeout)
+    )
+    if result.returncode != 0:
+        raise RuntimeError(f"ffmpeg decode failed ({result.returncode}): {result.stderr.decode('utf-8', 'replace')[-500:]}")
+    return result.stdout
+
+
+def encode_pcm(pcm, sample_rate, channels, name='standard', timeout=None):
+    """
+    Encode interleaved float32 PCM with the settings of a rendition. pcm is
+    bytes or an iterable of byte chunks, written to ffmpeg as they are made,
+    so a long track never has to exist whole. timeout is taken as given: a
+    long track may need more than TRANSCODE_TIMEOUT_SECONDS.
+    """
+    spec = RENDITIONS[name]
+    chunks = [pcm] if isinstance(pcm, (bytes, bytearray, memoryview)) else pcm
+    timeout = TRANSCODE_TIMEOUT_SECONDS if timeout is None else timeout
+    with tempfile.TemporaryDirectory(prefix='renditions-') as workdir:
+        output_path = os.path.join(workdir, f"encoded{spec['suffix']}")
+        # stderr goes to a file: a pipe nobody reads would stall ffmpeg once full
+        with open(os.path.join(workdir, 'stderr.log'), 'w+b') as stderr:
+            process = subprocess.Popen(
+                [FFMPEG_PATH, '-hide_banner', '-nostdin', '-y',
+                 '-f', 'f32le', '-ar', str(sample_rate), '-ac', str(channels), '-i', 'pipe:0']
+                + spec['args'] + [output_path],
+                stdin=subprocess.PIPE, stdout=subprocess.DEVNULL, stderr=stderr
+            )
+            timed_out = threading.Event()
+
+            def expire():
+                timed_out.set()
+                process.kill()
+
+            # Also unblocks a write to an encoder that stopped reading
+            watchdog = threading.Timer(timeout, expire)
+            watchdog.start()
+            try:
+                try:
+                    for chunk in chunks:
+                        process.stdin.write(chunk)
+                    process.stdin.close()
+                except BrokenPipeError:
+                    # ffmpeg exited early; its return code and stderr say why
+                    pass
+                process.wait()
+            finally:
+                watchdog.cancel()
+                if process.poll() is None:
+                    process.kill()
+                    process.wait()
+            if timed_out.is_set():
+                raise subprocess.TimeoutExpired(process.args, timeout)
+            if process.returncode != 0:
+                stderr.seek(0)
+                raise RuntimeError(f"ffmpeg encode failed ({process.returncode}): "
+                                   f"{stderr.read().decode('utf-8', 'replace')[-500:]}")
+        with open(output_path, 'rb') as f:
+            return f.read()
+
+
+def measure_loudness(input_path, timeout=None):
+    """
+    First loudnorm pass: integrated loudness, range, true peak and threshold,
+    plus the input's sample rate as 'sample_rate' when ffmpeg reports it
+    """
+    stderr = _run([
+        '-i', input_path,
+        '-af', f"loudnorm=I={TARGET_LUFS}:TP={TARGET_TRUE_PEAK}:LRA={TARGET_LRA}:print_format=json",
+        '-f', 'null', '-'
+    ], timeout)
+    match = _LOUDNORM_JSON.search(stderr)
+    if not match:
+        raise RuntimeError("ffmpeg loudnorm did not report measurements")
+    measured = json.loads(match.group(0))
+    rate = _INPUT_SAMPLE_RATE.search(stderr)
+    measured['sample_rate'] = int(rate.group(1)) if rate else None
+    return measured
+
+
+def render(audio_data, names=None, pcm_sample_rate=None, timeout=None):
+    """
+    Render normalized renditions of an encoded clip.
+
+    Returns (renditions, analysis) where renditions maps name to a dict with
+    'data' plus the RENDITIONS settings, and analysis holds the measured input
+    loudness in LUFS, the input sample rate and the processing time. With
+    pcm_sample_rate set, analysis['pcm'] also holds the normalized clip as
+    mono little-endian float32 at that rate, from the same decode. timeout
+    bounds both ffmpeg passes together, e.g. what is left of the request.
+    """
+    names = names or ENABLED_RENDITIONS
+    started = time.perf_counter()
+
+    def left():
+        return None if timeout is None else max(0.0, timeout - (time.perf_counter() - started))
+
+    with tempfile.TemporaryDirectory(prefix='renditions-') as workdir:
+        input_path = os.path.join(workdir, 'input')
+        with open(input_path, 'wb') as f:
+            f.write(audio_data)
+
+        measured = measure_loudness(input_path, left())
+        normalize = (
+            f"loudnorm=I={TARGET_LUFS}:TP={TARGET_TRUE_PEAK}:LRA={TARGET_LRA}"
+            f":measured_I={measured['input_i']}:measured_TP={measured['input_tp']}"
+            f":measured_LRA={measured['input_lra']}:measured_thresh={measured['input_thresh']}"
+            f":offset={measured['target_offset']}:linear=true"
+        )
+
+        # Decode and normalize once, then fan out to every encoder
+        labels = [f"[r{index}]" for index in range(len(names) + (1 if pcm_sample_rate else 0))]
+        filter_graph = f"[0:a]{normalize},asplit={len(labels)}{''.join(labels)}" if len(labels) > 1 \
+            else f"[0:a]{normalize}{labels[0]}"
+        args = ['-i', input_path, '-filter_complex', filter_graph]
+        outputs = {}
+        for name, label in zip(names, labels):
+            spec = RENDITIONS[name]
+            output_path = os.path.join(workdir, f"{name}{spec['suffix']}")
+            args += ['-map', label] + spec['args'] + [output_path]
+            outputs[name] = output_path
+        pcm_path = None
+        if pcm_sample_rate:
+            pcm_path = os.path.join(workdir, 'analysis.f32')
+            args += ['-map', labels[-1], '-ac', '1', '-ar', str(pcm_sample_rate), '-f', 'f32le', pcm_path]
+        _run(args, left())
+
+        renditions = {}
+        for name, output_path in outputs.items():
+            with open(output_path, 'rb') as f:
+                renditions[name] = dict(RENDITIONS[name], data=f.read())
+
+        analysis = {
+            'inputLufs': float(measured['input_i']),
+            'targetLufs': TARGET_LUFS,
+            'sampleRate': measured['sample_rate']
+        }
+        if pcm_path:
+            with open(pcm_path, 'rb') as f:
+                analysis['pcm'] = f.read()
+
+    analysis['processingMs'] = round((time.perf_counter() - started) * 1000)
+    return renditions, analysis
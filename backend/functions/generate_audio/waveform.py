@@ -0,0 +1,107 @@
+"""
+Waveform peaks and audio metadata for the frontend visualizer.
+
+Clients used to fetch and decode the whole MP3 before drawing anything. This
+module turns mono float32 PCM (produced by the renditions ffmpeg pass, so the
+clip is only decoded once) into a small sidecar: min/max peaks quantized to
+8 bits, an RMS envelope, duration and sample rate. All reductions are
+vectorized NumPy over a (points, samples_per_point) view of the signal.
+"""
+import json
+import os
+
+import numpy as np
+
+# Rate the PCM is resampled to for analysis; peaks do not need the full 44.1 kHz
+ANALYSIS_SAMPLE_RATE = int(os.environ.get('WAVEFORM_SAMPLE_RATE', '16000'))
+
+# Number of peak/RMS points per clip, independent of its length
+WAVEFORM_POINTS = int(os.environ.get('WAVEFORM_POINTS', '800'))
+
+# Points kept on the item and in the API response (about 3 KB of JSON), so the
+# player draws without fetching the sidecar; the sidecar keeps all WAVEFORM_POINTS
+WAVEFORM_INLINE_POINTS = int(os.environ.get('WAVEFORM_INLINE_POINTS', '200'))
+
+SIDECAR_SUFFIX = '.peaks.json'
+SIDECAR_CONTENT_TYPE = 'application/json'
+FORMAT_VERSION = 1
+
+
+def _quantize(values):
+    return np.clip(np.round(values * 127), -127, 127).astype(np.int8)
+
+
+def compute(pcm, sample_rate, source_sample_rate=None, points=WAVEFORM_POINTS):
+    """
+    Summarize mono float32 samples in [-1, 1].
+
+    pcm may be a NumPy array or raw little-endian float32 bytes. Returns a
+    JSON-serializable dict with interleaved [min, max, min, max, ...] peaks as
+    signed 8-bit integers, an RMS envelope (0-255), the duration in seconds
+    and the source sample rate.
+    """
+    samples = np.frombuffer(pcm, dtype='<f4') if isinstance(pcm, (bytes, bytearray, memoryview)) else np.asarray(pcm, dtype=np.float32)
+    length = samples.shape[0]
+    points = max(1, min(points, length))
+
+    if length == 0:
+        mins = maxs = rms = np.zeros(0, dtype=np.float32)
+        samples_per_point = 0
+    else:
+        # Pad to a whole number of buckets with zeros; silence never moves a peak
+        samples_per_point = -(-length // points)
+        padded = np.zeros(points * samples_per_point, dtype=np.float32)
+        padded[:length] = samples
+        buckets = padded.reshape(points, samples_per_point)
+        mins = buckets.min(axis=1)
+        maxs = buckets.max(axis=1)
+        rms = np.sqrt(np.einsum('ij,ij->i', buckets, buckets) / samples_per_point)
+
+    peaks = np.empty(mins.shape[0] * 2, dtype=np.int8)
+    peaks[0::2] = _quantize(mins)
+    peaks[1::2] = _quantize(maxs)
+
+    return {
+        'version': FORMAT_VERSION,
+        'sampleRate': int(source_sample_rate or sample_rate),
+        'durationSeconds': round(length / float(sample_rate), 3) if sample_rate else 0.0,
+        'samplesPerPoint': int(samples_per_point),
+        'points': int(mins.shape[0]),
+        'bits': 8,
+        'peaks': peaks.tolist(),
+        'rms': np.clip(np.round(rms * 255), 0, 255).astype(np.uint8).tolist(),
+        'peakLevel': round(float(max(-mins.min(), maxs.max())) if length else 0.0, 4)
+    }
+
+
+def encode(waveform):
+    """Compact JSON bytes for the S3 sidecar"""
+    return json.dumps(waveform, separators=(',', ':')).encode('utf-8')
+
+
+def summary(waveform):
+    """The scalar fields of a waveform"""
+    return {key: value for key, value in waveform.items() if key not in ('peaks', 'rms')}
+
+
+def downsample(waveform, points=WAVEFORM_INLINE_POINTS):
+    """
+    The waveform with at most `points` points: the min and max of each group
+    of peaks and the RMS of each group of the envelope. A waveform already
+    that small is returned as it is.
+    """
+    count = int(waveform.get('points') or 0)
+    if count <= points or not waveform.get('peaks'):
+        return dict(waveform)
+    group = -(-count // points)
+    points = -(-count // group)
+    # Repeat the last point into the padding so it never moves a min or max
+    pairs = np.asarray(waveform['peaks'], dtype=np.int16).reshape(count, 2)
+    pairs = np.pad(pairs, ((0, points * group - count), (0, 0)), mode='edge').reshape(points, group, 2)
+    peaks = np.empty(points * 2, dtype=np.int8)
+    peaks[0::2] = pairs[:, :, 0].min(axis=1)
+    peaks[1::2] = pairs[:, :, 1].max(axis=1)
+    rms = np.pad(np.asarray(waveform['rms'], dtype=np.float64), (0, points * group - count), mode='edge')
+    rms = np.sqrt((rms.reshape(points, group) ** 2).mean(axis=1))
+    return dict(waveform, points=int(points), samplesPerPoint=int(waveform['samplesPerPoint']) * group,
+                peaks=peaks.tolist(), rms=np.clip(np.round(rms), 0, 255).astype(np.uint8).tolist())
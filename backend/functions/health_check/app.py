@@ -2,93 +2,172 @@ import json
 import boto3
 import os
 import sys
+import threading
+import time
 import traceback
+from concurrent.futures import ThreadPoolExecutor, wait
+
+from botocore.config import Config
 
 # Add direct console logging for debugging
 print("health_check module loading without utils dependency...")
 print(f"Python version: {sys.version}")
 print(f"Environment variables: {os.environ}")
 
+# Deep results are reused for this long, so frequent load balancer pings cost one probe round per TTL
+CACHE_TTL_SECONDS = float(os.environ.get('HEALTH_CACHE_TTL_SECONDS', '10'))
+# Per-probe budget; a dependency slower than this is reported as an error
+PROBE_TIMEOUT_SECONDS = float(os.environ.get('HEALTH_PROBE_TIMEOUT_SECONDS', '2'))
+# 'shallow' answers from the function alone; 'deep' probes every dependency
+DEFAULT_MODE = os.environ.get('HEALTH_CHECK_MODE', 'shallow')
+
+images_bucket = os.environ.get('IMAGES_BUCKET')
+audio_bucket = os.environ.get('AUDIO_BUCKET')
+table_name = os.environ.get('TABLE_NAME')
+state_machine_arn = os.environ.get('STATE_MACHINE_ARN')
+
+# Clients are created once per container; probes fail fast instead of retrying
+try:
+    probe_config = Config(
+        connect_timeout=PROBE_TIMEOUT_SECONDS,
+        read_timeout=PROBE_TIMEOUT_SECONDS,
+        retries={'max_attempts': 1}
+    )
+    s3 = boto3.client('s3', config=probe_config)
+    dynamodb = boto3.resource('dynamodb', config=probe_config)
+    table = dynamodb.Table(table_name) if table_name else None
+    stepfunctions = boto3.client('stepfunctions', config=probe_config)
+except Exception as e:
+    print(f"Error initializing AWS clients: {e}")
+    print(traceback.format_exc())
+
+executor = ThreadPoolExecutor(max_workers=4, thread_name_prefix='health-probe')
+_cache = {'result': None, 'expires': 0.0}
+_cache_lock = threading.Lock()
+
+
+def probe_s3_images():
+    s3.head_bucket(Bucket=images_bucket)
+
+
+def probe_s3_audio():
+    s3.head_bucket(Bucket=audio_bucket)
+
+
+def probe_dynamodb():
+    # describe_table is a control-plane read: no read capacity, independent of table size
+    table.meta.client.describe_table(TableName=table_name)
+
+
+def probe_stepfunctions():
+    stepfunctions.describe_state_machine(stateMachineArn=state_machine_arn)
+
+
+def configured_probes():
+    """Probes for the dependencies this deployment has configured"""
+    probes = {}
+    if images_bucket:
+        probes['s3_images'] = probe_s3_images
+    if audio_bucket:
+        probes['s3_audio'] = probe_s3_audio
+    if table_name:
+        probes['dynamodb'] = probe_dynamodb
+    if state_machine_arn:
+        probes['stepfunctions'] = probe_stepfunctions
+    return probes
+
+
+def timed(probe):
+    start = time.perf_counter()
+    probe()
+    return round((time.perf_counter() - start) * 1000, 1)
+
+
+def run_probes():
+    """
+    Run every probe concurrently, bounded by PROBE_TIMEOUT_SECONDS overall.
+    Returns (services, latencies): a status string and a latency in ms per dependency.
+    """
+    start = time.perf_counter()
+    futures = {name: executor.submit(timed, probe) for name, probe in configured_probes().items()}
+    wait(futures.values(), timeout=PROBE_TIMEOUT_SECONDS)
+
+    services, latencies = {}, {}
+    for name, future in futures.items():
+        if not future.done():
+            services[name] = f"error: timed out after {PROBE_TIMEOUT_SECONDS:g}s"
+            latencies[name] = round((time.perf_counter() - start) * 1000, 1)
+            print(f"{name} health probe timed out")
+        elif future.exception() is not None:
+            error = future.exception()
+            services[name] = f"error: {str(error)}"
+            latencies[name] = round((time.perf_counter() - start) * 1000, 1)
+            print(f"{name} health probe failed: {error}")
+        else:
+            services[name] = "connected"
+            latencies[name] = future.result()
+    return services, latencies
+
+
+def deep_check():
+    """Probe results, served from the container cache while fresh"""
+    now = time.time()
+    with _cache_lock:
+        if _cache['result'] is not None and now < _cache['expires']:
+            return _cache['result'], True
+        services, latencies = run_probes()
+        _cache['result'] = {'services': services, 'latencyMs': latencies, 'checkedAt': now}
+        _cache['expires'] = now + CACHE_TTL_SECONDS
+        return _cache['result'], False
+
+
+def requested_mode(event):
+    params = (event or {}).get('queryStringParameters') or {}
+    mode = params.get('mode') or ('deep' if str(params.get('deep', '')).lower() == 'true' else DEFAULT_MODE)
+    return 'deep' if mode == 'deep' else 'shallow'
+
+
 def lambda_handler(event, context):
     """
-    Simple health check endpoint to verify if the API is running.
-    Also verifies connectivity to required AWS services.
-    This simplified version doesn't depend on utils module.
+    Health check endpoint.
+
+    Shallow mode (the default) only proves the function is running and makes
+    no AWS calls. Deep mode (?mode=deep) probes S3, DynamoDB and Step
+    Functions concurrently and reports each dependency's status and latency;
+    results are cached per container for HEALTH_CACHE_TTL_SECONDS.
     """
-    print("Health check invoked")
-    
-    # Check service connections
-    services_status = {}
-    
-    # Check S3 buckets
-    try:
-        s3 = boto3.client('s3')
-        images_bucket = os.environ.get('IMAGES_BUCKET')
-        audio_bucket = os.environ.get('AUDIO_BUCKET')
-        
-        # Check images bucket
-        if images_bucket:
-            s3.head_bucket(Bucket=images_bucket)
-            services_status['s3_images'] = "connected"
-            print(f"S3 images bucket '{images_bucket}' is connected")
-        
-        # Check audio bucket
-        if audio_bucket:
-            s3.head_bucket(Bucket=audio_bucket)
-            services_status['s3_audio'] = "connected"
-            print(f"S3 audio bucket '{audio_bucket}' is connected")
-    except Exception as e:
-        print(f"S3 connection check failed: {e}")
-        print(traceback.format_exc())
-        services_status['s3'] = f"error: {str(e)}"
-    
-    # Check DynamoDB
-    try:
-        dynamodb = boto3.resource('dynamodb')
-        table_name = os.environ.get('TABLE_NAME')
-        
-        if table_name:
-            table = dynamodb.Table(table_name)
-            table.scan(Limit=1)
-            services_status['dynamodb'] = "connected"
-            print(f"DynamoDB table '{table_name}' is connected")
-    except Exception as e:
-        print(f"DynamoDB connection check failed: {e}")
-        print(traceback.format_exc())
-        services_status['dynamodb'] = f"error: {str(e)}"
-    
-    # Check Step Functions if state machine ARN is available
-    try:
-        state_machine_arn = os.environ.get('STATE_MACHINE_ARN')
-        if state_machine_arn:
-            sfn = boto3.client('stepfunctions')
-            sfn.describe_state_machine(stateMachineArn=state_machine_arn)
-            services_status['stepfunctions'] = "connected"
-            print(f"Step Functions '{state_machine_arn}' is connected")
-    except Exception as e:
-        # This is expected to fail if the ARN isn't available
-        if state_machine_arn:
-            print(f"Step Functions connection check failed: {e}")
-            print(traceback.format_exc())
-            services_status['stepfunctions'] = f"error: {str(e)}"
-    
-    # Log health check results
-    all_healthy = all(not status.startswith("error") for status in services_status.values())
-    print(f"Health check completed. Services checked: {len(services_status)}, All healthy: {all_healthy}")
-    
-    # Return health status
+    start = time.perf_counter()
+    mode = requested_mode(event)
+    body = {
+        'status': 'healthy',
+        'mode': mode,
+        'region': os.environ.get('AWS_REGION', 'unknown'),
+        'version': os.environ.get('AWS_LAMBDA_FUNCTION_VERSION', 'latest')
+    }
+
+    if mode == 'deep':
+        result, cached = deep_check()
+        all_healthy = all(not status.startswith("error") for status in result['services'].values())
+        body.update({
+            'status': 'healthy' if all_healthy else 'unhealthy',
+            'services': result['services'],
+            'latencyMs': result['latencyMs'],
+            'cached': cached,
+            'ageSeconds': round(time.time() - result['checkedAt'], 1)
+        })
+        if not cached:
+            print(f"Health check completed. Services checked: {len(result['services'])}, All healthy: {all_healthy}")
+    body['durationMs'] = round((time.perf_counter() - start) * 1000, 1)
+
+    # Return health status; a failing deep check is a 503 so load balancers can act on it
     return {
-        'statusCode': 200,
+        'statusCode': 200 if body['status'] == 'healthy' else 503,
         'headers': {
             'Content-Type': 'application/json',
+            'Cache-Control': 'no-store',
             'Access-Control-Allow-Origin': '*',
             'Access-Control-Allow-Headers': 'Content-Type,X-Amz-Date,Authorization,X-Api-Key,X-Amz-Security-Token,X-Requested-With',
             'Access-Control-Allow-Methods': 'GET,POST,OPTIONS,PUT,DELETE'
         },
-        'body': json.dumps({
-            'status': 'healthy',
-            'services': services_status,
-            'region': os.environ.get('AWS_REGION', 'unknown'),
-            'version': os.environ.get('AWS_LAMBDA_FUNCTION_VERSION', 'latest')
-        })
+        'body': json.dumps(body)
     }
@@ -2,8 +2,13 @@ import json
 import boto3
 import base64
 import os
+import time
 import traceback
 import sys
+from decimal import Decimal
+
+import derivatives
+from utils import capture, deadline, hedging, imaging, metering, metrics, payload, profiling, prompts, resilience, scheduler, search_index, similarity, speculation
 
 # Check boto3 version to determine Bedrock service name
 import pkg_resources
@@ -21,6 +26,20 @@ from packaging import version
 boto3_has_bedrock = version.parse(boto3_version) >= version.parse("1.28.0")
 print(f"Boto3 has bedrock support: {boto3_has_bedrock}")
 
+BEDROCK_MODEL_ID = os.environ.get('BEDROCK_MODEL_ID', 'anthropic.claude-3-sonnet-20240229-v1:0')
+# Hedged Bedrock requests (opt-in); see utils/hedging.py for the delay and budget settings
+HEDGE_ENABLED = os.environ.get('BEDROCK_HEDGE_ENABLED', 'false').lower() == 'true'
+HEDGE_REGION = os.environ.get('BEDROCK_HEDGE_REGION')
+HEDGE_MODEL_ID = os.environ.get('BEDROCK_HEDGE_MODEL_ID', BEDROCK_MODEL_ID)
+# Request deadline budget (utils.deadline): Claude is only called when it can take
+# BEDROCK_MIN_SECONDS and still leave AUDIO_RESERVE_SECONDS for generate_audio
+BEDROCK_MIN_SECONDS = float(os.environ.get('DEADLINE_BEDROCK_MIN_SECONDS', '3'))
+AUDIO_RESERVE_SECONDS = float(os.environ.get('DEADLINE_AUDIO_RESERVE_SECONDS', '8'))
+# Keep the search index (utils/search_index.py) up to date as images are analysed
+SEARCH_INDEX_ENABLED = os.environ.get('SEARCH_INDEX_ENABLED', 'true').lower() == 'true'
+# Display-size derivatives (derivatives.py) are only rendered with this much of the budget left
+DERIVATIVES_MIN_SECONDS = float(os.environ.get('DEADLINE_DERIVATIVES_MIN_SECONDS', '12'))
+
 # Initialize AWS services
 try:
     s3 = boto3.client('s3')
@@ -53,6 +72,18 @@ try:
                     raise Exception("Bedrock client initialization failed. You may need to update boto3 to v1.28.0+ or ensure the Lambda function has proper permissions.")
             bedrock = MockBedrockClient()
 
+    # Optional hedge target for slow Bedrock calls: another region, another model, or both
+    hedge_bedrock = None
+    if HEDGE_ENABLED and boto3_has_bedrock:
+        try:
+            hedge_bedrock = boto3.client('bedrock-runtime', region_name=HEDGE_REGION) if HEDGE_REGION else bedrock
+            print(f"Bedrock hedging enabled: region={HEDGE_REGION or 'same'}, model={HEDGE_MODEL_ID}")
+        except Exception as hedge_err:
+            print(f"Error initializing hedge bedrock client, hedging disabled: {hedge_err}")
+
+    # Speculative audio jobs (utils/speculation.py) go through the audio queue
+    sqs = boto3.client('sqs') if speculation.enabled() else None
+
     # Get environment variables with validation
     table_name = os.environ.get('TABLE_NAME')
     images_bucket = os.environ.get('IMAGES_BUCKET')
@@ -70,6 +101,11 @@ except Exception as e:
     print(f"Error initializing AWS services: {e}")
     print(traceback.format_exc())
 
+def invoke_claude(client, model_id, body):
+    """One Bedrock call, read to completion so a hedged call finishes in its own thread"""
+    response = client.invoke_model(modelId=model_id, body=body)
+    return json.loads(response['body'].read())
+
 def update_db_error(image_id, error_message):
     """Update DynamoDB with error information"""
     try:
@@ -102,6 +138,10 @@ def update_db_error(image_id, error_message):
         print(f"Failed to update DynamoDB with error status for {image_id}: {db_err}")
         print(traceback.format_exc())
 
+@profiling.profiled('image_to_text')
+@imaging.budgeted
+@capture.captured('image_to_text')
+@metering.metered('image_to_text')
 def lambda_handler(event, context):
     # Print environment variables at the start of the function for debugging
     print(f"Environment variables in lambda_handler: {dict(os.environ)}")
@@ -127,6 +167,8 @@ def lambda_handler(event, context):
         s3_key = event['s3Key']
 
         print(f"Processing image ID: {image_id}, S3 Key: {s3_key}")
+        request_deadline = deadline.from_event(event, context)
+        print(f"Request deadline: {request_deadline}")
 
         # Get the image from S3
         print("Retrieving image from S3")
@@ -146,11 +188,13 @@ def lambda_handler(event, context):
             print(f"Using bucket name: {bucket_name}")
 
             # Get the image from S3
-            response = s3.get_object(
-                Bucket=bucket_name,
-                Key=s3_key
-            )
-            image_bytes = response['Body'].read()
+            with capture.call('s3', 'get_object') as call:
+                response = deadline.client(s3, request_deadline).get_object(
+                    Bucket=bucket_name,
+                    Key=s3_key
+                )
+                image_bytes = response['Body'].read()
+                call.response = lambda: {'bytes': len(image_bytes), 'digest': capture.digest(image_bytes)}
             print(f"Successfully retrieved image from S3, size: {len(image_bytes)} bytes")
         except ValueError as val_err:
             # Configuration error - environment variable issues
@@ -164,16 +208,28 @@ def lambda_handler(event, context):
             # Format error message specifically for Step Functions error handling
             raise Exception(f"Could not retrieve image from S3: {str(s3_err)}")
 
+        # Display-size derivatives are rendered and stored from the bytes just read while
+        # Rekognition and Claude run; they are an optimization, any failure keeps the original only
+        derivative_task = None
+        if not request_deadline.allows(DERIVATIVES_MIN_SECONDS):
+            print(f"Only {request_deadline.remaining():.1f} s left, skipping image derivatives")
+        else:
+            derivative_task = derivatives.start(deadline.client(s3, request_deadline), images_bucket,
+                                                image_id, image_bytes)
+
         # Use Rekognition to detect objects
         print("Calling AWS Rekognition for object detection")
         try:
-            rekognition_response = rekognition.detect_labels(
-                Image={
-                    'Bytes': image_bytes
-                },
-                MaxLabels=15,
-                MinConfidence=70
-            )
+            with capture.call('rekognition', 'detect_labels') as call:
+                rekognition_response = deadline.client(rekognition, request_deadline).detect_labels(
+                    Image={
+                        'Bytes': image_bytes
+                    },
+                    MaxLabels=15,
+                    MinConfidence=70
+                )
+                call.response = {'labels': [[label['Name'], round(label['Confidence'], 2)] for label in rekognition_response['Labels']]}
+            metering.add(rekognitionImages=1)
 
             # Extract detected elements
             detected_elements = [label['Name'] for label in rekognition_response['Labels']]
@@ -183,120 +239,179 @@ def lambda_handler(event, context):
             print(traceback.format_exc())
             raise Exception(f"Object detection failed: {str(rekognition_err)}")
 
-        # Use AWS Bedrock (Claude) for detailed image description and sound prompt generation
-        encoded_image = base64.b64encode(image_bytes).decode('utf-8')
-
-        prompt = """
-        Please analyze this image and provide two things:
-        1. A detailed description of what you see, including scene type and key elements
-        2. A sound generation prompt for Eleven Labs that would create the perfect audio atmosphere 
-           for this image. The sound prompt should be detailed and evocative, describing the specific 
-           sounds, their qualities, and how they interact.
-
-        IMPORTANT: Avoid including music or musical elements in your sound prompt unless the image 
-        explicitly contains musical instruments being played or shows a music performance setting. 
-        Focus on natural ambient sounds, environmental effects, human/animal vocalizations, and other 
-        non-musical audio elements. Music should only be included when absolutely necessary for the scene.
-
-        Format your response as:
-        DESCRIPTION: [your detailed image description]
-        SCENE_TYPE: [one of: city, nature, beach, forest, indoor, mountain, desert, snow]
-        ELEMENTS: [comma-separated list of key elements]
-        SOUND_PROMPT: [your sound generation prompt]
-        """
-
-        # Using Claude Anthropic API through Bedrock
-        print("Calling AWS Bedrock (Claude) for image description and sound prompt")
-        try:
-            # Check if bedrock client is available
-            if bedrock is None:
-                print("ERROR: Bedrock client is not available. Cannot analyze image.")
-                raise Exception("Bedrock client is not available. Cannot analyze image.")
-
-            # Prepare payload for Bedrock
-            claude_payload = {
-                "anthropic_version": "bedrock-2023-05-31",
-                "max_tokens": 1000,
-                "messages": [
-                    {
-                        "role": "user",
-                        "content": [
-                            {
-                                "type": "text",
-                                "text": prompt
-                            },
-                            {
-                                "type": "image",
-                                "source": {
-                                    "type": "base64",
-                                    "media_type": "image/jpeg",
-                                    "data": encoded_image
-                                }
-                            }
-                        ]
-                    }
-                ]
-            }
-
-            # Call Bedrock API
-            print(f"Calling Bedrock API with {len(encoded_image)} chars of base64 image data")
-            bedrock_response = bedrock.invoke_model(
-                modelId='anthropic.claude-3-sonnet-20240229-v1:0',
-                body=json.dumps(claude_payload)
+        # Reuse mode (utils/similarity.py): a finished soundscape for a near-identical
+        # label set is returned instead of calling Bedrock and ElevenLabs
+        label_vector = similarity.vector(rekognition_response['Labels'])
+        lsh_buckets = similarity.buckets(similarity.signature(label_vector)) if similarity.indexing() and label_vector else []
+        reused = None
+        speculative = None
+        if similarity.reusing() and lsh_buckets:
+            lookup_started = time.perf_counter()
+            try:
+                reused, reuse_similarity = similarity.find(
+                    similarity.TableIndex(deadline.client(table, request_deadline), deadline.client(dynamodb, request_deadline)),
+                    label_vector, lsh_buckets, exclude=image_id
+                )
+            except Exception as reuse_err:
+                print(f"Similarity lookup failed, analysing the image as usual: {reuse_err}")
+                print(traceback.format_exc())
+                reused, reuse_similarity = None, 0.0
+            lookup_ms = int((time.perf_counter() - lookup_started) * 1000)
+            metrics.emit(
+                {'SimilarityReused': 1 if reused else 0, 'SimilarityLookupTime': lookup_ms},
+                dimensions={'Index': 'lsh'},
+                units={'SimilarityLookupTime': 'Milliseconds'},
+                properties={'similarity': round(reuse_similarity, 3)}
             )
-
-            # Parse response
-            response_body = json.loads(bedrock_response['body'].read())
-            response_text = response_body['content'][0]['text']
-            print("Successfully received image analysis from Claude")
-        except Exception as bedrock_err:
-            print(f"Failed to generate description with Bedrock: {bedrock_err}")
-            print(traceback.format_exc())
-
-            # Fallback: use Rekognition elements if Bedrock fails
-            print("USING FALLBACK: Creating description using Rekognition results only")
+            if reused:
+                print(f"Reusing soundscape {reused['imageId']} (similarity {reuse_similarity:.3f}), skipping Bedrock and ElevenLabs")
+            else:
+                print(f"No soundscape to reuse; best similarity {reuse_similarity:.3f} in {lookup_ms} ms")
+
+        if reused is not None:
+            # The reused soundscape's scene and prompt produced its audio; the description is this image's labels
+            degraded = []
             description = f"Image containing {', '.join(detected_elements[:5])}"
-            scene = "unknown"
+            scene = reused.get('scene') or "unknown"
             ai_elements = []
-            sound_prompt = f"Create a natural ambient soundscape with environmental sounds for a scene with {', '.join(detected_elements[:5])}. Focus on non-musical audio elements like ambient noises, natural sounds, and spatial effects."
-
-            # Log the fallback situation
-            print(f"Created fallback description and sound prompt from Rekognition results")
-            print(f"Fallback description: {description}")
-            print(f"Fallback sound prompt: {sound_prompt}")
-
-        # Check if we have a response from Claude to parse (vs. using fallback values)
-        if 'response_text' in locals():
-            # Parse the response from Claude
-            print("Parsing Claude response")
-            parts = response_text.split('\n')
-
-            description = ""
-            scene = "other"
-            ai_elements = []
-            sound_prompt = ""
-
-            for part in parts:
-                if part.startswith("DESCRIPTION:"):
-                    description = part.replace("DESCRIPTION:", "").strip()
-                elif part.startswith("SCENE_TYPE:"):
-                    scene = part.replace("SCENE_TYPE:", "").strip().lower()
-                elif part.startswith("ELEMENTS:"):
-                    elements_text = part.replace("ELEMENTS:", "").strip()
-                    ai_elements = [elem.strip() for elem in elements_text.split(',')]
-                elif part.startswith("SOUND_PROMPT:"):
-                    sound_prompt = part.replace("SOUND_PROMPT:", "").strip()
-
-            # Validate response parsing
-            if not description or not sound_prompt:
-                print(
-                    f"Claude response parsing incomplete: description={bool(description)}, "
-                    f"scene={bool(scene != 'other')}, elements={len(ai_elements)}, "
-                    f"sound_prompt={bool(sound_prompt)}"
-                )
+            sound_prompt = reused.get('soundPrompt', "")
         else:
-            # We're using fallback values, already set in the except block
-            print("Using fallback values, skipping Claude response parsing")
+            # Using Claude Anthropic API through Bedrock
+            print("Calling AWS Bedrock (Claude) for image description and sound prompt")
+            degradation = resilience.controller(globals().get('table'))
+            degraded = []
+            # Bulk requests take a cheaper model when one is configured, and are never hedged
+            lane = scheduler.lane_of(event)
+            model_id = scheduler.bedrock_model(lane, BEDROCK_MODEL_ID)
+            # Start a clip from the labels while Claude runs (utils/speculation.py)
+            if speculation.enabled():
+                try:
+                    speculative = speculation.start(deadline.client(table, request_deadline), sqs,
+                                                    rekognition_response['Labels'], image_id, lane,
+                                                    request_deadline.epoch_ms)
+                except Exception as speculation_err:
+                    print(f"Could not start speculative audio, generating after Claude as usual: {speculation_err}")
+                    print(traceback.format_exc())
+            try:
+                # Skip Bedrock entirely while its circuit is open instead of waiting out a timeout
+                if not degradation.allow('bedrock'):
+                    raise resilience.CircuitOpenError("Bedrock circuit breaker is open")
+                # Likewise once Claude would eat into the time audio generation needs
+                if not request_deadline.allows(BEDROCK_MIN_SECONDS + AUDIO_RESERVE_SECONDS):
+                    raise TimeoutError(f"Skipping Bedrock: {request_deadline.remaining():.1f} s left of the request budget")
+
+                # Check if bedrock client is available
+                if bedrock is None:
+                    print("ERROR: Bedrock client is not available. Cannot analyze image.")
+                    raise Exception("Bedrock client is not available. Cannot analyze image.")
+
+                # The versioned prompt (utils/prompts.py) and the image fitted to its token budget
+                prompt = prompts.get()
+                # An upload too large for Claude is sent as its medium derivative, already decoded
+                # and encoded by the render, instead of being downscaled a second time
+                claude_source = (image_bytes, event.get('format'), event.get('width'), event.get('height'))
+                if max(event.get('width') or 0, event.get('height') or 0) > prompts.MAX_IMAGE_SIDE:
+                    claude_source = derivatives.medium_jpeg(
+                        derivative_task, request_deadline.remaining() - BEDROCK_MIN_SECONDS - AUDIO_RESERVE_SECONDS
+                    ) or claude_source
+                claude_image, media_type, claude_width, claude_height = prompts.fit_image(
+                    *claude_source, decode_budget=imaging.invocation_budget())
+                encoded_image = base64.b64encode(claude_image).decode('utf-8')
+                estimated = prompts.estimate(prompt, claude_width, claude_height)
+                if len(claude_image) != len(image_bytes):
+                    print(f"Downscaled the image for Claude to {claude_width}x{claude_height}, {len(claude_image)} bytes")
+                claude_payload = prompts.build_request(prompt, encoded_image, media_type, model_id)
+
+                # Call Bedrock API
+                print(f"Calling Bedrock API with {len(encoded_image)} chars of base64 image data")
+                # Waiting for a slot of the lane (utils/scheduler.py) is not Bedrock latency
+                slot_timeout = request_deadline.remaining() - BEDROCK_MIN_SECONDS - AUDIO_RESERVE_SECONDS
+                with scheduler.slot('bedrock', lane, slot_timeout, globals().get('table'), request_deadline.expires_at), \
+                        capture.call('bedrock', 'invoke_model') as call, degradation.breaker('bedrock').track():
+                    body = json.dumps(claude_payload)
+                    hedge = None
+                    if globals().get('hedge_bedrock') is not None and lane == scheduler.INTERACTIVE:
+                        hedge_client = deadline.client(hedge_bedrock, request_deadline, reserve=AUDIO_RESERVE_SECONDS)
+                        # A cache point is only sent to models with prompt caching
+                        hedge_body = body if HEDGE_MODEL_ID == model_id else json.dumps(
+                            prompts.build_request(prompt, encoded_image, media_type, HEDGE_MODEL_ID))
+                        hedge = lambda: invoke_claude(hedge_client, HEDGE_MODEL_ID, hedge_body)
+                    bedrock_client = deadline.client(bedrock, request_deadline, reserve=AUDIO_RESERVE_SECONDS)
+                    response_body, hedge_info = hedging.hedger('bedrock').run(
+                        lambda: invoke_claude(bedrock_client, model_id, body),
+                        hedge
+                    )
+                    if hedge_info['hedged']:
+                        print(f"Hedged Bedrock call after {hedge_info['delayMs']} ms; {hedge_info['winner']} won")
+
+                    # Parse response
+                    response_text = response_body['content'][0]['text']
+                    call.response = {'text': response_text, 'usage': response_body.get('usage'), 'hedge': hedge_info,
+                                     'prompt': prompt.version, 'estimatedInputTokens': estimated['total'],
+                                     'stopReason': response_body.get('stop_reason')}
+                # A hedged request pays for both calls; the loser's usage is taken to match the winner's
+                calls = 2 if hedge_info['hedged'] else 1
+                usage = response_body.get('usage') or {}
+                metering.add(bedrockInputTokens=usage.get('input_tokens', 0) * calls,
+                             bedrockOutputTokens=usage.get('output_tokens', 0) * calls,
+                             bedrockCacheReadTokens=usage.get('cache_read_input_tokens', 0) * calls,
+                             bedrockCacheWriteTokens=usage.get('cache_creation_input_tokens', 0) * calls)
+                truncated = response_body.get('stop_reason') == 'max_tokens'
+                metrics.emit(
+                    {'PromptInputTokensEstimated': estimated['total'], 'PromptImageTokensEstimated': estimated['image'],
+                     'PromptOutputTruncated': 1 if truncated else 0},
+                    dimensions={'PromptVersion': prompt.version},
+                    properties={'inputTokens': usage.get('input_tokens'), 'outputTokens': usage.get('output_tokens'),
+                                'cacheReadTokens': usage.get('cache_read_input_tokens'), 'maxTokens': prompt.max_tokens}
+                )
+                if truncated:
+                    print(f"Claude's response hit max_tokens ({prompt.max_tokens}) with prompt {prompt.version}")
+                if hedge_info['hedged']:
+                    metering.count('bedrock', 'invoke_model')
+                print("Successfully received image analysis from Claude")
+            except Exception as bedrock_err:
+                print(f"Failed to generate description with Bedrock: {bedrock_err}")
+                print(traceback.format_exc())
+
+                # Fallback: use Rekognition elements if Bedrock fails
+                print("USING FALLBACK: Creating description using Rekognition results only")
+                degraded.append('bedrock')
+                description = f"Image containing {', '.join(detected_elements[:5])}"
+                scene = "unknown"
+                ai_elements = []
+                sound_prompt = speculation.label_prompt(detected_elements)
+
+                # Log the fallback situation
+                print(f"Created fallback description and sound prompt from Rekognition results")
+                print(f"Fallback description: {description}")
+                print(f"Fallback sound prompt: {sound_prompt}")
+
+            # Check if we have a response from Claude to parse (vs. using fallback values)
+            if 'response_text' in locals():
+                # Parse the response from Claude
+                print("Parsing Claude response")
+                description, scene, ai_elements, sound_prompt = prompts.parse(response_text)
+
+                # Validate response parsing
+                if not description or not sound_prompt:
+                    print(
+                        f"Claude response parsing incomplete: description={bool(description)}, "
+                        f"scene={bool(scene != 'other')}, elements={len(ai_elements)}, "
+                        f"sound_prompt={bool(sound_prompt)}"
+                    )
+            else:
+                # We're using fallback values, already set in the except block
+                print("Using fallback values, skipping Claude response parsing")
+
+            # Keep the speculative clip if Claude asks for much the same sounds, else release it
+            if speculative is not None:
+                try:
+                    speculative = speculation.settle(deadline.client(table, request_deadline), speculative,
+                                                     rekognition_response['Labels'], scene, ai_elements, sound_prompt)
+                except Exception as speculation_err:
+                    print(f"Could not settle speculative audio job {speculative['job']}, not using it: {speculation_err}")
+                    print(traceback.format_exc())
+                    speculative = None
 
         # Merge AI-detected elements with Rekognition elements
         combined_elements = list(set(detected_elements + ai_elements))
@@ -304,20 +419,43 @@ def lambda_handler(event, context):
 
         # Update DynamoDB with analysis results
         print("Updating DynamoDB with analysis results")
+        search_terms = search_index.terms(scene, rekognition_response['Labels'], ai_elements)
+        # Stored for similarity lookups (generate_audio adds the image to its buckets once it has
+        # audio of its own), and with a reused soundscape its audio
+        extra_fields = {}
+        if lsh_buckets:
+            extra_fields['labelVector'] = similarity.to_item(label_vector)
+        if speculative is not None:
+            extra_fields['speculation'] = speculation.to_item(speculative)
+        finished = derivatives.result(derivative_task, request_deadline.remaining() - AUDIO_RESERVE_SECONDS)
+        if finished:
+            extra_fields['derivatives'] = finished[1]
+            metering.count('s3', 'put_object', len(finished[1]))
+            metering.add(s3BytesStored=sum(d['bytes'] for d in finished[1]))
+        if reused is not None:
+            extra_fields.update(reusedFrom=reused['imageId'], similarity=Decimal(str(round(reuse_similarity, 3))))
+            extra_fields.update({field: reused[field] for field in ('audioUrl', 'renditions', 'waveform', 'loudnessLufs')
+                                 if reused.get(field) is not None})
         try:
-            table.update_item(
+            db_table = deadline.client(table, request_deadline)
+            update = db_table.update_item(
                 Key={'imageId': image_id},
-                UpdateExpression="set #s=:s, description=:d, scene=:sc, detectedElements=:e, soundPrompt=:p",
+                UpdateExpression="set #s=:s, description=:d, scene=:sc, detectedElements=:e, soundPrompt=:p, degraded=:g, searchTerms=:t"
+                                 + ''.join(f", {field}=:x{index}" for index, field in enumerate(extra_fields)),
                 ExpressionAttributeNames={
                     '#s': 'status'
                 },
-                ExpressionAttributeValues={
+                ExpressionAttributeValues=dict({
                     ':s': 'ANALYZED',
                     ':d': description,
                     ':sc': scene,
                     ':e': combined_elements,
-                    ':p': sound_prompt
-                }
+                    ':p': sound_prompt,
+                    ':g': degraded,
+                    ':t': search_terms
+                }, **{f":x{index}": value for index, value in enumerate(extra_fields.values())}),
+                # A re-analysed image may have lost terms whose postings must go
+                ReturnValues='UPDATED_OLD'
             )
             print("Successfully updated DynamoDB with analysis results")
         except Exception as db_err:
@@ -325,14 +463,21 @@ def lambda_handler(event, context):
             print(traceback.format_exc())
             raise Exception(f"Failed to update analysis results: {str(db_err)}")
 
-        # Return the analysis results for the next step
-        result = {
-            'imageId': image_id,
-            'description': description,
-            'scene': scene,
-            'detectedElements': combined_elements,
-            'soundPrompt': sound_prompt
-        }
+        # Search is secondary: a failed index write leaves the image out of results, not the request failed
+        if SEARCH_INDEX_ENABLED:
+            try:
+                previous_terms = (update.get('Attributes') or {}).get('searchTerms')
+                search_index.TableIndex(db_table, deadline.client(dynamodb, request_deadline)).update(image_id, search_terms, previous_terms)
+                print(f"Indexed {len(search_terms)} search terms")
+            except Exception as index_err:
+                print(f"Failed to update the search index for {image_id}: {index_err}")
+                print(traceback.format_exc())
+
+        # Return the analysis results for the next step; the text stays on the item
+        result = payload.compact(event, scene=scene, elementCount=len(combined_elements), degraded=degraded,
+                                 reusedFrom=reused['imageId'] if reused else None,
+                                 audioUrl=reused['audioUrl'] if reused else None,
+                                 speculativeJob=speculative['job'] if speculative and speculative['hit'] else None)
 
         print(f"Image analysis complete. Scene: {scene}, Elements: {len(combined_elements)}")
 
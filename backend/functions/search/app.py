@@ -0,0 +1,130 @@
+import base64
+import binascii
+import json
+import boto3
+import os
+import traceback
+
+from utils import deadline, payload, profiling, search_index
+
+# Results are ranked by utils.search_index over the posting lists image_to_text
+# keeps in the table; a page deeper than MAX_DEPTH is not served, since each
+# page re-ranks everything above it
+DEFAULT_PAGE_SIZE = int(os.environ.get('SEARCH_PAGE_SIZE', '20'))
+MAX_PAGE_SIZE = int(os.environ.get('SEARCH_MAX_PAGE_SIZE', '50'))
+MAX_DEPTH = int(os.environ.get('SEARCH_MAX_DEPTH', '200'))
+MAX_QUERY_LENGTH = 200
+
+# What a result card shows, as in the gallery
+RESULT_FIELDS = ('imageId', 'createdAt', 'status', 'scene', 'description', 'audioUrl', 'derivatives', 'degraded')
+
+try:
+    dynamodb = boto3.resource('dynamodb')
+    table_name = os.environ.get('TABLE_NAME')
+    table = dynamodb.Table(table_name) if table_name else None
+except Exception as e:
+    print(f"Error initializing DynamoDB: {e}")
+    print(traceback.format_exc())
+
+
+class InvalidRequest(Exception):
+    pass
+
+
+def encode_cursor(offset):
+    """Opaque cursor for the next page: the offset of its first result, base64url JSON"""
+    raw = payload.dumps({'offset': offset}).encode('utf-8')
+    return base64.urlsafe_b64encode(raw).rstrip(b'=').decode('ascii')
+
+
+def decode_cursor(cursor):
+    try:
+        raw = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4))
+        position = json.loads(raw)
+    except (binascii.Error, ValueError):
+        raise InvalidRequest("Invalid cursor")
+    if (not isinstance(position, dict) or set(position) != {'offset'} or not isinstance(position['offset'], int)
+            or not 0 < position['offset'] < MAX_DEPTH):
+        raise InvalidRequest("Invalid cursor")
+    return position['offset']
+
+
+def parse_request(event):
+    params = (event or {}).get('queryStringParameters') or {}
+    query = (params.get('q') or '').strip()
+    if not query:
+        raise InvalidRequest("q is required, e.g. 'beach + seagull' or 'forest without rain'")
+    if len(query) > MAX_QUERY_LENGTH:
+        raise InvalidRequest(f"q must be at most {MAX_QUERY_LENGTH} characters")
+    try:
+        include, exclude = search_index.parse_query(query)
+    except ValueError as err:
+        raise InvalidRequest(str(err))
+    try:
+        limit = int(params.get('limit') or DEFAULT_PAGE_SIZE)
+    except ValueError:
+        raise InvalidRequest("limit must be an integer")
+    if not 1 <= limit <= MAX_PAGE_SIZE:
+        raise InvalidRequest(f"limit must be between 1 and {MAX_PAGE_SIZE}")
+    offset = decode_cursor(params['cursor']) if params.get('cursor') else 0
+    return include, exclude, limit, offset
+
+
+def run_search(index, include, exclude, limit, offset=0):
+    """One page of results ranked by confidence, with the cursor of the next"""
+    depth = min(offset + limit, MAX_DEPTH)
+    found = search_index.search(index, include, exclude, limit=depth, fields=RESULT_FIELDS)
+    items = [payload.plain(item) for item in found['results'][offset:depth]]
+    more = len(found['results']) == depth and depth < MAX_DEPTH
+    return {
+        'query': {'include': include, 'exclude': exclude},
+        'items': items,
+        'nextCursor': encode_cursor(depth) if more else None,
+        'exhaustive': found['exhaustive'],
+        'examined': found['examined']
+    }
+
+
+def response(status_code, body):
+    headers = {
+        'Content-Type': 'application/json',
+        'Access-Control-Allow-Origin': '*',
+        'Access-Control-Allow-Headers': 'Content-Type,X-Amz-Date,Authorization,X-Api-Key,X-Amz-Security-Token,X-Requested-With',
+        'Access-Control-Allow-Methods': 'GET,OPTIONS'
+    }
+    return {'statusCode': status_code, 'headers': headers, 'body': payload.dumps(body)}
+
+
+@profiling.profiled('search')
+def lambda_handler(event, context):
+    """
+    GET /search: finished soundscapes by scene and detected elements, best
+    match first.
+
+    Query parameters: q (required terms, "+"-separated or not, and excluded
+    ones after "without"/"not"/"-", e.g. "beach + seagull" or "forest without
+    rain"), limit (default SEARCH_PAGE_SIZE, at most SEARCH_MAX_PAGE_SIZE) and
+    cursor (the nextCursor of the previous page).
+    """
+    print(f"search lambda_handler invoked with parameters: {(event or {}).get('queryStringParameters')}")
+
+    if table is None:
+        return response(500, {'error': 'System configuration error: Missing table name'})
+
+    try:
+        include, exclude, limit, offset = parse_request(event)
+    except InvalidRequest as err:
+        return response(400, {'error': str(err)})
+
+    try:
+        request_deadline = deadline.start(context)
+        index = search_index.TableIndex(deadline.client(table, request_deadline), deadline.client(dynamodb, request_deadline))
+        page = run_search(index, include, exclude, limit, offset)
+    except Exception as e:
+        print(f"Error searching soundscapes: {e}")
+        print(traceback.format_exc())
+        return response(500, {'error': f'Error searching soundscapes: {str(e)}'})
+
+    print(f"Returning {len(page['items'])} results for {include} without {exclude}, "
+          f"{page['examined']} candidates examined, exhaustive: {page['exhaustive']}")
+    return response(200, dict(page, count=len(page['items'])))
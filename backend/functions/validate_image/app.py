@@ -6,8 +6,10 @@ import sys
 import traceback
 import datetime
 
+from utils import deadline, imaging, metering, payload, profiling
+
 # Add direct console logging for debugging
-print("validate_image module loading without utils dependency...")
+print("validate_image module loading...")
 print(f"Python version: {sys.version}")
 print(f"Environment variables: {os.environ}")
 
@@ -27,10 +29,17 @@ except Exception as e:
 # Image validation constants
 SUPPORTED_FORMATS = ['jpeg', 'jpg', 'png']
 
+class ImageValidationError(Exception):
+    """
+    Raised for uploads that fail validation. The Step Functions error name lets
+    analyze_api answer with a 400 instead of a generic workflow failure.
+    """
+    pass
+
 def format_error_response(status_code, message, event=None):
     """
-    Format a standardized error response.
-    This is a simplified version that doesn't depend on the utils module.
+    Format a standardized error response with CORS headers for API Gateway;
+    a Step Functions invocation gets the error raised instead.
     """
     if event and isinstance(event, dict) and 'httpMethod' in event:
         # This is an API Gateway request
@@ -49,12 +58,17 @@ def format_error_response(status_code, message, event=None):
     else:
         # This is a Step Functions request
         # For Step Functions, we need to throw an exception instead of returning an error response
+        if status_code == 400:
+            raise ImageValidationError(message)
         raise Exception(message)
 
+@profiling.profiled('validate_image')
+@metering.metered('validate_image')
 def lambda_handler(event, context):
     """
-    Validates the image that was already uploaded to S3.
-    This simplified version doesn't depend on utils module.
+    Validates the image that was already uploaded to S3: reads its header with
+    a ranged GET (utils.imaging), records the real format and dimensions on the
+    item, and rejects anything that is not an image within the limits.
     """
     # Direct console logs for debugging
     print(f"validate_image lambda_handler invoked with event: {event}")
@@ -84,6 +98,7 @@ def lambda_handler(event, context):
         s3_key = event['s3Key']
 
         print(f"Processing image ID: {image_id}, S3 Key: {s3_key}")
+        request_deadline = deadline.from_event(event, context)
 
         # Get file extension from S3 key
         try:
@@ -98,24 +113,19 @@ def lambda_handler(event, context):
             print(f"Error extracting image format: {format_err}")
             return format_error_response(400, f"Error determining image format: {str(format_err)}", event)
 
-        # SKIPPING PILLOW VALIDATION
-        # Instead of downloading and validating with Pillow, 
-        # we'll just check that the object exists in S3
+        # Read only the first few KB and parse the header with Pillow, so corrupt,
+        # oversized or non-image uploads are rejected before any paid call
         try:
-            print(f"Checking if image exists in S3: {images_bucket}/{s3_key}")
-            # Use head_object instead of get_object to avoid downloading the whole file
-            s3.head_object(
-                Bucket=images_bucket,
-                Key=s3_key
-            )
-            print("Image exists in S3")
-
-            # Set dimensions to unknown since we're skipping Pillow
-            dimensions = "unknown (Pillow validation skipped)"
-
-            print("Basic image validation successful (Pillow validation skipped)")
+            print(f"Probing image header in S3: {images_bucket}/{s3_key}")
+            image_info = imaging.probe_s3_object(deadline.client(s3, request_deadline), images_bucket, s3_key)
+            dimensions = f"{image_info['width']}x{image_info['height']}"
+            image_format = image_info['format']
+            print(f"Image header valid. Format: {image_format}, Dimensions: {dimensions}, Size: {image_info['sizeBytes']} bytes")
+        except imaging.ImageRejected as reject_err:
+            print(f"Image rejected: {reject_err}")
+            return format_error_response(400, f"Invalid image: {str(reject_err)}", event)
         except Exception as s3_err:
-            print(f"Failed to verify image in S3: {s3_err}")
+            print(f"Failed to read image from S3: {s3_err}")
             print(traceback.format_exc())
             return format_error_response(500, f"Could not access image from storage: {str(s3_err)}", event)
 
@@ -123,18 +133,26 @@ def lambda_handler(event, context):
         print("Creating/updating entry in DynamoDB")
         try:
             timestamp = int(datetime.datetime.now().timestamp())
-            table.update_item(
+            # The empty usage map lets each later stage record its usage (utils.metering) in one write
+            deadline.client(table, request_deadline).update_item(
                 Key={'imageId': image_id},
-                UpdateExpression="set #s=:s, s3Key=:k, createdAt=:t, #f=:f",
+                UpdateExpression="set #s=:s, s3Key=:k, createdAt=:t, #f=:f, dimensions=:d, width=:w, height=:h, sizeBytes=:b, "
+                                 "#u=if_not_exists(#u, :u)",
                 ExpressionAttributeNames={
                     '#s': 'status',
-                    '#f': 'format'
+                    '#f': 'format',
+                    '#u': 'usage'
                 },
                 ExpressionAttributeValues={
                     ':s': 'PROCESSING',
                     ':k': s3_key,
                     ':t': timestamp,
-                    ':f': image_format
+                    ':f': image_format,
+                    ':d': dimensions,
+                    ':w': image_info['width'],
+                    ':h': image_info['height'],
+                    ':b': image_info['sizeBytes'],
+                    ':u': {}
                 }
             )
             print(f"Successfully updated DynamoDB entry. Timestamp: {timestamp}")
@@ -147,10 +165,16 @@ def lambda_handler(event, context):
         print("Image validation complete, proceeding to processing")
 
         # Return data for the next step in the Step Functions workflow
-        return {
-            'imageId': image_id,
-            's3Key': s3_key
-        }
+        return payload.compact(
+            event,
+            imageId=image_id,
+            s3Key=s3_key,
+            format=image_format,
+            width=image_info['width'],
+            height=image_info['height']
+        )
+    except ImageValidationError:
+        raise
     except Exception as e:
         print(f"Unhandled error in validate_image: {e}")
         print(traceback.format_exc())
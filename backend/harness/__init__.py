@@ -0,0 +1,5 @@
+"""
+What the benchmarks and the self-hosted server share to run the handlers
+without Lambda: the handler loader (harness.handlers) and in-memory
+stand-ins for AWS and ElevenLabs (harness.stubs).
+"""
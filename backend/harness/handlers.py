@@ -0,0 +1,63 @@
+"""
+The Lambda handlers of functions/*/app.py, loaded outside Lambda.
+
+Shared by the benchmarks' in-memory pipeline and the self-hosted server:
+load_handler() imports a function the way its Lambda package would, and
+LocalContext stands in for the Lambda context the handlers read their
+remaining time from.
+"""
+import contextlib
+import importlib.util
+import io
+import os
+import sys
+import time
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+FUNCTIONS_DIR = os.path.join(BACKEND_DIR, 'functions')
+LAYER_DIRS = [os.path.join(BACKEND_DIR, 'layers', name, 'python') for name in ('utils', 'pillow')]
+
+# Order of the Step Functions states the local executors (benchmarks.pipeline, server.runtime) run
+WORKFLOW_STAGES = ['validate_image', 'image_to_text', 'generate_audio', 'final_response']
+
+
+def load_handler(name):
+    """
+    Import functions/<name>/app.py as an isolated module. The function's own
+    directory is put first on sys.path while importing so sibling modules
+    resolve the way they do in the Lambda package.
+    """
+    function_dir = os.path.join(FUNCTIONS_DIR, name)
+    path = os.path.join(function_dir, 'app.py')
+
+    for layer in LAYER_DIRS:
+        if os.path.isdir(layer) and layer not in sys.path:
+            sys.path.append(layer)
+
+    # Sibling modules of a previously loaded function must not shadow this one's
+    siblings = {f[:-3] for f in os.listdir(function_dir) if f.endswith('.py') and f != 'app.py'}
+    for module in siblings:
+        sys.modules.pop(module, None)
+
+    sys.path.insert(0, function_dir)
+    try:
+        spec = importlib.util.spec_from_file_location(f"soundscape_{name}", path)
+        module = importlib.util.module_from_spec(spec)
+        with contextlib.redirect_stdout(io.StringIO()):
+            spec.loader.exec_module(module)
+    finally:
+        sys.path.remove(function_dir)
+    return module
+
+
+class LocalContext:
+    """Minimal Lambda context object"""
+
+    def __init__(self, function_name, timeout_seconds=30.0):
+        self.function_name = function_name
+        self.aws_request_id = f"local-{function_name}"
+        self.memory_limit_in_mb = 1024
+        self._deadline = time.time() + timeout_seconds
+
+    def get_remaining_time_in_millis(self):
+        return max(0, int((self._deadline - time.time()) * 1000))
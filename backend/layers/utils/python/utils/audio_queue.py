@@ -0,0 +1,304 @@
+"""
+Queued ElevenLabs generation with deduplication and backpressure.
+
+ElevenLabs caps concurrent generations per account, so during a traffic
+spike an inline call per request turns into 429s and timeouts. With
+AUDIO_QUEUE_URL set, the generate_audio stage submits a job to SQS and waits
+for it instead. Workers (generate_audio.worker_handler behind an SQS event
+source mapping whose MaximumConcurrency is AUDIO_MAX_CONCURRENCY) are the
+only callers of ElevenLabs, so a spike becomes queueing delay, not errors.
+
+Jobs are keyed by a hash of the generation request. The first submitter of a
+prompt creates the `audiojob#<hash>` item and sends the message; identical
+prompts submitted while that job is queued, running or recently completed
+attach to the same item instead of generating again. Waiters poll the item;
+one that no longer wants the clip releases it (release()), which cancels a
+job still queued for nobody else. The worker stores the clip once at
+audio/jobs/<hash>.mp3, and every waiter renders its own renditions from it.
+
+analyze_api calls pressure() before starting a workflow. It compares the
+approximate queue depth (cached for a few seconds) with what the workers can
+drain within part of AUDIO_JOB_WAIT_SECONDS and sheds load with a Retry-After
+instead of accepting requests whose audio could not be made in time.
+"""
+import hashlib
+import json
+import os
+import threading
+import time
+
+from botocore.exceptions import ClientError
+
+from utils import metrics
+
+QUEUE_URL = os.environ.get('AUDIO_QUEUE_URL')
+# Must match the worker event source mapping's MaximumConcurrency
+MAX_CONCURRENCY = int(os.environ.get('AUDIO_MAX_CONCURRENCY', '4'))
+# How long a workflow waits for its job before completing without audio
+JOB_WAIT_SECONDS = float(os.environ.get('AUDIO_JOB_WAIT_SECONDS', '60'))
+# Typical ElevenLabs generation time, used to turn queue depth into a wait estimate
+SERVICE_SECONDS = float(os.environ.get('AUDIO_SERVICE_SECONDS', '10'))
+# Deliveries of one job before the worker gives up on it
+MAX_ATTEMPTS = int(os.environ.get('AUDIO_JOB_MAX_ATTEMPTS', '3'))
+# Completed jobs are reused by identical prompts for this long, then removed by TTL
+JOB_TTL_SECONDS = int(os.environ.get('AUDIO_JOB_TTL_SECONDS', '900'))
+# Share of the wait budget the current backlog may use when admitting a request;
+# the rest covers requests already accepted but still in Rekognition/Bedrock
+ADMISSION_FRACTION = float(os.environ.get('AUDIO_ADMISSION_FRACTION', '0.5'))
+DEPTH_CACHE_SECONDS = float(os.environ.get('AUDIO_QUEUE_DEPTH_CACHE_SECONDS', '2'))
+POLL_MAX_SECONDS = 0.5
+
+JOB_QUEUED = 'QUEUED'
+JOB_RUNNING = 'RUNNING'
+JOB_COMPLETED = 'COMPLETED'
+JOB_FAILED = 'FAILED'
+
+RELEASE_CANCELLED = 'cancelled'
+RELEASE_SHARED = 'shared'
+RELEASE_STARTED = 'started'
+
+PRESSURE_OK = 'ok'
+PRESSURE_BUSY = 'busy'
+PRESSURE_FULL = 'full'
+
+_depth_cache = {'value': None, 'expires': 0.0}
+_depth_lock = threading.Lock()
+
+
+def enabled():
+    return bool(QUEUE_URL)
+
+
+def job_id(generation):
+    """Stable id for a generation request (prompt text and parameters)"""
+    canonical = json.dumps(generation, sort_keys=True, separators=(',', ':'))
+    return hashlib.sha256(canonical.encode('utf-8')).hexdigest()[:32]
+
+
+def _item_key(job):
+    return {'imageId': f"audiojob#{job}"}
+
+
+def audio_key(job):
+    return f"audio/jobs/{job}.mp3"
+
+
+def _is_conditional_failure(err):
+    return isinstance(err, ClientError) and err.response.get('Error', {}).get('Code') == 'ConditionalCheckFailedException'
+
+
+def submit(table, sqs, generation, image_id=None, deadline_ms=None, stage=None):
+    """
+    Queue a generation unless an identical one is already queued, running or
+    recently completed. Returns (job id, created).
+
+    deadline_ms is the submitting request's deadline (utils.deadline). The job
+    keeps the latest of its waiters' deadlines, and a worker that picks it up
+    after that skips the generation. stage names the usage the worker records
+    on image_id's item (utils.metering), audio_worker by default.
+    """
+    job = job_id(generation)
+    now = time.time()
+    try:
+        table.put_item(
+            Item=dict(
+                _item_key(job),
+                jobId=job,
+                jobState=JOB_QUEUED,
+                enqueuedAtMs=int(now * 1000),
+                firstImageId=image_id,
+                attempts=0,
+                waiters=1,
+                deadlineMs=deadline_ms,
+                meterStage=stage,
+                expiresAt=int(now) + JOB_TTL_SECONDS
+            ),
+            ConditionExpression="attribute_not_exists(imageId) OR jobState = :failed OR expiresAt < :now",
+            ExpressionAttributeValues={':failed': JOB_FAILED, ':now': int(now)}
+        )
+    except ClientError as err:
+        if not _is_conditional_failure(err):
+            raise
+        # An identical prompt is already in flight or done: share its clip
+        _attach(table, job, deadline_ms)
+        metrics.emit({'AudioJobsDeduplicated': 1}, dimensions={'Queue': 'audio'})
+        print(f"Attached to existing audio job {job}")
+        return job, False
+
+    try:
+        sqs.send_message(
+            QueueUrl=QUEUE_URL,
+            MessageBody=json.dumps({'jobId': job, 'generation': generation, 'enqueuedAtMs': int(now * 1000)})
+        )
+    except Exception as err:
+        fail(table, job, f"Could not enqueue audio job: {err}")
+        raise
+    metrics.emit({'AudioJobsSubmitted': 1}, dimensions={'Queue': 'audio'})
+    print(f"Queued audio job {job}")
+    return job, True
+
+
+def _attach(table, job, deadline_ms):
+    """Count another waiter and extend the job's deadline to cover it"""
+    if deadline_ms is not None:
+        try:
+            table.update_item(
+                Key=_item_key(job),
+                UpdateExpression="SET deadlineMs = :deadline ADD waiters :one",
+                ConditionExpression="attribute_not_exists(deadlineMs) OR deadlineMs < :deadline",
+                ExpressionAttributeValues={':deadline': deadline_ms, ':one': 1}
+            )
+            return
+        except ClientError as err:
+            if not _is_conditional_failure(err):
+                raise
+    # The job already runs to a later deadline
+    table.update_item(Key=_item_key(job), UpdateExpression="ADD waiters :one", ExpressionAttributeValues={':one': 1})
+
+
+def wait(table, job, timeout):
+    """
+    Poll the job until it completes or fails. Returns the job item, or None
+    if it is still pending after timeout seconds.
+    """
+    deadline = time.time() + max(0.0, timeout)
+    delay = 0.05
+    while True:
+        item = table.get_item(Key=_item_key(job), ConsistentRead=True).get('Item')
+        if item and item.get('jobState') in (JOB_COMPLETED, JOB_FAILED):
+            return item
+        if time.time() + delay > deadline:
+            return None
+        time.sleep(delay)
+        delay = min(delay * 2, POLL_MAX_SECONDS)
+
+
+def start(table, job):
+    """
+    Mark a delivered job as running. Returns the updated item, or None when
+    the job is already finished (a duplicate or late delivery).
+    """
+    try:
+        return table.update_item(
+            Key=_item_key(job),
+            UpdateExpression="SET jobState = :running, startedAtMs = :now ADD attempts :one",
+            ConditionExpression="jobState = :queued OR jobState = :running",
+            ExpressionAttributeValues={
+                ':running': JOB_RUNNING,
+                ':queued': JOB_QUEUED,
+                ':now': int(time.time() * 1000),
+                ':one': 1
+            },
+            ReturnValues='ALL_NEW'
+        ).get('Attributes')
+    except ClientError as err:
+        if _is_conditional_failure(err):
+            return None
+        raise
+
+
+def complete(table, job, key, started_ms, enqueued_ms):
+    """Record the clip and the job's wait and service times"""
+    finished_ms = int(time.time() * 1000)
+    wait_ms = max(0, started_ms - enqueued_ms)
+    service_ms = max(0, finished_ms - started_ms)
+    table.update_item(
+        Key=_item_key(job),
+        UpdateExpression="SET jobState = :done, audioKey = :key, finishedAtMs = :now, waitMs = :wait, serviceMs = :service",
+        ExpressionAttributeValues={
+            ':done': JOB_COMPLETED,
+            ':key': key,
+            ':now': finished_ms,
+            ':wait': wait_ms,
+            ':service': service_ms
+        }
+    )
+    metrics.emit(
+        {'AudioJobWaitTime': wait_ms, 'AudioJobServiceTime': service_ms},
+        dimensions={'Queue': 'audio'},
+        units={'AudioJobWaitTime': 'Milliseconds', 'AudioJobServiceTime': 'Milliseconds'}
+    )
+    return {'waitMs': wait_ms, 'serviceMs': service_ms}
+
+
+def fail(table, job, error):
+    """Mark the job failed; waiters fall back and the next identical prompt queues a new job"""
+    try:
+        table.update_item(
+            Key=_item_key(job),
+            UpdateExpression="SET jobState = :failed, jobError = :error, finishedAtMs = :now",
+            ExpressionAttributeValues={':failed': JOB_FAILED, ':error': str(error)[:500], ':now': int(time.time() * 1000)}
+        )
+    except Exception as err:
+        print(f"Failed to mark audio job {job} failed: {err}")
+    metrics.emit({'AudioJobsFailed': 1}, dimensions={'Queue': 'audio'})
+
+
+def release(table, job):
+    """
+    Drop a waiter that no longer wants the clip (utils.speculation). The job
+    is cancelled when it is still queued and nobody else waits for it, so the
+    worker skips its delivery. Returns RELEASE_CANCELLED, RELEASE_SHARED
+    (other requests still wait for it) or RELEASE_STARTED (already generating
+    or done, and paid for).
+    """
+    now = int(time.time() * 1000)
+    try:
+        table.update_item(
+            Key=_item_key(job),
+            UpdateExpression="SET jobState = :failed, jobError = :error, finishedAtMs = :now ADD waiters :minus",
+            ConditionExpression="jobState = :queued AND waiters <= :one",
+            ExpressionAttributeValues={':failed': JOB_FAILED, ':queued': JOB_QUEUED, ':error': 'Cancelled by its waiter',
+                                       ':now': now, ':minus': -1, ':one': 1}
+        )
+        metrics.emit({'AudioJobsCancelled': 1}, dimensions={'Queue': 'audio'})
+        return RELEASE_CANCELLED
+    except ClientError as err:
+        if not _is_conditional_failure(err):
+            raise
+    item = table.update_item(Key=_item_key(job), UpdateExpression="ADD waiters :minus",
+                             ExpressionAttributeValues={':minus': -1}, ReturnValues='ALL_NEW').get('Attributes') or {}
+    return RELEASE_SHARED if int(item.get('waiters') or 0) > 0 else RELEASE_STARTED
+
+
+def queue_depth(sqs):
+    """(visible, in flight) message counts, cached for DEPTH_CACHE_SECONDS"""
+    now = time.time()
+    with _depth_lock:
+        if _depth_cache['value'] is not None and now < _depth_cache['expires']:
+            return _depth_cache['value']
+    attributes = sqs.get_queue_attributes(
+        QueueUrl=QUEUE_URL,
+        AttributeNames=['ApproximateNumberOfMessages', 'ApproximateNumberOfMessagesNotVisible']
+    )['Attributes']
+    value = (int(attributes.get('ApproximateNumberOfMessages', 0)),
+             int(attributes.get('ApproximateNumberOfMessagesNotVisible', 0)))
+    with _depth_lock:
+        _depth_cache.update(value=value, expires=now + DEPTH_CACHE_SECONDS)
+    return value
+
+
+def pressure(sqs):
+    """
+    Backpressure signal for new requests: 'state' is ok, busy (jobs are
+    waiting for a worker) or full (a new job would not finish within its
+    share of AUDIO_JOB_WAIT_SECONDS); 'retryAfter' is the estimated time in
+    seconds until it would.
+    """
+    visible, in_flight = queue_depth(sqs)
+    # Jobs ahead of a new one, drained MAX_CONCURRENCY at a time
+    estimated_wait = (visible + in_flight) / max(1, MAX_CONCURRENCY) * SERVICE_SECONDS
+    budget = JOB_WAIT_SECONDS * ADMISSION_FRACTION
+    if estimated_wait + SERVICE_SECONDS > budget:
+        state = PRESSURE_FULL
+    elif visible > 0:
+        state = PRESSURE_BUSY
+    else:
+        state = PRESSURE_OK
+    return {
+        'state': state,
+        'queued': visible,
+        'inFlight': in_flight,
+        'estimatedWaitSeconds': round(estimated_wait, 1),
+        'retryAfter': max(1, int(estimated_wait + SERVICE_SECONDS - budget + 1)) if state == PRESSURE_FULL else 0
+    }
@@ -0,0 +1,230 @@
+"""
+Traffic capture for offline replay.
+
+Handlers decorated with captured() record the shape of their input, every
+downstream call wrapped in call() (timing, error and a compact summary of
+the response) and their own outcome. Sampling is decided per imageId by
+hashing, so every stage of a sampled request is captured and the rest cost
+one env check. Request shapes and call summaries that cost something to
+compute (an image digest) are passed as callables and only evaluated for a
+recording that is written.
+
+Configuration (environment):
+    CAPTURE_SAMPLE_RATE  fraction of imageIds to capture (default 0 = off)
+    CAPTURE_DIR          append JSON lines to <dir>/<function>.jsonl (local runs)
+    CAPTURE_BUCKET       otherwise upload one object per invocation here
+    CAPTURE_PREFIX       key prefix for uploads (default captures/)
+"""
+import contextvars
+import datetime
+import functools
+import hashlib
+import json
+import os
+import threading
+import time
+
+from utils import metering
+
+FORMAT_VERSION = 1
+
+CAPTURE_SAMPLE_RATE = float(os.environ.get('CAPTURE_SAMPLE_RATE') or 0)
+CAPTURE_DIR = os.environ.get('CAPTURE_DIR')
+CAPTURE_BUCKET = os.environ.get('CAPTURE_BUCKET')
+CAPTURE_PREFIX = os.environ.get('CAPTURE_PREFIX', 'captures/')
+
+# Strings longer than this are recorded by length only
+MAX_STRING_CHARS = 2000
+
+_current = contextvars.ContextVar('soundscape_capture', default=None)
+_file_lock = threading.Lock()
+_s3 = None
+
+
+def sampled(image_id, rate=None):
+    """Deterministic per-imageId sampling decision shared by every stage"""
+    rate = CAPTURE_SAMPLE_RATE if rate is None else rate
+    if rate <= 0 or not image_id:
+        return False
+    if rate >= 1:
+        return True
+    bucket = int(hashlib.sha1(str(image_id).encode('utf-8')).hexdigest()[:8], 16)
+    return bucket / 0xffffffff < rate
+
+
+def shape(value):
+    """Compact description of an event: short strings verbatim, large ones by length"""
+    if isinstance(value, dict):
+        return {k: shape(v) for k, v in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [shape(v) for v in value[:50]]
+    if isinstance(value, str) and len(value) > MAX_STRING_CHARS:
+        return {'len': len(value)}
+    if isinstance(value, (bytes, bytearray)):
+        return {'bytes': len(value)}
+    if isinstance(value, (str, int, float, bool)) or value is None:
+        return value
+    return str(value)
+
+
+def digest(data):
+    """Short content digest used to recognise repeated images across requests"""
+    return hashlib.sha256(data).hexdigest()[:16]
+
+
+class _Call:
+    """Timing context for one downstream call; set .response to a compact summary"""
+
+    def __init__(self, recording, service, operation):
+        self.recording = recording
+        self.service = service
+        self.operation = operation
+        self.response = None
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        elapsed = time.perf_counter() - self.start
+        self.recording.calls.append({
+            'svc': self.service,
+            'op': self.operation,
+            't': round((self.start - self.recording.perf_start) * 1000, 2),
+            'ms': round(elapsed * 1000, 2),
+            'err': type(exc).__name__ if exc else None,
+            'res': self.response
+        })
+        return False
+
+
+class _NullCall:
+    """Shared do-nothing call context used when capture is off"""
+
+    response = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        return False
+
+    def __setattr__(self, name, value):
+        pass
+
+
+_NULL_CALL = _NullCall()
+
+
+class Recording:
+    def __init__(self, function, event):
+        self.function = function
+        self.started = time.time()
+        self.perf_start = time.perf_counter()
+        self.image_id = event.get('imageId') if isinstance(event, dict) else None
+        self.request = None
+        self.annotations = {}
+        self.calls = []
+        self.event = event
+
+    def to_record(self, result, error):
+        request = _resolve(self.request) if self.request is not None else shape(self.event)
+        for call in self.calls:
+            call['res'] = _resolve(call['res'])
+        return {
+            'v': FORMAT_VERSION,
+            'fn': self.function,
+            'id': self.image_id,
+            'ts': round(self.started, 3),
+            'ms': round((time.perf_counter() - self.perf_start) * 1000, 2),
+            'ok': error is None,
+            'err': f"{type(error).__name__}: {error}"[:300] if error else None,
+            'status': result.get('statusCode') if isinstance(result, dict) else None,
+            'req': request,
+            'ann': self.annotations,
+            'calls': self.calls
+        }
+
+
+def captured(function_name):
+    """Decorator for a lambda_handler that records sampled invocations"""
+    def decorator(handler):
+        @functools.wraps(handler)
+        def wrapper(event, context):
+            if CAPTURE_SAMPLE_RATE <= 0:
+                return handler(event, context)
+
+            recording = Recording(function_name, event)
+            token = _current.set(recording)
+            result = error = None
+            try:
+                result = handler(event, context)
+                return result
+            except Exception as exc:
+                error = exc
+                raise
+            finally:
+                _current.reset(token)
+                if sampled(recording.image_id):
+                    _write(recording.to_record(result, error))
+        return wrapper
+    return decorator
+
+
+def _resolve(value):
+    return value() if callable(value) else value
+
+
+def annotate(image_id=None, request=None, **fields):
+    """
+    Attach the imageId (when the handler creates it), a request shape, or
+    extra fields. request may be a callable, evaluated only if the recording
+    is written.
+    """
+    recording = _current.get()
+    if recording is None:
+        return
+    if image_id:
+        recording.image_id = image_id
+    if request is not None:
+        recording.request = request
+    recording.annotations.update(fields)
+
+
+def call(service, operation):
+    """
+    Context manager timing a downstream call in the current recording; also
+    counted by utils.metering unless its before-call handler counts the
+    service. Set .response to a compact summary, or to a callable returning
+    one when it is costly to compute.
+    """
+    if service not in metering.HOOKED_SERVICES:
+        metering.count(service, operation)
+    recording = _current.get()
+    if recording is None:
+        return _NULL_CALL
+    return _Call(recording, service, operation)
+
+
+def _write(record):
+    line = json.dumps(record, separators=(',', ':'), default=str)
+    try:
+        if CAPTURE_DIR:
+            os.makedirs(CAPTURE_DIR, exist_ok=True)
+            with _file_lock, open(os.path.join(CAPTURE_DIR, f"{record['fn']}.jsonl"), 'a') as f:
+                f.write(line + '\n')
+        elif CAPTURE_BUCKET:
+            global _s3
+            if _s3 is None:
+                import boto3
+                _s3 = boto3.client('s3')
+            day = datetime.datetime.utcfromtimestamp(record['ts']).strftime('%Y/%m/%d')
+            _s3.put_object(
+                Bucket=CAPTURE_BUCKET,
+                Key=f"{CAPTURE_PREFIX}{day}/{record['fn']}/{record['id']}-{int(record['ts'] * 1000)}.json",
+                Body=line.encode('utf-8'),
+                ContentType='application/json'
+            )
+    except Exception as err:
+        # Capture must never fail the request it is observing
+        print(f"Failed to write traffic capture: {err}")
@@ -0,0 +1,223 @@
+"""
+Request deadlines carried through the workflow.
+
+analyze_api starts each request with REQUEST_BUDGET_SECONDS (API Gateway's
+29 s integration limit, less a margin), capped by its own remaining Lambda
+time, and passes the end of that budget as `deadlineMs` (epoch milliseconds)
+in the workflow input. Every stage rebuilds the deadline from its payload and
+its own Lambda context, whichever ends first, and derives from what is left:
+
+- read timeouts for HTTP calls (timeout()) and boto3 clients (client())
+- how many attempts a boto3 call may make (attempts())
+- whether an expensive step is still worth starting (allows())
+
+A step that cannot finish in time is skipped the way it is while its circuit
+breaker is open, so the request completes degraded instead of producing a
+result after the caller has stopped waiting.
+"""
+import os
+import threading
+import time
+
+import boto3
+from botocore.config import Config
+
+BUDGET_SECONDS = float(os.environ.get('REQUEST_BUDGET_SECONDS', '28'))
+# Kept back by analyze_api to answer after the workflow returns
+RESPONSE_RESERVE_SECONDS = float(os.environ.get('DEADLINE_RESPONSE_RESERVE_SECONDS', '1'))
+CONNECT_TIMEOUT_SECONDS = float(os.environ.get('DEADLINE_CONNECT_TIMEOUT_SECONDS', '2'))
+MAX_ATTEMPTS = int(os.environ.get('DEADLINE_MAX_ATTEMPTS', '3'))
+# Shortest timeout handed out; a call with less time than this is not worth making
+MIN_TIMEOUT_SECONDS = 0.5
+
+# Client read timeouts are rounded down to one of these so a container keeps a
+# handful of clients per service instead of one per request
+TIMEOUT_STEPS = (1, 2, 3, 4, 6, 8, 10, 12, 15, 18, 21, 24, 27, 30, 45, 60)
+
+# Read timeout per attempt for short calls, so the budget buys retries rather
+# than one long wait; other services (Bedrock, Step Functions) get all of it
+CALL_TIMEOUTS = {
+    'dynamodb': float(os.environ.get('DEADLINE_DYNAMODB_TIMEOUT_SECONDS', '2')),
+    's3': float(os.environ.get('DEADLINE_S3_TIMEOUT_SECONDS', '6')),
+    'rekognition': float(os.environ.get('DEADLINE_REKOGNITION_TIMEOUT_SECONDS', '4')),
+    'sqs': 2.0,
+    'ssm': 2.0
+}
+
+_clients = {}
+_clients_lock = threading.Lock()
+# One session builds every variant: it caches the service models and the
+# credential chain, so a new variant costs a client, not a session. Sessions
+# are not thread-safe, so variants are built one at a time under this lock,
+# which lookups of existing variants never wait on.
+_session = None
+_session_lock = threading.Lock()
+# botocore before-call handlers given to on_call(), registered on _session when it is created
+_call_handlers = []
+
+
+class Deadline:
+    """The end of a request's budget, as an absolute epoch time"""
+
+    def __init__(self, expires_at):
+        self.expires_at = expires_at
+
+    @property
+    def epoch_ms(self):
+        return int(self.expires_at * 1000)
+
+    def remaining(self):
+        """Seconds left, never negative"""
+        return max(0.0, self.expires_at - time.time())
+
+    def expired(self):
+        return self.remaining() <= 0
+
+    def allows(self, seconds):
+        """Whether a step expected to take `seconds` can still finish in time"""
+        return self.remaining() >= seconds
+
+    def timeout(self, default=None, reserve=0.0):
+        """
+        A timeout for one call: what is left after `reserve` (time needed for
+        the work that follows), capped at `default`, and never below
+        MIN_TIMEOUT_SECONDS.
+        """
+        seconds = self.remaining() - reserve
+        if default is not None:
+            seconds = min(seconds, default)
+        return max(MIN_TIMEOUT_SECONDS, seconds)
+
+    def attempts(self, per_attempt, maximum=MAX_ATTEMPTS):
+        """How many attempts of `per_attempt` seconds fit in the remaining time"""
+        return max(1, min(maximum, int(self.remaining() // max(per_attempt, MIN_TIMEOUT_SECONDS))))
+
+    def __repr__(self):
+        return f"Deadline(remaining={self.remaining():.2f}s)"
+
+
+def _context_end(context, reserve):
+    if context is None or not hasattr(context, 'get_remaining_time_in_millis'):
+        return None
+    return time.time() + context.get_remaining_time_in_millis() / 1000.0 - reserve
+
+
+def start(context=None, budget=None, reserve=None):
+    """
+    A new request deadline: the budget or the Lambda's remaining time,
+    whichever is shorter, less reserve (RESPONSE_RESERVE_SECONDS by default)
+    """
+    reserve = RESPONSE_RESERVE_SECONDS if reserve is None else reserve
+    ends = time.time() + (BUDGET_SECONDS if budget is None else budget) - reserve
+    context_end = _context_end(context, reserve)
+    return Deadline(min(ends, context_end) if context_end is not None else ends)
+
+
+def from_event(event, context=None, reserve=0.0):
+    """
+    The deadline a stage runs under: the request's `deadlineMs` or this
+    Lambda's own remaining time less reserve, whichever is sooner. Events
+    without a deadline (executions started before it was propagated) get a
+    fresh budget.
+    """
+    ends = []
+    if isinstance(event, dict) and event.get('deadlineMs'):
+        ends.append(int(event['deadlineMs']) / 1000.0)
+    context_end = _context_end(context, reserve)
+    if context_end is not None:
+        ends.append(context_end)
+    return Deadline(min(ends)) if ends else start(reserve=0.0)
+
+
+def _step(seconds):
+    """Largest TIMEOUT_STEPS value not above seconds"""
+    chosen = TIMEOUT_STEPS[0]
+    for step in TIMEOUT_STEPS:
+        if step <= seconds:
+            chosen = step
+    return chosen
+
+
+def _shared_session():
+    global _session
+    if _session is None:
+        _session = boto3.session.Session()
+        for handler in _call_handlers:
+            _session.events.register('before-call', handler)
+    return _session
+
+
+def on_call(handler):
+    """
+    Register a botocore before-call handler, which runs once per operation
+    (not per retry attempt), on the default boto3 session and on the session
+    client() builds its variants from. A client copies its session's handlers
+    when it is created, so register before the module-level clients are.
+    """
+    if boto3.DEFAULT_SESSION is None:
+        boto3.setup_default_session()
+    with _session_lock:
+        _call_handlers.append(handler)
+        for session in (boto3.DEFAULT_SESSION, _session):
+            if session is not None:
+                session.events.register('before-call', handler)
+
+
+def call_handlers():
+    """The handlers given to on_call(), for stand-in clients that emit no botocore events"""
+    return tuple(_call_handlers)
+
+
+def client(base, deadline, reserve=0.0, timeout=None, attempts=None):
+    """
+    `base` (a boto3 client, DynamoDB Table or the DynamoDB service resource,
+    which BatchGetItem needs) with its read timeout and
+    retries bounded by the deadline: each attempt gets the service's
+    CALL_TIMEOUTS entry (or `timeout`) but no more than what is left after
+    `reserve`, and as many attempts as fit. Read timeouts are rounded down to
+    TIMEOUT_STEPS and the variants are cached per container and built from
+    one shared session, so this costs a dictionary lookup after the first
+    request and a client, not a session, before it. Objects that are not botocore
+    clients are returned unchanged. A proxy with rewrap() (the server's
+    concurrency limits) is applied to the bounded client as well.
+    """
+    if hasattr(base, 'rewrap'):
+        return base.rewrap(client(base.target, deadline, reserve, timeout, attempts))
+    table_name = getattr(base, 'table_name', None)
+    resource = hasattr(getattr(base, 'meta', None), 'resource_model')
+    low_level = base.meta.client if resource else base
+    base_config = getattr(getattr(low_level, 'meta', None), 'config', None)
+    if not isinstance(base_config, Config):
+        return base
+
+    service = low_level.meta.service_model.service_name
+    read_timeout = _step(deadline.timeout(timeout or CALL_TIMEOUTS.get(service), reserve))
+    if attempts is None:
+        attempts = deadline.attempts(read_timeout + CONNECT_TIMEOUT_SECONDS)
+    key = (id(low_level), resource, table_name, read_timeout, attempts)
+    with _clients_lock:
+        bounded = _clients.get(key)
+    if bounded is not None:
+        return bounded
+
+    with _session_lock:
+        bounded = _clients.get(key)
+        if bounded is None:
+            config = base_config.merge(Config(
+                connect_timeout=min(CONNECT_TIMEOUT_SECONDS, read_timeout),
+                read_timeout=read_timeout,
+                retries={'total_max_attempts': attempts, 'mode': 'standard'}
+            ))
+            meta = low_level.meta
+            session = _shared_session()
+            if resource:
+                bounded = session.resource(meta.service_model.service_name, region_name=meta.region_name,
+                                           endpoint_url=meta.endpoint_url, config=config)
+                if table_name:
+                    bounded = bounded.Table(table_name)
+            else:
+                bounded = session.client(service, region_name=meta.region_name,
+                                         endpoint_url=meta.endpoint_url, config=config)
+            with _clients_lock:
+                _clients[key] = bounded
+    return bounded
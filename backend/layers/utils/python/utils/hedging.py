@@ -0,0 +1,188 @@
+"""
+Hedged requests for tail-latency-sensitive downstream calls.
+
+A hedged call starts the primary request and waits up to an adaptive delay,
+the HEDGE_PERCENTILE of recent primary latencies. If the primary has not
+finished by then, a second request goes to an alternate endpoint (another
+region or model), and whichever succeeds first wins. A token bucket caps
+hedges at HEDGE_BUDGET of calls, so a slow downstream cannot double our
+load on it. The losing request cannot be cancelled once it is in flight, so
+it finishes in the background and its result is discarded. A primary that
+finishes late still updates the latency estimate.
+"""
+import os
+import threading
+import time
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+from utils import metrics
+
+
+def _env(name, default, cast=float):
+    value = os.environ.get(name)
+    return cast(value) if value not in (None, '') else default
+
+
+class LatencyTracker:
+    """Recent successful primary latencies and a percentile over them"""
+
+    def __init__(self, size=200):
+        self._samples = deque(maxlen=size)
+        self._lock = threading.Lock()
+
+    def add(self, seconds):
+        with self._lock:
+            self._samples.append(seconds)
+
+    def __len__(self):
+        return len(self._samples)
+
+    def percentile(self, pct):
+        with self._lock:
+            samples = sorted(self._samples)
+        if not samples:
+            return None
+        index = min(len(samples) - 1, max(0, int(round(pct / 100.0 * len(samples))) - 1))
+        return samples[index]
+
+
+class HedgeBudget:
+    """Token bucket: each call earns `rate` tokens (up to `burst`), each hedge spends one"""
+
+    def __init__(self, rate, burst=5.0):
+        self.rate = rate
+        self.burst = burst
+        self._tokens = 1.0
+        self._lock = threading.Lock()
+
+    def earn(self):
+        with self._lock:
+            self._tokens = min(self.burst, self._tokens + self.rate)
+
+    def spend(self):
+        with self._lock:
+            if self._tokens >= 1.0:
+                self._tokens -= 1.0
+                return True
+            return False
+
+
+class Hedger:
+    """
+    Runs a primary callable with an optional hedge. One instance per
+    downstream per container, so the latency estimate and budget persist
+    across warm invocations.
+    """
+
+    def __init__(self, name, percentile=None, budget=None, min_delay=None, max_delay=None,
+                 initial_delay=None, min_samples=None, window=None):
+        self.name = name
+        self.percentile = percentile if percentile is not None else _env('HEDGE_PERCENTILE', 95)
+        self.min_delay = min_delay if min_delay is not None else _env('HEDGE_MIN_DELAY_MS', 1000) / 1000.0
+        self.max_delay = max_delay if max_delay is not None else _env('HEDGE_MAX_DELAY_MS', 15000) / 1000.0
+        self.initial_delay = initial_delay if initial_delay is not None else _env('HEDGE_INITIAL_DELAY_MS', 8000) / 1000.0
+        self.min_samples = min_samples if min_samples is not None else _env('HEDGE_MIN_SAMPLES', 20, int)
+        self.latencies = LatencyTracker(window or _env('HEDGE_WINDOW', 200, int))
+        self.budget = HedgeBudget(budget if budget is not None else _env('HEDGE_BUDGET', 0.05))
+        # Two calls per hedged request, plus room for stragglers from earlier invocations
+        self._executor = ThreadPoolExecutor(max_workers=4, thread_name_prefix=f"hedge-{name}")
+        self._lock = threading.Lock()
+        self.counters = {'calls': 0, 'hedged': 0, 'hedgeWins': 0, 'primaryWins': 0, 'budgetDenied': 0,
+                         'primaryErrorsRescued': 0}
+
+    def delay(self):
+        """Seconds to wait for the primary before hedging"""
+        if len(self.latencies) < self.min_samples:
+            return self.initial_delay
+        return min(self.max_delay, max(self.min_delay, self.latencies.percentile(self.percentile)))
+
+    def _count(self, **increments):
+        with self._lock:
+            for key, value in increments.items():
+                self.counters[key] += value
+
+    def run(self, primary, hedge=None):
+        """
+        Return (result, info). info holds 'hedged', 'winner' ('primary' or
+        'hedge'), 'delayMs' and 'elapsedMs'. Without a hedge callable the
+        primary runs inline, with no thread hand-off.
+        """
+        self._count(calls=1)
+        self.budget.earn()
+        start = time.perf_counter()
+
+        if hedge is None:
+            result = primary()
+            self.latencies.add(time.perf_counter() - start)
+            return result, {'hedged': False, 'winner': 'primary', 'delayMs': None,
+                            'elapsedMs': round((time.perf_counter() - start) * 1000)}
+
+        delay = self.delay()
+        primary_future = self._executor.submit(primary)
+
+        def record_primary(future):
+            # Late primaries still count, so the threshold tracks the real distribution
+            if not future.cancelled() and future.exception() is None:
+                self.latencies.add(time.perf_counter() - start)
+
+        primary_future.add_done_callback(record_primary)
+
+        done, _ = wait([primary_future], timeout=delay)
+        futures = {primary_future: 'primary'}
+        hedged = False
+        if not done:
+            if self.budget.spend():
+                hedged = True
+                futures[self._executor.submit(hedge)] = 'hedge'
+            else:
+                self._count(budgetDenied=1)
+        elif primary_future.exception() is not None and self.budget.spend():
+            # The primary failed fast; the hedge target doubles as a retry
+            hedged = True
+            futures[self._executor.submit(hedge)] = 'hedge'
+
+        pending = set(futures)
+        error = None
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                if future.exception() is None:
+                    winner = futures[future]
+                    if winner == 'hedge' and primary_future.done() and primary_future.exception() is not None:
+                        self._count(primaryErrorsRescued=1)
+                    self._count(hedged=int(hedged), hedgeWins=int(winner == 'hedge'), primaryWins=int(winner == 'primary'))
+                    info = {'hedged': hedged, 'winner': winner, 'delayMs': round(delay * 1000),
+                            'elapsedMs': round((time.perf_counter() - start) * 1000)}
+                    self._emit(info)
+                    return future.result(), info
+                error = error or future.exception()
+
+        self._count(hedged=int(hedged))
+        self._emit({'hedged': hedged, 'winner': None, 'delayMs': round(delay * 1000),
+                    'elapsedMs': round((time.perf_counter() - start) * 1000)})
+        raise error
+
+    def _emit(self, info):
+        metrics.emit(
+            {
+                'HedgedRequests': int(info['hedged']),
+                'HedgeWins': int(info['winner'] == 'hedge'),
+                'HedgeDelay': info['delayMs'] or 0,
+                'HedgedCallLatency': info['elapsedMs']
+            },
+            dimensions={'Downstream': self.name},
+            units={'HedgeDelay': 'Milliseconds', 'HedgedCallLatency': 'Milliseconds'}
+        )
+
+
+_hedgers = {}
+_hedgers_lock = threading.Lock()
+
+
+def hedger(name):
+    """The container's hedger for a downstream"""
+    with _hedgers_lock:
+        if name not in _hedgers:
+            _hedgers[name] = Hedger(name)
+        return _hedgers[name]
@@ -0,0 +1,261 @@
+"""
+Cheap image checks that run before any paid call, and a memory-bounded decode.
+
+sniff_format() looks only at magic bytes; probe_header() uses Pillow's lazy
+Image.open on the first few KB of the file to read the true format and
+dimensions without decoding pixel data. Both raise ImageRejected when an
+upload is not an image we can process or exceeds the configured limits.
+
+decode() is the only way handlers should turn image bytes into pixels: it
+checks the declared size against the pixel and per-invocation memory
+budgets before decoding, and decodes JPEGs straight to a reduced size. Handlers that decode are wrapped with budgeted(), so every
+decode() of an invocation charges the same DecodeBudget unless it is passed
+another one.
+"""
+import contextvars
+import functools
+import io
+import os
+import threading
+
+from utils import metering
+
+JPEG_MAGIC = b'\xff\xd8\xff'
+PNG_MAGIC = b'\x89PNG\r\n\x1a\n'
+
+# Rekognition accepts at most 5 MB of inline image bytes
+MAX_IMAGE_BYTES = int(os.environ.get('MAX_IMAGE_BYTES', str(5 * 1024 * 1024)))
+MAX_IMAGE_PIXELS = int(os.environ.get('MAX_IMAGE_PIXELS', str(40_000_000)))
+# Rekognition needs 80px on each side; Claude rejects images over 8000px
+MIN_IMAGE_DIMENSION = int(os.environ.get('MIN_IMAGE_DIMENSION', '80'))
+MAX_IMAGE_DIMENSION = int(os.environ.get('MAX_IMAGE_DIMENSION', '8000'))
+
+# Bytes fetched for header parsing; JPEGs with large EXIF blocks get one larger retry
+HEADER_BYTES = int(os.environ.get('IMAGE_HEADER_BYTES', '16384'))
+MAX_HEADER_BYTES = 262144
+
+# Decoded bytes one invocation may hold across decode() calls. Defaults to 40% of
+# the function's memory so a crafted image fails cleanly instead of OOM-killing it.
+DECODE_MEMORY_LIMIT_BYTES = int(os.environ.get(
+    'DECODE_MEMORY_LIMIT_MB',
+    str(int(int(os.environ.get('AWS_LAMBDA_FUNCTION_MEMORY_SIZE', '1024')) * 0.4))
+)) * 1024 * 1024
+
+# Bytes per pixel of decoded Pillow modes. Pillow pads every three-band mode to four bytes a pixel.
+MODE_BYTES_PER_PIXEL = {'1': 1, 'L': 1, 'P': 1, 'LA': 4, 'PA': 4, 'I;16': 2, 'RGB': 4, 'YCbCr': 4, 'LAB': 4,
+                        'HSV': 4, 'RGBA': 4, 'RGBX': 4, 'CMYK': 4, 'I': 4, 'F': 4}
+
+FORMAT_EXTENSIONS = {'jpeg': 'jpg', 'png': 'png'}
+FORMAT_CONTENT_TYPES = {'jpeg': 'image/jpeg', 'png': 'image/png'}
+
+
+_invocation_budget = contextvars.ContextVar('soundscape_decode_budget', default=None)
+
+
+class ImageRejected(ValueError):
+    """The upload is not a supported image or is outside the size limits"""
+
+
+def sniff_format(data):
+    """Return 'jpeg' or 'png' from the magic bytes, or None"""
+    if data.startswith(JPEG_MAGIC):
+        return 'jpeg'
+    if data.startswith(PNG_MAGIC):
+        return 'png'
+    return None
+
+
+def extension_for(image_format):
+    return FORMAT_EXTENSIONS.get(image_format, image_format)
+
+
+def content_type_for(image_format):
+    return FORMAT_CONTENT_TYPES.get(image_format, 'application/octet-stream')
+
+
+def check_size(size_bytes):
+    if size_bytes is not None and size_bytes > MAX_IMAGE_BYTES:
+        raise ImageRejected(f"Image is {size_bytes} bytes; the limit is {MAX_IMAGE_BYTES} bytes")
+    if size_bytes is not None and size_bytes < len(JPEG_MAGIC):
+        raise ImageRejected("Image is empty")
+
+
+def check_dimensions(width, height):
+    if width < MIN_IMAGE_DIMENSION or height < MIN_IMAGE_DIMENSION:
+        raise ImageRejected(f"Image is {width}x{height}; each side must be at least {MIN_IMAGE_DIMENSION}px")
+    if width > MAX_IMAGE_DIMENSION or height > MAX_IMAGE_DIMENSION:
+        raise ImageRejected(f"Image is {width}x{height}; each side must be at most {MAX_IMAGE_DIMENSION}px")
+    if width * height > MAX_IMAGE_PIXELS:
+        raise ImageRejected(f"Image has {width * height} pixels; the limit is {MAX_IMAGE_PIXELS}")
+
+
+def probe_header(data):
+    """
+    Parse the image header from a prefix of the file without decoding pixels.
+
+    Returns a dict with format, width, height and mode. Raises ImageRejected
+    for non-images, unsupported formats and out-of-range dimensions, and
+    EOFError when the prefix ends before the header does.
+    """
+    image_format = sniff_format(data)
+    if image_format is None:
+        raise ImageRejected("File is not a JPEG or PNG image")
+
+    from PIL import Image
+
+    try:
+        # open() only reads the header; pixel data is never touched
+        with Image.open(io.BytesIO(data)) as image:
+            width, height = image.size
+            mode = image.mode
+            detected = (image.format or '').lower()
+    except Image.DecompressionBombError as err:
+        raise ImageRejected(f"Image dimensions are too large: {err}")
+    except (OSError, SyntaxError, ValueError) as err:
+        raise EOFError(f"Could not parse image header: {err}")
+
+    if detected != image_format:
+        raise ImageRejected(f"Image header says {detected or 'unknown'} but content is {image_format}")
+
+    check_dimensions(width, height)
+    return {'format': image_format, 'width': width, 'height': height, 'mode': mode}
+
+
+def probe_s3_object(s3, bucket, key):
+    """
+    Read just enough of an S3 object with ranged GETs to validate its header.
+    Returns probe_header()'s dict plus sizeBytes.
+    """
+    length = HEADER_BYTES
+    while True:
+        response = s3.get_object(Bucket=bucket, Key=key, Range=f"bytes=0-{length - 1}")
+        metering.count('s3', 'get_object')
+        data = response['Body'].read()
+        size_bytes = _total_size(response, len(data))
+        check_size(size_bytes)
+
+        try:
+            info = probe_header(data)
+            info['sizeBytes'] = size_bytes
+            return info
+        except EOFError as err:
+            # Header runs past what we fetched; try once more with a bigger window
+            if len(data) >= size_bytes or length >= MAX_HEADER_BYTES:
+                raise ImageRejected(f"Image is corrupt or truncated: {err}")
+            length = MAX_HEADER_BYTES
+
+
+def _total_size(response, fetched):
+    content_range = response.get('ContentRange')
+    if content_range and '/' in content_range:
+        total = content_range.rsplit('/', 1)[1]
+        if total.isdigit():
+            return int(total)
+    # Range ignored: the whole object came back
+    return response.get('ContentLength', fetched)
+
+
+class DecodeBudget:
+    """
+    Per-invocation ceiling on decoded pixel memory. Create one per handler
+    invocation and pass it to every decode() call; each decode reserves its
+    estimated size up front and fails before allocating if the total would
+    pass the limit. Decodes in other threads of the invocation share it.
+    """
+
+    def __init__(self, limit_bytes=None):
+        self.limit_bytes = DECODE_MEMORY_LIMIT_BYTES if limit_bytes is None else limit_bytes
+        self.used_bytes = 0
+        self._lock = threading.Lock()
+
+    def reserve(self, nbytes, what):
+        with self._lock:
+            if self.used_bytes + nbytes > self.limit_bytes:
+                raise ImageRejected(
+                    f"Decoding {what} needs {nbytes // (1024 * 1024)} MB; "
+                    f"{(self.limit_bytes - self.used_bytes) // (1024 * 1024)} MB of the decode budget is left"
+                )
+            self.used_bytes += nbytes
+
+    def release(self, nbytes):
+        with self._lock:
+            self.used_bytes = max(0, self.used_bytes - nbytes)
+
+
+def budgeted(handler):
+    """Decorator giving each invocation of a handler one DecodeBudget, the default of decode()"""
+    @functools.wraps(handler)
+    def wrapper(event, context):
+        token = _invocation_budget.set(DecodeBudget())
+        try:
+            return handler(event, context)
+        finally:
+            _invocation_budget.reset(token)
+    return wrapper
+
+
+def invocation_budget():
+    """The current invocation's DecodeBudget, or a fresh one outside a budgeted() handler"""
+    budget = _invocation_budget.get()
+    return budget if budget is not None else DecodeBudget()
+
+
+def decoded_size(width, height, mode):
+    return width * height * MODE_BYTES_PER_PIXEL.get(mode, 4)
+
+
+def decode(data, max_side=None, budget=None, mode='RGB'):
+    """
+    Decode image bytes to a loaded Pillow image no larger than max_side on its
+    long edge.
+
+    The declared dimensions are checked against MAX_IMAGE_PIXELS and the decode
+    budget before any pixel data is read. JPEGs are downscaled in the DCT domain
+    with draft(), so a 24 MP photo decoded for a 1568px target never exists at
+    full size in memory. PNG and every other format are decoded at full size,
+    charged to the budget at that size; reduce() only speeds up the resample.
+    """
+    from PIL import Image
+
+    budget = budget if budget is not None else invocation_budget()
+    try:
+        image = Image.open(io.BytesIO(data))
+    except Image.DecompressionBombError as err:
+        raise ImageRejected(f"Image dimensions are too large: {err}")
+    except (OSError, SyntaxError, ValueError) as err:
+        raise ImageRejected(f"Image is corrupt or not supported: {err}")
+
+    width, height = image.size
+    if width * height > MAX_IMAGE_PIXELS:
+        raise ImageRejected(f"Image has {width * height} pixels; the limit is {MAX_IMAGE_PIXELS}")
+
+    target = None
+    if max_side and max(width, height) > max_side:
+        scale = max_side / float(max(width, height))
+        target = (max(1, round(width * scale)), max(1, round(height * scale)))
+
+    if target and image.format == 'JPEG':
+        # Decoder picks the smallest 1/2, 1/4 or 1/8 scale still >= target
+        image.draft(mode, target)
+
+    decode_bytes = decoded_size(image.size[0], image.size[1], image.mode)
+    budget.reserve(decode_bytes, f"{width}x{height} {image.format}")
+    try:
+        image.load()
+    except Exception as err:
+        budget.release(decode_bytes)
+        raise ImageRejected(f"Image could not be decoded: {err}")
+
+    if target:
+        factor = min(image.size[0] // target[0], image.size[1] // target[1])
+        if factor >= 2:
+            image = image.reduce(factor)
+        if image.size != target:
+            image = image.resize(target, Image.LANCZOS)
+    if mode and image.mode != mode:
+        image = image.convert(mode)
+
+    # Only the final image stays alive; intermediate buffers are freed already
+    budget.release(decode_bytes)
+    budget.reserve(decoded_size(image.size[0], image.size[1], image.mode), "decoded image")
+    return image
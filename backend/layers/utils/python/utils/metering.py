@@ -0,0 +1,309 @@
+"""
+Per-request usage and cost.
+
+Handlers decorated with metered() collect what their request consumed:
+
+- calls to each downstream: DynamoDB, SQS and SSM operations are counted once
+  each by a botocore before-call handler on the sessions clients are made
+  from (utils.deadline.on_call), wherever in the handler or utils they are
+  made; other calls by capture.call() (or count() for calls that are not
+  captured)
+- billable units reported with add(): Bedrock input, output and prompt cache tokens,
+  Rekognition images, ElevenLabs seconds and prompt characters, bytes stored
+  in S3
+
+When the handler returns, the stage's usage is written to the item as
+usage.<stage> in one UpdateItem (not counted in it), bounded by the request
+deadline (utils.deadline) like the stage's own calls. validate_image creates
+the empty usage map with the item, so that write's condition holds and no
+stage pays for a second UpdateItem to create it. It is also emitted as EMF metrics
+(utils.metrics), dimensioned by Stage, with an EstimatedCost in USD. Queued
+ElevenLabs generations are metered by the worker and written to the item of
+the request that created the job, so deduplicated requests show none.
+
+Costs are estimates from PRICES, which METERING_PRICES (JSON) can override.
+cost() and mode() are shared with benchmarks/cost_report.py, so the report
+and the metrics agree.
+"""
+import contextvars
+import functools
+import json
+import os
+import traceback
+from contextlib import contextmanager
+from decimal import Decimal
+
+from botocore import xform_name
+from botocore.exceptions import ClientError
+
+from utils import deadline, metrics
+
+ENABLED = os.environ.get('METERING_ENABLED', 'true').lower() != 'false'
+
+# USD per unit (on-demand list prices, us-east-1)
+PRICES = {
+    # Claude 3 Sonnet on Bedrock, per token
+    'bedrockInputTokens': 0.003 / 1000,
+    'bedrockOutputTokens': 0.015 / 1000,
+    # Prompt caching: reads at a tenth of the input price, writes at a quarter more
+    'bedrockCacheReadTokens': 0.0003 / 1000,
+    'bedrockCacheWriteTokens': 0.00375 / 1000,
+    'rekognitionImages': 0.001,
+    # Sound effects bill 20 credits per generated second; Creator plan credit price
+    'elevenlabsSeconds': 20 * 0.00022,
+    # One month of S3 Standard storage
+    's3BytesStored': 0.023 / 1024 ** 3,
+    # Per call, keyed service:operation
+    's3:put_object': 0.005 / 1000,
+    's3:get_object': 0.0004 / 1000,
+    'dynamodb:get_item': 0.25 / 1e6,
+    'dynamodb:query': 0.25 / 1e6,
+    'dynamodb:scan': 0.25 / 1e6,
+    'dynamodb:batch_get_item': 0.25 / 1e6,
+    'dynamodb:put_item': 1.25 / 1e6,
+    'dynamodb:update_item': 1.25 / 1e6,
+    'dynamodb:delete_item': 1.25 / 1e6,
+    'dynamodb:batch_write_item': 1.25 / 1e6,
+    'sqs:send_message': 0.40 / 1e6,
+    'sqs:receive_message': 0.40 / 1e6,
+    'sqs:delete_message': 0.40 / 1e6,
+    'sqs:get_queue_attributes': 0.40 / 1e6,
+    # Standard parameters with the default throughput are free
+    'ssm:get_parameter': 0.0,
+    'stepfunctions:start_sync_execution': 1.0 / 1e6
+}
+PRICES.update(json.loads(os.environ.get('METERING_PRICES') or '{}'))
+
+# Units reported with add(), as EMF metric names
+UNIT_METRICS = {
+    'bedrockInputTokens': 'BedrockInputTokens',
+    'bedrockOutputTokens': 'BedrockOutputTokens',
+    'bedrockCacheReadTokens': 'BedrockCacheReadTokens',
+    'bedrockCacheWriteTokens': 'BedrockCacheWriteTokens',
+    'rekognitionImages': 'RekognitionImages',
+    'elevenlabsSeconds': 'ElevenLabsSeconds',
+    'elevenlabsCharacters': 'ElevenLabsCharacters',
+    's3BytesStored': 'S3BytesStored'
+}
+
+# Cost components for reports: unit or call service -> component
+COMPONENTS = {
+    'bedrockInputTokens': 'bedrock',
+    'bedrockOutputTokens': 'bedrock',
+    'bedrockCacheReadTokens': 'bedrock',
+    'bedrockCacheWriteTokens': 'bedrock',
+    'rekognitionImages': 'rekognition',
+    'elevenlabsSeconds': 'elevenlabs',
+    's3BytesStored': 's3',
+    's3': 's3',
+    'dynamodb': 'dynamodb',
+    'sqs': 'sqs',
+    'ssm': 'ssm',
+    'stepfunctions': 'stepfunctions',
+    'bedrock': 'bedrock',
+    'rekognition': 'rekognition',
+    'elevenlabs': 'elevenlabs'
+}
+
+# Counted by the before-call handler, so capture.call() leaves them alone
+HOOKED_SERVICES = ('dynamodb', 'sqs', 'ssm')
+
+_current = contextvars.ContextVar('soundscape_meter', default=None)
+
+
+class Meter:
+    """Usage of one stage of one request"""
+
+    def __init__(self, stage, image_id=None):
+        self.stage = stage
+        self.image_id = image_id
+        self.units = {}
+        self.calls = {}
+
+    def add(self, **units):
+        for name, value in units.items():
+            if value:
+                self.units[name] = self.units.get(name, 0) + value
+
+    def count(self, service, operation, calls=1):
+        key = f"{service}:{operation}"
+        self.calls[key] = self.calls.get(key, 0) + calls
+
+    def usage(self):
+        """The stage's usage as stored on the item"""
+        usage = {name: _number(value) for name, value in self.units.items()}
+        if self.calls:
+            usage['calls'] = dict(self.calls)
+        return usage
+
+
+def _number(value):
+    return Decimal(str(round(value, 3))) if isinstance(value, float) else value
+
+
+def add(**units):
+    """Add billable units to the current request's meter, if any"""
+    meter = _current.get()
+    if meter is not None:
+        meter.add(**units)
+
+
+def count(service, operation, calls=1):
+    """Count downstream calls that capture.call() does not wrap"""
+    meter = _current.get()
+    if meter is not None:
+        meter.count(service, operation, calls)
+
+
+def _count_operation(model, **kwargs):
+    service = model.service_model.service_name
+    if service in HOOKED_SERVICES:
+        count(service, xform_name(model.name))
+
+
+deadline.on_call(_count_operation)
+
+
+def annotate(image_id):
+    """Set the imageId for handlers that create it (analyze_api)"""
+    meter = _current.get()
+    if meter is not None:
+        meter.image_id = image_id
+
+
+def cost(usage):
+    """{component: USD} for one stage's usage (or the sum of several)"""
+    components = {}
+    for name, value in usage.items():
+        if name == 'calls':
+            for call, calls in value.items():
+                if call in PRICES:
+                    component = COMPONENTS.get(call.split(':', 1)[0], 'other')
+                    components[component] = components.get(component, 0.0) + PRICES[call] * float(calls)
+        elif name in PRICES:
+            component = COMPONENTS.get(name, 'other')
+            components[component] = components.get(component, 0.0) + PRICES[name] * float(value)
+    return components
+
+
+def total(usage_by_stage):
+    """One usage dict summing every stage of an item's usage map"""
+    summed = {'calls': {}}
+    for usage in (usage_by_stage or {}).values():
+        for name, value in usage.items():
+            if name == 'calls':
+                for call, calls in value.items():
+                    summed['calls'][call] = summed['calls'].get(call, 0) + float(calls)
+            else:
+                summed[name] = summed.get(name, 0) + float(value)
+    return summed
+
+
+def mode(item):
+    """How a request was served, for grouping costs"""
+    degraded = item.get('degraded') or []
+    usage = item.get('usage') or {}
+    if item.get('status') == 'ERROR':
+        return 'error'
+    if item.get('reusedFrom'):
+        return 'reused'
+    if 'bedrock' in degraded:
+        return 'labels-only'
+    if 'elevenlabs' in degraded:
+        return 'no-audio'
+    if not total(usage).get('elevenlabsSeconds'):
+        # The clip came from a queued job another request created
+        return 'deduplicated'
+    if float((usage.get('image_to_text') or {}).get('calls', {}).get('bedrock:invoke_model', 0)) > 1:
+        return 'hedged'
+    return 'full'
+
+
+def write(table, meter):
+    """Store the stage's usage as usage.<stage> on the item"""
+    usage = meter.usage()
+    names = {'#u': 'usage', '#s': meter.stage}
+    try:
+        table.update_item(
+            Key={'imageId': meter.image_id},
+            UpdateExpression="SET #u.#s = :v",
+            ConditionExpression="attribute_exists(#u)",
+            ExpressionAttributeNames=names,
+            ExpressionAttributeValues={':v': usage}
+        )
+    except ClientError as err:
+        if err.response['Error']['Code'] != 'ConditionalCheckFailedException':
+            raise
+        # Only items written before validate_image created the map get here; a concurrent creator
+        # wins and we retry into it
+        try:
+            table.update_item(
+                Key={'imageId': meter.image_id},
+                UpdateExpression="SET #u = :m",
+                ConditionExpression="attribute_not_exists(#u)",
+                ExpressionAttributeNames={'#u': 'usage'},
+                ExpressionAttributeValues={':m': {meter.stage: usage}}
+            )
+        except ClientError as retry_err:
+            if retry_err.response['Error']['Code'] != 'ConditionalCheckFailedException':
+                raise
+            table.update_item(
+                Key={'imageId': meter.image_id},
+                UpdateExpression="SET #u.#s = :v",
+                ExpressionAttributeNames=names,
+                ExpressionAttributeValues={':v': usage}
+            )
+
+
+def emit(meter):
+    components = cost(meter.usage())
+    values = {UNIT_METRICS[name]: value for name, value in meter.units.items() if name in UNIT_METRICS}
+    values['DownstreamCalls'] = sum(meter.calls.values())
+    values['EstimatedCost'] = round(sum(components.values()), 8)
+    metrics.emit(
+        values,
+        dimensions={'Stage': meter.stage},
+        units={'S3BytesStored': 'Bytes', 'EstimatedCost': 'None', 'ElevenLabsSeconds': 'Seconds'},
+        properties={'imageId': meter.image_id, 'costByComponent': {k: round(v, 8) for k, v in components.items()}}
+    )
+
+
+@contextmanager
+def meter(stage, image_id=None, table=None, request_deadline=None):
+    """
+    Meter the block; on exit the usage is written to `table` (with its
+    timeouts and retries bounded by request_deadline, if given) and emitted
+    """
+    if not ENABLED:
+        yield None
+        return
+    current = Meter(stage, image_id)
+    token = _current.set(current)
+    try:
+        yield current
+    finally:
+        _current.reset(token)
+        if current.image_id and (current.units or current.calls):
+            try:
+                if table is not None:
+                    write(deadline.client(table, request_deadline) if request_deadline else table, current)
+                emit(current)
+            except Exception as err:
+                # Metering must never fail the request it measures
+                print(f"Failed to record usage for {current.image_id}: {err}")
+                print(traceback.format_exc())
+
+
+def metered(stage):
+    """Decorator for a lambda_handler; the usage goes to the module's `table`"""
+    def decorator(handler):
+        @functools.wraps(handler)
+        def wrapper(event, context):
+            if not ENABLED:
+                return handler(event, context)
+            image_id = event.get('imageId') if isinstance(event, dict) else None
+            # Looked up per call so a table patched after import is used
+            with meter(stage, image_id, handler.__globals__.get('table'), deadline.from_event(event, context)):
+                return handler(event, context)
+        return wrapper
+    return decorator
@@ -0,0 +1,43 @@
+"""
+CloudWatch metrics as Embedded Metric Format (EMF) log lines.
+
+Lambda ships stdout to CloudWatch Logs, which extracts EMF records into
+metrics asynchronously, so emitting a metric costs one print and no API call.
+"""
+import json
+import os
+import time
+
+NAMESPACE = os.environ.get('METRICS_NAMESPACE', 'SoundscapeAI')
+ENABLED = os.environ.get('METRICS_ENABLED', 'true').lower() != 'false'
+
+
+def emit(metrics, dimensions=None, units=None, properties=None):
+    """
+    Emit one EMF record.
+
+    metrics maps metric name to value; dimensions maps dimension name to
+    value (one dimension set); units maps metric name to a CloudWatch unit,
+    defaulting to Count. properties are logged alongside but not extracted.
+    """
+    if not ENABLED or not metrics:
+        return
+    dimensions = dimensions or {}
+    if 'Function' not in dimensions and os.environ.get('AWS_LAMBDA_FUNCTION_NAME'):
+        dimensions = dict(dimensions, Function=os.environ['AWS_LAMBDA_FUNCTION_NAME'])
+    units = units or {}
+
+    record = {
+        '_aws': {
+            'Timestamp': int(time.time() * 1000),
+            'CloudWatchMetrics': [{
+                'Namespace': NAMESPACE,
+                'Dimensions': [sorted(dimensions)],
+                'Metrics': [{'Name': name, 'Unit': units.get(name, 'Count')} for name in metrics]
+            }]
+        }
+    }
+    record.update(properties or {})
+    record.update(dimensions)
+    record.update(metrics)
+    print(json.dumps(record, separators=(',', ':'), default=str))
@@ -0,0 +1,140 @@
+"""
+The compact payload passed between workflow stages, and the API response body.
+
+Step Functions state carries identifiers, small scalars and flags only.
+Text and lists that a stage writes to the DynamoDB item (description,
+detected elements, sound prompt, renditions, waveform, image derivatives) are passed by reference: the
+item key is the imageId, and a stage that needs one of them reads it with a
+projected GetItem. Each transition then copies a few hundred bytes instead
+of re-serializing the whole analysis at every hop.
+
+final_response returns the response body itself, not an API Gateway
+envelope with a JSON string inside, so the execution output is already the
+HTTP body and analyze_api forwards it without decoding or re-encoding it.
+"""
+import json
+from decimal import Decimal
+from typing import List, TypedDict
+
+try:
+    import orjson
+except ImportError:  # Optional; the stdlib encoder produces the same output
+    orjson = None
+
+
+class StagePayload(TypedDict, total=False):
+    """Fields allowed in Step Functions state between stages"""
+    imageId: str            # DynamoDB key; every referenced field lives on this item
+    s3Key: str
+    format: str
+    width: int
+    height: int
+    scene: str
+    elementCount: int
+    loopSeconds: float      # Extended track length the request asked for (generate_audio/looping.py)
+    audioUrl: str
+    fallback: bool
+    degraded: List[str]
+    deadlineMs: int         # End of the request's budget (utils.deadline)
+    reusedFrom: str         # imageId whose soundscape is reused (utils.similarity)
+    lane: str               # Scheduler lane when not interactive (utils.scheduler)
+    speculativeJob: str     # Audio job started from the labels and kept (utils.speculation)
+    profile: bool           # Profile every stage of the request (utils.profiling)
+
+
+STAGE_FIELDS = frozenset(StagePayload.__annotations__)
+
+# Fields read from the item instead of the state
+REFERENCED_FIELDS = ('description', 'scene', 'detectedElements', 'soundPrompt', 'audioUrl', 'renditions', 'waveform',
+                     'derivatives', 'degraded')
+
+
+def compact(state, **fields):
+    """
+    The next stage's payload: the fields of state and the given fields that
+    belong in StagePayload, without None values.
+    """
+    merged = dict(state or {}, **fields)
+    return {key: value for key, value in merged.items() if key in STAGE_FIELDS and value is not None}
+
+
+def resolve(table, state, fields, consistent=True):
+    """
+    Values of referenced fields for the state's item. Fields the state still
+    carries inline (executions started before the compact payload) are used
+    as they are; the rest come from one projected GetItem. A consistent read
+    is the default because the previous stage has just written the item.
+    """
+    values = {field: state[field] for field in fields if field in state}
+    missing = [field for field in fields if field not in values]
+    if missing:
+        names = {f"#f{index}": field for index, field in enumerate(missing)}
+        response = table.get_item(
+            Key={'imageId': state['imageId']},
+            ConsistentRead=consistent,
+            ProjectionExpression=', '.join(names),
+            ExpressionAttributeNames=names
+        )
+        item = response.get('Item') or {}
+        values.update({field: plain(item[field]) for field in missing if field in item})
+    return values
+
+
+def plain(value):
+    """Convert DynamoDB Decimals and sets back to JSON types"""
+    if isinstance(value, Decimal):
+        return int(value) if value == value.to_integral_value() else float(value)
+    if isinstance(value, dict):
+        return {k: plain(v) for k, v in value.items()}
+    if isinstance(value, (list, set)):
+        return [plain(v) for v in value]
+    return value
+
+
+def response_body(item, state=None):
+    """
+    The API response body for a soundscape. item holds the referenced fields;
+    state (the final stage payload) takes precedence for what it carries,
+    e.g. the degraded list of a request that completed without audio.
+    """
+    values = dict(plain(item), **{k: v for k, v in (state or {}).items() if v is not None})
+    body = {
+        'imageId': values['imageId'],
+        'description': values.get('description', "No description available"),
+        'scene': values.get('scene', "unknown"),
+        # None when the request completed without audio; degraded then holds 'elevenlabs'
+        'audioUrl': values.get('audioUrl'),
+        'renditions': values.get('renditions', []),
+        # Peaks downsampled to WAVEFORM_INLINE_POINTS, so the player draws without another
+        # round trip; waveform.url holds the full-resolution sidecar
+        'waveform': values.get('waveform'),
+        # Thumbnail and display-size copies of the upload (image_to_text), smallest first
+        'derivatives': values.get('derivatives', []),
+        'detectedElements': list(values.get('detectedElements', [])),
+        'soundPrompt': values.get('soundPrompt', ""),
+        'degraded': list(values.get('degraded', []))
+    }
+    if values.get('reusedFrom'):
+        body['reusedFrom'] = values['reusedFrom']
+    return body
+
+
+def _default(value):
+    if isinstance(value, Decimal):
+        return int(value) if value == value.to_integral_value() else float(value)
+    if isinstance(value, (set, frozenset)):
+        return sorted(value)
+    raise TypeError(f"Object of type {type(value).__name__} is not JSON serializable")
+
+
+def dumps(value):
+    """Compact JSON text, with orjson when it is installed"""
+    if orjson is not None:
+        return orjson.dumps(value, default=_default).decode('utf-8')
+    return json.dumps(value, separators=(',', ':'), ensure_ascii=False, default=_default)
+
+
+def loads(data):
+    if orjson is not None:
+        return orjson.loads(data)
+    return json.loads(data)
@@ -0,0 +1,264 @@
+"""
+On-demand profiling of single handler invocations.
+
+Handlers decorated with profiled() run a selected invocation under cProfile
+and tracemalloc and write one profile for it, keyed by imageId so every
+stage of a request sits under one prefix: the cProfile function stats with
+their caller edges, the allocation sites still holding the most memory when
+the handler returns (with their stacks), the traced peak, wall and CPU time,
+and RSS before, after and at the process high-water mark.
+benchmarks/profile_report.py turns profiles into collapsed stacks for flame
+graphs and a top-functions table.
+
+An invocation is profiled when:
+
+- PROFILE_ENABLED=true (every invocation: a staging stack, a load test)
+- its API request carries an X-Profile header equal to PROFILE_TOKEN; the
+  header does nothing while PROFILE_TOKEN is unset. analyze_api passes
+  `profile: true` down the workflow, so every stage of the request is
+  profiled
+- its imageId is sampled at PROFILE_SAMPLE_RATE, by the same hash as
+  utils.capture, so every stage of a sampled request is profiled; an API
+  request that has no imageId yet is sampled at random
+
+tracemalloc traces the whole process, so one invocation per process is
+profiled at a time; another selected invocation that overlaps it (the
+self-hosted server runs stages in threads) is not profiled, and a stage run
+inside a profiled one (benchmarks/pipeline.py runs the whole workflow inside
+analyze_api) is part of the outer profile. cProfile sees the
+handler's own thread: time spent in pool threads (hedged Bedrock calls, the
+gallery's parallel reads) shows as the handler waiting for them.
+
+Configuration (environment):
+    PROFILE_ENABLED            profile every invocation (default false)
+    PROFILE_SAMPLE_RATE        fraction of imageIds to profile (default 0)
+    PROFILE_TOKEN              value of the X-Profile header that selects a request
+    PROFILE_DIR                write <dir>/<imageId>/<function>-<ms>.json.gz (local runs)
+    PROFILE_BUCKET             otherwise upload <prefix><imageId>/<function>-<ms>.json.gz here
+    PROFILE_PREFIX             key prefix for uploads (default profiles/)
+    PROFILE_TOP_ALLOCATIONS    allocation sites kept (default 25)
+    PROFILE_TRACEMALLOC_FRAMES stack depth of each allocation (default 8)
+"""
+import contextvars
+import cProfile
+import functools
+import gzip
+import hmac
+import json
+import os
+import random
+import resource
+import threading
+import time
+import tracemalloc
+
+from utils import capture, metrics
+
+FORMAT_VERSION = 1
+
+ENABLED = os.environ.get('PROFILE_ENABLED', 'false').lower() == 'true'
+SAMPLE_RATE = float(os.environ.get('PROFILE_SAMPLE_RATE') or 0)
+TOKEN = os.environ.get('PROFILE_TOKEN')
+PROFILE_DIR = os.environ.get('PROFILE_DIR')
+PROFILE_BUCKET = os.environ.get('PROFILE_BUCKET')
+PROFILE_PREFIX = os.environ.get('PROFILE_PREFIX', 'profiles/')
+TOP_ALLOCATIONS = int(os.environ.get('PROFILE_TOP_ALLOCATIONS', '25'))
+TRACEMALLOC_FRAMES = int(os.environ.get('PROFILE_TRACEMALLOC_FRAMES', '8'))
+
+HEADER = 'x-profile'
+PAGE_SIZE = os.sysconf('SC_PAGE_SIZE') if hasattr(os, 'sysconf') else 4096
+
+_current = contextvars.ContextVar('soundscape_profile', default=None)
+_busy = threading.Lock()
+_s3 = None
+
+
+def _requested(event):
+    if not isinstance(event, dict):
+        return False
+    if event.get('profile'):
+        return True
+    if not TOKEN:
+        return False
+    headers = {k.lower(): v for k, v in (event.get('headers') or {}).items()}
+    return hmac.compare_digest(str(headers.get(HEADER) or ''), TOKEN)
+
+
+def selected(event):
+    """Why the invocation is profiled ('env', 'request' or 'sample'), or None"""
+    if ENABLED:
+        return 'env'
+    if _requested(event):
+        return 'request'
+    if SAMPLE_RATE > 0:
+        image_id = event.get('imageId') if isinstance(event, dict) else None
+        if capture.sampled(image_id, SAMPLE_RATE) if image_id else random.random() < SAMPLE_RATE:
+            return 'sample'
+    return None
+
+
+def active():
+    """Whether the current invocation is being profiled; analyze_api passes it down the workflow"""
+    return _current.get() is not None
+
+
+def annotate(image_id):
+    """Set the imageId for handlers that create it (analyze_api)"""
+    profile = _current.get()
+    if profile is not None and image_id:
+        profile.image_id = image_id
+
+
+def _rss():
+    """Resident set size of the process in bytes, or None where /proc is missing"""
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * PAGE_SIZE
+    except (OSError, IndexError, ValueError):
+        return None
+
+
+def _peak_rss():
+    # ru_maxrss is in kilobytes on Linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+class Profile:
+    """One profiled invocation"""
+
+    def __init__(self, function, event, trigger, handler=None):
+        self.function = function
+        # The stats key of the handler the decorator calls: the root of the rebuilt stacks
+        code = getattr(handler, '__code__', None)
+        self.root = [code.co_filename, code.co_firstlineno, code.co_name] if code else None
+        self.trigger = trigger
+        self.image_id = event.get('imageId') if isinstance(event, dict) else None
+        self.profiler = cProfile.Profile()
+
+    def __enter__(self):
+        self.started = time.time()
+        self.rss_before = _rss()
+        # A benchmark tracing the whole run keeps its tracing; the peak is then the run's
+        self.owns_tracing = not tracemalloc.is_tracing()
+        if self.owns_tracing:
+            tracemalloc.start(TRACEMALLOC_FRAMES)
+        self.cpu_start = time.process_time()
+        self.perf_start = time.perf_counter()
+        self.profiler.enable()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.profiler.disable()
+        self.wall_ms = (time.perf_counter() - self.perf_start) * 1000
+        self.cpu_ms = (time.process_time() - self.cpu_start) * 1000
+        # The snapshot is taken at the end; the peak is tracemalloc's own high-water mark
+        self.snapshot = tracemalloc.take_snapshot()
+        self.traced_current, self.traced_peak = tracemalloc.get_traced_memory()
+        if self.owns_tracing:
+            tracemalloc.stop()
+        self.error = f"{exc_type.__name__}: {exc}"[:300] if exc_type else None
+        return False
+
+    def stats(self):
+        """[[file, line, function, primitive calls, calls, self s, cumulative s, callers]] from cProfile"""
+        self.profiler.create_stats()
+        rows = []
+        for (filename, line, name), (cc, nc, tt, ct, callers) in self.profiler.stats.items():
+            rows.append([filename, line, name, cc, nc, round(tt, 6), round(ct, 6),
+                         [[c_file, c_line, c_name, c_cc, c_nc, round(c_tt, 6), round(c_ct, 6)]
+                          for (c_file, c_line, c_name), (c_cc, c_nc, c_tt, c_ct) in callers.items()]
+                         if isinstance(callers, dict) else []])
+        return rows
+
+    def allocations(self):
+        """Top allocation sites still held at the end, with their stacks (outermost first)"""
+        filters = [tracemalloc.Filter(False, tracemalloc.__file__), tracemalloc.Filter(False, __file__)]
+        statistics = self.snapshot.filter_traces(filters).statistics('traceback')[:TOP_ALLOCATIONS]
+        return [{'bytes': stat.size, 'count': stat.count,
+                 'stack': [[frame.filename, frame.lineno] for frame in reversed(stat.traceback)]}
+                for stat in statistics]
+
+    def to_record(self):
+        return {
+            'v': FORMAT_VERSION,
+            'fn': self.function,
+            'id': self.image_id,
+            'ts': round(self.started, 3),
+            'trigger': self.trigger,
+            'root': self.root,
+            'err': self.error,
+            'wallMs': round(self.wall_ms, 2),
+            'cpuMs': round(self.cpu_ms, 2),
+            'memory': {
+                'tracedPeakBytes': self.traced_peak,
+                'tracedEndBytes': self.traced_current,
+                'rssBeforeBytes': self.rss_before,
+                'rssAfterBytes': _rss(),
+                'peakRssBytes': _peak_rss()
+            },
+            'allocations': self.allocations(),
+            'stats': self.stats()
+        }
+
+
+def profiled(function_name):
+    """Decorator for a handler that profiles selected invocations"""
+    def decorator(handler):
+        @functools.wraps(handler)
+        def wrapper(event, context):
+            trigger = selected(event)
+            if trigger is None:
+                return handler(event, context)
+            if not _busy.acquire(blocking=False):
+                print(f"Another invocation is being profiled, running {function_name} unprofiled")
+                return handler(event, context)
+            profile = Profile(function_name, event, trigger, handler)
+            token = _current.set(profile)
+            try:
+                with profile:
+                    return handler(event, context)
+            finally:
+                _current.reset(token)
+                _busy.release()
+                _write(profile)
+        return wrapper
+    return decorator
+
+
+def _key(record):
+    return f"{record['id'] or 'no-image'}/{record['fn']}-{int(record['ts'] * 1000)}.json.gz"
+
+
+def _write(profile):
+    try:
+        record = profile.to_record()
+        body = gzip.compress(json.dumps(record, separators=(',', ':'), default=str).encode('utf-8'))
+        if PROFILE_DIR:
+            path = os.path.join(PROFILE_DIR, _key(record))
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            with open(path, 'wb') as f:
+                f.write(body)
+            location = path
+        elif PROFILE_BUCKET:
+            global _s3
+            if _s3 is None:
+                import boto3
+                _s3 = boto3.client('s3')
+            key = f"{PROFILE_PREFIX}{_key(record)}"
+            _s3.put_object(Bucket=PROFILE_BUCKET, Key=key, Body=body, ContentType='application/json',
+                           ContentEncoding='gzip')
+            location = f"s3://{PROFILE_BUCKET}/{key}"
+        else:
+            print("Profiled an invocation but neither PROFILE_DIR nor PROFILE_BUCKET is set")
+            return
+        print(f"Profile of {record['fn']} ({record['wallMs']:.0f} ms, traced peak "
+              f"{record['memory']['tracedPeakBytes'] / 1e6:.1f} MB) written to {location}")
+        metrics.emit(
+            {'ProfiledInvocations': 1, 'ProfileTracedPeak': record['memory']['tracedPeakBytes']},
+            dimensions={'Function': record['fn']},
+            units={'ProfileTracedPeak': 'Bytes'},
+            properties={'imageId': record['id'], 'trigger': record['trigger'], 'location': location}
+        )
+    except Exception as err:
+        # Profiling must never fail the request it is observing
+        print(f"Failed to write profile: {err}")
@@ -0,0 +1,241 @@
+"""
+The Claude prompts of image_to_text, versioned, and what a request costs in
+tokens.
+
+Each version in VERSIONS is the static instructions plus the max_tokens its
+responses need. PROMPT_VERSION picks the one image_to_text sends (v2, the
+compact system prompt, by default; v1 is the original user-turn prompt) and
+the version is recorded with every captured Bedrock call, so
+benchmarks/prompt_benchmark.py can compare versions on recorded responses.
+
+Per request:
+
+- the image is fitted to a token budget (PROMPT_IMAGE_TOKENS, at most Claude's
+  own 1568px / ~1600 token limit) before it is sent: Claude bills an image at
+  about width * height / 750 tokens and downscales larger ones itself, after
+  they have been uploaded. Re-encoding costs about as much CPU as the rest of
+  the stage, so it is done only for images over MAX_IMAGE_SIDE (a much
+  smaller upload) or when it saves PROMPT_IMAGE_MIN_SAVING (20%) of the
+  tokens Claude would bill
+- estimate() gives the expected input tokens, which image_to_text emits next
+  to the billed ones
+- the static prefix (system prompt, or v1's instruction block) is marked as a
+  prompt cache point when the model supports Bedrock prompt caching and the
+  prefix reaches the model's minimum cacheable length; shorter prefixes are
+  not cached by Bedrock, so no cache point is sent for them
+
+recommend_max_tokens() derives a version's max_tokens from observed output
+lengths; PROMPT_MAX_TOKENS overrides it without a deploy.
+"""
+import io
+import math
+import os
+
+from utils import imaging
+
+VERSION = os.environ.get('PROMPT_VERSION', 'v2')
+MAX_TOKENS = int(os.environ.get('PROMPT_MAX_TOKENS', '0')) or None
+CACHE_MODE = os.environ.get('PROMPT_CACHE', 'auto').lower()
+
+# Claude resizes images over 1568px on the long edge or ~1.15 MP (about 1600 tokens)
+MAX_IMAGE_SIDE = 1568
+MAX_IMAGE_TOKENS = 1600
+IMAGE_TOKEN_BUDGET = min(MAX_IMAGE_TOKENS, int(os.environ.get('PROMPT_IMAGE_TOKENS', str(MAX_IMAGE_TOKENS))))
+PIXELS_PER_TOKEN = 750
+RESIZE_QUALITY = 85
+# Smallest share of the billed image tokens worth a decode and JPEG encode; an image just
+# over the budget would be re-encoded for a few tokens
+MIN_TOKEN_SAVING = float(os.environ.get('PROMPT_IMAGE_MIN_SAVING', '0.2'))
+
+# Characters per token of English prompt text; errs towards more tokens
+CHARS_PER_TOKEN = 3.5
+# Fixed tokens of a messages request: role markers, block separators
+REQUEST_OVERHEAD_TOKENS = 10
+
+# Minimum cacheable prefix per model family (Bedrock prompt caching); others have no caching
+CACHE_MIN_TOKENS = {
+    'claude-3-7-sonnet': 1024,
+    'claude-sonnet-4': 1024,
+    'claude-opus-4': 1024,
+    'claude-3-5-haiku': 2048,
+    'claude-haiku-4-5': 4096
+}
+
+SCENE_TYPES = ('city', 'nature', 'beach', 'forest', 'indoor', 'mountain', 'desert', 'snow')
+
+
+class Prompt:
+    """One prompt version: its static text and response budget"""
+
+    def __init__(self, version, instructions, max_tokens, system=None):
+        self.version = version
+        self.system = system
+        self.instructions = instructions
+        self.max_tokens = max_tokens
+
+    def static_text(self):
+        return (self.system or '') + self.instructions
+
+
+VERSIONS = {
+    # The original prompt: all instructions in the user turn, before the image
+    'v1': Prompt('v1', max_tokens=1000, instructions="""
+        Please analyze this image and provide two things:
+        1. A detailed description of what you see, including scene type and key elements
+        2. A sound generation prompt for Eleven Labs that would create the perfect audio atmosphere
+           for this image. The sound prompt should be detailed and evocative, describing the specific
+           sounds, their qualities, and how they interact.
+
+        IMPORTANT: Avoid including music or musical elements in your sound prompt unless the image
+        explicitly contains musical instruments being played or shows a music performance setting.
+        Focus on natural ambient sounds, environmental effects, human/animal vocalizations, and other
+        non-musical audio elements. Music should only be included when absolutely necessary for the scene.
+
+        Format your response as:
+        DESCRIPTION: [your detailed image description]
+        SCENE_TYPE: [one of: city, nature, beach, forest, indoor, mountain, desert, snow]
+        ELEMENTS: [comma-separated list of key elements]
+        SOUND_PROMPT: [your sound generation prompt]
+        """),
+    # Same output format, a third of the instruction tokens, and a response budget for its shorter answers
+    'v2': Prompt('v2', max_tokens=500, instructions="Describe this image.", system=(
+        "You write sound design briefs for images. Reply in exactly four lines:\n"
+        "DESCRIPTION: <2-3 sentences: the scene and its key elements>\n"
+        f"SCENE_TYPE: <one of {', '.join(SCENE_TYPES)}>\n"
+        "ELEMENTS: <comma-separated key elements>\n"
+        "SOUND_PROMPT: <one vivid paragraph for a sound effects model: the specific sounds, "
+        "their qualities and how they interact>\n"
+        "No music unless the image shows instruments being played or a performance; "
+        "use ambience, nature, voices, animals and other non-musical sounds."))
+}
+
+
+def get(version=None):
+    """The prompt of version (default PROMPT_VERSION), with PROMPT_MAX_TOKENS applied"""
+    version = version or VERSION
+    if version not in VERSIONS:
+        raise ValueError(f"Unknown prompt version {version}; one of {', '.join(VERSIONS)}")
+    prompt = VERSIONS[version]
+    if MAX_TOKENS:
+        return Prompt(prompt.version, prompt.instructions, MAX_TOKENS, prompt.system)
+    return prompt
+
+
+def text_tokens(text):
+    return math.ceil(len(text) / CHARS_PER_TOKEN) if text else 0
+
+
+def billed_size(width, height, budget=MAX_IMAGE_TOKENS):
+    """(width, height) of an image once scaled to MAX_IMAGE_SIDE and the token budget"""
+    scale = min(1.0, MAX_IMAGE_SIDE / float(max(width, height)),
+                math.sqrt(budget * PIXELS_PER_TOKEN / float(width * height)))
+    return max(1, int(width * scale)), max(1, int(height * scale))
+
+
+def image_tokens(width, height):
+    """Input tokens Claude bills for an image, after its own downscaling"""
+    width, height = billed_size(width, height)
+    return math.ceil(width * height / PIXELS_PER_TOKEN)
+
+
+def estimate(prompt, width=None, height=None):
+    """Expected input tokens of a request: {'text', 'image', 'total'}"""
+    text = text_tokens(prompt.static_text()) + REQUEST_OVERHEAD_TOKENS
+    image = image_tokens(width, height) if width and height else 0
+    return {'text': text, 'image': image, 'total': text + image}
+
+
+def cache_min_tokens(model_id):
+    """Minimum cacheable prefix of the model, or None when it has no prompt caching"""
+    for family, minimum in CACHE_MIN_TOKENS.items():
+        if family in model_id:
+            return minimum
+    return None
+
+
+def cacheable(prompt, model_id):
+    if CACHE_MODE == 'off':
+        return False
+    minimum = cache_min_tokens(model_id)
+    return minimum is not None and text_tokens(prompt.static_text()) >= minimum
+
+
+def fit_image(image_bytes, image_format, width, height, budget=None, decode_budget=None):
+    """
+    (bytes, media type, width, height) of the image to send: the original when
+    it is within MAX_IMAGE_SIDE and fitting it to the token budget would save
+    less than MIN_TOKEN_SAVING, otherwise downscaled and re-encoded as JPEG.
+    decode_budget is the imaging.DecodeBudget the decode is charged to. Pillow
+    errors leave the original to Claude's own resize.
+    """
+    budget = IMAGE_TOKEN_BUDGET if budget is None else budget
+    media_type = imaging.content_type_for(image_format or 'jpeg')
+    if not width or not height:
+        return image_bytes, media_type, width, height
+    target = billed_size(width, height, budget)
+    if target[0] >= width:
+        return image_bytes, media_type, width, height
+    saving = 1 - math.ceil(target[0] * target[1] / PIXELS_PER_TOKEN) / float(image_tokens(width, height))
+    if max(width, height) <= MAX_IMAGE_SIDE and saving < MIN_TOKEN_SAVING:
+        return image_bytes, media_type, width, height
+    try:
+        image = imaging.decode(image_bytes, max_side=max(target), budget=decode_budget)
+        buffer = io.BytesIO()
+        image.save(buffer, format='JPEG', quality=RESIZE_QUALITY)
+    except Exception as err:
+        print(f"Could not downscale the image for Claude, sending it as uploaded: {err}")
+        return image_bytes, media_type, width, height
+    resized = buffer.getvalue()
+    if len(resized) >= len(image_bytes) and image_tokens(*image.size) >= image_tokens(width, height):
+        return image_bytes, media_type, width, height
+    return resized, 'image/jpeg', image.size[0], image.size[1]
+
+
+def build_request(prompt, encoded_image, media_type, model_id):
+    """Bedrock messages-API body for the prompt and a base64 image"""
+    image_block = {'type': 'image', 'source': {'type': 'base64', 'media_type': media_type, 'data': encoded_image}}
+    text_block = {'type': 'text', 'text': prompt.instructions}
+    body = {'anthropic_version': 'bedrock-2023-05-31', 'max_tokens': prompt.max_tokens}
+    cache = cacheable(prompt, model_id)
+    if prompt.system:
+        system_block = {'type': 'text', 'text': prompt.system}
+        if cache:
+            system_block['cache_control'] = {'type': 'ephemeral'}
+        body['system'] = [system_block]
+        content = [image_block, text_block]
+    else:
+        # Instructions first, so they are the cacheable prefix
+        if cache:
+            text_block['cache_control'] = {'type': 'ephemeral'}
+        content = [text_block, image_block]
+    body['messages'] = [{'role': 'user', 'content': content}]
+    return body
+
+
+def parse(text):
+    """(description, scene, elements, sound prompt) from a response in the prompts' line format"""
+    description, scene, elements, sound_prompt = "", "other", [], ""
+    for line in text.split('\n'):
+        line = line.strip()
+        if line.startswith("DESCRIPTION:"):
+            description = line[len("DESCRIPTION:"):].strip()
+        elif line.startswith("SCENE_TYPE:"):
+            scene = line[len("SCENE_TYPE:"):].strip().lower()
+        elif line.startswith("ELEMENTS:"):
+            elements = [element.strip() for element in line[len("ELEMENTS:"):].split(',') if element.strip()]
+        elif line.startswith("SOUND_PROMPT:"):
+            sound_prompt = line[len("SOUND_PROMPT:"):].strip()
+    return description, scene, elements, sound_prompt
+
+
+def recommend_max_tokens(output_tokens, percentile=99, headroom=1.25, step=50):
+    """
+    max_tokens covering the given percentile of observed output lengths with
+    headroom, rounded up to step. It bounds how long a runaway response can
+    hold the request; responses are billed by what they use either way.
+    """
+    lengths = sorted(output_tokens)
+    if not lengths:
+        return None
+    observed = lengths[min(len(lengths) - 1, int(math.ceil(percentile / 100.0 * len(lengths))) - 1)]
+    return int(math.ceil(observed * headroom / step) * step)
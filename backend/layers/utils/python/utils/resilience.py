@@ -0,0 +1,405 @@
+"""
+Per-downstream circuit breakers and the degradation controller built on them.
+
+Each breaker keeps a rolling window of call outcomes and a latency histogram
+for one downstream (Bedrock, ElevenLabs). It opens when the error rate or the
+p95 latency over the window breaks the downstream's SLO, so requests stop
+waiting out full timeouts against a service that is already failing. After a
+cooldown exactly one caller, across all containers, is let through as a
+half-open probe; its outcome closes or re-opens the breaker.
+
+State is shared between warm containers through a single item per breaker in
+the soundscape DynamoDB table (imageId 'breaker#<name>'). The window is a
+fixed ring of time slots on that item, updated with atomic ADDs, so the item
+never grows. Containers read it at most every BREAKER_SYNC_SECONDS and batch
+successes between writes; failures are written immediately so an outage
+trips the breaker quickly. Without a table the breaker works per container.
+
+DegradationController turns breaker states into the pipeline's operating
+mode: skip Bedrock in favour of the Rekognition-derived prompt, return
+without audio, or both.
+"""
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+from botocore.exceptions import ClientError
+
+CLOSED = 'CLOSED'
+OPEN = 'OPEN'
+HALF_OPEN = 'HALF_OPEN'
+
+# Latency histogram upper bounds (ms); the last bucket is everything slower
+LATENCY_BUCKETS_MS = (100, 250, 500, 1000, 2000, 4000, 8000, 15000, 30000)
+
+# p95 latency SLO per downstream; a window whose p95 exceeds it trips the breaker
+DEFAULT_SLO_MS = {'bedrock': 12000, 'elevenlabs': 20000}
+
+
+def _setting(name, key, default, cast=float):
+    """BREAKER_<NAME>_<KEY>, then BREAKER_<KEY>, then the default"""
+    value = os.environ.get(f"BREAKER_{name.upper()}_{key}", os.environ.get(f"BREAKER_{key}"))
+    return cast(value) if value not in (None, '') else default
+
+
+def _is_conditional_failure(err):
+    return isinstance(err, ClientError) and err.response.get('Error', {}).get('Code') == 'ConditionalCheckFailedException'
+
+
+class CircuitOpenError(Exception):
+    """The downstream's breaker is open; the caller should degrade instead of calling it"""
+
+
+class CircuitBreaker:
+    """
+    Rolling-window circuit breaker for one downstream.
+
+    Call allow() before the downstream call and wrap the call in track();
+    track() records latency and treats any exception as a failure. When
+    allow() returns False the caller must take its degraded path.
+    """
+
+    def __init__(self, name, table=None):
+        self.name = name
+        self.table = table
+        self.key = {'imageId': f"breaker#{name}"}
+        self.error_rate = _setting(name, 'ERROR_RATE', 0.5)
+        self.min_calls = _setting(name, 'MIN_CALLS', 5, int)
+        self.slo_ms = _setting(name, 'SLO_MS', DEFAULT_SLO_MS.get(name, 10000))
+        self.window_seconds = _setting(name, 'WINDOW_SECONDS', 60)
+        self.slots = _setting(name, 'SLOTS', 6, int)
+        self.cooldown_seconds = _setting(name, 'COOLDOWN_SECONDS', 30)
+        self.probe_timeout_seconds = _setting(name, 'PROBE_TIMEOUT_SECONDS', 60)
+        self.sync_seconds = _setting(name, 'SYNC_SECONDS', 5)
+        self.slot_seconds = self.window_seconds / float(self.slots)
+
+        self._lock = threading.Lock()
+        self._shared = {}
+        self._read_at = float('-inf')
+        self._pending = {}
+        self._flushed_at = time.time()
+        self._probing = False
+
+    # -- shared state ----------------------------------------------------------
+    def _slot(self, now):
+        return int(now // self.slot_seconds)
+
+    def _refresh(self, now, force=False):
+        if self.table is None or (not force and now - self._read_at < self.sync_seconds):
+            return
+        try:
+            self._shared = self.table.get_item(Key=self.key).get('Item') or {}
+            self._read_at = now
+        except Exception as err:
+            # Keep deciding on the last snapshot; the store being down must not fail requests
+            print(f"Could not read breaker {self.name}: {err}")
+            self._read_at = now
+
+    def _flush(self, now):
+        pending, self._pending = self._pending, {}
+        if not pending:
+            return
+        self._flushed_at = now
+        if self.table is None:
+            self._merge(self._shared, pending)
+            return
+
+        for slot, counts in pending.items():
+            position = slot % self.slots
+            names = {'#t': f"s{position}t"}
+            values = {':slot': slot}
+            adds = []
+            for index, (field, count) in enumerate(sorted(counts.items())):
+                names[f"#c{index}"] = f"s{position}{field}"
+                values[f":c{index}"] = count
+                adds.append((f"#c{index}", f":c{index}"))
+            try:
+                # Same slot as stored: add to it
+                self.table.update_item(
+                    Key=self.key,
+                    UpdateExpression="ADD " + ", ".join(f"{n} {v}" for n, v in adds),
+                    ConditionExpression="#t = :slot",
+                    ExpressionAttributeNames=names,
+                    ExpressionAttributeValues=values
+                )
+            except ClientError as err:
+                if not _is_conditional_failure(err):
+                    print(f"Could not record breaker {self.name} outcomes: {err}")
+                    continue
+                self._reset_slot(slot, names, values, adds)
+            except Exception as err:
+                print(f"Could not record breaker {self.name} outcomes: {err}")
+
+        # Our own writes are visible on the next decision
+        self._read_at = float('-inf')
+
+    def _reset_slot(self, slot, names, values, adds):
+        """The ring position holds an older slot: overwrite it with our counts"""
+        position = slot % self.slots
+        stale = [f"s{position}{field}" for field in self._fields()]
+        names = dict(names)
+        removes = []
+        for index, attribute in enumerate(stale):
+            if attribute not in names.values():
+                names[f"#r{index}"] = attribute
+                removes.append(f"#r{index}")
+        update = "SET #t = :slot, " + ", ".join(f"{n} = {v}" for n, v in adds)
+        if removes:
+            update += " REMOVE " + ", ".join(removes)
+        try:
+            self.table.update_item(
+                Key=self.key,
+                UpdateExpression=update,
+                ConditionExpression="attribute_not_exists(#t) OR #t < :slot",
+                ExpressionAttributeNames=names,
+                ExpressionAttributeValues=values
+            )
+        except ClientError as err:
+            if not _is_conditional_failure(err):
+                raise
+            # Another container reset it first; add to the fresh slot instead
+            self.table.update_item(
+                Key=self.key,
+                UpdateExpression="ADD " + ", ".join(f"{n} {v}" for n, v in adds),
+                ConditionExpression="#t = :slot",
+                ExpressionAttributeNames={k: v for k, v in names.items() if not k.startswith('#r')},
+                ExpressionAttributeValues=values
+            )
+
+    def _fields(self):
+        return ['e'] + [f"h{index}" for index in range(len(LATENCY_BUCKETS_MS) + 1)]
+
+    def _merge(self, item, pending):
+        for slot, counts in pending.items():
+            position = slot % self.slots
+            if item.get(f"s{position}t") != slot:
+                for field in self._fields():
+                    item.pop(f"s{position}{field}", None)
+                item[f"s{position}t"] = slot
+            for field, count in counts.items():
+                item[f"s{position}{field}"] = item.get(f"s{position}{field}", 0) + count
+
+    def _transition(self, now, new_state, expected, condition=None, condition_values=None, **fields):
+        """
+        Conditionally move the shared state from one of the expected states;
+        returns True if this caller made the change
+        """
+        updates = {'breakerState': new_state, 'changedAt': int(now)}
+        updates.update(fields)
+        if self.table is None:
+            if self._shared.get('breakerState', CLOSED) not in expected:
+                return False
+            self._shared.update(updates)
+            return True
+
+        values = {f":{k}": v for k, v in updates.items()}
+        for index, state in enumerate(expected):
+            values[f":e{index}"] = state
+        if condition is None:
+            clauses = [f"breakerState = :e{index}" for index in range(len(expected))]
+            if CLOSED in expected:
+                clauses.append("attribute_not_exists(breakerState)")
+            condition = " OR ".join(clauses)
+        values.update(condition_values or {})
+        try:
+            self.table.update_item(
+                Key=self.key,
+                UpdateExpression="SET " + ", ".join(f"{k} = :{k}" for k in updates),
+                ConditionExpression=condition,
+                ExpressionAttributeValues=values
+            )
+        except ClientError as err:
+            if not _is_conditional_failure(err):
+                print(f"Could not update breaker {self.name}: {err}")
+            self._read_at = float('-inf')
+            return False
+        except Exception as err:
+            print(f"Could not update breaker {self.name}: {err}")
+            return False
+        self._shared.update(updates)
+        print(f"Circuit breaker {self.name}: {'/'.join(expected)} -> {new_state}")
+        return True
+
+    # -- window statistics -----------------------------------------------------
+    def stats(self, now=None):
+        """Calls, errors, error rate and estimated p95 (ms) over the rolling window"""
+        now = time.time() if now is None else now
+        current = self._slot(now)
+        since = int(self._shared.get('windowStart', 0))
+        histogram = [0] * (len(LATENCY_BUCKETS_MS) + 1)
+        errors = 0
+
+        snapshot = dict(self._shared)
+        self._merge(snapshot, self._pending)
+        for position in range(self.slots):
+            slot = snapshot.get(f"s{position}t")
+            if slot is None or int(slot) <= current - self.slots or int(slot) * self.slot_seconds < since:
+                continue
+            errors += int(snapshot.get(f"s{position}e", 0))
+            for index in range(len(histogram)):
+                histogram[index] += int(snapshot.get(f"s{position}h{index}", 0))
+
+        calls = sum(histogram)
+        p95 = None
+        if calls:
+            threshold, running = calls * 0.95, 0
+            for index, count in enumerate(histogram):
+                running += count
+                if running >= threshold:
+                    p95 = LATENCY_BUCKETS_MS[index] if index < len(LATENCY_BUCKETS_MS) else float('inf')
+                    break
+        return {'calls': calls, 'errors': errors, 'errorRate': errors / calls if calls else 0.0, 'p95Ms': p95}
+
+    def _tripped(self, stats):
+        if stats['calls'] < self.min_calls:
+            return None
+        if stats['errorRate'] >= self.error_rate:
+            return f"error rate {stats['errorRate']:.0%} over {stats['calls']} calls"
+        if stats['p95Ms'] is not None and stats['p95Ms'] > self.slo_ms:
+            return f"p95 {stats['p95Ms']} ms above the {self.slo_ms:.0f} ms SLO"
+        return None
+
+    # -- public API ------------------------------------------------------------
+    def state(self, now=None):
+        now = time.time() if now is None else now
+        with self._lock:
+            self._refresh(now)
+            return self._shared.get('breakerState', CLOSED)
+
+    def allow(self, now=None, claim=True):
+        """
+        True if the downstream may be called now. While open, returns True
+        only for the one caller that claims the half-open probe. With
+        claim=False it only reports whether a probe could be claimed, and
+        leaves it to whoever makes the call.
+        """
+        now = time.time() if now is None else now
+        with self._lock:
+            self._refresh(now)
+            state = self._shared.get('breakerState', CLOSED)
+            if state == CLOSED:
+                reason = self._tripped(self.stats(now))
+                if not reason:
+                    return True
+                print(f"Opening circuit breaker {self.name}: {reason}")
+                self._transition(now, OPEN, [CLOSED])
+                return False
+
+            changed_at = int(self._shared.get('changedAt', 0))
+            probe_until = int(self._shared.get('probeUntil', 0))
+            ready = (state == OPEN and now - changed_at >= self.cooldown_seconds) or \
+                    (state == HALF_OPEN and now >= probe_until)
+            if not ready or not claim:
+                return ready
+
+            # Only one container wins the probe: the cooldown must have passed, or the last probe expired
+            claimed = self._transition(
+                now, HALF_OPEN, [OPEN, HALF_OPEN],
+                condition="(breakerState = :e0 AND changedAt <= :cutoff) OR (breakerState = :e1 AND probeUntil <= :now)",
+                condition_values={':cutoff': int(now - self.cooldown_seconds), ':now': int(now)},
+                probeUntil=int(now + self.probe_timeout_seconds)
+            )
+            self._probing = claimed
+            return claimed
+
+    def record(self, ok, seconds, now=None):
+        """Record one call outcome; closes or re-opens the breaker after a probe"""
+        now = time.time() if now is None else now
+        with self._lock:
+            counts = self._pending.setdefault(self._slot(now), {})
+            milliseconds = seconds * 1000.0
+            bucket = next((i for i, bound in enumerate(LATENCY_BUCKETS_MS) if milliseconds <= bound), len(LATENCY_BUCKETS_MS))
+            counts[f"h{bucket}"] = counts.get(f"h{bucket}", 0) + 1
+            if not ok:
+                counts['e'] = counts.get('e', 0) + 1
+
+            if self._probing:
+                self._probing = False
+                if ok and milliseconds <= self.slo_ms:
+                    # Old failures must not immediately re-trip the closed breaker
+                    self._transition(now, CLOSED, [HALF_OPEN], windowStart=int(now))
+                else:
+                    self._transition(now, OPEN, [HALF_OPEN])
+
+            if not ok or now - self._flushed_at >= self.sync_seconds:
+                self._flush(now)
+
+    @contextmanager
+    def track(self):
+        """Time the wrapped call and record it; exceptions count as failures"""
+        start = time.perf_counter()
+        try:
+            yield
+        except BaseException:
+            self.record(False, time.perf_counter() - start)
+            raise
+        self.record(True, time.perf_counter() - start)
+
+
+class DegradationController:
+    """
+    Chooses what the pipeline skips based on its downstream breakers.
+
+    DEGRADATION_MODE forces a mode for every request ('full', 'skip_bedrock',
+    'no_audio' or 'minimal'); otherwise each feature is degraded while its
+    breaker is open.
+    """
+
+    FULL = 'full'
+    SKIP_BEDROCK = 'skip_bedrock'
+    NO_AUDIO = 'no_audio'
+    MINIMAL = 'minimal'
+
+    FEATURES = {'bedrock': SKIP_BEDROCK, 'elevenlabs': NO_AUDIO}
+
+    def __init__(self, breakers):
+        self.breakers = breakers
+
+    def forced(self):
+        mode = os.environ.get('DEGRADATION_MODE', '').strip().lower()
+        return mode if mode in (self.FULL, self.SKIP_BEDROCK, self.NO_AUDIO, self.MINIMAL) else None
+
+    def allow(self, name, claim=True):
+        """
+        True if this request should call the downstream. A False answer means
+        take the degraded path; a True answer may be the breaker's probe.
+        claim=False is for callers that hand the call to someone else (the
+        audio queue's workers), who must be the one to claim the probe.
+        """
+        forced = self.forced()
+        if forced:
+            return forced == self.FULL or (forced != self.MINIMAL and forced != self.FEATURES.get(name))
+        breaker = self.breakers.get(name)
+        return breaker.allow(claim=claim) if breaker else True
+
+    def breaker(self, name):
+        return self.breakers[name]
+
+    def mode(self):
+        """Current mode from breaker states, without claiming probes"""
+        forced = self.forced()
+        if forced:
+            return forced
+        degraded = {self.FEATURES[name] for name, breaker in self.breakers.items()
+                    if name in self.FEATURES and breaker.state() != CLOSED}
+        if len(degraded) > 1:
+            return self.MINIMAL
+        return degraded.pop() if degraded else self.FULL
+
+
+_breakers = {}
+_breakers_lock = threading.Lock()
+
+
+def breaker(name, table=None):
+    """The container's breaker for a downstream, kept across warm invocations"""
+    with _breakers_lock:
+        key = (name, id(table))
+        if key not in _breakers:
+            _breakers[key] = CircuitBreaker(name, table)
+        return _breakers[key]
+
+
+def controller(table=None, names=('bedrock', 'elevenlabs')):
+    return DegradationController({name: breaker(name, table) for name in names})
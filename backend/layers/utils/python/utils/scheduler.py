@@ -0,0 +1,363 @@
+"""
+Priority lanes for the Bedrock and ElevenLabs calls of the pipeline.
+
+Every request runs in a lane: interactive (the default, uploads from the web
+UI) or bulk (backfills and batch uploads, sent with an `X-Priority: bulk`
+header or `"priority": "bulk"` in the body). The lanes share each
+downstream's concurrency, SCHEDULER_CAPACITY (bedrock=8,elevenlabs=4):
+
+- each lane is guaranteed a share of it in proportion to SCHEDULER_WEIGHTS
+  (interactive=3,bulk=1), at least one slot
+- a lane beyond its share borrows idle slots only while no other lane is
+  waiting below its own share, so a freed slot goes to the starved lane
+- a lane never holds more than its ceiling (SCHEDULER_CEILINGS, bulk=0.75 of
+  capacity), so interactive requests find a slot free even while a backfill
+  keeps the rest busy
+
+Handlers take a slot with slot(downstream, lane, timeout) around the call.
+Where slots are kept is SCHEDULER_BACKEND:
+
+- table: in the downstream's scheduler item (`sched#<downstream>`), shared by
+  every Lambda. Holders and waiters are map entries with an expiry, so a
+  crashed invocation's slot frees itself; the fair-share rule is the
+  condition of the UpdateItem that takes a slot.
+- local: LaneQueue in the process, FIFO within a lane (the self-hosted
+  server; benchmarks/lane_benchmark.py simulates it on arrival traces)
+- off (the default): no scheduling, every call goes straight through
+
+Each acquisition emits SchedulerWaitTime and SchedulerQueueDepth (the lane's
+waiters when it queued), or SchedulerTimeouts when no slot came in time,
+dimensioned by Lane and Downstream.
+
+Bulk requests also take the cheaper paths: no hedged Bedrock calls, the
+model in SCHEDULER_BULK_BEDROCK_MODEL_ID when set, and admission to the audio
+queue only while it is idle.
+"""
+import math
+import os
+import threading
+import time
+import uuid
+from collections import deque
+from contextlib import contextmanager
+
+from botocore.exceptions import ClientError
+
+from utils import metrics
+
+INTERACTIVE = 'interactive'
+BULK = 'bulk'
+LANES = (INTERACTIVE, BULK)
+
+
+def _setting(name, default, cast=float):
+    """{key: value} from a name=value,name=value setting"""
+    values = {}
+    for pair in os.environ.get(name, default).split(','):
+        key, _, value = pair.partition('=')
+        if key.strip() and value.strip():
+            values[key.strip()] = cast(value)
+    return values
+
+
+BACKEND = os.environ.get('SCHEDULER_BACKEND', 'off').lower()
+CAPACITY = _setting('SCHEDULER_CAPACITY', 'bedrock=8,elevenlabs=4', int)
+WEIGHTS = _setting('SCHEDULER_WEIGHTS', 'interactive=3,bulk=1')
+CEILINGS = _setting('SCHEDULER_CEILINGS', 'bulk=0.75')
+# Slots of callers without a deadline expire after this long
+LEASE_SECONDS = float(os.environ.get('SCHEDULER_LEASE_SECONDS', '60'))
+# Added to a holder's deadline before its slot counts as abandoned
+LEASE_GRACE_SECONDS = 5.0
+POLL_MAX_SECONDS = 0.5
+BULK_BEDROCK_MODEL_ID = os.environ.get('SCHEDULER_BULK_BEDROCK_MODEL_ID')
+KEY_PREFIX = 'sched#'
+
+
+class SlotUnavailable(TimeoutError):
+    """No slot of the downstream came free within the caller's time"""
+
+
+def lane_for(event, body=None):
+    """The lane an API request asks for; ValueError for an unknown one"""
+    headers = {k.lower(): v for k, v in ((event or {}).get('headers') or {}).items()}
+    lane = headers.get('x-priority') or (body or {}).get('priority') or INTERACTIVE
+    lane = str(lane).strip().lower()
+    if lane not in LANES:
+        raise ValueError(f"Unknown priority {lane!r}; use one of {', '.join(LANES)}")
+    return lane
+
+
+def lane_of(state):
+    """The lane of a workflow stage's input"""
+    return (state or {}).get('lane') or INTERACTIVE
+
+
+def bedrock_model(lane, default):
+    return BULK_BEDROCK_MODEL_ID if lane == BULK and BULK_BEDROCK_MODEL_ID else default
+
+
+class FairShare:
+    """Guaranteed shares, borrowing and ceilings of one downstream's capacity"""
+
+    def __init__(self, capacity, weights=None, ceilings=None):
+        weights = weights or WEIGHTS
+        ceilings = CEILINGS if ceilings is None else ceilings
+        self.capacity = capacity
+        self.weights = {lane: float(weights.get(lane, 1.0)) for lane in LANES}
+        total = sum(self.weights.values())
+        self.shares = {lane: max(1, int(math.floor(capacity * weight / total))) for lane, weight in self.weights.items()}
+        self.ceilings = {lane: max(self.shares[lane], min(capacity, int(capacity * ceilings.get(lane, 1.0))))
+                         for lane in LANES}
+
+    def admissible(self, lane, held, waiting):
+        """Whether lane may take a slot, given slots held and waiters per lane"""
+        if sum(held.values()) >= self.capacity or held.get(lane, 0) >= self.ceilings[lane]:
+            return False
+        if held.get(lane, 0) < self.shares[lane]:
+            return True
+        return not any(waiting.get(other) and held.get(other, 0) < self.shares[other] for other in LANES if other != lane)
+
+    def order(self, held):
+        """Lanes, the least served for its weight first"""
+        return sorted(LANES, key=lambda lane: (held.get(lane, 0) / self.weights[lane], -self.weights[lane]))
+
+
+class LaneQueue:
+    """
+    Slots of one downstream with a FIFO queue per lane. Not thread-safe:
+    LocalSlots locks around it, the lane benchmark runs it on simulated time.
+    """
+
+    def __init__(self, policy):
+        self.policy = policy
+        self.held = {lane: 0 for lane in LANES}
+        self.waiting = {lane: deque() for lane in LANES}
+
+    def _counts(self):
+        return {lane: len(queue) for lane, queue in self.waiting.items()}
+
+    def request(self, lane, ticket):
+        """Take a slot now (True) or queue ticket for one (False)"""
+        if not self.waiting[lane] and self.policy.admissible(lane, self.held, self._counts()):
+            self.held[lane] += 1
+            return True
+        self.waiting[lane].append(ticket)
+        return False
+
+    def cancel(self, lane, ticket):
+        try:
+            self.waiting[lane].remove(ticket)
+        except ValueError:
+            return []
+        # A waiter that gave up may have been what held other lanes back
+        return self.dispatch()
+
+    def release(self, lane):
+        """Free a slot; returns the (lane, ticket) pairs granted one"""
+        self.held[lane] = max(0, self.held[lane] - 1)
+        return self.dispatch()
+
+    def dispatch(self):
+        granted = []
+        while True:
+            for lane in self.policy.order(self.held):
+                if self.waiting[lane] and self.policy.admissible(lane, self.held, self._counts()):
+                    self.held[lane] += 1
+                    granted.append((lane, self.waiting[lane].popleft()))
+                    break
+            else:
+                return granted
+
+    def depth(self, lane):
+        return len(self.waiting[lane])
+
+
+class LocalSlots:
+    """Slots of one downstream within this process"""
+
+    def __init__(self, capacity):
+        self.queue = LaneQueue(FairShare(capacity))
+        self._lock = threading.Lock()
+        self._events = {}
+
+    def acquire(self, lane, timeout, expires_at=None):
+        """(token, queue depth when it queued), or (None, depth) after timeout seconds"""
+        with self._lock:
+            ticket = object()
+            if self.queue.request(lane, ticket):
+                return ticket, 0
+            depth = self.queue.depth(lane)
+            event = self._events[ticket] = threading.Event()
+        if event.wait(max(0.0, timeout)):
+            return ticket, depth
+        with self._lock:
+            self._events.pop(ticket, None)
+            if event.is_set():
+                return ticket, depth
+            self._grant(self.queue.cancel(lane, ticket))
+        return None, depth
+
+    def release(self, lane, token):
+        with self._lock:
+            self._grant(self.queue.release(lane))
+
+    def _grant(self, granted):
+        for _, ticket in granted:
+            self._events.pop(ticket).set()
+
+
+def _is_conditional_failure(err):
+    return isinstance(err, ClientError) and err.response.get('Error', {}).get('Code') == 'ConditionalCheckFailedException'
+
+
+class TableSlots:
+    """
+    Slots of one downstream in its scheduler item, shared by every Lambda:
+    slotHolders and slotHolders_<lane> map holder tokens to their expiry
+    (epoch ms), slotWaiters_<lane> maps waiting tokens to when they give up.
+    """
+
+    _created = set()
+
+    def __init__(self, table, downstream, capacity):
+        self.table = table
+        self.downstream = downstream
+        self.policy = FairShare(capacity)
+        self.key = {'imageId': f"{KEY_PREFIX}{downstream}"}
+
+    def _ensure(self):
+        # Nested SETs need the maps to exist
+        if (self.table.name, self.downstream) in self._created:
+            return
+        item = dict(self.key, downstream=self.downstream, slotHolders={})
+        for lane in LANES:
+            item.update({f"slotHolders_{lane}": {}, f"slotWaiters_{lane}": {}})
+        try:
+            self.table.put_item(Item=item, ConditionExpression="attribute_not_exists(imageId)")
+        except ClientError as err:
+            if not _is_conditional_failure(err):
+                raise
+        self._created.add((self.table.name, self.downstream))
+
+    def _take(self, lane, token, expires_ms):
+        """One attempt at a slot; the fair-share rule is the write's condition"""
+        others = [other for other in LANES if other != lane]
+        values = {':capacity': self.policy.capacity, ':ceiling': self.policy.ceilings[lane],
+                  ':share': self.policy.shares[lane], ':zero': 0, ':expires': expires_ms}
+        starved = []
+        for other in others:
+            values[f":share_{other}"] = self.policy.shares[other]
+            starved.append(f"(size(slotWaiters_{other}) = :zero OR size(slotHolders_{other}) >= :share_{other})")
+        condition = f"size(slotHolders) < :capacity AND size(slotHolders_{lane}) < :ceiling"
+        condition += f" AND (size(slotHolders_{lane}) < :share" + (f" OR ({' AND '.join(starved)})" if starved else "") + ")"
+        try:
+            self.table.update_item(
+                Key=self.key,
+                UpdateExpression=f"SET slotHolders.#t = :expires, slotHolders_{lane}.#t = :expires REMOVE slotWaiters_{lane}.#t",
+                ConditionExpression=condition,
+                ExpressionAttributeNames={'#t': token},
+                ExpressionAttributeValues=values
+            )
+            return True
+        except ClientError as err:
+            if _is_conditional_failure(err):
+                return False
+            raise
+
+    def _reap(self, item, now_ms):
+        """Remove holders and waiters past their expiry"""
+        paths, names = [], {}
+        for attribute in ['slotHolders'] + [f"{kind}_{lane}" for lane in LANES for kind in ('slotHolders', 'slotWaiters')]:
+            for token, expires in (item.get(attribute) or {}).items():
+                if int(expires) < now_ms:
+                    names[f"#r{len(names)}"] = token
+                    paths.append(f"{attribute}.#r{len(names) - 1}")
+        if paths:
+            self.table.update_item(Key=self.key, UpdateExpression="REMOVE " + ', '.join(paths),
+                                   ExpressionAttributeNames=names)
+        return bool(paths)
+
+    def _wait(self, lane, token, give_up_ms):
+        self.table.update_item(Key=self.key, UpdateExpression=f"SET slotWaiters_{lane}.#t = :until",
+                               ExpressionAttributeNames={'#t': token}, ExpressionAttributeValues={':until': give_up_ms})
+
+    def _leave(self, lane, token):
+        self.table.update_item(Key=self.key, UpdateExpression=f"REMOVE slotWaiters_{lane}.#t",
+                               ExpressionAttributeNames={'#t': token})
+
+    def acquire(self, lane, timeout, expires_at=None):
+        self._ensure()
+        token = uuid.uuid4().hex
+        give_up = time.time() + max(0.0, timeout)
+        expires_ms = int(((expires_at or time.time() + LEASE_SECONDS) + LEASE_GRACE_SECONDS) * 1000)
+        depth, waiting, delay = 0, False, 0.05
+        while True:
+            if self._take(lane, token, expires_ms):
+                return token, depth
+            if not waiting:
+                # Registered, so lanes borrowing beyond their share leave the next free slot to us
+                self._wait(lane, token, int((give_up + LEASE_GRACE_SECONDS) * 1000))
+                waiting = True
+            item = self.table.get_item(Key=self.key, ConsistentRead=True).get('Item') or {}
+            depth = max(depth, len(item.get(f"slotWaiters_{lane}") or {}))
+            if self._reap(item, int(time.time() * 1000)):
+                continue
+            if time.time() + delay > give_up:
+                self._leave(lane, token)
+                return None, depth
+            time.sleep(delay)
+            delay = min(delay * 2, POLL_MAX_SECONDS)
+
+    def release(self, lane, token):
+        self.table.update_item(Key=self.key, UpdateExpression=f"REMOVE slotHolders.#t, slotHolders_{lane}.#t",
+                               ExpressionAttributeNames={'#t': token})
+
+
+_slots = {}
+_slots_lock = threading.Lock()
+
+
+def slots(downstream, table=None):
+    """The downstream's slots under SCHEDULER_BACKEND, or None when it is not scheduled"""
+    if BACKEND == 'off' or downstream not in CAPACITY:
+        return None
+    if BACKEND == 'table':
+        # Stateless apart from the item; one per table and downstream
+        return TableSlots(table, downstream, CAPACITY[downstream]) if table is not None else None
+    with _slots_lock:
+        if downstream not in _slots:
+            _slots[downstream] = LocalSlots(CAPACITY[downstream])
+        return _slots[downstream]
+
+
+@contextmanager
+def slot(downstream, lane, timeout, table=None, expires_at=None):
+    """
+    Hold one of the downstream's slots for the lane while the block runs.
+    Raises SlotUnavailable when none came free within timeout seconds.
+    expires_at (epoch seconds, e.g. the request deadline) bounds how long a
+    slot is kept for a caller that never releases it.
+    """
+    backend = slots(downstream, table)
+    if backend is None:
+        yield
+        return
+    started = time.perf_counter()
+    token, depth = backend.acquire(lane, timeout, expires_at)
+    waited_ms = int((time.perf_counter() - started) * 1000)
+    dimensions = {'Lane': lane, 'Downstream': downstream}
+    if token is None:
+        metrics.emit({'SchedulerTimeouts': 1, 'SchedulerQueueDepth': depth}, dimensions=dimensions)
+        raise SlotUnavailable(f"No {downstream} slot for the {lane} lane within {timeout:.1f} s")
+    metrics.emit({'SchedulerWaitTime': waited_ms, 'SchedulerQueueDepth': depth}, dimensions=dimensions,
+                 units={'SchedulerWaitTime': 'Milliseconds'})
+    if waited_ms >= 100:
+        print(f"Waited {waited_ms} ms for a {downstream} slot in the {lane} lane ({depth} queued)")
+    try:
+        yield
+    finally:
+        try:
+            backend.release(lane, token)
+        except Exception as err:
+            # The slot's expiry frees it
+            print(f"Failed to release the {downstream} slot: {err}")
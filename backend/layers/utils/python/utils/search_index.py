@@ -0,0 +1,245 @@
+"""
+Search over finished soundscapes by scene and detected elements.
+
+image_to_text turns an image's scene, Rekognition labels and Claude's elements
+into normalized terms with a confidence (terms()) and keeps an inverted index
+next to the items in the soundscape table (TableIndex.update()):
+
+- one adjacency item per (term, image), keyed `search#<term>#<imageId>`, with
+  searchTerm, searchScore and targetImageId; the SEARCH_INDEX_NAME GSI on
+  (searchTerm, searchScore) serves each term's posting list best first
+- the image's own term map (searchTerms) on its item, which candidates are
+  checked against
+
+Adjacency items have no status attribute, so they stay out of the gallery index.
+
+A query such as "beach + seagull" or "forest without rain" becomes required
+and excluded terms (parse_query()). search() intersects the required terms'
+posting lists with the threshold algorithm: it reads the lists a page at a time
+in turn (pages doubling up to BATCH_SIZE), checks each new candidate's term map with one BatchGetItem, and stops
+once the k-th best score (the sum of the required terms' confidences) is at
+least what an unseen image could still reach, or once a list runs out, since a
+match is on every list. Its cost follows the heads of the lists, not the size
+of the table.
+"""
+import os
+import re
+import time
+from decimal import Decimal
+
+INDEX_NAME = os.environ.get('SEARCH_INDEX_NAME', 'searchTerm-searchScore-index')
+KEY_PREFIX = 'search#'
+# Claude's scene and elements come without a confidence; Rekognition's is used as is
+SCENE_CONFIDENCE = float(os.environ.get('SEARCH_SCENE_CONFIDENCE', '0.9'))
+ELEMENT_CONFIDENCE = float(os.environ.get('SEARCH_ELEMENT_CONFIDENCE', '0.75'))
+MAX_TERMS = 40
+MAX_TERM_LENGTH = 40
+MAX_QUERY_TERMS = 8
+# Candidates one query may check before it settles for the best found so far
+MAX_CANDIDATES = int(os.environ.get('SEARCH_MAX_CANDIDATES', '2000'))
+# BatchGetItem takes at most 100 keys
+BATCH_SIZE = 100
+BATCH_ATTEMPTS = 5
+
+# Attributes search() needs on a candidate, on top of what the caller returns
+CHECKED_FIELDS = ('imageId', 'status', 'searchTerms')
+
+STOPWORDS = frozenset({'a', 'an', 'the', 'of', 'in', 'on', 'at', 'to', 'by', 'for', 'or', 'some', 'any'})
+NEGATIONS = frozenset({'without', 'not', 'no', 'except', '-', '!'})
+CONJUNCTIONS = frozenset({'and', 'with', '+', '&', ','})
+
+
+def _singular(word):
+    """Fold simple English plurals so "seagulls" finds "Seagull" """
+    if len(word) > 4 and word.endswith('ies'):
+        return word[:-3] + 'y'
+    if len(word) > 3 and word.endswith('s') and not word.endswith(('ss', 'us', 'is')):
+        return word[:-1]
+    return word
+
+
+def normalize(text):
+    """Index terms in a label or element: lower-case words, stopwords dropped, plurals folded"""
+    words = re.findall(r'[a-z0-9]+', str(text).lower())
+    return [_singular(word) for word in words
+            if word not in STOPWORDS and word not in CONJUNCTIONS and len(word) <= MAX_TERM_LENGTH]
+
+
+def terms(scene=None, labels=(), elements=()):
+    """
+    {term: confidence} for an analysed image, from each word of the scene, the
+    Rekognition labels (their Confidence scaled to 0-1) and Claude's elements.
+    Where they overlap the best confidence wins; at most MAX_TERMS are kept.
+    """
+    scored = {}
+
+    def add(text, confidence):
+        for term in normalize(text):
+            if confidence > scored.get(term, 0.0):
+                scored[term] = confidence
+
+    if scene and scene not in ('unknown', 'other'):
+        add(scene, SCENE_CONFIDENCE)
+    for label in labels:
+        add(label['Name'], min(1.0, float(label['Confidence']) / 100))
+    for element in elements:
+        add(element, ELEMENT_CONFIDENCE)
+    best = sorted(scored.items(), key=lambda entry: (-entry[1], entry[0]))[:MAX_TERMS]
+    return {term: Decimal(str(round(confidence, 3))) for term, confidence in best}
+
+
+def parse_query(text):
+    """
+    (required terms, excluded terms) of a search. Words are required unless a
+    negation ("without", "not", "no", "except", or a leading - or !) comes
+    before them; a negation holds until the next "+", ",", "&", "and" or "with".
+    Raises ValueError for a query without a required term.
+    """
+    include, exclude = [], []
+    negated = False
+    for token in re.findall(r'[a-z0-9]+|(?:^|(?<=\s))[-!]|[+&,]', str(text).lower()):
+        if token in NEGATIONS:
+            negated = True
+        elif token in CONJUNCTIONS:
+            negated = False
+        elif token not in STOPWORDS and len(token) <= MAX_TERM_LENGTH:
+            term = _singular(token)
+            target = exclude if negated else include
+            if term not in target:
+                target.append(term)
+    include = [term for term in include if term not in exclude]
+    if not include:
+        raise ValueError("A search needs at least one term to look for")
+    if len(include) + len(exclude) > MAX_QUERY_TERMS:
+        raise ValueError(f"A search may use at most {MAX_QUERY_TERMS} terms")
+    return include, exclude
+
+
+def posting_key(term, image_id):
+    return f"{KEY_PREFIX}{term}#{image_id}"
+
+
+class TableIndex:
+    """Posting lists as adjacency items in the soundscape table"""
+
+    def __init__(self, table, dynamodb):
+        self.table = table
+        # BatchGetItem is a call on the service resource, not the Table
+        self.dynamodb = dynamodb
+
+    def update(self, image_id, scored, previous=None):
+        """Write the image's postings and delete those of terms it no longer has"""
+        stale = set(previous or {}) - set(scored)
+        with self.table.batch_writer() as batch:
+            for term, score in scored.items():
+                batch.put_item(Item={
+                    'imageId': posting_key(term, image_id),
+                    'searchTerm': term,
+                    'searchScore': score,
+                    'targetImageId': image_id
+                })
+            for term in stale:
+                batch.delete_item(Key={'imageId': posting_key(term, image_id)})
+
+    def postings(self, term, limit, after=None):
+        """([(imageId, confidence)] best first, marker for the rest or None)"""
+        request = {
+            'IndexName': INDEX_NAME,
+            'KeyConditionExpression': '#t = :t',
+            'ExpressionAttributeNames': {'#t': 'searchTerm'},
+            'ExpressionAttributeValues': {':t': term},
+            'ScanIndexForward': False,
+            'Limit': limit
+        }
+        if after:
+            request['ExclusiveStartKey'] = after
+        response = self.table.query(**request)
+        entries = [(item['targetImageId'], float(item['searchScore'])) for item in response.get('Items', [])]
+        return entries, response.get('LastEvaluatedKey')
+
+    def documents(self, image_ids, fields):
+        """{imageId: item} with the given attributes, BATCH_SIZE keys per BatchGetItem"""
+        names = {f"#f{index}": field for index, field in enumerate(fields)}
+        found = {}
+        for start in range(0, len(image_ids), BATCH_SIZE):
+            request = {self.table.name: {
+                'Keys': [{'imageId': image_id} for image_id in image_ids[start:start + BATCH_SIZE]],
+                'ProjectionExpression': ', '.join(names),
+                'ExpressionAttributeNames': names
+            }}
+            for attempt in range(BATCH_ATTEMPTS):
+                response = self.dynamodb.batch_get_item(RequestItems=request)
+                for item in response.get('Responses', {}).get(self.table.name, []):
+                    found[item['imageId']] = item
+                request = response.get('UnprocessedKeys')
+                if not request:
+                    break
+                time.sleep(0.05 * 2 ** attempt)
+            else:
+                raise RuntimeError(f"BatchGetItem left {len(request[self.table.name]['Keys'])} keys unprocessed")
+        return found
+
+
+def search(index, include, exclude=(), limit=20, fields=CHECKED_FIELDS, statuses=('COMPLETED',),
+           max_candidates=None):
+    """
+    The `limit` best images carrying every `include` term and no `exclude`
+    term, with a status in `statuses`, ranked by the sum of their confidences
+    for the required terms. `index` provides postings() and documents() as
+    TableIndex does. Returns {'results': [item with score], 'examined':
+    candidates checked, 'exhaustive': False when MAX_CANDIDATES cut it short}.
+    """
+    max_candidates = MAX_CANDIDATES if max_candidates is None else max_candidates
+    fields = tuple(dict.fromkeys(tuple(fields) + CHECKED_FIELDS))
+    page_size = min(BATCH_SIZE, max(25, limit))
+    markers = {term: None for term in include}
+    # Highest confidence still unread in each list
+    frontier = {term: 1.0 for term in include}
+    seen = set()
+    matches = []
+    exhaustive = True
+
+    while True:
+        fresh = []
+        finished = False
+        for term in include:
+            entries, markers[term] = index.postings(term, page_size, markers[term])
+            if entries:
+                frontier[term] = entries[-1][1]
+            if not markers[term]:
+                # Every match is on this list and all of it has now been read
+                finished = True
+            for image_id, _ in entries:
+                if image_id not in seen:
+                    seen.add(image_id)
+                    fresh.append(image_id)
+
+        if fresh:
+            documents = index.documents(fresh, fields)
+            for image_id in fresh:
+                item = documents.get(image_id)
+                if item is None or item.get('status') not in statuses:
+                    continue
+                scores = item.get('searchTerms') or {}
+                if all(term in scores for term in include) and not any(term in scores for term in exclude):
+                    matches.append((sum(float(scores[term]) for term in include), image_id, item))
+            matches.sort(key=lambda match: (-match[0], match[1]))
+            del matches[limit:]
+
+        if finished:
+            break
+        if len(matches) >= limit and matches[-1][0] >= sum(frontier.values()):
+            break
+        if len(seen) >= max_candidates:
+            exhaustive = False
+            break
+        # Deep lists are read in bigger pages so a hard query costs fewer round trips
+        page_size = min(BATCH_SIZE, page_size * 2)
+
+    results = []
+    for score, _, item in matches:
+        result = {field: value for field, value in item.items() if field != 'searchTerms'}
+        result['score'] = round(score, 3)
+        result['matched'] = {term: float(item['searchTerms'][term]) for term in include}
+        results.append(result)
+    return {'results': results, 'examined': len(seen), 'exhaustive': exhaustive}
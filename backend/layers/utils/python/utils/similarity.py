@@ -0,0 +1,186 @@
+"""
+Reuse of finished soundscapes for images that look alike.
+
+Each analysed image gets a sparse label vector: the words of its Rekognition
+labels (normalized as for search) weighted by confidence. Its random-projection
+LSH signature (SimHash: one bit per random hyperplane, whose ±1 components
+are derived from a hash of the term, so nothing is stored) is split into
+BANDS bands of ROWS bits. Once generate_audio completes the image with its
+own audio, it joins one bucket item per band, `lsh#<band>:<bits>`, holding
+at most MAX_BUCKET_MEMBERS imageIds; images that fail or complete without
+audio never take a slot. Images whose cosine similarity is high share a
+band with high probability.
+
+With SIMILARITY_MODE=reuse, image_to_text looks up a new image's buckets
+(one BatchGetItem) and checks the candidates' stored vectors
+(labelVector). When a completed soundscape with its own ElevenLabs audio is
+at least REUSE_THRESHOLD similar, Bedrock and ElevenLabs are skipped and that
+soundscape's audio is returned. SIMILARITY_MODE=index only builds the buckets,
+so they fill before reuse is switched on; off (the default) does neither.
+Both indexing modes add BANDS conditional UpdateItems (16 write units) to
+every soundscape completed with its own audio, made WRITE_CONCURRENCY at a
+time so generate_audio waits about two write latencies rather than sixteen.
+"""
+import contextvars
+import hashlib
+import os
+from concurrent.futures import ThreadPoolExecutor
+from decimal import Decimal
+from functools import lru_cache
+
+from botocore.exceptions import ClientError
+
+from utils import search_index
+
+# index and reuse each cost BANDS bucket writes per analysed image (see above)
+MODE = os.environ.get('SIMILARITY_MODE', 'off').lower()
+REUSE_THRESHOLD = float(os.environ.get('SIMILARITY_REUSE_THRESHOLD', '0.9'))
+# 16 bands of 12 bits: ~95% recall at 0.9 similarity in benchmarks/similarity_benchmark.py,
+# while unrelated images rarely share a 12-bit band
+BANDS = int(os.environ.get('SIMILARITY_BANDS', '16'))
+ROWS = int(os.environ.get('SIMILARITY_ROWS', '12'))
+# A full bucket already offers plenty of candidates; later images are not added
+MAX_BUCKET_MEMBERS = int(os.environ.get('SIMILARITY_MAX_BUCKET_MEMBERS', '20'))
+KEY_PREFIX = 'lsh#'
+# Bucket writes in flight per image; kept under botocore's 10 pooled connections per client
+WRITE_CONCURRENCY = int(os.environ.get('SIMILARITY_WRITE_CONCURRENCY', '8'))
+
+_executor = ThreadPoolExecutor(max_workers=max(1, WRITE_CONCURRENCY), thread_name_prefix='lsh-write')
+
+# Attributes a candidate is checked and reused with
+CANDIDATE_FIELDS = ('imageId', 'status', 'labelVector', 'scene', 'soundPrompt', 'audioUrl', 'renditions',
+                    'waveform', 'loudnessLufs', 'degraded')
+
+
+def indexing():
+    return MODE in ('index', 'reuse')
+
+
+def reusing():
+    return MODE == 'reuse'
+
+
+def vector(labels):
+    """{term: weight} from Rekognition labels, weights being their confidence (0-1)"""
+    weights = {}
+    for label in labels:
+        confidence = min(1.0, float(label['Confidence']) / 100)
+        for term in search_index.normalize(label['Name']):
+            weights[term] = max(weights.get(term, 0.0), confidence)
+    return weights
+
+
+def cosine(a, b):
+    dot = sum(weight * b[term] for term, weight in a.items() if term in b)
+    if not dot:
+        return 0.0
+    norm = (sum(w * w for w in a.values()) * sum(w * w for w in b.values())) ** 0.5
+    return dot / norm
+
+
+@lru_cache(maxsize=8192)
+def _hyperplanes(term, bits):
+    """The term's component on each of `bits` random hyperplanes, +1 or -1"""
+    digest = hashlib.blake2b(term.encode('utf-8'), digest_size=(bits + 7) // 8, person=b'soundscape-lsh').digest()
+    value = int.from_bytes(digest, 'big')
+    return tuple(1.0 if value >> bit & 1 else -1.0 for bit in range(bits))
+
+
+def signature(weights, bands=None, rows=None):
+    """SimHash of the vector: bit i is set when it lies on the positive side of hyperplane i"""
+    bits = (bands or BANDS) * (rows or ROWS)
+    sums = [0.0] * bits
+    for term, weight in weights.items():
+        sums = [total + weight * sign for total, sign in zip(sums, _hyperplanes(term, bits))]
+    return sum(1 << bit for bit, total in enumerate(sums) if total >= 0)
+
+
+def buckets(value, bands=None, rows=None):
+    """The signature's bands as bucket names, `<band>:<bits in hex>`"""
+    bands, rows = bands or BANDS, rows or ROWS
+    mask = (1 << rows) - 1
+    width = (rows + 3) // 4
+    return [f"{band}:{value >> band * rows & mask:0{width}x}" for band in range(bands)]
+
+
+def to_item(weights):
+    """The vector as stored on the item (labelVector)"""
+    return {term: Decimal(str(round(weight, 3))) for term, weight in weights.items()}
+
+
+def from_item(value):
+    return {term: float(weight) for term, weight in (value or {}).items()}
+
+
+class TableIndex:
+    """LSH buckets as items in the soundscape table"""
+
+    def __init__(self, table, dynamodb):
+        self.table = table
+        self.dynamodb = dynamodb
+
+    def _add_one(self, image_id, name):
+        try:
+            self.table.update_item(
+                Key={'imageId': KEY_PREFIX + name},
+                UpdateExpression="ADD members :m",
+                ConditionExpression="attribute_not_exists(members) OR size(members) < :max",
+                ExpressionAttributeValues={':m': {image_id}, ':max': MAX_BUCKET_MEMBERS}
+            )
+            return True
+        except ClientError as err:
+            if err.response['Error']['Code'] != 'ConditionalCheckFailedException':
+                raise
+            return False
+
+    def add(self, image_id, names):
+        """
+        Put the image in each bucket that still has room, WRITE_CONCURRENCY
+        buckets at a time; returns how many took it. Every write is attempted
+        before the first error is raised.
+        """
+        # Each write runs in a copy of the caller's context, so metering and capture still see it
+        futures = [_executor.submit(contextvars.copy_context().run, self._add_one, image_id, name) for name in names]
+        added, error = 0, None
+        for future in futures:
+            try:
+                added += future.result()
+            except Exception as err:
+                error = error or err
+        if error is not None:
+            raise error
+        return added
+
+    def candidates(self, names):
+        """imageIds sharing at least one bucket"""
+        found = search_index.TableIndex(self.table, self.dynamodb).documents(
+            [KEY_PREFIX + name for name in names], ('imageId', 'members'))
+        return set().union(*(item.get('members') or () for item in found.values()))
+
+    def documents(self, image_ids, fields=CANDIDATE_FIELDS):
+        return search_index.TableIndex(self.table, self.dynamodb).documents(list(image_ids), fields)
+
+
+def reusable(item):
+    """Whether a candidate's soundscape may be handed to another request"""
+    return (item.get('status') == 'COMPLETED' and bool(item.get('audioUrl')) and bool(item.get('labelVector'))
+            and 'elevenlabs' not in (item.get('degraded') or []))
+
+
+def find(index, weights, names, threshold=None, exclude=None):
+    """
+    (best reusable item, its similarity), or (None, best similarity seen),
+    among the images sharing a bucket with the vector
+    """
+    threshold = REUSE_THRESHOLD if threshold is None else threshold
+    candidates = index.candidates(names) - {exclude}
+    best, best_similarity = None, 0.0
+    if not candidates:
+        return None, best_similarity
+    for image_id, item in index.documents(candidates).items():
+        if not reusable(item):
+            continue
+        similarity = cosine(weights, from_item(item['labelVector']))
+        if similarity > best_similarity:
+            best, best_similarity = item, similarity
+    return (best, best_similarity) if best_similarity >= threshold else (None, best_similarity)
@@ -0,0 +1,195 @@
+"""
+Speculative audio generation from Rekognition labels while Claude runs.
+
+generate_audio cannot start until image_to_text has Claude's SOUND_PROMPT,
+but the labels arrive seconds earlier. With SPECULATION_MODE set,
+image_to_text submits an audio job (utils.audio_queue) for a prompt built
+from the labels (label_prompt(), the same prompt the Bedrock fallback uses)
+as soon as they are in, so a worker generates the clip while Claude is
+still answering.
+
+When Claude's answer arrives, settle() compares its scene, elements and sound
+prompt with the labels the clip was made from (cosine similarity of
+normalized terms, as in utils.similarity):
+
+- at or above the mode's threshold the clip is kept: the job travels to
+  generate_audio as speculativeJob and is waited for instead of a new one
+- below it the job is released: cancelled if no worker has picked it up and
+  no other request shares it, otherwise its spend is wasted, and
+  generate_audio generates from Claude's prompt as usual
+
+A Bedrock fallback sends the label prompt itself, so it always keeps the clip.
+
+The mode sets how aggressively to speculate:
+
+- conservative: confident labels only, an idle audio queue, threshold 0.4
+- balanced: threshold 0.3, labels of at least 80% confidence, an idle queue
+- aggressive: every request while the queue is not full, threshold 0.2
+
+SPECULATION_THRESHOLD and SPECULATION_MIN_CONFIDENCE override the mode's
+values. Only interactive requests speculate (utils.scheduler), and only
+through the audio queue, whose jobs are the one way one stage can start a
+generation another stage waits for; without AUDIO_QUEUE_URL the mode has no
+effect. Hit rate, similarity, wasted ElevenLabs spend and latency saved are
+emitted as metrics; benchmarks/speculation_benchmark.py replays captures at
+each mode.
+"""
+import os
+from decimal import Decimal
+
+from utils import audio_queue, metering, metrics, scheduler, search_index, similarity
+
+MODES = {
+    'conservative': {'threshold': 0.4, 'minConfidence': 90.0, 'pressure': (audio_queue.PRESSURE_OK,)},
+    'balanced': {'threshold': 0.3, 'minConfidence': 80.0, 'pressure': (audio_queue.PRESSURE_OK,)},
+    'aggressive': {'threshold': 0.2, 'minConfidence': 0.0,
+                   'pressure': (audio_queue.PRESSURE_OK, audio_queue.PRESSURE_BUSY)}
+}
+MODE = os.environ.get('SPECULATION_MODE', 'off').lower()
+_preset = MODES.get(MODE, MODES['balanced'])
+THRESHOLD = float(os.environ.get('SPECULATION_THRESHOLD') or _preset['threshold'])
+# Mean confidence (0-100) of the labels in the prompt
+MIN_CONFIDENCE = float(os.environ.get('SPECULATION_MIN_CONFIDENCE') or _preset['minConfidence'])
+
+# Labels named in the prompt, highest confidence first
+PROMPT_LABELS = 5
+# Claude's sound prompt words count for less than its scene and elements
+PROMPT_TERM_WEIGHT = 0.5
+# Words of any sound prompt that say nothing about what is heard
+GENERIC_TERMS = frozenset({
+    'sound', 'soundscape', 'ambient', 'ambience', 'atmosphere', 'audio', 'create', 'scene', 'element', 'effect',
+    'focus', 'noise', 'musical', 'non', 'like', 'spatial', 'environmental', 'natural', 'background', 'distant',
+    'faint', 'soft', 'gentle', 'subtle', 'their', 'that', 'as', 'from', 'into', 'over', 'while', 'is', 'are'
+})
+
+# Usage of the speculative clip on the item, next to the audio_worker usage of a regenerated one
+STAGE = 'audio_speculative'
+
+OUTCOME_HIT = 'hit'
+OUTCOME_CANCELLED = 'cancelled'
+OUTCOME_SHARED = 'shared'
+OUTCOME_WASTED = 'wasted'
+
+
+def enabled():
+    return MODE in MODES and audio_queue.enabled()
+
+
+def label_prompt(elements):
+    """The sound prompt made from label names alone"""
+    return (f"Create a natural ambient soundscape with environmental sounds for a scene with "
+            f"{', '.join(elements[:PROMPT_LABELS])}. Focus on non-musical audio elements like ambient noises, "
+            f"natural sounds, and spatial effects.")
+
+
+def generation(text):
+    """The ElevenLabs request for a prompt; identical bodies share one queued job"""
+    return {
+        "text": text,
+        "duration_seconds": 8.0,  # Reduced from 10 to 8 seconds to save tokens
+        "prompt_influence": 0.7    # Increased from 0.5 to better follow the prompt with fewer tokens
+    }
+
+
+def confidence(labels):
+    """Mean confidence of the labels the prompt names"""
+    top = sorted((float(label['Confidence']) for label in labels), reverse=True)[:PROMPT_LABELS]
+    return sum(top) / len(top) if top else 0.0
+
+
+def start(table, sqs, labels, image_id, lane, deadline_ms=None):
+    """
+    Submit the label prompt's job when the mode allows it for this request.
+    Returns {'job', 'prompt', 'created'}, or None without speculating.
+    """
+    label_confidence = confidence(labels)
+    if lane != scheduler.INTERACTIVE:
+        reason = f"{lane} requests do not speculate"
+    elif not labels or label_confidence < MIN_CONFIDENCE:
+        reason = f"label confidence {label_confidence:.1f} is below {MIN_CONFIDENCE:.0f}"
+    else:
+        state = audio_queue.pressure(sqs)['state']
+        reason = None if state in MODES[MODE]['pressure'] else f"audio queue is {state}"
+    if reason:
+        print(f"Not speculating: {reason}")
+        metrics.emit({'SpeculationStarted': 0}, dimensions={'SpeculationMode': MODE})
+        return None
+
+    # Rekognition lists labels by confidence
+    prompt = label_prompt([label['Name'] for label in labels])
+    job, created = audio_queue.submit(table, sqs, generation(prompt), image_id, deadline_ms=deadline_ms, stage=STAGE)
+    metrics.emit({'SpeculationStarted': 1}, dimensions={'SpeculationMode': MODE},
+                 properties={'job': job, 'created': created, 'labelConfidence': round(label_confidence, 1)})
+    print(f"Started speculative audio job {job} from {min(len(labels), PROMPT_LABELS)} labels")
+    return {'job': job, 'prompt': prompt, 'created': created}
+
+
+def claude_vector(scene, elements, sound_prompt):
+    """{term: weight} of what Claude's answer says is heard"""
+    weights = {}
+    for word in search_index.normalize(sound_prompt):
+        if word not in GENERIC_TERMS and len(word) > 1:
+            weights[word] = PROMPT_TERM_WEIGHT
+    for text in [scene] + list(elements):
+        for term in search_index.normalize(text or ''):
+            if term not in GENERIC_TERMS:
+                weights[term] = 1.0
+    return weights
+
+
+def score(labels, scene, elements, sound_prompt, speculative_prompt=None):
+    """Similarity (0-1) of the labels a clip was made from and Claude's answer"""
+    if speculative_prompt is not None and sound_prompt == speculative_prompt:
+        return 1.0
+    return similarity.cosine(similarity.vector(labels), claude_vector(scene, elements, sound_prompt))
+
+
+def settle(table, speculative, labels, scene, elements, sound_prompt):
+    """
+    Keep or release the speculative job once Claude's answer is in. Returns
+    the speculation with 'similarity', 'hit' and 'outcome' added.
+    """
+    value = score(labels, scene, elements, sound_prompt, speculative['prompt'])
+    hit = value >= THRESHOLD
+    wasted_seconds = 0.0
+    if hit:
+        outcome = OUTCOME_HIT
+    else:
+        released = audio_queue.release(table, speculative['job'])
+        outcome = {audio_queue.RELEASE_CANCELLED: OUTCOME_CANCELLED,
+                   audio_queue.RELEASE_SHARED: OUTCOME_SHARED}.get(released, OUTCOME_WASTED)
+        if outcome == OUTCOME_WASTED:
+            wasted_seconds = generation(speculative['prompt'])['duration_seconds']
+    wasted_cost = metering.cost({'elevenlabsSeconds': wasted_seconds}).get('elevenlabs', 0.0)
+    metrics.emit(
+        {'SpeculationHit': 1 if hit else 0, 'SpeculationSimilarity': round(value, 3),
+         'SpeculationWastedSeconds': wasted_seconds, 'SpeculationWastedCost': round(wasted_cost, 6)},
+        dimensions={'SpeculationMode': MODE},
+        properties={'job': speculative['job'], 'outcome': outcome, 'threshold': THRESHOLD}
+    )
+    print(f"Speculative audio job {speculative['job']}: similarity {value:.3f} "
+          f"(threshold {THRESHOLD}), {outcome}")
+    return dict(speculative, similarity=value, hit=hit, outcome=outcome)
+
+
+def to_item(speculative):
+    """The speculation as stored on the item"""
+    return {
+        'job': speculative['job'],
+        'prompt': speculative['prompt'],
+        'similarity': Decimal(str(round(speculative['similarity'], 3))),
+        'outcome': speculative['outcome']
+    }
+
+
+def latency_saved(job_item, waited_ms):
+    """
+    Emit the time a kept clip saved: a job for Claude's prompt submitted now
+    would have queued and generated for about as long as this one did, of
+    which the request only waited waited_ms.
+    """
+    fresh_ms = int(job_item.get('waitMs') or 0) + int(job_item.get('serviceMs') or 0)
+    saved_ms = max(0, fresh_ms - int(waited_ms))
+    metrics.emit({'SpeculationLatencySaved': saved_ms}, dimensions={'SpeculationMode': MODE},
+                 units={'SpeculationLatencySaved': 'Milliseconds'}, properties={'waitedMs': int(waited_ms)})
+    return saved_ms
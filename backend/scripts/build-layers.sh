@@ -10,4 +10,10 @@ mkdir -p layers/pillow/python
 echo "Installing Pillow..."
 pip install pillow -t layers/pillow/python
 
+# Static ffmpeg for audio renditions (mounted at /opt/bin/ffmpeg)
+echo "Installing ffmpeg..."
+mkdir -p layers/ffmpeg/bin
+curl -sSL https://johnvansickle.com/ffmpeg/releases/ffmpeg-release-amd64-static.tar.xz \
+  | tar -xJ --strip-components=1 -C layers/ffmpeg/bin --wildcards '*/ffmpeg'
+
 echo "Layer build complete!"
\ No newline at end of file
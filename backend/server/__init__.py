@@ -0,0 +1,5 @@
+"""
+Self-hosted server: the Lambda handlers of functions/ behind one ASGI
+application, with the workflow run in-process instead of by Step Functions.
+Run it with `python -m server` from backend/.
+"""
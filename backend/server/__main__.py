@@ -0,0 +1,66 @@
+"""
+Run the self-hosted server (server.app) under uvicorn.
+
+Options are passed to the worker processes as SERVER_* environment variables
+(server.runtime.Settings), so each process configures itself the same way.
+On SIGTERM or Ctrl-C uvicorn stops accepting connections and the app drains
+running analyses for up to --shutdown-timeout seconds.
+
+Usage (from backend/):
+    pip install -r server/requirements.txt
+    python -m server --offline
+    python -m server --workers 4 --port 8080 --storage aws --models live
+    python -m server --limit bedrock=4 --limit elevenlabs=2 --max-in-flight 16
+"""
+import argparse
+import os
+import sys
+
+from server.runtime import DEFAULT_LIMITS
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--host', default='0.0.0.0')
+    parser.add_argument('--port', type=int, default=8080)
+    parser.add_argument('--workers', type=int, default=1, help="Worker processes")
+    parser.add_argument('--storage', choices=['local', 'aws'], help="Where images, audio and items live")
+    parser.add_argument('--models', choices=['live', 'stub'], help="Rekognition, Bedrock and ElevenLabs, or stand-ins")
+    parser.add_argument('--offline', action='store_true', help="Same as --storage local --models stub")
+    parser.add_argument('--data-dir', help="Directory of local storage (default ./server-data)")
+    parser.add_argument('--public-url', help="URL clients reach the server at, for links to local files")
+    parser.add_argument('--max-in-flight', type=int, help="Analyses per worker process at once")
+    parser.add_argument('--limit', action='append', default=[], metavar='DOWNSTREAM=N',
+                        help=f"Concurrent calls per downstream and process; one of {', '.join(DEFAULT_LIMITS)}")
+    parser.add_argument('--shutdown-timeout', type=float, help="Seconds running analyses get to finish on shutdown")
+    args = parser.parse_args(argv)
+
+    settings = {
+        'SERVER_STORAGE': 'local' if args.offline else args.storage,
+        'SERVER_MODELS': 'stub' if args.offline else args.models,
+        'SERVER_DATA_DIR': args.data_dir and os.path.abspath(args.data_dir),
+        'SERVER_PUBLIC_URL': args.public_url or (None if os.environ.get('SERVER_PUBLIC_URL') else f"http://localhost:{args.port}"),
+        'SERVER_MAX_IN_FLIGHT': args.max_in_flight,
+        'SERVER_SHUTDOWN_SECONDS': args.shutdown_timeout
+    }
+    for limit in args.limit:
+        name, _, value = limit.partition('=')
+        if name not in DEFAULT_LIMITS or not value.isdigit():
+            parser.error(f"--limit takes DOWNSTREAM=N with DOWNSTREAM one of {', '.join(DEFAULT_LIMITS)}")
+        settings[f'SERVER_LIMIT_{name.upper()}'] = value
+    for key, value in settings.items():
+        if value is not None:
+            os.environ[key] = str(value)
+
+    try:
+        import uvicorn
+    except ImportError:
+        print("uvicorn is not installed: pip install -r server/requirements.txt", file=sys.stderr)
+        return 1
+    uvicorn.run('server.app:app', host=args.host, port=args.port, workers=args.workers, lifespan='on',
+                timeout_graceful_shutdown=float(os.environ.get('SERVER_SHUTDOWN_SECONDS', '30')) + 5)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
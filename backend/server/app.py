@@ -0,0 +1,259 @@
+"""
+ASGI application serving the Soundscape API from one process.
+
+Routes, with or without the /api prefix the frontend uses:
+
+- POST /analyze - analyze_api, which runs the workflow (server.runtime.Workflow)
+- GET /health - health_check; 503 while the process drains
+- GET /gallery, GET /search - the gallery and search handlers
+- GET /status/{imageId} - the soundscape's status and, once finished, its result
+- GET|HEAD /files/{bucket}/{key} - objects of local storage (SERVER_STORAGE=local),
+  with Range support for audio seeking
+- OPTIONS on any route - the CORS preflight answer
+
+Requests become API Gateway proxy events for the handlers, which run in the
+API thread pool. At most SERVER_MAX_IN_FLIGHT analyses run at once; more are
+answered 429 with Retry-After, which the frontend retries. On shutdown
+(lifespan.shutdown, sent by the server on SIGTERM) new analyses get 503 and
+running ones get up to SERVER_SHUTDOWN_SECONDS to finish.
+"""
+import asyncio
+import json
+import re
+import time
+import traceback
+import uuid
+from urllib.parse import parse_qsl, unquote
+
+from botocore.exceptions import ClientError
+
+from harness.handlers import LocalContext
+from server.runtime import Runtime, Settings
+from utils import payload
+
+CORS_HEADERS = {
+    'Access-Control-Allow-Origin': '*',
+    'Access-Control-Allow-Headers': 'Content-Type,X-Amz-Date,Authorization,X-Api-Key,X-Amz-Security-Token,X-Requested-With,Idempotency-Key,X-Priority,X-Profile',
+    'Access-Control-Allow-Methods': 'GET,POST,OPTIONS',
+    'Access-Control-Expose-Headers': 'Retry-After'
+}
+
+# Item attributes returned by the status route before the soundscape is finished
+STATUS_FIELDS = ('imageId', 'status', 'createdAt', 'scene', 'degraded', 'errorMessage', 'reusedFrom')
+
+ROUTES = [
+    ('POST', re.compile(r'/analyze'), 'analyze'),
+    ('GET', re.compile(r'/health'), 'health_check'),
+    ('GET', re.compile(r'/gallery'), 'gallery'),
+    ('GET', re.compile(r'/search'), 'search'),
+    ('GET', re.compile(r'/status/(?P<imageId>[A-Za-z0-9_-]+)'), 'status'),
+    ('GET', re.compile(r'/files/(?P<bucket>[^/]+)/(?P<key>.+)'), 'files'),
+    ('HEAD', re.compile(r'/files/(?P<bucket>[^/]+)/(?P<key>.+)'), 'files')
+]
+
+
+class Server:
+    """State of one worker process: the runtime, in-flight analyses and draining"""
+
+    def __init__(self):
+        self.settings = Settings()
+        self.runtime = None
+        self.in_flight = set()
+        self.draining = False
+
+    def start(self):
+        self.runtime = Runtime(self.settings, asyncio.get_running_loop())
+        print(f"Soundscape server started: storage={self.settings.storage}, models={self.settings.models}, "
+              f"max in flight={self.settings.max_in_flight}, limits={self.settings.limits}")
+
+    async def stop(self):
+        self.draining = True
+        if self.in_flight:
+            print(f"Draining {len(self.in_flight)} analyses for up to {self.settings.shutdown_timeout:.0f} s")
+            _, pending = await asyncio.wait(self.in_flight, timeout=self.settings.shutdown_timeout)
+            if pending:
+                print(f"Shutting down with {len(pending)} analyses unfinished")
+        self.runtime.close()
+
+    async def invoke(self, name, event, timeout):
+        handler = self.runtime.handlers[name].lambda_handler
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self.runtime.api_executor, handler, event, LocalContext(name, timeout))
+
+    async def analyze(self, event):
+        if self.draining:
+            return _json_response(503, {'error': 'Server is shutting down, please retry'}, {'Retry-After': '1'})
+        if len(self.in_flight) >= self.settings.max_in_flight:
+            return _json_response(429, {'error': 'Server is at capacity, please retry shortly', 'retryAfterSeconds': 1},
+                                  {'Retry-After': '1'})
+        # A task of its own so shutdown can wait for it even if the client goes away
+        task = asyncio.ensure_future(self.invoke('analyze_api', event, self.settings.request_timeout))
+        self.in_flight.add(task)
+        task.add_done_callback(self.in_flight.discard)
+        return await asyncio.shield(task)
+
+    async def health_check(self, event):
+        if self.draining:
+            return _json_response(503, {'status': 'draining'})
+        return await self.invoke('health_check', event, 10.0)
+
+    async def gallery(self, event):
+        return await self.invoke('gallery', event, 10.0)
+
+    async def search(self, event):
+        return await self.invoke('search', event, 10.0)
+
+    async def status(self, event):
+        image_id = event['pathParameters']['imageId']
+        table = self.runtime.handlers['analyze_api'].table
+        loop = asyncio.get_running_loop()
+        item = (await loop.run_in_executor(self.runtime.api_executor, lambda: table.get_item(Key={'imageId': image_id}))).get('Item')
+        if not item or 'status' not in item:
+            return _json_response(404, {'error': f'No soundscape {image_id}'})
+        body = {field: item[field] for field in STATUS_FIELDS if field in item}
+        if item['status'] == 'COMPLETED':
+            body['result'] = payload.response_body(item)
+        return {'statusCode': 200, 'headers': {'Content-Type': 'application/json'}, 'body': payload.dumps(body)}
+
+    async def files(self, event):
+        s3 = self.runtime.s3
+        if s3 is None:
+            return _json_response(404, {'error': 'Objects are served by S3 in this deployment'})
+        params = event['pathParameters']
+        headers = {k.lower(): v for k, v in event['headers'].items()}
+        loop = asyncio.get_running_loop()
+        try:
+            obj = await loop.run_in_executor(
+                self.runtime.api_executor,
+                lambda: s3.get_object(Bucket=params['bucket'], Key=params['key'], Range=headers.get('range')))
+        except (ClientError, KeyError):
+            return _json_response(404, {'error': 'Not found'})
+        except (AttributeError, ValueError):
+            return _json_response(416, {'error': 'Invalid range'})
+        response_headers = {'Content-Type': obj['ContentType'], 'Accept-Ranges': 'bytes',
+                            'Content-Length': str(obj['ContentLength'])}
+        if 'ContentRange' in obj:
+            response_headers['Content-Range'] = obj['ContentRange']
+        body = b'' if event['httpMethod'] == 'HEAD' else obj['Body'].read()
+        return {'statusCode': 206 if 'ContentRange' in obj else 200, 'headers': response_headers, 'body': body}
+
+
+def _json_response(status_code, body, headers=None):
+    return {'statusCode': status_code, 'headers': dict({'Content-Type': 'application/json'}, **(headers or {})),
+            'body': json.dumps(body)}
+
+
+def _event(scope, body, path, path_parameters):
+    """The API Gateway proxy event the handlers expect"""
+    headers = {}
+    for name, value in scope['headers']:
+        # API Gateway keeps the last of repeated headers
+        headers[name.decode('latin-1').title()] = value.decode('latin-1')
+    query = dict(parse_qsl(scope.get('query_string', b'').decode('latin-1')))
+    return {
+        'httpMethod': scope['method'],
+        'path': path,
+        'headers': headers,
+        'queryStringParameters': query or None,
+        'pathParameters': path_parameters or None,
+        'body': body.decode('utf-8') if body else None,
+        'isBase64Encoded': False,
+        'requestContext': {'requestId': str(uuid.uuid4()), 'requestTimeEpoch': int(time.time() * 1000)}
+    }
+
+
+async def _read_body(receive, limit):
+    chunks, size = [], 0
+    while True:
+        message = await receive()
+        if message['type'] == 'http.disconnect':
+            return None
+        chunk = message.get('body', b'')
+        size += len(chunk)
+        if size > limit:
+            return False
+        chunks.append(chunk)
+        if not message.get('more_body'):
+            return b''.join(chunks)
+
+
+async def _send(send, response):
+    body = response.get('body') or b''
+    if isinstance(body, str):
+        body = body.encode('utf-8')
+    headers = dict(CORS_HEADERS, **(response.get('headers') or {}))
+    headers.setdefault('Content-Length', str(len(body)))
+    await send({'type': 'http.response.start', 'status': response['statusCode'],
+                'headers': [(k.lower().encode('latin-1'), str(v).encode('latin-1')) for k, v in headers.items()]})
+    await send({'type': 'http.response.body', 'body': body})
+
+
+async def _lifespan(receive, send):
+    while True:
+        message = await receive()
+        if message['type'] == 'lifespan.startup':
+            try:
+                server.start()
+            except Exception as err:
+                print(traceback.format_exc())
+                await send({'type': 'lifespan.startup.failed', 'message': str(err)})
+                return
+            await send({'type': 'lifespan.startup.complete'})
+        elif message['type'] == 'lifespan.shutdown':
+            await server.stop()
+            await send({'type': 'lifespan.shutdown.complete'})
+            return
+
+
+async def app(scope, receive, send):
+    if scope['type'] == 'lifespan':
+        await _lifespan(receive, send)
+        return
+    if scope['type'] != 'http':
+        return
+    if server.runtime is None:
+        # Servers without lifespan support
+        server.start()
+
+    path = unquote(scope['path'])
+    path = path[len('/api'):] if path.startswith('/api/') else path
+    method = scope['method']
+
+    body = await _read_body(receive, server.settings.max_body_bytes)
+    if body is None:
+        return
+    if body is False:
+        await _send(send, _json_response(413, {'error': f'Request body over {server.settings.max_body_bytes} bytes'}))
+        return
+
+    if method == 'OPTIONS':
+        await _send(send, _json_response(200, {'message': 'CORS preflight request successful'},
+                                         {'Access-Control-Max-Age': '3600'}))
+        return
+
+    allowed = []
+    for route_method, pattern, name in ROUTES:
+        match = pattern.fullmatch(path)
+        if not match:
+            continue
+        if route_method != method:
+            allowed.append(route_method)
+            continue
+        try:
+            response = await getattr(server, name)(_event(scope, body, path, match.groupdict()))
+        except Exception as err:
+            print(f"Error handling {method} {path}: {err}")
+            print(traceback.format_exc())
+            response = _json_response(500, {'error': f'Internal server error: {err}'})
+        if isinstance(response.get('body'), str):
+            response['body'] = server.runtime.public_body(response['body'])
+        await _send(send, response)
+        return
+
+    if allowed:
+        await _send(send, _json_response(405, {'error': f'{method} not allowed'}, {'Allow': ','.join(allowed)}))
+    else:
+        await _send(send, _json_response(404, {'error': f'No route for {path}'}))
+
+
+server = Server()
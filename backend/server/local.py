@@ -0,0 +1,272 @@
+"""
+Local stand-ins for S3 and DynamoDB that persist to disk, so the server runs
+without AWS.
+
+FilesystemS3 keeps objects as files under <root>/<bucket>/<key>, with their
+content type and metadata beside them under <root>/.meta. SqliteDynamoDB keeps
+items in one SQLite file, serialized as DynamoDB JSON. Both reuse the
+expression, query and range handling of the in-memory stubs
+(harness/stubs.py) and only replace where the data lives, so the handlers
+see the same behaviour in the server as in the load tests.
+
+Every table operation runs in one SQLite write transaction (BEGIN IMMEDIATE),
+so conditional writes stay atomic across the server's worker processes. GSI
+queries on a string partition key use an expression index instead of reading
+the whole table.
+"""
+import json
+import os
+import sqlite3
+import tempfile
+import threading
+from collections.abc import MutableMapping
+from urllib.parse import quote
+
+from boto3.dynamodb.types import TypeDeserializer, TypeSerializer
+
+from harness import stubs
+
+_serializer = TypeSerializer()
+_deserializer = TypeDeserializer()
+
+
+# ---------------------------------------------------------------------------
+# S3
+# ---------------------------------------------------------------------------
+
+class _FilesystemObjects(MutableMapping):
+    """FakeS3.objects on disk: (bucket, key) -> {'Body', 'ContentType', 'Metadata'}"""
+
+    META_DIR = '.meta'
+
+    def __init__(self, root):
+        self.root = os.path.abspath(root)
+        os.makedirs(self.root, exist_ok=True)
+
+    def _path(self, *parts):
+        path = os.path.abspath(os.path.join(self.root, *parts))
+        if not path.startswith(self.root + os.sep):
+            raise KeyError(parts)
+        return path
+
+    def _paths(self, location):
+        bucket, key = location
+        if not bucket or bucket == self.META_DIR or not key:
+            raise KeyError(location)
+        return self._path(bucket, key), self._path(self.META_DIR, bucket, key + '.json')
+
+    @staticmethod
+    def _write(path, data):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        handle, temporary = tempfile.mkstemp(dir=os.path.dirname(path), prefix='.upload-')
+        with os.fdopen(handle, 'wb') as output:
+            output.write(data)
+        # Readers see the old object or the new one, never a partial write
+        os.replace(temporary, path)
+
+    def __getitem__(self, location):
+        data_path, meta_path = self._paths(location)
+        try:
+            with open(data_path, 'rb') as data:
+                body = data.read()
+        except (FileNotFoundError, IsADirectoryError):
+            raise KeyError(location)
+        try:
+            with open(meta_path) as meta:
+                attributes = json.load(meta)
+        except FileNotFoundError:
+            attributes = {}
+        return {'Body': body, 'ContentType': attributes.get('ContentType', 'binary/octet-stream'),
+                'Metadata': attributes.get('Metadata', {})}
+
+    def __setitem__(self, location, obj):
+        data_path, meta_path = self._paths(location)
+        self._write(meta_path, json.dumps({'ContentType': obj['ContentType'], 'Metadata': obj['Metadata']}).encode('utf-8'))
+        self._write(data_path, obj['Body'])
+
+    def __delitem__(self, location):
+        data_path, meta_path = self._paths(location)
+        try:
+            os.remove(data_path)
+        except FileNotFoundError:
+            raise KeyError(location)
+        if os.path.exists(meta_path):
+            os.remove(meta_path)
+
+    def __iter__(self):
+        for bucket in sorted(os.listdir(self.root)):
+            bucket_dir = os.path.join(self.root, bucket)
+            if bucket == self.META_DIR or not os.path.isdir(bucket_dir):
+                continue
+            for directory, _, files in os.walk(bucket_dir):
+                for name in files:
+                    if not name.startswith('.upload-'):
+                        yield bucket, os.path.relpath(os.path.join(directory, name), bucket_dir).replace(os.sep, '/')
+
+    def __len__(self):
+        return sum(1 for _ in self)
+
+
+class FilesystemS3(stubs.FakeS3):
+    """
+    S3 client on the local filesystem. Presigned URLs point at the server's
+    /files route (public_url), which serves the objects.
+    """
+
+    def __init__(self, root, public_url):
+        super().__init__()
+        self.objects = _FilesystemObjects(root)
+        self.public_url = public_url.rstrip('/')
+
+    def url(self, bucket, key):
+        return f"{self.public_url}/files/{bucket}/{quote(key)}"
+
+    def generate_presigned_url(self, ClientMethod, Params, ExpiresIn=3600):
+        return self.url(Params['Bucket'], Params['Key'])
+
+
+# ---------------------------------------------------------------------------
+# DynamoDB
+# ---------------------------------------------------------------------------
+
+def _encode(item):
+    return json.dumps({name: _serializer.serialize(value) for name, value in item.items()}, separators=(',', ':'))
+
+
+def _decode(body):
+    return {name: _deserializer.deserialize(value) for name, value in json.loads(body).items()}
+
+
+class _Transaction:
+    """
+    FakeTable's lock: holding it is one SQLite write transaction, committed
+    when the outermost holder in this process releases it.
+    """
+
+    def __init__(self, connection):
+        self.connection = connection
+        self._lock = threading.RLock()
+        self._depth = 0
+
+    def __enter__(self):
+        self._lock.acquire()
+        if self._depth == 0:
+            try:
+                self.connection.execute('BEGIN IMMEDIATE')
+            except Exception:
+                self._lock.release()
+                raise
+        self._depth += 1
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self._depth -= 1
+        try:
+            if self._depth == 0:
+                self.connection.execute('ROLLBACK' if exc_type else 'COMMIT')
+        finally:
+            self._lock.release()
+        return False
+
+
+class _SqliteItems(MutableMapping):
+    """FakeTable.items in SQLite: key value -> item"""
+
+    def __init__(self, connection, table):
+        self.connection = connection
+        self.table = table
+
+    def __getitem__(self, key):
+        row = self.connection.execute('SELECT body FROM items WHERE tbl = ? AND pk = ?', (self.table, key)).fetchone()
+        if row is None:
+            raise KeyError(key)
+        return _decode(row[0])
+
+    def __setitem__(self, key, item):
+        self.connection.execute('INSERT OR REPLACE INTO items (tbl, pk, body) VALUES (?, ?, ?)',
+                                (self.table, key, _encode(item)))
+
+    def __delitem__(self, key):
+        if not self.connection.execute('DELETE FROM items WHERE tbl = ? AND pk = ?', (self.table, key)).rowcount:
+            raise KeyError(key)
+
+    def __iter__(self):
+        return iter([row[0] for row in self.connection.execute('SELECT pk FROM items WHERE tbl = ?', (self.table,))])
+
+    def __len__(self):
+        return self.connection.execute('SELECT COUNT(*) FROM items WHERE tbl = ?', (self.table,)).fetchone()[0]
+
+    def values(self):
+        return [_decode(row[0]) for row in self.connection.execute('SELECT body FROM items WHERE tbl = ?', (self.table,))]
+
+    def where(self, attribute, value):
+        """Items whose string attribute equals value, through the attribute's expression index"""
+        rows = self.connection.execute(
+            f"SELECT body FROM items WHERE tbl = ? AND {_string_attribute(attribute)} = ?", (self.table, value))
+        return [_decode(row[0]) for row in rows]
+
+
+def _string_attribute(attribute):
+    if not attribute.isidentifier():
+        raise ValueError(f"Unsupported index attribute: {attribute}")
+    return f"json_extract(body, '$.{attribute}.S')"
+
+
+class SqliteTable(stubs.FakeTable):
+    """FakeTable whose items live in SQLite"""
+
+    def __init__(self, name, connection, transaction):
+        super().__init__(name)
+        self.connection = connection
+        self.items = _SqliteItems(connection, name)
+        self._lock = transaction
+        self._counter_lock = threading.Lock()
+
+    def add_index(self, name, partition_key, sort_key=None):
+        super().add_index(name, partition_key, sort_key)
+        self.connection.execute(
+            f"CREATE INDEX IF NOT EXISTS idx_{partition_key} ON items (tbl, {_string_attribute(partition_key)})")
+
+    def _begin(self, operation=None):
+        # Counting a call must not open a transaction
+        if operation:
+            stubs.before_call('dynamodb', operation)
+        with self._counter_lock:
+            self.calls += 1
+
+    @staticmethod
+    def _copy(item):
+        # Items are decoded fresh from SQLite on every read
+        return item
+
+    def _index_partition(self, index_name, value):
+        partition_key, sort_key = self.indexes[index_name]
+        if isinstance(value, str):
+            items = [item for item in self.items.where(partition_key, value) if sort_key in item]
+        else:
+            items = [item for item in self.items.values() if item.get(partition_key) == value and sort_key in item]
+        items.sort(key=lambda i: (i[sort_key], i[self.key]))
+        return items, [(i[sort_key], i[self.key]) for i in items]
+
+
+class SqliteDynamoDB(stubs.FakeDynamoDBResource):
+    """Stand-in for boto3.resource('dynamodb') backed by one SQLite file"""
+
+    def __init__(self, path):
+        super().__init__()
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        # Autocommit mode; _Transaction issues BEGIN/COMMIT itself
+        self.connection = sqlite3.connect(path, timeout=30.0, isolation_level=None, check_same_thread=False)
+        self.connection.execute('PRAGMA journal_mode=WAL')
+        self.connection.execute('PRAGMA synchronous=NORMAL')
+        self.connection.execute('CREATE TABLE IF NOT EXISTS items (tbl TEXT NOT NULL, pk TEXT NOT NULL, body TEXT NOT NULL, '
+                                'PRIMARY KEY (tbl, pk))')
+        self.transaction = _Transaction(self.connection)
+
+    def Table(self, name):
+        if name not in self.tables:
+            self.tables[name] = SqliteTable(name, self.connection, self.transaction)
+        return self.tables[name]
+
+    def close(self):
+        self.connection.close()
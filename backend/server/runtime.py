@@ -0,0 +1,230 @@
+"""
+The Lambda handlers of functions/*/app.py, loaded and wired for one server
+process.
+
+Workflow replaces Step Functions: analyze_api's start_sync_execution() runs
+the validate -> analyze -> audio -> response stages as asyncio tasks on the
+server's event loop, each stage in the stage thread pool with its own
+timeout, and returns the execution result the way Step Functions does.
+
+Every downstream client a handler uses is wrapped in a Limited proxy holding
+a semaphore per downstream (SERVER_LIMIT_<NAME>, see DEFAULT_LIMITS), so a
+slow Bedrock or ElevenLabs cannot take every thread of the process. Within
+those limits, interactive and bulk requests share the Bedrock and ElevenLabs
+slots through the in-process scheduler (utils.scheduler, SCHEDULER_BACKEND=local).
+
+SERVER_STORAGE picks where images, audio and items live: local (the default)
+uses server.local (files and SQLite under SERVER_DATA_DIR), aws uses S3 and
+DynamoDB as deployed. SERVER_MODELS picks Rekognition, Bedrock and ElevenLabs:
+live, or stub for the canned responses of harness/stubs.py, which with
+local storage runs the whole pipeline offline.
+"""
+import asyncio
+import inspect
+import json
+import os
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from harness import stubs
+from harness.handlers import LAYER_DIRS, WORKFLOW_STAGES, LocalContext, load_handler
+from server import local
+
+for _layer in LAYER_DIRS:
+    if _layer not in sys.path:
+        sys.path.append(_layer)
+from utils import payload  # noqa: E402
+
+# Handlers the server routes to, besides the workflow stages
+API_HANDLERS = ['analyze_api', 'health_check', 'gallery', 'search']
+
+# Concurrent calls per downstream and process
+DEFAULT_LIMITS = {'s3': 64, 'dynamodb': 64, 'rekognition': 16, 'bedrock': 8, 'elevenlabs': 4}
+
+# What the handlers read at import; the deployed stack sets these in template.yaml
+DEFAULTS = {
+    'AWS_DEFAULT_REGION': 'us-east-1',
+    'TABLE_NAME': 'soundscape',
+    'IMAGES_BUCKET': 'soundscape-images',
+    'AUDIO_BUCKET': 'soundscape-audio',
+    'ELEVEN_LABS_PARAM': '/soundscape/elevenlabs-api-key',
+    'STATE_MACHINE_ARN': 'arn:aws:states:local:000000000000:stateMachine:soundscape-server'
+}
+
+# GSIs of the deployed table, created on the SQLite table
+TABLE_INDEXES = [('status-createdAt-index', 'status', 'createdAt'),
+                 ('searchTerm-searchScore-index', 'searchTerm', 'searchScore')]
+
+
+class Settings:
+    """Server configuration from SERVER_* environment variables, read by every worker process"""
+
+    def __init__(self, environ=None):
+        environ = os.environ if environ is None else environ
+        self.storage = environ.get('SERVER_STORAGE', 'local').lower()
+        self.models = environ.get('SERVER_MODELS', 'live').lower()
+        self.data_dir = os.path.abspath(environ.get('SERVER_DATA_DIR', 'server-data'))
+        self.public_url = environ.get('SERVER_PUBLIC_URL', 'http://localhost:8080').rstrip('/')
+        # API Gateway's integration timeout, which the frontend is built around
+        self.request_timeout = float(environ.get('SERVER_REQUEST_TIMEOUT_SECONDS', '29'))
+        self.stage_timeout = float(environ.get('SERVER_STAGE_TIMEOUT_SECONDS', '30'))
+        # Workflows one process runs at once; more get a 429
+        self.max_in_flight = int(environ.get('SERVER_MAX_IN_FLIGHT', '32'))
+        self.shutdown_timeout = float(environ.get('SERVER_SHUTDOWN_SECONDS', '30'))
+        self.max_body_bytes = int(environ.get('SERVER_MAX_BODY_BYTES', str(8 * 1024 * 1024)))
+        self.limits = {name: int(environ.get(f'SERVER_LIMIT_{name.upper()}', default))
+                       for name, default in DEFAULT_LIMITS.items()}
+        if self.storage not in ('local', 'aws'):
+            raise ValueError(f"SERVER_STORAGE must be local or aws, not {self.storage}")
+        if self.models not in ('live', 'stub'):
+            raise ValueError(f"SERVER_MODELS must be live or stub, not {self.models}")
+
+    @property
+    def offline(self):
+        return self.storage == 'local' and self.models == 'stub'
+
+
+class Limited:
+    """
+    Proxy for a client, resource or module whose calls each hold one slot of
+    the downstream's semaphore. Attributes that are not functions (exception
+    classes, meta) pass through unwrapped.
+    """
+
+    # Methods returning objects that make further calls to the same downstream
+    NESTED = ('Table',)
+
+    def __init__(self, target, semaphore):
+        self.target = target
+        self._semaphore = semaphore
+
+    def rewrap(self, target):
+        """The same limit around another client (utils.deadline's bounded variants)"""
+        return target if target is self.target else Limited(target, self._semaphore)
+
+    def __getattr__(self, name):
+        attribute = getattr(self.target, name)
+        if not inspect.isroutine(attribute):
+            return attribute
+
+        def call(*args, **kwargs):
+            with self._semaphore:
+                result = attribute(*args, **kwargs)
+            return Limited(result, self._semaphore) if name in self.NESTED else result
+        return call
+
+
+class Workflow:
+    """start_sync_execution stand-in that runs the stages as asyncio tasks on the server's loop"""
+
+    def __init__(self, handlers, loop, executor, stage_timeout):
+        self.handlers = handlers
+        self.loop = loop
+        self.executor = executor
+        self.stage_timeout = stage_timeout
+        self.executions = 0
+
+    def start_sync_execution(self, stateMachineArn, name, input, **kwargs):
+        # Called from analyze_api in an API thread, which waits like the synchronous API does
+        return asyncio.run_coroutine_threadsafe(self.execute(stateMachineArn, name, input), self.loop).result()
+
+    async def execute(self, arn, name, input):
+        self.executions += 1
+        started = time.time()
+        state = json.loads(input)
+        result = {'executionArn': f"{arn}:{name}", 'name': name, 'startDate': started}
+
+        for stage in WORKFLOW_STAGES:
+            handler = self.handlers[stage].lambda_handler
+            task = asyncio.ensure_future(self.loop.run_in_executor(
+                self.executor, handler, state, LocalContext(stage, self.stage_timeout)))
+            try:
+                state = await asyncio.wait_for(task, self.stage_timeout)
+            except asyncio.TimeoutError:
+                # The stage's thread runs on; its deadline (utils.deadline) ends it
+                return dict(result, stopDate=time.time(), status='TIMED_OUT', error='States.Timeout',
+                            cause=f"{stage} did not finish within {self.stage_timeout:.0f} s")
+            except Exception as err:
+                return dict(result, stopDate=time.time(), status='FAILED', error=type(err).__name__,
+                            cause=json.dumps({'errorMessage': str(err), 'errorType': type(err).__name__}))
+            # Stage results cross the Step Functions boundary as JSON
+            state = payload.loads(payload.dumps(state))
+
+        return dict(result, stopDate=time.time(), status='SUCCEEDED', output=payload.dumps(state))
+
+    def describe_state_machine(self, stateMachineArn):
+        return {'stateMachineArn': stateMachineArn, 'status': 'ACTIVE'}
+
+
+class Runtime:
+    """The handlers of one server process, their clients and thread pools"""
+
+    def __init__(self, settings, loop):
+        self.settings = settings
+        for key, value in DEFAULTS.items():
+            os.environ.setdefault(key, value)
+        # Priority lanes share each model's slots in this process (utils/scheduler.py)
+        os.environ.setdefault('SCHEDULER_BACKEND', 'local')
+        os.environ.setdefault('SCHEDULER_CAPACITY', f"bedrock={settings.limits['bedrock']},elevenlabs={settings.limits['elevenlabs']}")
+        if settings.offline:
+            # Clients are still created at import; they need credentials to exist, not to work
+            os.environ.setdefault('AWS_ACCESS_KEY_ID', 'local')
+            os.environ.setdefault('AWS_SECRET_ACCESS_KEY', 'local')
+
+        # API threads wait for their workflow, so stages get a pool of their own
+        self.api_executor = ThreadPoolExecutor(settings.max_in_flight + 8, thread_name_prefix='soundscape-api')
+        self.stage_executor = ThreadPoolExecutor(settings.max_in_flight, thread_name_prefix='soundscape-stage')
+        self.semaphores = {name: threading.BoundedSemaphore(limit) for name, limit in settings.limits.items()}
+
+        self.handlers = {name: load_handler(name) for name in WORKFLOW_STAGES + API_HANDLERS}
+        self.workflow = Workflow(self.handlers, loop, self.stage_executor, settings.stage_timeout)
+        self.s3 = self.dynamodb = None
+        self._patch()
+
+    def _limited(self, downstream, client):
+        return Limited(client, self.semaphores[downstream])
+
+    def _patch(self):
+        settings = self.settings
+        replacements = {'stepfunctions': self.workflow}
+        if settings.storage == 'local':
+            self.s3 = local.FilesystemS3(os.path.join(settings.data_dir, 's3'), settings.public_url)
+            self.dynamodb = local.SqliteDynamoDB(os.path.join(settings.data_dir, 'dynamodb.sqlite3'))
+            table = self.dynamodb.Table(os.environ['TABLE_NAME'])
+            for index in TABLE_INDEXES:
+                table.add_index(*index)
+            replacements.update(s3=self.s3, dynamodb=self.dynamodb, table=table)
+        if settings.models == 'stub':
+            bedrock = stubs.FakeBedrock()
+            replacements.update(rekognition=stubs.FakeRekognition(), bedrock=bedrock, hedge_bedrock=bedrock,
+                                requests=stubs.FakeElevenLabs())
+        if settings.models == 'stub' or os.environ.get('ELEVENLABS_API_KEY'):
+            # The API key from the environment instead of Parameter Store
+            replacements['ssm'] = stubs.FakeSSM({os.environ['ELEVEN_LABS_PARAM']: os.environ.get('ELEVENLABS_API_KEY', 'local')})
+
+        downstreams = {'s3': 's3', 'dynamodb': 'dynamodb', 'table': 'dynamodb', 'rekognition': 'rekognition',
+                       'bedrock': 'bedrock', 'hedge_bedrock': 'bedrock', 'requests': 'elevenlabs'}
+        for module in self.handlers.values():
+            for attribute in set(downstreams) | set(replacements):
+                if getattr(module, attribute, None) is None:
+                    continue
+                client = replacements.get(attribute, getattr(module, attribute))
+                if attribute in downstreams:
+                    client = self._limited(downstreams[attribute], client)
+                setattr(module, attribute, client)
+
+    def public_body(self, body):
+        """Response body with S3 URLs pointing at the /files route when objects are stored locally"""
+        if self.settings.storage != 'local' or not body:
+            return body
+        for bucket in (os.environ['IMAGES_BUCKET'], os.environ['AUDIO_BUCKET']):
+            body = body.replace(f"https://{bucket}.s3.amazonaws.com/", f"{self.settings.public_url}/files/{bucket}/")
+        return body
+
+    def close(self):
+        self.api_executor.shutdown(wait=False, cancel_futures=True)
+        self.stage_executor.shutdown(wait=False, cancel_futures=True)
+        if self.dynamodb is not None:
+            self.dynamodb.close()
@@ -7,7 +7,7 @@ const Header: React.FC = () => {
   const [menuOpen, setMenuOpen] = useState(false);
   useLocation();
   const navigate = useNavigate();
-  const { audioUrl, resetState } = useAppContext();
+  const { description, resetState } = useAppContext();
   
   const toggleMenu = () => {
     setMenuOpen(!menuOpen);
@@ -20,7 +20,7 @@ const Header: React.FC = () => {
   const handleLogoClick = () => {
     closeMenu();
     // Always reset state and navigate home
-    if (audioUrl) {
+    if (description) {
       resetState();
     }
     navigate('/');
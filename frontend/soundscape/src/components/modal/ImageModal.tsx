@@ -1,15 +1,21 @@
 import React, { useEffect, useRef, useState } from 'react';
+import { pickDerivative } from '../../services/imageService';
+import type { ImageDerivative } from '../../services/imageService';
 
 interface ImageModalProps {
   imageUrl: string;
+  // Display-size copies; the full-size imageUrl is only loaded without them
+  derivatives?: ImageDerivative[];
   altText: string;
-  audioUrl: string;
+  // null when the soundscape has no audio
+  audioUrl: string | null;
   isOpen: boolean;
   onClose: () => void;
 }
 
 const ImageModal: React.FC<ImageModalProps> = ({
   imageUrl,
+  derivatives = [],
   altText,
   audioUrl,
   isOpen,
@@ -108,6 +114,9 @@ const ImageModal: React.FC<ImageModalProps> = ({
   };
   
   if (!isOpen) return null;
+
+  const display = pickDerivative(derivatives, 'medium');
+  const displayImage = display.jpeg || display.webp;
   
   return (
     <div 
@@ -136,20 +145,26 @@ const ImageModal: React.FC<ImageModalProps> = ({
         <h2 id="modal-title" className="visually-hidden">Fullscreen Image</h2>
         
         <div className="modal-image-container">
-          <img 
-            src={imageUrl} 
-            alt={altText} 
-            className="modal-image"
-          />
+          <picture>
+            {display.webp && <source srcSet={display.webp.url} type="image/webp" />}
+            <img 
+              src={displayImage?.url || imageUrl} 
+              alt={altText} 
+              className="modal-image"
+              decoding="async"
+            />
+          </picture>
         </div>
         
         {/* Hidden audio element instead of audio player */}
-        <audio 
-          ref={audioRef}
-          src={audioUrl}
-          preload="auto"
-          style={{ display: 'none' }}
-        />
+        {audioUrl && (
+          <audio 
+            ref={audioRef}
+            src={audioUrl}
+            preload="auto"
+            style={{ display: 'none' }}
+          />
+        )}
       </div>
     </div>
   );
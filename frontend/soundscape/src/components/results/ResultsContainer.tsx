@@ -5,6 +5,7 @@ import SceneDescription from './SceneDescription';
 import DetectedElements from './DetectedElements';
 import Button from '../common/Button';
 import ImageModal from '../modal/ImageModal';
+import { pickDerivative } from '../../services/imageService';
 
 const ResultsContainer: React.FC = () => {
   const {
@@ -12,17 +13,27 @@ const ResultsContainer: React.FC = () => {
     description,
     scene,
     audioUrl,
+    waveform,
+    imageDerivatives,
     detectedElements,
+    degraded,
     resetState
   } = useAppContext();
 
-  if (!audioUrl || !description) {
+  if (!description) {
     return null;
   }
 
+  // Audio generation was skipped (degraded mode, open breaker or no time left)
+  const hasAudio = Boolean(audioUrl) && !degraded.includes('elevenlabs');
+
   // State for image modal
   const [isModalOpen, setIsModalOpen] = useState(false);
 
+  // The display-size copy when the backend made one, otherwise the local preview
+  const display = pickDerivative(imageDerivatives, 'medium');
+  const displayImage = display.jpeg || display.webp;
+
   // Handle reset/start over
   const handleReset = () => {
     resetState();
@@ -44,26 +55,40 @@ const ResultsContainer: React.FC = () => {
       
       <div className="results-content">
         {/* Image as the main focus */}
-        {imagePreview && (
+        {(imagePreview || displayImage) && (
           <div className="results-image-container">
             <h2>Image Analysis</h2>
-            <img 
-              src={imagePreview} 
-              alt={`Image of ${description}`} 
-              className="results-image"
-              onClick={handleImageClick}
-            />
+            <picture>
+              {display.webp && <source srcSet={display.webp.url} type="image/webp" />}
+              <img 
+                src={displayImage?.url || imagePreview || ''} 
+                alt={`Image of ${description}`} 
+                className="results-image"
+                width={displayImage?.width}
+                height={displayImage?.height}
+                decoding="async"
+                onClick={handleImageClick}
+              />
+            </picture>
             <p className="image-click-hint">Click image to view fullscreen</p>
           </div>
         )}
         
         {/* Audio player below the image */}
         <div className="audio-section">
-          <AudioPlayer 
-            audioUrl={audioUrl} 
-            description={description}
-            hideVisualizer={true}
-          />
+          {hasAudio ? (
+            <AudioPlayer 
+              audioUrl={audioUrl as string} 
+              description={description}
+              waveform={waveform}
+              hideVisualizer={true}
+            />
+          ) : (
+            <div className="audio-player audio-unavailable" role="status">
+              <h3>No audio for this soundscape</h3>
+              <p>The sound service was unavailable, so only the description was generated. Try again later.</p>
+            </div>
+          )}
         </div>
         
         {/* Description and detected elements */}
@@ -92,8 +117,9 @@ const ResultsContainer: React.FC = () => {
       {/* Image Modal */}
       <ImageModal 
         imageUrl={imagePreview || ''}
+        derivatives={imageDerivatives}
         altText={`Image of ${description}`}
-        audioUrl={audioUrl}
+        audioUrl={hasAudio ? audioUrl : null}
         isOpen={isModalOpen}
         onClose={handleCloseModal}
       />
@@ -2,23 +2,27 @@ import React, { useRef, useState, useEffect } from "react";
 import AudioVisualizer from "./AudioVisualizer";
 import DownloadButton from "./DownloadButton";
 import Button from "../common/Button";
+import type { AudioWaveform } from "../../services/soundscapeService";
 
 interface AudioPlayerProps {
   audioUrl: string;
   description: string;
+  waveform?: AudioWaveform | null;
   hideVisualizer?: boolean;
 }
 
 const AudioPlayer: React.FC<AudioPlayerProps> = ({
   audioUrl,
   description,
+  waveform = null,
   hideVisualizer = false,
 }) => {
   const audioRef = useRef<HTMLAudioElement>(
     null
   ) as React.RefObject<HTMLAudioElement>;
   const [isPlaying, setIsPlaying] = useState(false);
-  const [duration, setDuration] = useState(0);
+  // Known from the precomputed waveform before the audio metadata loads
+  const [duration, setDuration] = useState(waveform?.durationSeconds || 0);
   const [currentTime, setCurrentTime] = useState(0);
   const [volume, setVolume] = useState(0.75);
   const [isLooping, setIsLooping] = useState(false);
@@ -325,8 +329,8 @@ const AudioPlayer: React.FC<AudioPlayerProps> = ({
               <DownloadButton audioUrl={audioUrl} description={description} />
             </div>
 
-            {!hideVisualizer && audioLoaded && audioRef.current && (
-              <AudioVisualizer audioRef={audioRef} isPlaying={isPlaying} />
+            {!hideVisualizer && (audioLoaded || waveform?.peaks) && audioRef.current && (
+              <AudioVisualizer audioRef={audioRef} isPlaying={isPlaying} waveform={waveform} />
             )}
           </>
         )}
@@ -1,14 +1,16 @@
 import React, { useRef, useEffect } from 'react';
+import type { AudioWaveform } from '../../services/soundscapeService';
 
 interface AudioVisualizerProps {
   audioRef: React.RefObject<HTMLAudioElement | null>;
   isPlaying: boolean;
+  waveform?: AudioWaveform | null;
 }
 
 // Create a shared AudioContext
 const audioContext = new (window.AudioContext || (window as any).webkitAudioContext)();
 
-const AudioVisualizer: React.FC<AudioVisualizerProps> = ({ audioRef, isPlaying }) => {
+const AudioVisualizer: React.FC<AudioVisualizerProps> = ({ audioRef, isPlaying, waveform = null }) => {
   const canvasRef = useRef<HTMLCanvasElement>(null);
   const animationRef = useRef<number | undefined>(undefined);
   const analyserRef = useRef<AnalyserNode | null>(null);
@@ -133,6 +135,12 @@ const AudioVisualizer: React.FC<AudioVisualizerProps> = ({ audioRef, isPlaying }
     const rect = canvas.getBoundingClientRect();
     const width = rect.width;
     const height = rect.height;
+
+    // Draw the real waveform from server-side peaks when we have them
+    if (waveform?.peaks && waveform.peaks.length >= 2) {
+      drawWaveformPeaks(ctx, waveform.peaks, width, height);
+      return;
+    }
     
     const barCount = 32;
     const barWidth = (width / barCount) * 2.5;
@@ -151,10 +159,36 @@ const AudioVisualizer: React.FC<AudioVisualizerProps> = ({ audioRef, isPlaying }
     }
   };
 
+  // Draw min/max peaks as mirrored bars, one per canvas pixel column at most
+  const drawWaveformPeaks = (ctx: CanvasRenderingContext2D, peaks: number[], width: number, height: number) => {
+    const points = peaks.length / 2;
+    const columns = Math.max(1, Math.min(points, Math.floor(width / 2)));
+    const pointsPerColumn = points / columns;
+    const columnWidth = width / columns;
+    const middle = height / 2;
+
+    for (let column = 0; column < columns; column++) {
+      const start = Math.floor(column * pointsPerColumn);
+      const end = Math.max(start + 1, Math.floor((column + 1) * pointsPerColumn));
+      let min = 0;
+      let max = 0;
+      for (let point = start; point < end; point++) {
+        min = Math.min(min, peaks[point * 2]);
+        max = Math.max(max, peaks[point * 2 + 1]);
+      }
+
+      const hue = 240 - (column / columns) * 60;
+      ctx.fillStyle = `hsl(${hue}, 70%, 50%)`;
+      const top = middle - (max / 127) * middle;
+      const bottom = middle - (min / 127) * middle;
+      ctx.fillRect(column * columnWidth, top, Math.max(1, columnWidth - 1), Math.max(1, bottom - top));
+    }
+  };
+
   // Draw the initial static visualization on component mount
   useEffect(() => {
     drawStaticVisualization();
-  }, []);
+  }, [waveform]);
 
   return (
     <div className="audio-visualizer">
@@ -1,4 +1,6 @@
 import React, { createContext, useContext, useState, ReactNode, useEffect } from 'react';
+import type { AudioWaveform } from '../services/soundscapeService';
+import type { ImageDerivative } from '../services/imageService';
 
 // Define the shape of our app state
 interface AppState {
@@ -10,7 +12,12 @@ interface AppState {
   description: string | null;
   scene: string | null;
   audioUrl: string | null;
+  waveform: AudioWaveform | null;
+  // Display-size copies of the upload stored by the backend
+  imageDerivatives: ImageDerivative[];
   detectedElements: string[];
+  // Stages the backend skipped; 'elevenlabs' means the soundscape has no audio
+  degraded: string[];
   isFirstVisit: boolean;
   isHighContrast: boolean;
   isDarkMode: boolean; // Dark mode state
@@ -26,8 +33,11 @@ interface AppContextType extends AppState {
   setResults: (results: { 
     description: string; 
     scene: string; 
-    audioUrl: string; 
-    detectedElements: string[] 
+    audioUrl: string | null; 
+    waveform?: AudioWaveform | null;
+    imageDerivatives?: ImageDerivative[];
+    detectedElements: string[];
+    degraded?: string[];
   }) => void;
   resetState: () => void;
   completeOnboarding: () => void;
@@ -45,7 +55,10 @@ const initialState: AppState = {
   description: null,
   scene: null,
   audioUrl: null,
+  waveform: null,
+  imageDerivatives: [],
   detectedElements: [],
+  degraded: [],
   isFirstVisit: true,
   isHighContrast: false,
   isDarkMode: true, // Dark mode default is true
@@ -114,8 +127,11 @@ export const AppProvider: React.FC<{ children: ReactNode }> = ({ children }) =>
   const setResults = (results: { 
     description: string; 
     scene: string; 
-    audioUrl: string; 
-    detectedElements: string[] 
+    audioUrl: string | null; 
+    waveform?: AudioWaveform | null;
+    imageDerivatives?: ImageDerivative[];
+    detectedElements: string[];
+    degraded?: string[];
   }) => {
     setState(prev => ({
       ...prev,
@@ -124,7 +140,10 @@ export const AppProvider: React.FC<{ children: ReactNode }> = ({ children }) =>
       description: results.description,
       scene: results.scene,
       audioUrl: results.audioUrl,
+      waveform: results.waveform || null,
+      imageDerivatives: results.imageDerivatives || [],
       detectedElements: results.detectedElements,
+      degraded: results.degraded || [],
     }));
   };
 
@@ -5,6 +5,7 @@ import LoadingIndicator from '../components/common/LoadingIndicator';
 import ErrorMessage from '../components/common/ErrorMessage';
 import ResultsContainer from '../components/results/ResultsContainer';
 import { api } from '../services/api';
+import { loadWaveform, pickPlaybackUrl } from '../services/soundscapeService';
 
 const Home: React.FC = () => {
   const { 
@@ -15,14 +16,14 @@ const Home: React.FC = () => {
     setProgress, 
     setError, 
     setResults,
-    audioUrl
+    description
   } = useAppContext();
   
   const [showExample] = useState(false);
 
   // Process the image when it's uploaded
   useEffect(() => {
-    if (imageFile && !isLoading && !audioUrl) {
+    if (imageFile && !isLoading && !description) {
       processImage(imageFile);
     }
   }, [imageFile]);
@@ -42,8 +43,14 @@ const Home: React.FC = () => {
       setResults({
         description: result.description,
         scene: result.scene,
-        audioUrl: result.audioUrl,
+        // Smallest encoding the browser can play; starts faster on slow links
+        audioUrl: result.audioUrl ? pickPlaybackUrl(result.audioUrl, result.renditions) : null,
+        // Precomputed peaks let the player draw the waveform without decoding
+        waveform: await loadWaveform(result.waveform),
+        // Display-size copies load in kilobytes instead of the full upload
+        imageDerivatives: result.derivatives,
         detectedElements: result.detectedElements,
+        degraded: result.degraded,
       });
     } catch (err) {
       console.error('Error processing image:', err);
@@ -65,7 +72,7 @@ const Home: React.FC = () => {
 
   return (
     <div className="home-container">
-      {!audioUrl && (
+      {!description && (
         <section className="hero-section">
           <h1>Soundscape AI</h1>
           <p className="subtitle">Hear the world through images</p>
@@ -89,7 +96,7 @@ const Home: React.FC = () => {
       
       {/* Remove top controls section - will move Start Over button to the bottom of the results */}
 
-      {!audioUrl && (
+      {!description && (
         <section className="upload-section">
           {(isLoading || showExample) ? (
             <LoadingIndicator />
@@ -101,7 +108,7 @@ const Home: React.FC = () => {
         </section>
       )}
 
-      {audioUrl && (
+      {description && (
         <section className="results-section">
           <ResultsContainer />
         </section>
@@ -1,3 +1,7 @@
+import type { AudioRendition, AudioWaveform } from './soundscapeService';
+import { prepareImage } from './imageService';
+import type { ImageDerivative } from './imageService';
+
 // Maximum time in milliseconds to wait for a response before timing out
 const REQUEST_TIMEOUT = 30000;
 
@@ -18,17 +22,59 @@ export class ApiError extends Error {
   }
 }
 
+// Type for upload progress callback
+type ProgressCallback = (percent: number) => void;
+
+// fetch() for uploads: XMLHttpRequest reports how much of the body has been sent
+const fetchWithUploadProgress = (url: string, options: RequestInit, onUploadProgress: ProgressCallback): Promise<Response> => {
+  return new Promise((resolve, reject) => {
+    const xhr = new XMLHttpRequest();
+    xhr.open(options.method || 'GET', url);
+    Object.entries((options.headers || {}) as Record<string, string>).forEach(([name, value]) => {
+      xhr.setRequestHeader(name, value);
+    });
+
+    xhr.upload.onprogress = event => {
+      if (event.lengthComputable) {
+        onUploadProgress((event.loaded / event.total) * 100);
+      }
+    };
+    xhr.onload = () => {
+      const headers = new Headers();
+      xhr.getAllResponseHeaders().trim().split(/[\r\n]+/).forEach(line => {
+        const separator = line.indexOf(':');
+        if (separator > 0) {
+          headers.append(line.slice(0, separator).trim(), line.slice(separator + 1).trim());
+        }
+      });
+      resolve(new Response(xhr.responseText, { status: xhr.status, statusText: xhr.statusText, headers }));
+    };
+    xhr.onerror = () => reject(new TypeError('Network request failed'));
+    xhr.onabort = () => reject(new DOMException('The request was aborted', 'AbortError'));
+
+    options.signal?.addEventListener('abort', () => xhr.abort());
+    xhr.send(options.body as XMLHttpRequestBodyInit | null);
+  });
+};
+
 // Retry logic with exponential backoff
-const retryFetch = async (url: string, options: RequestInit, retries = 0): Promise<Response> => {
+const retryFetch = async (
+  url: string,
+  options: RequestInit,
+  retries = 0,
+  onUploadProgress?: ProgressCallback
+): Promise<Response> => {
   try {
     // Create an AbortController to handle timeouts
     const controller = new AbortController();
     const timeoutId = setTimeout(() => controller.abort(), REQUEST_TIMEOUT);
     
-    const response = await fetch(url, {
-      ...options,
-      signal: controller.signal
-    });
+    const response = onUploadProgress
+      ? await fetchWithUploadProgress(url, { ...options, signal: controller.signal }, onUploadProgress)
+      : await fetch(url, {
+        ...options,
+        signal: controller.signal
+      });
     
     // Clear the timeout
     clearTimeout(timeoutId);
@@ -36,10 +82,13 @@ const retryFetch = async (url: string, options: RequestInit, retries = 0): Promi
     // If the response is not ok and we have retries left, try again
     if (!response.ok) {
       if (retries < MAX_RETRIES) {
-        // Exponential backoff with jitter
-        const delay = Math.min(1000 * 2 ** retries, 10000) + Math.random() * 1000;
+        // Exponential backoff with jitter; a 429 says how long the backend needs
+        const retryAfter = Number(response.headers.get('Retry-After'));
+        const delay = response.status === 429 && retryAfter > 0
+          ? retryAfter * 1000 + Math.random() * 1000
+          : Math.min(1000 * 2 ** retries, 10000) + Math.random() * 1000;
         await new Promise(resolve => setTimeout(resolve, delay));
-        return retryFetch(url, options, retries + 1);
+        return retryFetch(url, options, retries + 1, onUploadProgress);
       }
       
       // If we've exhausted our retries, throw an error
@@ -60,7 +109,7 @@ const retryFetch = async (url: string, options: RequestInit, retries = 0): Promi
       // Exponential backoff with jitter for network errors
       const delay = Math.min(1000 * 2 ** retries, 10000) + Math.random() * 1000;
       await new Promise(resolve => setTimeout(resolve, delay));
-      return retryFetch(url, options, retries + 1);
+      return retryFetch(url, options, retries + 1, onUploadProgress);
     }
     
     throw error;
@@ -72,8 +121,47 @@ const buildUrl = (endpoint: string): string => {
   return `${API_BASE_URL}${endpoint.startsWith('/') ? endpoint : `/${endpoint}`}`;
 };
 
-// Type for upload progress callback
-type ProgressCallback = (percent: number) => void;
+// Share of the progress bar for resizing the image and for uploading it; the
+// rest fills when the soundscape comes back
+const PREPARE_PROGRESS = 10;
+const UPLOAD_PROGRESS = 50;
+
+// One soundscape in the gallery listing
+export interface GalleryItem {
+  imageId: string;
+  createdAt: number;
+  status: string;
+  scene?: string;
+  description?: string;
+  audioUrl?: string;
+  // Thumbnail and display-size copies; a card loads the thumb instead of the upload
+  derivatives?: ImageDerivative[];
+  degraded?: string[];
+}
+
+export interface GalleryPage {
+  items: GalleryItem[];
+  // Pass back as `cursor` for the next page; null on the last page
+  nextCursor: string | null;
+  count: number;
+  cached: boolean;
+}
+
+export interface SearchResult extends GalleryItem {
+  // Sum of the confidences of the required terms
+  score: number;
+  matched: Record<string, number>;
+}
+
+export interface SearchPage {
+  query: { include: string[]; exclude: string[] };
+  items: SearchResult[];
+  nextCursor: string | null;
+  count: number;
+  // False when the search stopped at its candidate limit with the best found so far
+  exhaustive: boolean;
+  examined: number;
+}
 
 /**
  * API methods for the Soundscape application
@@ -90,6 +178,42 @@ export const api = {
     return response.json();
   },
   
+  /**
+   * List recent soundscapes, newest first
+   * @param cursor The nextCursor of the previous page
+   * @param limit Page size (at most 50)
+   * @param status Which results to list
+   */
+  async listGallery(cursor?: string | null, limit = 20, status = 'COMPLETED'): Promise<GalleryPage> {
+    const params = new URLSearchParams({ limit: String(limit), status });
+    if (cursor) {
+      params.set('cursor', cursor);
+    }
+    const response = await retryFetch(buildUrl(`/gallery?${params.toString()}`), {
+      method: 'GET',
+    });
+
+    return response.json();
+  },
+
+  /**
+   * Search finished soundscapes by scene and detected elements, best match first
+   * @param query e.g. "beach + seagull" or "forest without rain"
+   * @param cursor The nextCursor of the previous page
+   * @param limit Page size (at most 50)
+   */
+  async searchSoundscapes(query: string, cursor?: string | null, limit = 20): Promise<SearchPage> {
+    const params = new URLSearchParams({ q: query, limit: String(limit) });
+    if (cursor) {
+      params.set('cursor', cursor);
+    }
+    const response = await retryFetch(buildUrl(`/search?${params.toString()}`), {
+      method: 'GET',
+    });
+
+    return response.json();
+  },
+
   /**
    * Analyze an image and generate a soundscape
    * @param imageFile The image file to analyze
@@ -102,37 +226,45 @@ export const api = {
     imageId: string;
     description: string;
     scene: string;
-    audioUrl: string;
+    // null when the soundscape completed without audio; degraded then includes 'elevenlabs'
+    audioUrl: string | null;
+    renditions?: AudioRendition[];
+    // Peaks downsampled for drawing; url points to the full-resolution sidecar
+    waveform?: AudioWaveform | null;
+    derivatives?: ImageDerivative[];
     detectedElements: string[];
+    degraded?: string[];
+    // Set when the soundscape of a near-identical earlier image was reused
+    reusedFrom?: string;
   }> {
     return new Promise(async (resolve, reject) => {
       try {
-        // Convert the image to base64
-        const base64Image = await this.fileToBase64(imageFile);
-        
-        // Simulate progress for now
-        if (onProgress) {
-          let progress = 0;
-          const interval = setInterval(() => {
-            progress += 5;
-            if (progress <= 90) {
-              onProgress(progress);
-            } else {
-              clearInterval(interval);
-            }
-          }, 300);
+        // Downscale and re-encode to the resolution the backend analyses at
+        const prepared = await prepareImage(imageFile);
+        if (prepared.resized) {
+          console.log(`Resized upload from ${prepared.originalBytes} to ${prepared.blob.size} bytes (${prepared.width}x${prepared.height})`);
         }
+        onProgress?.(PREPARE_PROGRESS);
+
+        // Convert the image to base64
+        const base64Image = await this.fileToBase64(prepared.blob);
         
-        // Make the API request
+        // One key per upload so retries attach to the same backend execution
+        const idempotencyKey = crypto.randomUUID();
+
+        // Make the API request, reporting bytes sent as they go
         const response = await retryFetch(buildUrl('/analyze'), {
           method: 'POST',
           headers: {
             'Content-Type': 'application/json',
+            'Idempotency-Key': idempotencyKey,
           },
           body: JSON.stringify({
             image: base64Image
           })
-        });
+        }, 0, onProgress && (percent => {
+          onProgress(PREPARE_PROGRESS + (percent / 100) * (UPLOAD_PROGRESS - PREPARE_PROGRESS));
+        }));
         
         // Complete the progress at 100%
         if (onProgress) {
@@ -149,9 +281,9 @@ export const api = {
   
   /**
    * Convert a file to base64
-   * @param file The file to convert
+   * @param file The file (or resized image) to convert
    */
-  fileToBase64(file: File): Promise<string> {
+  fileToBase64(file: Blob): Promise<string> {
     return new Promise((resolve, reject) => {
       const reader = new FileReader();
       reader.readAsDataURL(file);
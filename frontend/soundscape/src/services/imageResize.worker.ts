@@ -0,0 +1,20 @@
+/**
+ * Decodes, downscales and re-encodes an image off the main thread.
+ * Used by prepareImage() in imageService.ts when OffscreenCanvas is available.
+ */
+import { resizeToBlob, type ResizeRequest } from './imageService';
+
+// The DOM lib types `self` as a Window; in a dedicated worker it is the worker scope
+const scope = self as unknown as {
+  onmessage: ((event: MessageEvent<ResizeRequest>) => void) | null;
+  postMessage(message: unknown): void;
+};
+
+scope.onmessage = async (event) => {
+  try {
+    const result = await resizeToBlob(event.data, (width, height) => new OffscreenCanvas(width, height));
+    scope.postMessage({ ok: true, ...result });
+  } catch (error) {
+    scope.postMessage({ ok: false, error: error instanceof Error ? error.message : String(error) });
+  }
+};
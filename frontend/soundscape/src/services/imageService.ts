@@ -0,0 +1,193 @@
+// interface AnalysisResult {
+//   imageId: string;
+//   description: string;
+//   scene: string;
+//   audioUrl: string;
+//   detectedElements: string[];
+// }
+
+// Longest side the backend analyses at: Bedrock scales anything larger down to
+// 1568px, and Rekognition labels are no better above it
+export const MAX_UPLOAD_SIDE = 1568;
+
+// JPEG quality of the re-encoded upload; the backend accepts JPEG and PNG only
+export const UPLOAD_QUALITY = 0.85;
+
+// Files already within MAX_UPLOAD_SIDE and this size are sent as they are
+const KEEP_ORIGINAL_BYTES = 1024 * 1024;
+
+const ACCEPTED_TYPES = ['image/jpeg', 'image/png'];
+
+export interface ResizeRequest {
+  image: Blob;
+  maxSide: number;
+  quality: number;
+}
+
+export interface PreparedImage {
+  blob: Blob;
+  width: number | null;
+  height: number | null;
+  originalBytes: number;
+  // False when the original file is uploaded unchanged
+  resized: boolean;
+}
+
+export interface ResizeResult {
+  blob: Blob;
+  width: number;
+  height: number;
+  // False when the image was already within maxSide
+  scaled: boolean;
+}
+
+type Canvas = OffscreenCanvas | HTMLCanvasElement;
+
+const createCanvasElement = (width: number, height: number): Canvas =>
+  Object.assign(document.createElement('canvas'), { width, height });
+
+const encode = (canvas: Canvas, quality: number): Promise<Blob> => {
+  if ('convertToBlob' in canvas) {
+    return canvas.convertToBlob({ type: 'image/jpeg', quality });
+  }
+  return new Promise((resolve, reject) => {
+    canvas.toBlob(
+      blob => (blob ? resolve(blob) : reject(new Error('Image encoding failed'))),
+      'image/jpeg',
+      quality
+    );
+  });
+};
+
+/**
+ * Decode an image, scale it to at most maxSide on its longest side and
+ * re-encode it as JPEG. Runs in imageResize.worker.ts with an OffscreenCanvas,
+ * or on the main thread with a canvas element.
+ * @param request The image and target size
+ * @param createCanvas Makes a canvas of the given size
+ */
+export const resizeToBlob = async (
+  { image, maxSide, quality }: ResizeRequest,
+  createCanvas: (width: number, height: number) => Canvas
+): Promise<ResizeResult> => {
+  const probe = await createImageBitmap(image);
+  const scale = Math.min(1, maxSide / Math.max(probe.width, probe.height));
+  const width = Math.max(1, Math.round(probe.width * scale));
+  const height = Math.max(1, Math.round(probe.height * scale));
+
+  let bitmap = probe;
+  if (scale < 1) {
+    // Let the decoder do the downscale where it can; it filters better than one drawImage
+    try {
+      bitmap = await createImageBitmap(image, { resizeWidth: width, resizeHeight: height, resizeQuality: 'high' });
+      probe.close();
+    } catch {
+      bitmap = probe;
+    }
+  }
+
+  try {
+    const canvas = createCanvas(width, height);
+    // Narrowed separately: getContext's overloads differ between the two canvas types
+    const context = 'convertToBlob' in canvas ? canvas.getContext('2d') : canvas.getContext('2d');
+    if (!context) {
+      throw new Error('Canvas 2D context unavailable');
+    }
+    // JPEG has no alpha; transparent PNG areas become white rather than black
+    context.fillStyle = '#ffffff';
+    context.fillRect(0, 0, width, height);
+    context.drawImage(bitmap, 0, 0, width, height);
+    return { blob: await encode(canvas, quality), width, height, scaled: scale < 1 };
+  } finally {
+    bitmap.close();
+  }
+};
+
+const resizeInWorker = (request: ResizeRequest): Promise<ResizeResult> => {
+  return new Promise((resolve, reject) => {
+    const worker = new Worker(new URL('./imageResize.worker.ts', import.meta.url), { type: 'module' });
+    worker.onmessage = event => {
+      worker.terminate();
+      if (event.data.ok) {
+        const { blob, width, height, scaled } = event.data;
+        resolve({ blob, width, height, scaled });
+      } else {
+        reject(new Error(event.data.error));
+      }
+    };
+    worker.onerror = event => {
+      worker.terminate();
+      reject(new Error(event.message || 'Image worker failed'));
+    };
+    worker.postMessage(request);
+  });
+};
+
+/**
+ * Shrink a photo to the resolution the backend analyses at before it is
+ * uploaded. A phone photo of several MB becomes a JPEG of a few hundred KB.
+ * Falls back to the original file when the browser cannot decode it or the
+ * re-encoded image would not be smaller; the backend still validates it.
+ * @param file The file the user picked
+ */
+export const prepareImage = async (file: File): Promise<PreparedImage> => {
+  const original: PreparedImage = { blob: file, width: null, height: null, originalBytes: file.size, resized: false };
+  if (typeof createImageBitmap === 'undefined') {
+    return original;
+  }
+
+  const request: ResizeRequest = { image: file, maxSide: MAX_UPLOAD_SIDE, quality: UPLOAD_QUALITY };
+  let result: ResizeResult;
+  try {
+    if (typeof Worker !== 'undefined' && typeof OffscreenCanvas !== 'undefined') {
+      try {
+        result = await resizeInWorker(request);
+      } catch (error) {
+        console.warn('Image worker failed, resizing on the main thread:', error);
+        result = await resizeToBlob(request, createCanvasElement);
+      }
+    } else {
+      result = await resizeToBlob(request, createCanvasElement);
+    }
+  } catch (error) {
+    console.warn('Could not resize the image, uploading the original:', error);
+    return original;
+  }
+
+  const alreadySmall = !result.scaled && file.size <= KEEP_ORIGINAL_BYTES;
+  if (ACCEPTED_TYPES.includes(file.type) && (alreadySmall || result.blob.size >= file.size)) {
+    return { ...original, width: result.width, height: result.height };
+  }
+  return { blob: result.blob, width: result.width, height: result.height, originalBytes: file.size, resized: true };
+};
+
+/**
+ * A display-size copy of an uploaded image, as returned by the analyze,
+ * gallery and search APIs
+ */
+export interface ImageDerivative {
+  // 'thumb' for cards and lists, 'medium' for the results view and the modal
+  name: string;
+  url: string;
+  contentType: string;
+  width: number;
+  height: number;
+  bytes: number;
+}
+
+/**
+ * The WebP and JPEG copies of one derivative size, for a <picture> element:
+ * browsers without WebP load the JPEG.
+ * @param derivatives Derivatives from the API, in any order
+ * @param name 'thumb' or 'medium'
+ */
+export const pickDerivative = (
+  derivatives: ImageDerivative[] = [],
+  name: string
+): { webp?: ImageDerivative; jpeg?: ImageDerivative } => {
+  const sized = derivatives.filter(derivative => derivative.name === name);
+  return {
+    webp: sized.find(derivative => derivative.contentType === 'image/webp'),
+    jpeg: sized.find(derivative => derivative.contentType === 'image/jpeg'),
+  };
+};
@@ -0,0 +1,71 @@
+/**
+ * An encoded copy of a generated soundscape, as returned by the analyze API
+ */
+export interface AudioRendition {
+  name: string;
+  url: string;
+  contentType: string;
+  codec: string;
+  bitrateKbps: number | null;
+  bytes: number;
+}
+
+/**
+ * Pick the smallest rendition this browser can play, falling back to the
+ * standard MP3 URL when none are listed or none are playable.
+ * @param audioUrl The standard MP3 URL
+ * @param renditions Renditions from the API, in any order
+ */
+export const pickPlaybackUrl = (audioUrl: string, renditions: AudioRendition[] = []): string => {
+  if (typeof Audio === 'undefined' || renditions.length === 0) {
+    return audioUrl;
+  }
+
+  const probe = new Audio();
+  const playable = renditions
+    .filter(rendition => probe.canPlayType(rendition.contentType) !== '')
+    .sort((a, b) => a.bytes - b.bytes);
+
+  return playable.length > 0 ? playable[0].url : audioUrl;
+};
+
+/**
+ * Precomputed waveform of a soundscape, from the API response or its S3 sidecar
+ */
+export interface AudioWaveform {
+  url?: string;
+  sampleRate: number;
+  durationSeconds: number;
+  points: number;
+  bits: number;
+  // Interleaved [min, max, min, max, ...] in -127..127
+  peaks?: number[];
+  // RMS envelope in 0..255
+  rms?: number[];
+}
+
+/**
+ * Return a waveform with its peaks. The API returns them downsampled, so
+ * this only fetches the sidecar for a response without them (e.g. from an
+ * item written before peaks were stored inline).
+ * @param waveform Waveform from the API, if any
+ */
+export const loadWaveform = async (waveform?: AudioWaveform | null): Promise<AudioWaveform | null> => {
+  if (!waveform) {
+    return null;
+  }
+  if (waveform.peaks || !waveform.url) {
+    return waveform;
+  }
+
+  try {
+    const response = await fetch(waveform.url);
+    if (!response.ok) {
+      return waveform;
+    }
+    return { ...waveform, ...(await response.json()) };
+  } catch (error) {
+    console.warn('Could not load waveform peaks:', error);
+    return waveform;
+  }
+};